@@ -0,0 +1,93 @@
+"""
+Creates the resized WebP/JPEG derivatives (thumb, card, full) of vehicle
+photos uploaded before the upload endpoint generated them, and fills
+vehicles.photo_variants.
+
+Only photos stored in static/ are processed; external URLs are counted and
+left as they are. Derivatives that already exist are reused unless --force.
+
+Usage:
+    python backfill_photo_derivatives.py
+    python backfill_photo_derivatives.py --company-id 3 --dry-run
+    IMAGE_DERIVATIVE_WORKERS=4 python backfill_photo_derivatives.py --force
+"""
+import argparse
+import os
+import sys
+
+import image_derivatives
+import models
+from database import SessionLocal
+
+CHUNK_SIZE = 200
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Backfill resized derivatives of vehicle photos")
+    parser.add_argument("--company-id", type=int, default=None)
+    parser.add_argument("--dry-run", action="store_true", help="Only count the photos that need derivatives")
+    parser.add_argument("--force", action="store_true", help="Rebuild derivatives that already exist")
+    args = parser.parse_args()
+
+    counts = {"vehicles": 0, "rendered": 0, "existing": 0, "external": 0, "missing": 0, "failed": 0}
+    last_id = 0
+    with SessionLocal() as db:
+        while True:
+            query = db.query(models.Vehicle).filter(
+                models.Vehicle.id > last_id,
+                models.Vehicle.photos.isnot(None),
+            )
+            if args.company_id:
+                query = query.filter(models.Vehicle.company_id == args.company_id)
+            chunk = query.order_by(models.Vehicle.id).limit(CHUNK_SIZE).all()
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+
+            pending = {}
+            for vehicle in chunk:
+                photos = vehicle.photos if isinstance(vehicle.photos, list) else []
+                if photos:
+                    counts["vehicles"] += 1
+                for photo in photos:
+                    name = image_derivatives.static_name(photo)
+                    if not name or not image_derivatives.is_image_name(name):
+                        counts["external"] += 1
+                    elif not os.path.isfile(os.path.join(image_derivatives.STATIC_DIR, name)):
+                        counts["missing"] += 1
+                    elif not args.force and image_derivatives.load_variants(name):
+                        counts["existing"] += 1
+                    elif name not in pending:
+                        pending[name] = None if args.dry_run else image_derivatives.submit(name)
+
+            for name, future in pending.items():
+                if future is None:
+                    counts["rendered"] += 1
+                    continue
+                try:
+                    future.result(timeout=image_derivatives.IMAGE_DERIVATIVE_TIMEOUT_SECONDS)
+                    counts["rendered"] += 1
+                except Exception as exc:
+                    counts["failed"] += 1
+                    print(f"Warning: could not create derivatives of {name}: {exc!r}", flush=True)
+
+            if args.dry_run:
+                continue
+            for vehicle in chunk:
+                variants = image_derivatives.variants_for_photos(vehicle.photos)
+                if variants != vehicle.photo_variants:
+                    vehicle.photo_variants = variants
+            db.commit()
+            print(f"Processed vehicles up to id {last_id}", flush=True)
+
+    label = "would render" if args.dry_run else "rendered"
+    print(
+        f"{counts['vehicles']} vehicle(s) with photos: {counts['rendered']} photo(s) {label}, "
+        f"{counts['existing']} already had derivatives, {counts['external']} external, "
+        f"{counts['missing']} missing on disk, {counts['failed']} failed"
+    )
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
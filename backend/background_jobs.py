@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Set
+
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+
+# Long-running bulk operations (reassignments, exports...) run on this pool so
+# the request returns immediately and the client polls GET /jobs/{id}.
+BACKGROUND_JOB_WORKERS = int(os.getenv("BACKGROUND_JOB_WORKERS", "2") or "2")
+# Progress is written at most this often to avoid one UPDATE per processed item.
+PROGRESS_FLUSH_SECONDS = 1.0
+# Every worker touches updated_at of the jobs it holds this often; a queued or
+# running job not touched for BACKGROUND_JOB_STALE_SECONDS belonged to a worker
+# that was restarted or killed and is marked failed.
+JOB_HEARTBEAT_SECONDS = 60
+BACKGROUND_JOB_STALE_SECONDS = int(os.getenv("BACKGROUND_JOB_STALE_SECONDS", "300") or "300")
+STALE_JOB_ERROR = "El proceso se interrumpió porque el servidor se reinició; vuelve a ejecutarlo."
+
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_COMPLETED = "completed"
+JOB_STATUS_FAILED = "failed"
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_held_job_ids: Set[int] = set()
+_heartbeat_thread: Optional[threading.Thread] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor, _heartbeat_thread
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, BACKGROUND_JOB_WORKERS),
+                thread_name_prefix="background-job",
+            )
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name="background-job-heartbeat", daemon=True)
+            _heartbeat_thread.start()
+        return _executor
+
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        with _executor_lock:
+            job_ids = list(_held_job_ids)
+        if not job_ids:
+            continue
+        try:
+            with SessionLocal() as db:
+                db.query(models.BackgroundJob).filter(
+                    models.BackgroundJob.id.in_(job_ids),
+                    models.BackgroundJob.status.in_((JOB_STATUS_QUEUED, JOB_STATUS_RUNNING)),
+                ).update({"updated_at": datetime.datetime.utcnow()}, synchronize_session=False)
+                db.commit()
+        except Exception as exc:
+            print(f"Warning: could not refresh background job heartbeats: {exc}", flush=True)
+
+
+def _stale_filter():
+    stale_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=BACKGROUND_JOB_STALE_SECONDS)
+    return (
+        models.BackgroundJob.status.in_((JOB_STATUS_QUEUED, JOB_STATUS_RUNNING)),
+        (models.BackgroundJob.updated_at < stale_before) | models.BackgroundJob.updated_at.is_(None),
+    )
+
+
+def fail_stale_jobs(db: Session, job_id: Optional[int] = None) -> int:
+    """Marks queued/running jobs whose worker stopped sending heartbeats as failed.
+
+    Called at startup for every job and when a job is read, so a poller never
+    waits forever on a job lost in a restart. Commits.
+    """
+    query = db.query(models.BackgroundJob).filter(*_stale_filter())
+    if job_id is not None:
+        query = query.filter(models.BackgroundJob.id == job_id)
+    now = datetime.datetime.utcnow()
+    failed = query.update(
+        {"status": JOB_STATUS_FAILED, "error": STALE_JOB_ERROR, "finished_at": now, "updated_at": now},
+        synchronize_session=False,
+    )
+    db.commit()
+    return failed
+
+
+def is_stale(job: models.BackgroundJob) -> bool:
+    if job.status not in (JOB_STATUS_QUEUED, JOB_STATUS_RUNNING):
+        return False
+    if job.updated_at is None:
+        return True
+    return (datetime.datetime.utcnow() - job.updated_at).total_seconds() > BACKGROUND_JOB_STALE_SECONDS
+
+
+class JobProgress:
+    """Handed to job handlers to report how many items were processed."""
+
+    def __init__(self, job_id: int, total: int):
+        self.job_id = job_id
+        self.total = total
+        self.processed = 0
+        self._last_flush = 0.0
+
+    def advance(self, count: int = 1, force: bool = False):
+        self.processed += count
+        now = time.monotonic()
+        if force or now - self._last_flush >= PROGRESS_FLUSH_SECONDS:
+            self._last_flush = now
+            _update_job(self.job_id, processed=self.processed)
+
+
+def _update_job(job_id: int, **values):
+    values["updated_at"] = datetime.datetime.utcnow()
+    with SessionLocal() as db:
+        db.query(models.BackgroundJob).filter(models.BackgroundJob.id == job_id).update(
+            values,
+            synchronize_session=False,
+        )
+        db.commit()
+
+
+def _claim_job(job_id: int) -> bool:
+    now = datetime.datetime.utcnow()
+    with SessionLocal() as db:
+        claimed = db.query(models.BackgroundJob).filter(
+            models.BackgroundJob.id == job_id,
+            models.BackgroundJob.status == JOB_STATUS_QUEUED,
+        ).update(
+            {"status": JOB_STATUS_RUNNING, "started_at": now, "updated_at": now},
+            synchronize_session=False,
+        )
+        db.commit()
+    return bool(claimed)
+
+
+def _run_job(job_id: int, total: int, handler: Callable[[Session, JobProgress], Any]):
+    try:
+        _run_claimed_job(job_id, total, handler)
+    finally:
+        with _executor_lock:
+            _held_job_ids.discard(job_id)
+
+
+def _run_claimed_job(job_id: int, total: int, handler: Callable[[Session, JobProgress], Any]):
+    if not _claim_job(job_id):
+        # Already marked failed as stale while it waited in the queue.
+        return
+    progress = JobProgress(job_id, total)
+    try:
+        with SessionLocal() as db:
+            result = handler(db, progress)
+    except Exception as exc:
+        print(f"Background job {job_id} failed: {exc}", flush=True)
+        # Handlers that commit in chunks attach what was already applied.
+        partial_result = getattr(exc, "partial_result", None)
+        _update_job(
+            job_id,
+            status=JOB_STATUS_FAILED,
+            processed=progress.processed,
+            error=str(exc)[:2000],
+            result_json=json.dumps(partial_result, default=str) if partial_result is not None else None,
+            finished_at=datetime.datetime.utcnow(),
+        )
+        return
+    _update_job(
+        job_id,
+        status=JOB_STATUS_COMPLETED,
+        processed=max(progress.processed, total),
+        result_json=json.dumps(result, default=str) if result is not None else None,
+        finished_at=datetime.datetime.utcnow(),
+    )
+
+
+def submit_job(
+    db: Session,
+    kind: str,
+    total: int,
+    handler: Callable[[Session, JobProgress], Any],
+    company_id: Optional[int] = None,
+    created_by_id: Optional[int] = None,
+    payload: Optional[Dict[str, Any]] = None,
+) -> models.BackgroundJob:
+    """Persists the job row and schedules `handler(db, progress)` on the pool.
+
+    The handler gets its own session; its return value is stored as the job result.
+    """
+    job = models.BackgroundJob(
+        company_id=company_id,
+        created_by_id=created_by_id,
+        kind=kind,
+        status=JOB_STATUS_QUEUED,
+        total=total,
+        processed=0,
+        payload_json=json.dumps(payload, default=str) if payload is not None else None,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    executor = _get_executor()
+    with _executor_lock:
+        _held_job_ids.add(job.id)
+    executor.submit(_run_job, job.id, total, handler)
+    return job
+
+
+def serialize_job(job: models.BackgroundJob) -> Dict[str, Any]:
+    result = None
+    if job.result_json:
+        try:
+            result = json.loads(job.result_json)
+        except Exception:
+            result = None
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "total": job.total or 0,
+        "processed": job.processed or 0,
+        "progress": round(min(1.0, (job.processed or 0) / job.total), 4) if job.total else (1.0 if job.status == JOB_STATUS_COMPLETED else 0.0),
+        "result": result,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
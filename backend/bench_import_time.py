@@ -0,0 +1,88 @@
+"""
+Import-time benchmark for the API workers.
+
+Runs `python -X importtime -c "import main"` in a clean interpreter, prints the
+slowest modules and fails (exit 1) when:
+  * the cumulative import time of `main` exceeds IMPORT_TIME_BUDGET_MS, or
+  * a heavy optional dependency (pandas, reportlab, openpyxl, pypdf) was imported at boot.
+
+Usage:
+    python bench_import_time.py
+    python bench_import_time.py --budget-ms 900 --top 30 --lazy
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+IMPORT_TIME_BUDGET_MS = int(os.getenv("IMPORT_TIME_BUDGET_MS", "2500") or "2500")
+FORBIDDEN_BOOT_MODULES = ("pandas", "reportlab", "openpyxl", "pypdf", "numpy")
+
+
+def measure_imports(lazy: bool) -> list[tuple[str, int, int]]:
+    env = os.environ.copy()
+    env.setdefault(
+        "DATABASE_URL",
+        f"sqlite:///{os.path.join(tempfile.gettempdir(), 'autosqp_import_bench.db')}",
+    )
+    # Workers never migrate in production; keep the benchmark to pure import cost.
+    env["SCHEMA_MIGRATIONS_MODE"] = "skip"
+    if lazy:
+        env["ROUTER_LOAD_MODE"] = "lazy"
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        print(result.stderr[-4000:])
+        raise SystemExit(f"Importing main failed with exit code {result.returncode}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, payload = line.split(":", 1)
+        self_us, cumulative_us, module_name = [part.strip() for part in payload.split("|", 2)]
+        rows.append((module_name, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Measure API import time")
+    parser.add_argument("--budget-ms", type=int, default=IMPORT_TIME_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--lazy", action="store_true", help="Benchmark with ROUTER_LOAD_MODE=lazy")
+    args = parser.parse_args()
+
+    rows = measure_imports(args.lazy)
+    main_row = next((row for row in rows if row[0] == "main"), None)
+    if not main_row:
+        raise SystemExit("importtime output did not include main")
+
+    print(f"{'module':<50} {'self ms':>10} {'cumulative ms':>14}")
+    for module_name, self_us, cumulative_us in sorted(rows, key=lambda row: row[1], reverse=True)[:args.top]:
+        print(f"{module_name:<50} {self_us / 1000:>10.1f} {cumulative_us / 1000:>14.1f}")
+
+    total_ms = main_row[2] / 1000
+    print(f"\nmain total: {total_ms:.1f} ms (budget {args.budget_ms} ms)")
+
+    failures = []
+    if total_ms > args.budget_ms:
+        failures.append(f"import time {total_ms:.1f} ms exceeds budget {args.budget_ms} ms")
+    imported_names = {row[0] for row in rows}
+    for module_name in FORBIDDEN_BOOT_MODULES:
+        if module_name in imported_names:
+            failures.append(f"heavy module imported at boot: {module_name}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
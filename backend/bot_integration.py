@@ -565,11 +565,14 @@ def find_or_create_channel_session(
         models.ChannelChatSession.source == source,
         models.ChannelChatSession.external_user_id == external_user_id,
     ).first()
+    # The session and its conversation are linked to the lead here, when the
+    # message arrives, so reading a lead's timeline never has to.
+    lookup_phones = set(phone_variants_for_lookup(external_user_id)) | {external_user_id}
     existing_lead = db.query(models.Lead).filter(
         models.Lead.company_id == company_id,
         models.Lead.source == source,
-        models.Lead.phone == external_user_id,
-    ).first()
+        models.Lead.phone.in_(lookup_phones),
+    ).order_by((models.Lead.phone == external_user_id).desc(), models.Lead.id.asc()).first()
     is_new_contact = session is None and existing_lead is None
     previous_last_message_at = session.last_message_at if session else None
 
@@ -604,6 +607,7 @@ def find_or_create_channel_session(
             source=source,
             external_user_id=external_user_id,
             recipient_id=recipient_id,
+            lead_id=existing_lead.id if existing_lead else None,
             conversation_id=conversation.id,
             last_message_at=datetime.datetime.utcnow(),
         )
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+
+# Company logos normalized once (downscaled PNG) and kept on disk and as
+# PNG bytes in memory, so PDF rendering never fetches or re-normalizes the
+# logo per document. Each render gets its own ImageReader over those bytes:
+# readers hold a file handle and decode state and are not safe to share
+# between the threads that render PDFs. update_company/create_company warm the
+# cache when logo_url changes; a render that misses it loads the logo once.
+BRANDING_ASSET_DIR = os.getenv("BRANDING_ASSET_DIR", os.path.join("cache", "branding"))
+LOGO_MAX_PIXELS = int(os.getenv("BRANDING_LOGO_MAX_PIXELS", "600") or "600")
+LOGO_FETCH_TIMEOUT_SECONDS = 8
+# A logo that could not be loaded is not retried for this long.
+LOGO_FAILURE_TTL_SECONDS = 600
+MEMORY_CACHE_SIZE = 64
+
+_lock = threading.Lock()
+_logos: "OrderedDict[Tuple[int, str], bytes]" = OrderedDict()
+_failures: Dict[Tuple[int, str], float] = {}
+
+
+def _logo_key(company_id: int, logo_url: str) -> Tuple[int, str]:
+    return int(company_id or 0), logo_url
+
+
+def _logo_path(company_id: int, logo_url: str) -> str:
+    digest = hashlib.sha256(logo_url.encode("utf-8")).hexdigest()[:20]
+    return os.path.join(BRANDING_ASSET_DIR, f"company_{int(company_id or 0)}_{digest}.png")
+
+
+def _local_logo_candidates(logo_url: str):
+    clean_value = logo_url.split("?", 1)[0].replace("\\", "/")
+    candidates = []
+    if os.path.isabs(clean_value):
+        candidates.append(clean_value)
+    for marker in ("/api/static/", "/static/", "api/static/", "static/"):
+        if clean_value.startswith(marker):
+            relative = clean_value[len(marker):]
+            candidates.append(os.path.join("static", *relative.split("/")))
+        elif marker in clean_value:
+            relative = clean_value.split(marker, 1)[1]
+            candidates.append(os.path.join("static", *relative.split("/")))
+    candidates.append(clean_value.lstrip("/"))
+    return candidates
+
+
+def _read_logo_source(logo_url: str) -> Optional[bytes]:
+    for candidate in _local_logo_candidates(logo_url):
+        if candidate and os.path.isfile(candidate):
+            with open(candidate, "rb") as handle:
+                return handle.read()
+    if logo_url.split("?", 1)[0].startswith(("http://", "https://")):
+        response = requests.get(logo_url, timeout=LOGO_FETCH_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return response.content
+    return None
+
+
+def _normalize_logo(raw_bytes: bytes) -> bytes:
+    from PIL import Image
+
+    with Image.open(BytesIO(raw_bytes)) as image:
+        image.load()
+        normalized = image.convert("RGBA")
+    normalized.thumbnail((LOGO_MAX_PIXELS, LOGO_MAX_PIXELS))
+    output = BytesIO()
+    normalized.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+
+def _store_logo(path: str, png_bytes: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "wb") as handle:
+        handle.write(png_bytes)
+    os.replace(temp_path, path)
+
+
+def _remove_stale_logos(company_id: int, keep_path: Optional[str]):
+    prefix = f"company_{int(company_id or 0)}_"
+    try:
+        names = os.listdir(BRANDING_ASSET_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(BRANDING_ASSET_DIR, name)
+        if name.startswith(prefix) and name.endswith(".png") and path != keep_path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _remember(key: Tuple[int, str], png_bytes: bytes):
+    with _lock:
+        for stale_key in [item for item in _logos if item[0] == key[0] and item != key]:
+            _logos.pop(stale_key, None)
+        _logos[key] = png_bytes
+        _logos.move_to_end(key)
+        while len(_logos) > MEMORY_CACHE_SIZE:
+            _logos.popitem(last=False)
+        _failures.pop(key, None)
+
+
+def _new_reader(png_bytes: bytes) -> Any:
+    from reportlab.lib.utils import ImageReader
+
+    return ImageReader(BytesIO(png_bytes))
+
+
+def _load_logo(company_id: int, logo_url: str, refresh: bool = False) -> Optional[bytes]:
+    path = _logo_path(company_id, logo_url)
+    if refresh or not os.path.isfile(path):
+        raw_bytes = _read_logo_source(logo_url)
+        if not raw_bytes:
+            return None
+        _store_logo(path, _normalize_logo(raw_bytes))
+        _remove_stale_logos(company_id, path)
+    with open(path, "rb") as handle:
+        png_bytes = handle.read()
+    # Fails here, and not in the middle of a render, when the stored file is not an image.
+    _new_reader(png_bytes).getSize()
+    return png_bytes
+
+
+def get_logo_reader(company) -> Optional[Any]:
+    """A new ImageReader over the cached logo of the company, or None (draw initials instead)."""
+    logo_url = str(getattr(company, "logo_url", None) or "").strip()
+    if not company or not logo_url:
+        return None
+    key = _logo_key(company.id, logo_url)
+    with _lock:
+        png_bytes = _logos.get(key)
+        if png_bytes is not None:
+            _logos.move_to_end(key)
+            return _new_reader(png_bytes)
+        failed_at = _failures.get(key)
+    if failed_at and time.monotonic() - failed_at < LOGO_FAILURE_TTL_SECONDS:
+        return None
+    try:
+        png_bytes = _load_logo(company.id, logo_url)
+    except Exception as exc:
+        print(f"Warning: could not load logo of company {company.id}: {exc}", flush=True)
+        png_bytes = None
+    if png_bytes is None:
+        with _lock:
+            _failures[key] = time.monotonic()
+        return None
+    _remember(key, png_bytes)
+    return _new_reader(png_bytes)
+
+
+def refresh_company_logo(company_id: int, logo_url: Optional[str]):
+    """Downloads and normalizes a changed logo; meant to run off the request thread."""
+    logo_url = str(logo_url or "").strip()
+    if not logo_url:
+        _remove_stale_logos(company_id, None)
+        return
+    key = _logo_key(company_id, logo_url)
+    try:
+        png_bytes = _load_logo(company_id, logo_url, refresh=True)
+    except Exception as exc:
+        print(f"Warning: could not refresh logo of company {company_id}: {exc}", flush=True)
+        png_bytes = None
+    if png_bytes is None:
+        with _lock:
+            _failures[key] = time.monotonic()
+        return
+    _remember(key, png_bytes)
+
+
+def schedule_logo_refresh(company_id: int, logo_url: Optional[str]):
+    threading.Thread(
+        target=refresh_company_logo,
+        args=(company_id, logo_url),
+        name=f"branding-logo-{company_id}",
+        daemon=True,
+    ).start()
+
+
+def get_logo_path(company) -> Optional[str]:
+    """Path of the normalized logo on disk, for renderers running in other processes."""
+    if get_logo_reader(company) is None:
+        return None
+    path = _logo_path(company.id, str(company.logo_url).strip())
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, event, insert, inspect as sa_inspect, select
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+import models
+
+# Public requests (site, catalogue, team cards, chat, credit form) find their
+# tenant by Host header. company_domains holds one row per normalized host,
+# rewritten after every flush that changes a company's public_domain or
+# public_domains_json, and resolved hosts are cached in-process together with
+# a detached copy of the company, so a warm request resolves with no queries.
+# Changes made in this process clear the cache at once; other workers pick
+# them up when their entries expire.
+
+COMPANY_DOMAIN_CACHE_SECONDS = int(os.getenv("COMPANY_DOMAIN_CACHE_SECONDS", "60") or "60")
+COMPANY_DOMAIN_CACHE_MAX_HOSTS = int(os.getenv("COMPANY_DOMAIN_CACHE_MAX_HOSTS", "1024") or "1024")
+# Platform hosts that show the first company when no tenant claims them.
+PLATFORM_HOSTS = {"autosqp.com", "autosqp.co"}
+
+_lock = threading.Lock()
+_hosts: Dict[str, Tuple[float, Optional[int]]] = {}
+_companies: Dict[int, Tuple[float, models.Company]] = {}
+
+
+def normalize_public_host(raw_host: Optional[str]) -> str:
+    host = (raw_host or "").strip().lower()
+    if not host:
+        return ""
+    if ":" in host:
+        host = host.split(":", 1)[0]
+    if host.startswith("www."):
+        host = host[4:]
+    return host
+
+
+def company_hosts(public_domain: Optional[str], public_domains_json: Optional[str]) -> List[str]:
+    """Normalized hosts of a company, primary domain first."""
+    values = [public_domain] if public_domain else []
+    if public_domains_json:
+        try:
+            decoded = json.loads(public_domains_json)
+        except Exception:
+            decoded = []
+        if isinstance(decoded, list):
+            values.extend(decoded)
+    hosts: List[str] = []
+    for value in values:
+        host = normalize_public_host(str(value) if value else "")
+        if host and host not in hosts:
+            hosts.append(host)
+    return hosts
+
+
+# --- Cache ---------------------------------------------------------------
+
+def invalidate():
+    with _lock:
+        _hosts.clear()
+        _companies.clear()
+
+
+def _cached(store: dict, key):
+    with _lock:
+        entry = store.get(key)
+    if entry and entry[0] > time.monotonic():
+        return True, entry[1]
+    return False, None
+
+
+def _remember(store: dict, key, value):
+    with _lock:
+        if len(store) >= COMPANY_DOMAIN_CACHE_MAX_HOSTS:
+            store.clear()
+        store[key] = (time.monotonic() + COMPANY_DOMAIN_CACHE_SECONDS, value)
+
+
+def _snapshot(company: models.Company) -> models.Company:
+    copy = models.Company(**{
+        column.key: getattr(company, column.key) for column in sa_inspect(models.Company).column_attrs
+    })
+    make_transient_to_detached(copy)
+    return copy
+
+
+# --- Reads ---------------------------------------------------------------
+
+def resolve_company_id(db: Session, raw_host: Optional[str]) -> Optional[int]:
+    host = normalize_public_host(raw_host)
+    if not host:
+        return None
+    hit, company_id = _cached(_hosts, host)
+    if hit:
+        return company_id
+
+    company_id = db.execute(
+        select(models.CompanyDomain.company_id).where(models.CompanyDomain.host == host)
+    ).scalar()
+    if company_id is None and host in PLATFORM_HOSTS:
+        company_id = db.execute(select(models.Company.id).order_by(models.Company.id.asc()).limit(1)).scalar()
+    _remember(_hosts, host, company_id)
+    return company_id
+
+
+def resolve_company(db: Session, raw_host: Optional[str]) -> Optional[models.Company]:
+    company_id = resolve_company_id(db, raw_host)
+    if company_id is None:
+        return None
+    hit, snapshot = _cached(_companies, company_id)
+    if hit:
+        # load=False attaches the cached column values without a SELECT.
+        return db.merge(snapshot, load=False)
+    company = db.get(models.Company, company_id)
+    if company is not None:
+        _remember(_companies, company_id, _snapshot(company))
+    return company
+
+
+def find_domain_owner(
+    db: Session,
+    hosts: Iterable[str],
+    exclude_company_id: Optional[int] = None,
+) -> Optional[Tuple[str, models.Company]]:
+    """First (host, company) among hosts already registered by another company."""
+    hosts = [host for host in hosts if host]
+    if not hosts:
+        return None
+    query = (
+        select(models.CompanyDomain.host, models.Company)
+        .join(models.Company, models.Company.id == models.CompanyDomain.company_id)
+        .where(models.CompanyDomain.host.in_(hosts))
+    )
+    if exclude_company_id:
+        query = query.where(models.CompanyDomain.company_id != exclude_company_id)
+    owners = {host: company for host, company in db.execute(query).all()}
+    for host in hosts:
+        if host in owners:
+            return host, owners[host]
+    return None
+
+
+# --- Maintenance ---------------------------------------------------------
+
+def _rows(company_id: int, hosts: List[str]) -> List[dict]:
+    return [
+        {"host": host, "company_id": company_id, "is_primary": index == 0}
+        for index, host in enumerate(hosts)
+    ]
+
+
+def sync_company(connection, company_id: int, public_domain: Optional[str], public_domains_json: Optional[str]):
+    table = models.CompanyDomain.__table__
+    connection.execute(delete(table).where(table.c.company_id == company_id))
+    rows = _rows(company_id, company_hosts(public_domain, public_domains_json))
+    if rows:
+        # host is the primary key, so a domain taken by a concurrent update fails here.
+        connection.execute(insert(table), rows)
+
+
+def rebuild_company_domains(connection) -> int:
+    """Rewrites the whole table from companies; a host claimed twice goes to the lowest company id."""
+    table = models.CompanyDomain.__table__
+    companies = connection.execute(
+        select(models.Company.id, models.Company.public_domain, models.Company.public_domains_json)
+        .order_by(models.Company.id)
+    ).all()
+    claimed: Dict[str, int] = {}
+    rows = []
+    for company_id, public_domain, public_domains_json in companies:
+        hosts = []
+        for host in company_hosts(public_domain, public_domains_json):
+            if host in claimed:
+                print(f"Warning: domain {host} of company {company_id} already belongs to company {claimed[host]}", flush=True)
+                continue
+            claimed[host] = company_id
+            hosts.append(host)
+        rows.extend(_rows(company_id, hosts))
+    connection.execute(delete(table))
+    if rows:
+        connection.execute(insert(table), rows)
+    invalidate()
+    return len(rows)
+
+
+@event.listens_for(Session, "after_flush")
+def _sync_domains_after_flush(session: Session, flush_context):
+    changed = []
+    touched = False
+    for instance in session.new:
+        if isinstance(instance, models.Company):
+            changed.append(instance)
+    for instance in session.dirty:
+        if isinstance(instance, models.Company) and instance not in session.deleted:
+            touched = True
+            state = sa_inspect(instance)
+            if any(state.attrs[field].history.has_changes() for field in ("public_domain", "public_domains_json")):
+                changed.append(instance)
+    for instance in session.deleted:
+        if isinstance(instance, models.Company):
+            touched = True
+            table = models.CompanyDomain.__table__
+            session.connection().execute(delete(table).where(table.c.company_id == instance.id))
+    for company in changed:
+        sync_company(session.connection(), company.id, company.public_domain, company.public_domains_json)
+    if changed or touched:
+        # Any company change can alter what public pages show (branding, modules,
+        # license). Cleared now and again on commit, in case a concurrent request
+        # cached the old row in between.
+        session.info["company_domains_invalidate"] = True
+        invalidate()
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session):
+    if session.info.pop("company_domains_invalidate", False):
+        invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session: Session):
+    session.info.pop("company_domains_invalidate", None)
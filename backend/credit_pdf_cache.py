@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from typing import Any, Callable, Optional, Tuple
+
+import models
+
+# Rendered credit-submission PDFs, stored as <dir>/<submission_id>/<key>.pdf.
+# The key hashes every input the renderer reads, so a changed form, attachment
+# or company branding misses the cache by itself; the explicit invalidation
+# below only frees the disk space of stale versions.
+CREDIT_PDF_CACHE_DIR = os.getenv("CREDIT_PDF_CACHE_DIR", os.path.join("cache", "credit_pdfs"))
+# Bump when the PDF layout changes so previously cached files are not served.
+CREDIT_PDF_LAYOUT_VERSION = "reference-1"
+
+COMPANY_BRANDING_FIELDS = (
+    "name",
+    "logo_url",
+    "primary_color",
+    "secondary_color",
+    "contact_address",
+    "contact_email",
+    "contact_phone",
+    "public_domain",
+    "website_url",
+)
+
+
+def credit_pdf_cache_key(company: Optional[models.Company], submission: models.PublicCreditSubmission) -> str:
+    # Uploaded attachments and logos are stored under unique file names, so
+    # their paths identify their content and the files need not be read here.
+    fingerprint = {
+        "layout": CREDIT_PDF_LAYOUT_VERSION,
+        "submission": {
+            "id": submission.id,
+            "applicant_name": submission.applicant_name,
+            "consent_text": submission.consent_text,
+            "form_payload": submission.form_payload or {},
+            "attachments": submission.attachments or {},
+        },
+        "company": {field: getattr(company, field, None) for field in COMPANY_BRANDING_FIELDS},
+    }
+    encoded = json.dumps(fingerprint, sort_keys=True, default=str, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _submission_dir(submission_id: int) -> str:
+    return os.path.join(CREDIT_PDF_CACHE_DIR, str(int(submission_id)))
+
+
+def cached_pdf_path(submission_id: int, key: str) -> str:
+    return os.path.join(_submission_dir(submission_id), f"{key}.pdf")
+
+
+def _store(submission_id: int, key: str, pdf_bytes: bytes):
+    directory = _submission_dir(submission_id)
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, f".{uuid.uuid4().hex}.tmp")
+    with open(temp_path, "wb") as handle:
+        handle.write(pdf_bytes)
+    os.replace(temp_path, cached_pdf_path(submission_id, key))
+    # Only the current version of a submission is kept.
+    for name in os.listdir(directory):
+        if name.endswith(".pdf") and name != f"{key}.pdf":
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def get_or_render(
+    company: Optional[models.Company],
+    submission: models.PublicCreditSubmission,
+    render: Callable[[Optional[models.Company], models.PublicCreditSubmission], bytes],
+    key: Optional[str] = None,
+) -> Tuple[str, bytes]:
+    """Returns (cache key, PDF bytes), rendering and storing on a miss."""
+    key = key or credit_pdf_cache_key(company, submission)
+    path = cached_pdf_path(submission.id, key)
+    try:
+        with open(path, "rb") as handle:
+            return key, handle.read()
+    except OSError:
+        pass
+
+    pdf_bytes = render(company, submission)
+    try:
+        _store(submission.id, key, pdf_bytes)
+    except OSError as exc:
+        print(f"Warning: could not cache credit PDF for submission {submission.id}: {exc}", flush=True)
+    return key, pdf_bytes
+
+
+def invalidate(submission_id: Optional[Any]):
+    if not submission_id:
+        return
+    shutil.rmtree(_submission_dir(submission_id), ignore_errors=True)
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import os
+import time
+import uuid
+import zipfile
+from collections import deque
+from typing import Any, Callable, Deque, Iterable, Iterator, Optional, Tuple
+
+import pdf_render_pool
+
+# ZIP exports of rendered documents. Documents are rendered on the PDF pool a
+# few at a time and added to the archive in the order they were requested
+# while the next ones render, so the client starts receiving data right away.
+EXPORT_DIR = os.getenv("DOCUMENT_EXPORT_DIR", os.path.join("cache", "exports"))
+# Exports with more documents than this run as a background job.
+EXPORT_BACKGROUND_THRESHOLD = int(os.getenv("DOCUMENT_EXPORT_BACKGROUND_THRESHOLD", "300") or "300")
+EXPORT_RETENTION_SECONDS = 24 * 3600
+
+# (file name inside the ZIP, renderer, renderer argument)
+ExportItem = Tuple[str, Callable[..., bytes], Any]
+
+
+def render_in_order(items: Iterable[ExportItem], window: Optional[int] = None) -> Iterator[Tuple[str, bytes]]:
+    """Yields (name, pdf_bytes) keeping up to `window` renders in flight."""
+    window = window or max(2, pdf_render_pool.PDF_RENDER_WORKERS * 2)
+    pending: Deque[Tuple[str, Any, Callable[..., bytes], Any]] = deque()
+    for name, renderer, document in items:
+        pending.append((name, pdf_render_pool.submit(renderer, document), renderer, document))
+        if len(pending) >= window:
+            yield _collect(pending.popleft())
+    while pending:
+        yield _collect(pending.popleft())
+
+
+def _collect(entry) -> Tuple[str, bytes]:
+    name, future, renderer, document = entry
+    try:
+        return name, future.result(timeout=pdf_render_pool.PDF_RENDER_TIMEOUT_SECONDS)
+    except Exception as exc:
+        if isinstance(exc, ImportError):
+            raise
+        # One bad document must not abort the whole export.
+        print(f"Warning: could not render {name} for export: {exc}", flush=True)
+        return f"{name}.error.txt", f"No se pudo generar el documento: {exc}".encode("utf-8")
+
+
+class _ChunkSink:
+    """Write-only, non-seekable file object; zipfile then streams with data descriptors."""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip_stream(items: Iterable[ExportItem], progress=None) -> Iterator[bytes]:
+    # PDFs are already compressed, so entries are stored rather than deflated.
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for name, pdf_bytes in render_in_order(items):
+            archive.writestr(name, pdf_bytes)
+            if progress is not None:
+                progress.advance(1)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
+
+
+def export_path(file_name: str) -> str:
+    return os.path.join(EXPORT_DIR, os.path.basename(file_name))
+
+
+def write_zip_file(prefix: str, items: Iterable[ExportItem], progress=None) -> str:
+    """Writes the export ZIP to EXPORT_DIR and returns its file name."""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    _remove_expired_exports()
+    file_name = f"{prefix}_{uuid.uuid4().hex[:12]}.zip"
+    temp_path = export_path(f"{file_name}.tmp")
+    with open(temp_path, "wb") as handle:
+        for chunk in iter_zip_stream(items, progress):
+            handle.write(chunk)
+    os.replace(temp_path, export_path(file_name))
+    return file_name
+
+
+def _remove_expired_exports():
+    threshold = time.time() - EXPORT_RETENTION_SECONDS
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < threshold:
+                os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,343 @@
+from __future__ import annotations
+
+import datetime
+import email
+import email.policy
+import os
+import smtplib
+import socket
+import ssl
+import threading
+import time
+import uuid
+from collections import Counter
+from email.message import EmailMessage
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, or_, update
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+
+# Transactional mail is written to email_outbox inside the request and
+# delivered by a background worker. One authenticated SMTP connection per
+# company is reused across a batch; failures are retried with exponential
+# backoff and dead-lettered after EMAIL_OUTBOX_MAX_ATTEMPTS.
+EMAIL_OUTBOX_WORKER_ENABLED = (os.getenv("EMAIL_OUTBOX_WORKER", "1") or "1").strip().lower() not in {"0", "false", "no"}
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "50") or "50")
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "6") or "6")
+EMAIL_OUTBOX_POLL_SECONDS = 15
+EMAIL_OUTBOX_RETRY_BASE_SECONDS = 30
+EMAIL_OUTBOX_RETRY_MAX_SECONDS = 3600
+# A row stuck in "sending" longer than this (worker died mid-send) is retried.
+EMAIL_OUTBOX_LEASE_SECONDS = 300
+SMTP_IDLE_SECONDS = 60
+SMTP_TIMEOUT_SECONDS = 20
+
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_DEAD = "dead"
+
+# builder(db, outbox_row) -> (EmailMessage, smtp_settings); registered by main
+# for messages whose content (e.g. a PDF attachment) is produced at delivery time.
+_builders: Dict[str, Callable[[Session, models.EmailOutbox], Tuple[EmailMessage, Dict[str, Any]]]] = {}
+_settings_resolver: Optional[Callable[[Session, Optional[int]], Dict[str, Any]]] = None
+
+_metrics_lock = threading.Lock()
+_metrics: Counter = Counter()
+
+
+def _record_metric(name: str, amount: int = 1):
+    with _metrics_lock:
+        _metrics[name] += amount
+
+
+def register_builder(kind: str, builder: Callable[[Session, models.EmailOutbox], Tuple[EmailMessage, Dict[str, Any]]]):
+    _builders[kind] = builder
+
+
+def set_settings_resolver(resolver: Callable[[Session, Optional[int]], Dict[str, Any]]):
+    global _settings_resolver
+    _settings_resolver = resolver
+
+
+def _smtp_security(smtp_settings: Dict[str, Any]) -> str:
+    security = (smtp_settings.get("security") or "").strip().lower()
+    if security in {"starttls", "ssl", "none"}:
+        return security
+    return "starttls" if smtp_settings.get("use_tls", True) else "ssl"
+
+
+def open_smtp_connection(smtp_settings: Dict[str, Any]) -> smtplib.SMTP:
+    security = _smtp_security(smtp_settings)
+    if security == "ssl":
+        server = smtplib.SMTP_SSL(smtp_settings["host"], smtp_settings["port"], timeout=SMTP_TIMEOUT_SECONDS)
+    else:
+        server = smtplib.SMTP(smtp_settings["host"], smtp_settings["port"], timeout=SMTP_TIMEOUT_SECONDS)
+        if security == "starttls":
+            server.starttls(context=ssl.create_default_context())
+    if smtp_settings.get("username"):
+        server.login(smtp_settings["username"], smtp_settings["password"])
+    _record_metric("smtp_connections_opened")
+    return server
+
+
+def deliver_now(message: EmailMessage, smtp_settings: Dict[str, Any]):
+    """Synchronous one-off delivery (used to validate SMTP settings)."""
+    server = open_smtp_connection(smtp_settings)
+    try:
+        server.send_message(message)
+    finally:
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+
+class SmtpConnectionPool:
+    """Authenticated connections keyed by server/account, reused while warm.
+
+    Only used from the worker thread, so it needs no locking.
+    """
+
+    def __init__(self, idle_seconds: int = SMTP_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._connections: Dict[tuple, Tuple[smtplib.SMTP, float]] = {}
+
+    @staticmethod
+    def _key(smtp_settings: Dict[str, Any]) -> tuple:
+        return (
+            smtp_settings["host"],
+            int(smtp_settings["port"]),
+            smtp_settings.get("username") or "",
+            _smtp_security(smtp_settings),
+        )
+
+    def _discard(self, key: tuple):
+        entry = self._connections.pop(key, None)
+        if entry:
+            try:
+                entry[0].close()
+            except Exception:
+                pass
+
+    def send(self, message: EmailMessage, smtp_settings: Dict[str, Any]):
+        key = self._key(smtp_settings)
+        for attempt in range(2):
+            entry = self._connections.get(key)
+            server = entry[0] if entry else open_smtp_connection(smtp_settings)
+            try:
+                server.send_message(message)
+                self._connections[key] = (server, time.monotonic())
+                if entry:
+                    _record_metric("smtp_connections_reused")
+                return
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPSenderRefused, ConnectionError, socket.timeout):
+                # The server dropped an idle connection: reconnect once.
+                self._discard(key)
+                if attempt == 1 or not entry:
+                    raise
+            except Exception:
+                self._discard(key)
+                raise
+
+    def close_idle(self, force: bool = False):
+        now = time.monotonic()
+        for key, (server, last_used) in list(self._connections.items()):
+            if force or now - last_used > self.idle_seconds:
+                try:
+                    server.quit()
+                except Exception:
+                    pass
+                self._connections.pop(key, None)
+
+
+def enqueue_message(
+    db: Session,
+    message: Optional[EmailMessage],
+    *,
+    kind: str,
+    company_id: Optional[int] = None,
+    entity_type: Optional[str] = None,
+    entity_id: Optional[int] = None,
+    commit: bool = True,
+) -> models.EmailOutbox:
+    """Queues a message. message=None defers building to the registered builder for `kind`."""
+    row = models.EmailOutbox(
+        company_id=company_id,
+        kind=kind,
+        recipient=(str(message["To"]) if message is not None and message["To"] else None),
+        subject=(str(message["Subject"])[:255] if message is not None and message["Subject"] else None),
+        message_bytes=message.as_bytes(policy=email.policy.SMTP) if message is not None else None,
+        entity_type=entity_type,
+        entity_id=entity_id,
+        status=STATUS_PENDING,
+        attempts=0,
+        next_attempt_at=datetime.datetime.utcnow(),
+    )
+    db.add(row)
+    if commit:
+        db.commit()
+    _record_metric("enqueued")
+    wake_worker()
+    return row
+
+
+def _retry_delay_seconds(attempts: int) -> int:
+    return min(EMAIL_OUTBOX_RETRY_MAX_SECONDS, EMAIL_OUTBOX_RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+
+
+class OutboxWorker:
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.pool = SmtpConnectionPool()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                processed = self.process_batch()
+            except Exception as exc:
+                print(f"Warning: email outbox batch failed: {exc}", flush=True)
+                processed = 0
+            self.pool.close_idle()
+            if processed < EMAIL_OUTBOX_BATCH_SIZE:
+                self._wake.wait(EMAIL_OUTBOX_POLL_SECONDS)
+                self._wake.clear()
+
+    def _claim(self, db: Session) -> List[models.EmailOutbox]:
+        now = datetime.datetime.utcnow()
+        lease_expired = now - datetime.timedelta(seconds=EMAIL_OUTBOX_LEASE_SECONDS)
+        candidate_ids = [
+            row_id for (row_id,) in db.query(models.EmailOutbox.id).filter(
+                or_(
+                    (models.EmailOutbox.status == STATUS_PENDING) & (models.EmailOutbox.next_attempt_at <= now),
+                    (models.EmailOutbox.status == STATUS_SENDING) & (models.EmailOutbox.locked_at < lease_expired),
+                )
+            ).order_by(models.EmailOutbox.company_id, models.EmailOutbox.id).limit(EMAIL_OUTBOX_BATCH_SIZE).all()
+        ]
+        claimed_ids = []
+        for row_id in candidate_ids:
+            # Conditional UPDATE = claim; another worker process that got here first wins.
+            result = db.execute(
+                update(models.EmailOutbox)
+                .where(
+                    models.EmailOutbox.id == row_id,
+                    or_(
+                        models.EmailOutbox.status == STATUS_PENDING,
+                        (models.EmailOutbox.status == STATUS_SENDING) & (models.EmailOutbox.locked_at < lease_expired),
+                    ),
+                )
+                .values(status=STATUS_SENDING, locked_by=self.worker_id, locked_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount:
+                claimed_ids.append(row_id)
+        db.commit()
+        if not claimed_ids:
+            return []
+        return db.query(models.EmailOutbox).filter(models.EmailOutbox.id.in_(claimed_ids)).order_by(
+            models.EmailOutbox.company_id,
+            models.EmailOutbox.id,
+        ).all()
+
+    def _build(self, db: Session, row: models.EmailOutbox) -> Tuple[EmailMessage, Dict[str, Any]]:
+        if row.message_bytes is None:
+            builder = _builders.get(row.kind)
+            if builder is None:
+                raise RuntimeError(f"No hay constructor de correo para '{row.kind}'")
+            return builder(db, row)
+        if _settings_resolver is None:
+            raise RuntimeError("El outbox de correo no tiene configuración SMTP registrada")
+        message = email.message_from_bytes(row.message_bytes, policy=email.policy.default)
+        return message, _settings_resolver(db, row.company_id)
+
+    def process_batch(self) -> int:
+        with SessionLocal() as db:
+            rows = self._claim(db)
+            for row in rows:
+                try:
+                    message, smtp_settings = self._build(db, row)
+                    started = time.perf_counter()
+                    self.pool.send(message, smtp_settings)
+                    _record_metric("send_seconds_ms", int((time.perf_counter() - started) * 1000))
+                    row.status = STATUS_SENT
+                    row.sent_at = datetime.datetime.utcnow()
+                    row.last_error = None
+                    if row.recipient is None and message["To"]:
+                        row.recipient = str(message["To"])
+                    if row.subject is None and message["Subject"]:
+                        row.subject = str(message["Subject"])[:255]
+                    _record_metric("sent")
+                except Exception as exc:
+                    row.attempts = (row.attempts or 0) + 1
+                    row.last_error = str(exc)[:2000]
+                    if row.attempts >= EMAIL_OUTBOX_MAX_ATTEMPTS:
+                        row.status = STATUS_DEAD
+                        _record_metric("dead_lettered")
+                        print(f"Warning: email outbox {row.id} ({row.kind}) dead-lettered: {exc}", flush=True)
+                    else:
+                        row.status = STATUS_PENDING
+                        row.next_attempt_at = datetime.datetime.utcnow() + datetime.timedelta(
+                            seconds=_retry_delay_seconds(row.attempts)
+                        )
+                        _record_metric("retried")
+                row.locked_by = None
+                row.locked_at = None
+                db.commit()
+            return len(rows)
+
+
+_worker = OutboxWorker()
+
+
+def wake_worker():
+    if not EMAIL_OUTBOX_WORKER_ENABLED:
+        return
+    _worker.start()
+    _worker.wake()
+
+
+def start_worker():
+    if EMAIL_OUTBOX_WORKER_ENABLED:
+        _worker.start()
+
+
+def render_prometheus(db: Optional[Session] = None) -> str:
+    with _metrics_lock:
+        snapshot = dict(_metrics)
+    lines = [
+        "# HELP autosqp_email_outbox_events_total E-mail outbox events in this worker process.",
+        "# TYPE autosqp_email_outbox_events_total counter",
+    ]
+    for name in ("enqueued", "sent", "retried", "dead_lettered", "smtp_connections_opened", "smtp_connections_reused"):
+        lines.append(f'autosqp_email_outbox_events_total{{event="{name}"}} {snapshot.get(name, 0)}')
+    lines += [
+        "# HELP autosqp_email_outbox_send_seconds_total Time spent in SMTP send calls.",
+        "# TYPE autosqp_email_outbox_send_seconds_total counter",
+        f"autosqp_email_outbox_send_seconds_total {snapshot.get('send_seconds_ms', 0) / 1000:.3f}",
+    ]
+    if db is not None:
+        lines += [
+            "# HELP autosqp_email_outbox_messages Messages in the outbox by status.",
+            "# TYPE autosqp_email_outbox_messages gauge",
+        ]
+        for status_name, count in db.query(models.EmailOutbox.status, func.count(models.EmailOutbox.id)).group_by(
+            models.EmailOutbox.status
+        ).all():
+            lines.append(f'autosqp_email_outbox_messages{{status="{status_name}"}} {count}')
+    return "\n".join(lines) + "\n"
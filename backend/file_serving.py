@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from calendar import timegm
+from collections import OrderedDict
+from email.utils import parsedate
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import Request
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+import upload_store
+
+# Stored files (uploads, blobs, photo derivatives) are served with a strong
+# ETag built from their content: the SHA-256 in the name of content-addressed
+# blobs, or a hash of the bytes cached per (size, mtime) for everything else.
+# Blobs never change under the same URL, so they are sent as immutable for a
+# year. Other files may be replaced in place and are cached for
+# STATIC_CACHE_SECONDS, then revalidated with 304s. That includes the
+# derivatives of blobs, which backfill_photo_derivatives.py --force rewrites,
+# and their manifest.json. FileResponse answers Range requests (single and
+# multipart), honouring If-Range against the same ETag, so PDFs and videos can
+# be streamed and resumed.
+#
+# With STATIC_ACCEL_REDIRECT_PREFIX set (e.g. /_static/), the app only checks
+# the request and answers with an X-Accel-Redirect header, and nginx sends the
+# bytes with sendfile from an internal location that aliases static/:
+#
+#     location /_static/ {
+#         internal;
+#         alias /srv/autosqp/backend/static/;
+#         etag off;
+#     }
+#
+# nginx keeps the Cache-Control and Content-Disposition sent by the app but
+# not its ETag: it would send its own (mtime and size) instead, hence
+# `etag off`. Clients then revalidate with If-Modified-Since, which the app
+# answers with 304 from the same mtime before redirecting. Range and If-Range
+# requests are never redirected, since nginx would check If-Range against its
+# own validators; the app serves them itself with the content ETag.
+
+STATIC_DIR = "static"
+STATIC_CACHE_SECONDS = int(os.getenv("STATIC_CACHE_SECONDS", "300") or "300")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+STATIC_ACCEL_REDIRECT_PREFIX = (os.getenv("STATIC_ACCEL_REDIRECT_PREFIX", "") or "").strip()
+HASH_CHUNK_BYTES = 1024 * 1024
+ETAG_CACHE_SIZE = 4096
+# static/ subfolders whose URLs always point to the same bytes.
+IMMUTABLE_PREFIXES = ("blobs/",)
+
+_lock = threading.Lock()
+_etags: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+
+
+def _relative_static_path(path: str) -> Optional[str]:
+    absolute_path = os.path.realpath(path)
+    static_root = os.path.realpath(STATIC_DIR)
+    if not absolute_path.startswith(static_root + os.sep):
+        return None
+    return os.path.relpath(absolute_path, static_root).replace(os.sep, "/")
+
+
+def content_etag(path: str, stat_result: os.stat_result) -> str:
+    """Strong ETag of a file's content; hashing is skipped for blobs and for files seen unchanged."""
+    relative_path = _relative_static_path(path)
+    sha256 = upload_store.blob_sha(f"static/{relative_path}") if relative_path else None
+    if sha256:
+        return f'"{sha256}"'
+
+    key = os.path.realpath(path)
+    with _lock:
+        cached = _etags.get(key)
+        if cached and cached[0] == stat_result.st_size and cached[1] == stat_result.st_mtime_ns:
+            _etags.move_to_end(key)
+            return f'"{cached[2]}"'
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    hexdigest = digest.hexdigest()
+    with _lock:
+        _etags[key] = (stat_result.st_size, stat_result.st_mtime_ns, hexdigest)
+        _etags.move_to_end(key)
+        while len(_etags) > ETAG_CACHE_SIZE:
+            _etags.popitem(last=False)
+    return f'"{hexdigest}"'
+
+
+def cache_control(path: str) -> str:
+    relative_path = _relative_static_path(path) or ""
+    if relative_path.startswith(IMMUTABLE_PREFIXES):
+        return IMMUTABLE_CACHE_CONTROL
+    return f"public, max-age={STATIC_CACHE_SECONDS}"
+
+
+def _is_not_modified(etag: str, last_modified: Optional[float], request_headers: Headers) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match:
+        if if_none_match.strip() == "*":
+            return True
+        return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if_modified_since = parsedate(request_headers.get("if-modified-since") or "")
+    if if_modified_since is None or last_modified is None:
+        return False
+    return int(last_modified) <= timegm(if_modified_since)
+
+
+def _file_response_sync(
+    request_headers: Headers,
+    path: str,
+    stat_result: os.stat_result,
+    filename: Optional[str] = None,
+    media_type: Optional[str] = None,
+) -> Response:
+    headers = {
+        "etag": content_etag(path, stat_result),
+        "cache-control": cache_control(path),
+        "accept-ranges": "bytes",
+    }
+    response = FileResponse(path, headers=headers, media_type=media_type, filename=filename, stat_result=stat_result)
+    if _is_not_modified(headers["etag"], stat_result.st_mtime, request_headers):
+        return NotModifiedResponse(response.headers)
+
+    relative_path = _relative_static_path(path)
+    is_range_request = "range" in request_headers or "if-range" in request_headers
+    if STATIC_ACCEL_REDIRECT_PREFIX and relative_path and not is_range_request:
+        accel_headers = {
+            key: value
+            for key, value in response.headers.items()
+            if key in ("content-type", "content-disposition", "cache-control", "etag", "last-modified")
+        }
+        accel_headers["x-accel-redirect"] = STATIC_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(relative_path)
+        return Response(headers=accel_headers)
+    return response
+
+
+def build_file_response(
+    request: Request,
+    path: str,
+    filename: Optional[str] = None,
+    media_type: Optional[str] = None,
+) -> Response:
+    """Serves a stored file with content ETag, cache policy, Range and optional X-Accel-Redirect.
+
+    Hashing a file the first time reads it whole: call this from sync endpoints
+    (run in the threadpool) and use file_response() from async ones.
+    """
+    return _file_response_sync(request.headers, path, os.stat(path), filename=filename, media_type=media_type)
+
+
+async def file_response(
+    request: Request,
+    path: str,
+    filename: Optional[str] = None,
+    media_type: Optional[str] = None,
+) -> Response:
+    """build_file_response() off the event loop."""
+    return await anyio.to_thread.run_sync(lambda: build_file_response(request, path, filename, media_type))
+
+
+class StoredFiles(StaticFiles):
+    """StaticFiles mount that serves files through file_response()."""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        # The conditional and cache headers are added in get_response, off the event loop.
+        return FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        response = await super().get_response(path, scope)
+        if not isinstance(response, FileResponse) or response.status_code != 200:
+            return response
+        return await anyio.to_thread.run_sync(
+            _file_response_sync,
+            Headers(scope=scope),
+            str(response.path),
+            response.stat_result,
+        )
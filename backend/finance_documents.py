@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import datetime
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+# Reportlab renderers for finance documents. They take plain dicts (built in
+# main from the ORM rows) and return PDF bytes, so they can run in the
+# pdf_render_pool worker processes; keep this module free of main/database imports.
+
+# Logo bytes per path; each render wraps them in its own ImageReader, since
+# readers are not safe to share when PDF_RENDER_WORKERS=0 renders in threads.
+_logo_bytes: Dict[str, bytes] = {}
+
+
+def _money(value: int) -> str:
+    return f"COP ${int(value or 0):,}".replace(",", ".")
+
+
+def _logo_reader(logo_path: Optional[str]):
+    if not logo_path:
+        return None
+    from reportlab.lib.utils import ImageReader
+
+    png_bytes = _logo_bytes.get(logo_path)
+    if png_bytes is None:
+        try:
+            with open(logo_path, "rb") as handle:
+                png_bytes = handle.read()
+            ImageReader(BytesIO(png_bytes)).getSize()
+        except Exception:
+            return None
+        _logo_bytes[logo_path] = png_bytes
+    return ImageReader(BytesIO(png_bytes))
+
+
+def draw_header_logo(pdf, logo_reader, x: float, y: float, box_width: float, box_height: float) -> bool:
+    """Draws a cached company logo fitted into the box; False when it cannot be drawn."""
+    try:
+        image_width, image_height = logo_reader.getSize()
+        scale = min(box_width / max(image_width, 1), box_height / max(image_height, 1))
+        draw_width = image_width * scale
+        draw_height = image_height * scale
+        pdf.drawImage(
+            logo_reader,
+            x + (box_width - draw_width) / 2,
+            y + (box_height - draw_height) / 2,
+            width=draw_width,
+            height=draw_height,
+            preserveAspectRatio=True,
+            mask="auto",
+        )
+        return True
+    except Exception:
+        return False
+
+
+def render_sale_invoice_pdf(document: Dict[str, Any]) -> bytes:
+    from reportlab.lib.colors import HexColor
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    receipts = document["receipts"]
+
+    def write_row(pdf_doc, y_pos, values, fills=None):
+        x_positions = [50, 115, 290, 390, 470]
+        widths = [58, 165, 90, 70, 85]
+        for index, value in enumerate(values):
+            pdf_doc.setFillColor(fills[index] if fills and fills[index] else HexColor("#1e293b"))
+            pdf_doc.drawString(x_positions[index], y_pos, str(value)[: int(widths[index] / 4.8)])
+
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter
+    pdf.setTitle(f"factura_venta_{document['sale_id']}.pdf")
+    company_name = document["company_name"]
+    logo_reader = _logo_reader(document.get("logo_path"))
+
+    def draw_header():
+        pdf.setFillColor(HexColor("#1e293b"))
+        pdf.rect(0, height - 100, width, 100, fill=1, stroke=0)
+        title_x = 50
+        if logo_reader and draw_header_logo(pdf, logo_reader, 50, height - 82, 64, 64):
+            title_x = 126
+        pdf.setFillColor(HexColor("#ffffff"))
+        pdf.setFont("Helvetica-Bold", 22)
+        pdf.drawString(title_x, height - 58, f"{company_name.upper()} - FACTURA CONSOLIDADA"[:58 if title_x == 50 else 48])
+        pdf.setFont("Helvetica", 10)
+        pdf.drawString(title_x, height - 78, "Resumen contable de venta y movimientos relacionados")
+        pdf.setFont("Helvetica-Bold", 14)
+        pdf.drawRightString(width - 50, height - 58, f"Venta #{document['sale_id']}")
+        pdf.setFont("Helvetica", 10)
+        pdf.drawRightString(width - 50, height - 78, f"Fecha: {datetime.datetime.utcnow().strftime('%d/%m/%Y')}")
+
+    draw_header()
+    y = height - 135
+
+    pdf.setFont("Helvetica-Bold", 14)
+    pdf.setFillColor(HexColor("#0f172a"))
+    pdf.drawString(50, y, "Datos de la venta")
+    y -= 22
+    for label, value in [
+        ("Vehiculo", document["vehicle_label"]),
+        ("Cliente", document["lead_label"]),
+        ("Vendedor", document["seller_label"]),
+        ("Valor de venta", _money(document["sale_price"])),
+        ("Estado", (document["status"] or "pending").upper())
+    ]:
+        pdf.setFont("Helvetica-Bold", 10)
+        pdf.setFillColor(HexColor("#64748b"))
+        pdf.drawString(50, y, f"{label}:")
+        pdf.setFont("Helvetica", 10)
+        pdf.setFillColor(HexColor("#1e293b"))
+        pdf.drawString(150, y, str(value)[:80])
+        y -= 18
+
+    y -= 10
+    pdf.setFont("Helvetica-Bold", 14)
+    pdf.setFillColor(HexColor("#0f172a"))
+    pdf.drawString(50, y, "Movimientos relacionados")
+    y -= 24
+
+    pdf.setFillColor(HexColor("#f1f5f9"))
+    pdf.rect(45, y - 6, width - 90, 22, fill=1, stroke=0)
+    pdf.setFont("Helvetica-Bold", 9)
+    write_row(pdf, y, ["Fecha", "Concepto", "Cuenta", "Tipo", "Valor"])
+    y -= 22
+
+    income_total = 0
+    expense_total = 0
+    pdf.setFont("Helvetica", 9)
+    for receipt in receipts:
+        if y < 95:
+            pdf.showPage()
+            draw_header()
+            y = height - 135
+            pdf.setFillColor(HexColor("#f1f5f9"))
+            pdf.rect(45, y - 6, width - 90, 22, fill=1, stroke=0)
+            pdf.setFont("Helvetica-Bold", 9)
+            write_row(pdf, y, ["Fecha", "Concepto", "Cuenta", "Tipo", "Valor"])
+            y -= 22
+            pdf.setFont("Helvetica", 9)
+
+        is_expense = receipt["is_expense"]
+        if is_expense:
+            expense_total += int(receipt["amount"] or 0)
+        else:
+            income_total += int(receipt["amount"] or 0)
+
+        pdf.setStrokeColor(HexColor("#e2e8f0"))
+        pdf.line(45, y - 6, width - 45, y - 6)
+        write_row(
+            pdf,
+            y,
+            [
+                receipt["payment_date"].strftime("%d/%m/%Y") if receipt["payment_date"] else "-",
+                receipt["concept"],
+                receipt["category_label"],
+                receipt["movement_label"],
+                _money(receipt["amount"])
+            ],
+            [None, None, None, HexColor("#dc2626") if is_expense else HexColor("#059669"), HexColor("#dc2626") if is_expense else HexColor("#059669")]
+        )
+        y -= 20
+
+    if not receipts:
+        pdf.setFont("Helvetica-Oblique", 10)
+        pdf.setFillColor(HexColor("#64748b"))
+        pdf.drawString(50, y, "Esta venta no tiene movimientos contables asociados.")
+        y -= 24
+
+    y -= 16
+    if y < 150:
+        pdf.showPage()
+        draw_header()
+        y = height - 150
+
+    balance_total = income_total - expense_total
+    pdf.setFillColor(HexColor("#f8fafc"))
+    pdf.rect(330, y - 70, width - 380, 88, fill=1, stroke=1)
+    pdf.setFont("Helvetica-Bold", 10)
+    pdf.setFillColor(HexColor("#059669"))
+    pdf.drawString(350, y, f"Ingresos: {_money(income_total)}")
+    y -= 20
+    pdf.setFillColor(HexColor("#dc2626"))
+    pdf.drawString(350, y, f"Egresos: {_money(expense_total)}")
+    y -= 20
+    pdf.setFillColor(HexColor("#1d4ed8") if balance_total >= 0 else HexColor("#dc2626"))
+    pdf.drawString(350, y, f"Neto: {_money(balance_total)}")
+
+    pdf.setStrokeColor(HexColor("#cbd5e1"))
+    pdf.line(50, 80, width - 50, 80)
+    pdf.setFont("Helvetica-Oblique", 8)
+    pdf.setFillColor(HexColor("#94a3b8"))
+    pdf.drawCentredString(width / 2, 63, "Este documento consolida los movimientos contables relacionados con la venta.")
+    pdf.drawCentredString(width / 2, 51, f"Generado digitalmente el {datetime.datetime.utcnow().strftime('%d/%m/%Y %H:%M')}")
+
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def render_payment_receipt_pdf(document: Dict[str, Any]) -> bytes:
+    from reportlab.lib.colors import HexColor
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter
+    company_name = document["company_name"]
+
+    y = height - 60
+    pdf.setTitle(f"recibo_{document['receipt_id']}.pdf")
+
+    # Header with background
+    pdf.setFillColor(HexColor("#1e293b"))
+    pdf.rect(0, height - 100, width, 100, fill=1, stroke=0)
+    title_x = 50
+    logo_reader = _logo_reader(document.get("logo_path"))
+    if logo_reader and draw_header_logo(pdf, logo_reader, 50, height - 82, 64, 64):
+        title_x = 126
+
+    pdf.setFillColor(HexColor("#ffffff"))
+    pdf.setFont("Helvetica-Bold", 24)
+    pdf.drawString(title_x, height - 60, f"{company_name.upper()} - COMPRA Y VENTA"[:58 if title_x == 50 else 48])
+
+    pdf.setFont("Helvetica", 10)
+    pdf.drawString(title_x, height - 80, "Soporte de Contabilidad | Gestion Financiera")
+
+    pdf.setFillColor(HexColor("#ffffff"))
+    pdf.setFont("Helvetica-Bold", 14)
+    pdf.drawRightString(width - 50, height - 60, f"No. {document['receipt_number'] or 'PROV'}")
+    pdf.setFont("Helvetica", 10)
+    payment_date = document["payment_date"]
+    pdf.drawRightString(width - 50, height - 80, f"Fecha: {payment_date.strftime('%d/%m/%Y') if payment_date else 'N/A'}")
+
+    y = height - 140
+
+    # Main Content
+    pdf.setFillColor(HexColor("#0f172a"))
+    pdf.setFont("Helvetica-Bold", 16)
+    pdf.drawString(50, y, "Detalle del Movimiento")
+    y -= 10
+
+    pdf.setStrokeColor(HexColor("#e2e8f0"))
+    pdf.line(50, y, width - 50, y)
+    y -= 30
+
+    for label, value in document["display_lines"]:
+        pdf.setFont("Helvetica-Bold", 11)
+        pdf.setFillColor(HexColor("#64748b"))
+        pdf.drawString(50, y, f"{label}:")
+
+        pdf.setFont("Helvetica", 11)
+        pdf.setFillColor(HexColor("#1e293b"))
+        pdf.drawString(180, y, str(value))
+
+        y -= 6
+        pdf.setStrokeColor(HexColor("#f1f5f9"))
+        pdf.line(50, y, width - 50, y)
+        y -= 20
+
+    if document["notes"]:
+        y -= 20
+        pdf.setFillColor(HexColor("#f8fafc"))
+        pdf.rect(50, y - 60, width - 100, 70, fill=1, stroke=1)
+
+        pdf.setFillColor(HexColor("#475569"))
+        pdf.setFont("Helvetica-Bold", 10)
+        pdf.drawString(60, y, "NOTAS Y OBSERVACIONES:")
+        y -= 15
+        pdf.setFont("Helvetica", 9)
+        pdf.setFillColor(HexColor("#1e293b"))
+        text_object = pdf.beginText(60, y)
+        text_object.setLeading(12)
+        for paragraph in str(document["notes"]).splitlines() or [""]:
+            text_object.textLine(paragraph[:100])
+        pdf.drawText(text_object)
+        y -= 60
+
+    # Footer
+    pdf.setStrokeColor(HexColor("#cbd5e1"))
+    pdf.line(50, 100, width - 50, 100)
+
+    pdf.setFont("Helvetica-Oblique", 8)
+    pdf.setFillColor(HexColor("#94a3b8"))
+    pdf.drawCentredString(width/2, 85, f"Este documento es un soporte interno de contabilidad de {company_name}.")
+    pdf.drawCentredString(width/2, 75, f"Generado digitalmente el {datetime.datetime.utcnow().strftime('%d/%m/%Y %H:%M')}")
+
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
@@ -0,0 +1,360 @@
+from __future__ import annotations
+
+import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import case, delete, event, extract, func, inspect as sa_inspect, insert, select, update
+from sqlalchemy.orm import Session
+
+import models
+
+# Finance KPIs read from finance_monthly_rollups: one row per company and month
+# with the approved/pending sales and receipt totals. Rows are adjusted by
+# deltas after every flush that creates, deletes or changes a sale or receipt
+# (approval, rejection, amounts, dates), with an atomic upsert so concurrent
+# requests add up. reconcile_finance_rollups.py rebuilds them from the source
+# tables nightly.
+
+ROLLUP_COLUMNS = (
+    "approved_sales_count", "approved_net_revenue", "approved_commissions", "pending_sales_count",
+    "receipts_count", "receipts_amount", "income_amount", "expense_amount",
+)
+# Bucket of sales without sale_date; they only count in all-time totals.
+UNDATED_MONTH = datetime.date(1900, 1, 1)
+
+RollupKey = Tuple[int, datetime.date]
+
+
+def month_start(value) -> datetime.date:
+    if isinstance(value, datetime.datetime):
+        return value.date().replace(day=1)
+    if isinstance(value, datetime.date):
+        return value.replace(day=1)
+    return UNDATED_MONTH
+
+
+def next_month(value: datetime.date) -> datetime.date:
+    return (value.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def _status_value(status) -> str:
+    return str(getattr(status, "value", status) or "")
+
+
+def _sale_contribution(status, net_revenue, commission_amount) -> Dict[str, int]:
+    status = _status_value(status)
+    if status == models.SaleStatus.APPROVED.value:
+        return {
+            "approved_sales_count": 1,
+            "approved_net_revenue": int(net_revenue or 0),
+            "approved_commissions": int(commission_amount or 0),
+        }
+    if status == models.SaleStatus.PENDING.value:
+        return {"pending_sales_count": 1}
+    return {}
+
+
+def _receipt_contribution(movement_type, amount) -> Dict[str, int]:
+    amount = int(amount or 0)
+    movement_type = movement_type or "income"
+    contribution = {"receipts_count": 1, "receipts_amount": amount}
+    if movement_type == "income":
+        contribution["income_amount"] = amount
+    elif movement_type == "expense":
+        contribution["expense_amount"] = amount
+    return contribution
+
+
+def _empty_totals() -> Dict[str, int]:
+    return {column: 0 for column in ROLLUP_COLUMNS}
+
+
+# --- Maintenance ---------------------------------------------------------
+
+def _add(deltas: Dict[RollupKey, Dict[str, int]], company_id, month, contribution: Dict[str, int], sign: int):
+    if not company_id or not contribution:
+        return
+    bucket = deltas.setdefault((company_id, month), {})
+    for column, value in contribution.items():
+        bucket[column] = bucket.get(column, 0) + sign * value
+
+
+def _previous(instance, field: str):
+    history = sa_inspect(instance).attrs[field].history
+    return history.deleted[0] if history.deleted else getattr(instance, field)
+
+
+def _sale_state(instance, previous: bool):
+    read = (lambda field: _previous(instance, field)) if previous else (lambda field: getattr(instance, field))
+    return (
+        read("company_id"),
+        month_start(read("sale_date")),
+        _sale_contribution(read("status"), read("net_revenue"), read("commission_amount")),
+    )
+
+
+def _receipt_state(instance, previous: bool):
+    read = (lambda field: _previous(instance, field)) if previous else (lambda field: getattr(instance, field))
+    return (
+        read("company_id"),
+        month_start(read("payment_date")),
+        _receipt_contribution(read("movement_type"), read("amount")),
+    )
+
+
+SALE_FIELDS = ("company_id", "status", "sale_date", "net_revenue", "commission_amount")
+RECEIPT_FIELDS = ("company_id", "payment_date", "movement_type", "amount")
+
+
+def _keep_previous_value(target, value, oldvalue, initiator):
+    return value
+
+
+# Deltas need the value a row had before the change, also when the attribute
+# was expired (after a commit) and is assigned without being read first.
+for _model, _fields in ((models.Sale, SALE_FIELDS), (models.PaymentReceipt, RECEIPT_FIELDS)):
+    for _field in _fields:
+        event.listen(getattr(_model, _field), "set", _keep_previous_value, active_history=True, retval=True)
+
+
+def _upsert_delta(connection, company_id: int, month: datetime.date, delta: Dict[str, int]):
+    table = models.FinanceMonthlyRollup.__table__
+    now = datetime.datetime.utcnow()
+    row = {**_empty_totals(), **delta, "company_id": company_id, "month": month, "updated_at": now}
+    dialect = connection.dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+        statement = mysql_insert(table).values(row)
+        statement = statement.on_duplicate_key_update(
+            {column: table.c[column] + statement.inserted[column] for column in delta},
+            updated_at=now,
+        )
+        connection.execute(statement)
+        return
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+
+        statement = dialect_insert(table).values(row)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.company_id, table.c.month],
+            set_={**{column: table.c[column] + statement.excluded[column] for column in delta}, "updated_at": now},
+        )
+        connection.execute(statement)
+        return
+    result = connection.execute(
+        update(table)
+        .where(table.c.company_id == company_id, table.c.month == month)
+        .values({**{column: table.c[column] + value for column, value in delta.items()}, "updated_at": now})
+    )
+    if not result.rowcount:
+        connection.execute(insert(table), [row])
+
+
+@event.listens_for(Session, "after_flush")
+def _track_rollups_after_flush(session: Session, flush_context):
+    deltas: Dict[RollupKey, Dict[str, int]] = {}
+    states = {models.Sale: _sale_state, models.PaymentReceipt: _receipt_state}
+
+    for instance in session.new:
+        state_of = states.get(type(instance))
+        if state_of:
+            _add(deltas, *state_of(instance, previous=False), 1)
+    for instance in session.deleted:
+        state_of = states.get(type(instance))
+        if state_of:
+            _add(deltas, *state_of(instance, previous=True), -1)
+    for instance in session.dirty:
+        state_of = states.get(type(instance))
+        if not state_of or instance in session.deleted:
+            continue
+        before = state_of(instance, previous=True)
+        after = state_of(instance, previous=False)
+        if before != after:
+            _add(deltas, *before, -1)
+            _add(deltas, *after, 1)
+
+    connection = None
+    for (company_id, month), delta in deltas.items():
+        delta = {column: value for column, value in delta.items() if value}
+        if not delta:
+            continue
+        if connection is None:
+            connection = session.connection()
+        _upsert_delta(connection, company_id, month, delta)
+
+
+# --- Rebuild -------------------------------------------------------------
+
+def _aggregate_rows(connection, company_id: Optional[int]) -> Dict[RollupKey, Dict[str, int]]:
+    sales = models.Sale
+    receipts = models.PaymentReceipt
+    approved = sales.status == models.SaleStatus.APPROVED.value
+    movement = func.coalesce(receipts.movement_type, "income")
+    sale_query = select(
+        sales.company_id,
+        extract("year", sales.sale_date).label("year"),
+        extract("month", sales.sale_date).label("month"),
+        func.sum(case((approved, 1), else_=0)),
+        func.sum(case((approved, func.coalesce(sales.net_revenue, 0)), else_=0)),
+        func.sum(case((approved, func.coalesce(sales.commission_amount, 0)), else_=0)),
+        func.sum(case((sales.status == models.SaleStatus.PENDING.value, 1), else_=0)),
+    ).where(sales.company_id.isnot(None)).group_by(sales.company_id, "year", "month")
+    receipt_query = select(
+        receipts.company_id,
+        extract("year", receipts.payment_date).label("year"),
+        extract("month", receipts.payment_date).label("month"),
+        func.count(receipts.id),
+        func.sum(func.coalesce(receipts.amount, 0)),
+        func.sum(case((movement == "income", func.coalesce(receipts.amount, 0)), else_=0)),
+        func.sum(case((movement == "expense", func.coalesce(receipts.amount, 0)), else_=0)),
+    ).group_by(receipts.company_id, "year", "month")
+    if company_id:
+        sale_query = sale_query.where(sales.company_id == company_id)
+        receipt_query = receipt_query.where(receipts.company_id == company_id)
+
+    totals: Dict[RollupKey, Dict[str, int]] = {}
+
+    def bucket(row_company_id, year, month):
+        key_month = datetime.date(int(year), int(month), 1) if year and month else UNDATED_MONTH
+        return totals.setdefault((row_company_id, key_month), _empty_totals())
+
+    for row_company_id, year, month, approved_count, net_revenue, commissions, pending_count in connection.execute(sale_query):
+        values = bucket(row_company_id, year, month)
+        values["approved_sales_count"] += int(approved_count or 0)
+        values["approved_net_revenue"] += int(net_revenue or 0)
+        values["approved_commissions"] += int(commissions or 0)
+        values["pending_sales_count"] += int(pending_count or 0)
+    for row_company_id, year, month, count, amount, income, expense in connection.execute(receipt_query):
+        values = bucket(row_company_id, year, month)
+        values["receipts_count"] += int(count or 0)
+        values["receipts_amount"] += int(amount or 0)
+        values["income_amount"] += int(income or 0)
+        values["expense_amount"] += int(expense or 0)
+    return totals
+
+
+def rebuild_rollups(connection, company_id: Optional[int] = None) -> int:
+    """Replaces the rollup rows of one company (or all) with fresh GROUP BY totals.
+
+    The rows are locked before aggregating: a flush-time delta committed between
+    the aggregate and the DELETE would otherwise be lost. Deltas wait for the
+    lock (on MySQL the range lock also holds back new months) and then apply on
+    top of the rebuilt rows. Run it in a transaction.
+    """
+    table = models.FinanceMonthlyRollup.__table__
+    lock_query = select(table.c.company_id, table.c.month).with_for_update()
+    if company_id:
+        lock_query = lock_query.where(table.c.company_id == company_id)
+    connection.execute(lock_query).all()
+    totals = _aggregate_rows(connection, company_id)
+    statement = delete(table)
+    if company_id:
+        statement = statement.where(table.c.company_id == company_id)
+    connection.execute(statement)
+    now = datetime.datetime.utcnow()
+    rows = [
+        {**values, "company_id": row_company_id, "month": month, "updated_at": now}
+        for (row_company_id, month), values in totals.items()
+    ]
+    if rows:
+        connection.execute(insert(table), rows)
+    return len(rows)
+
+
+# --- Reads ---------------------------------------------------------------
+
+def _without_company_sales(month_from: Optional[datetime.date], month_to: Optional[datetime.date]):
+    sales = models.Sale
+    conditions = [sales.company_id.is_(None)]
+    if month_from:
+        conditions.append(sales.sale_date >= datetime.datetime.combine(month_from, datetime.time.min))
+    if month_to:
+        conditions.append(sales.sale_date < datetime.datetime.combine(month_to, datetime.time.min))
+    return conditions
+
+
+def _sale_totals(db: Session, conditions) -> Dict[str, int]:
+    sales = models.Sale
+    approved = sales.status == models.SaleStatus.APPROVED.value
+    sale_query = select(
+        func.coalesce(func.sum(case((approved, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((approved, func.coalesce(sales.net_revenue, 0)), else_=0)), 0),
+        func.coalesce(func.sum(case((approved, func.coalesce(sales.commission_amount, 0)), else_=0)), 0),
+        func.coalesce(func.sum(case((sales.status == models.SaleStatus.PENDING.value, 1), else_=0)), 0),
+    ).where(
+        sales.status.in_([models.SaleStatus.APPROVED.value, models.SaleStatus.PENDING.value]),
+        *conditions,
+    )
+    return dict(zip(ROLLUP_COLUMNS[:4], (int(value or 0) for value in db.execute(sale_query).one())))
+
+
+def rollup_totals(
+    db: Session,
+    company_id: Optional[int],
+    month_from: Optional[datetime.date] = None,
+    month_to: Optional[datetime.date] = None,
+) -> Dict[str, int]:
+    """Sums rollup rows; month_to is exclusive. Without bounds the undated bucket is included.
+
+    Without company_id (super admin) sales that belong to no company are added
+    from the sales table, since the rollup only has rows per company.
+    """
+    table = models.FinanceMonthlyRollup
+    query = select(*[func.coalesce(func.sum(getattr(table, column)), 0) for column in ROLLUP_COLUMNS])
+    if company_id:
+        query = query.where(table.company_id == company_id)
+    if month_from:
+        query = query.where(table.month >= month_from)
+    if month_to:
+        query = query.where(table.month < month_to)
+    totals = {column: int(value or 0) for column, value in zip(ROLLUP_COLUMNS, db.execute(query).one())}
+    if not company_id:
+        for column, value in _sale_totals(db, _without_company_sales(month_from, month_to)).items():
+            totals[column] += value
+    return totals
+
+
+def live_totals(db: Session, company_id: Optional[int], start: datetime.datetime, end: datetime.datetime) -> Dict[str, int]:
+    """The rollup figures computed straight from sales and receipts for [start, end)."""
+    sales = models.Sale
+    receipts = models.PaymentReceipt
+    sale_conditions = [sales.sale_date >= start, sales.sale_date < end]
+    movement = func.coalesce(receipts.movement_type, "income")
+    # payment_date is NOT NULL, so it can be compared directly and use the index.
+    receipt_date = receipts.payment_date
+    receipt_query = select(
+        func.count(receipts.id),
+        func.coalesce(func.sum(func.coalesce(receipts.amount, 0)), 0),
+        func.coalesce(func.sum(case((movement == "income", func.coalesce(receipts.amount, 0)), else_=0)), 0),
+        func.coalesce(func.sum(case((movement == "expense", func.coalesce(receipts.amount, 0)), else_=0)), 0),
+    ).where(receipt_date >= start, receipt_date < end)
+    if company_id:
+        sale_conditions.append(sales.company_id == company_id)
+        receipt_query = receipt_query.where(receipts.company_id == company_id)
+    totals = _sale_totals(db, sale_conditions)
+    for column, value in zip(ROLLUP_COLUMNS[4:], db.execute(receipt_query).one()):
+        totals[column] = int(value or 0)
+    return totals
+
+
+def period_totals(db: Session, company_id: Optional[int], start: datetime.datetime, end: datetime.datetime) -> Dict[str, int]:
+    """Whole months inside [start, end) come from the rollup; the partial edges are summed live."""
+    first_full = month_start(start)
+    if datetime.datetime.combine(first_full, datetime.time.min) < start:
+        first_full = next_month(first_full)
+    end_full = month_start(end)
+    first_full_at = datetime.datetime.combine(first_full, datetime.time.min)
+    end_full_at = datetime.datetime.combine(end_full, datetime.time.min)
+    if first_full_at >= end_full_at:
+        return live_totals(db, company_id, start, end)
+
+    totals = rollup_totals(db, company_id, first_full, end_full)
+    for edge_start, edge_end in ((start, first_full_at), (end_full_at, end)):
+        if edge_start < edge_end:
+            for column, value in live_totals(db, company_id, edge_start, edge_end).items():
+                totals[column] += value
+    return totals
@@ -0,0 +1,47 @@
+"""
+Removes uploaded files that no record references anymore.
+
+Blobs in static/blobs/ whose reference count dropped to zero, blob files
+without an upload_blobs row (requests that failed before committing) and
+leftover temp files are deleted once older than the grace period, together
+with the resized derivatives of images. Blobs that a record still points to
+(URLs copied between records) are kept and get their reference back.
+
+Usage:
+    python gc_upload_blobs.py
+    python gc_upload_blobs.py --dry-run
+    python gc_upload_blobs.py --grace-hours 72
+"""
+import argparse
+import sys
+
+import upload_store
+from database import SessionLocal
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Garbage-collect unreferenced upload blobs")
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be removed")
+    parser.add_argument(
+        "--grace-hours",
+        type=int,
+        default=upload_store.UPLOAD_GC_GRACE_HOURS,
+        help="Keep files changed more recently than this",
+    )
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        counts = upload_store.collect_garbage(db, grace_hours=args.grace_hours, dry_run=args.dry_run)
+
+    label = "would be removed" if args.dry_run else "removed"
+    print(
+        f"{counts['blobs']} unreferenced blob(s), {counts['orphans']} orphan file(s) and "
+        f"{counts['temp_files']} temp file(s) {label} ({counts['bytes'] / (1024 * 1024):.1f} MB)"
+    )
+    if counts["relinked"]:
+        print(f"{counts['relinked']} blob(s) kept: still referenced by copied URLs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+import models
+
+# Uploaded photos keep their original file in static/ and get resized copies
+# (thumb, card, full) as WebP and JPEG under static/derivatives/<stem>/, with
+# orientation applied and EXIF and other metadata dropped. A manifest.json
+# written last marks the set as complete. Vehicle.photo_variants holds the
+# derivative URLs of each photo in the same order as Vehicle.photos and is
+# refreshed on flush whenever photos change; pages and WhatsApp shares use the
+# derivatives and the original stays the master copy.
+# Resizing is CPU-bound, so it runs in a pool of processes like PDF rendering;
+# IMAGE_DERIVATIVE_WORKERS=0 resizes in-process.
+
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv("IMAGE_DERIVATIVE_WORKERS", "2") or "2")
+IMAGE_DERIVATIVE_TIMEOUT_SECONDS = int(os.getenv("IMAGE_DERIVATIVE_TIMEOUT_SECONDS", "30") or "30")
+STATIC_DIR = "static"
+DERIVATIVE_DIR = os.path.join(STATIC_DIR, "derivatives")
+STATIC_URL_PREFIX = "/api/static/"
+MANIFEST_NAME = "manifest.json"
+# Size name -> longest edge in pixels. Smaller originals are not upscaled.
+DERIVATIVE_SIZES = {
+    "thumb": 320,
+    "card": 800,
+    "full": 1600,
+}
+# Format name -> (Pillow format, extension, save options).
+DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", "webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "jpg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+IMAGE_EXTENSIONS = {"jpg", "jpeg", "png", "webp", "gif", "bmp", "tif", "tiff"}
+
+_BLOB_NAME_RE = re.compile(r"^blobs/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]{1,10}$")
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+# --- Paths ---------------------------------------------------------------
+
+def static_name(url: Optional[str]) -> Optional[str]:
+    """File name in static/ that a photo URL points to, in any of the stored URL forms."""
+    raw = str(url or "").split("?", 1)[0].split("#", 1)[0].strip().replace("\\", "/")
+    if not raw or raw.startswith(("data:", "blob:")):
+        return None
+    if "/static/" in raw:
+        raw = raw.split("/static/", 1)[1]
+    elif raw.startswith("static/"):
+        raw = raw[len("static/"):]
+    elif "/" in raw:
+        return None
+    # Content-addressed uploads (upload_store) live in static/blobs/<aa>/.
+    if _BLOB_NAME_RE.match(raw):
+        return raw
+    # Older uploads live directly in static/; other subfolders belong to other features.
+    if not raw or "/" in raw or raw.startswith("."):
+        return None
+    return raw
+
+
+def is_image_name(name: Optional[str]) -> bool:
+    return bool(name) and os.path.splitext(name)[1].lstrip(".").lower() in IMAGE_EXTENSIONS
+
+
+def _derivative_dir(name: str) -> str:
+    return os.path.join(DERIVATIVE_DIR, os.path.splitext(name)[0])
+
+
+def _derivative_url(name: str, file_name: str) -> str:
+    return f"{STATIC_URL_PREFIX}derivatives/{os.path.splitext(name)[0]}/{file_name}"
+
+
+# --- Rendering (runs in the pool) ----------------------------------------
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "wb") as handle:
+        handle.write(data)
+    os.replace(temp_path, path)
+
+
+def render_derivatives(name: str) -> Dict[str, Any]:
+    """Writes every size and format of static/<name> and returns its variants entry."""
+    from PIL import Image, ImageOps
+
+    with Image.open(os.path.join(STATIC_DIR, name)) as source:
+        source.load()
+        image = ImageOps.exif_transpose(source)
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+
+    variants: Dict[str, Any] = {}
+    for size, max_edge in DERIVATIVE_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        entry: Dict[str, Any] = {"width": resized.width, "height": resized.height}
+        for format_name, (pil_format, extension, options) in DERIVATIVE_FORMATS.items():
+            frame = resized
+            if pil_format == "JPEG" and frame.mode == "RGBA":
+                # JPEG has no alpha channel: flatten on white.
+                flattened = Image.new("RGB", frame.size, (255, 255, 255))
+                flattened.paste(frame, mask=frame.getchannel("A"))
+                frame = flattened
+            output = BytesIO()
+            # Neither exif nor icc_profile is passed, so only the pixels are kept.
+            frame.save(output, format=pil_format, **options)
+            file_name = f"{size}.{extension}"
+            _write_atomic(os.path.join(_derivative_dir(name), file_name), output.getvalue())
+            entry[format_name] = _derivative_url(name, file_name)
+        variants[size] = entry
+
+    _write_atomic(
+        os.path.join(_derivative_dir(name), MANIFEST_NAME),
+        json.dumps(variants, separators=(",", ":")).encode("utf-8"),
+    )
+    return variants
+
+
+# --- Pool ----------------------------------------------------------------
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if IMAGE_DERIVATIVE_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            # spawn: never fork the API process with its open DB connections and threads.
+            _executor = ProcessPoolExecutor(
+                max_workers=IMAGE_DERIVATIVE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def _reset_executor(broken: ProcessPoolExecutor):
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def submit(name: str) -> Future:
+    """Schedules render_derivatives(name); the future resolves to the variants entry."""
+    executor = _get_executor()
+    if executor is not None:
+        try:
+            return executor.submit(render_derivatives, name)
+        except (BrokenProcessPool, RuntimeError) as exc:
+            print(f"Warning: image derivative pool unavailable, resizing in-process: {exc}", flush=True)
+            _reset_executor(executor)
+    future: Future = Future()
+    try:
+        future.set_result(render_derivatives(name))
+    except Exception as exc:
+        future.set_exception(exc)
+    return future
+
+
+# --- Variants ------------------------------------------------------------
+
+def load_variants(name: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Variants entry of a static file, or None while its derivatives do not exist."""
+    if not name:
+        return None
+    try:
+        with open(os.path.join(_derivative_dir(name), MANIFEST_NAME), "rb") as handle:
+            return json.loads(handle.read())
+    except (OSError, ValueError):
+        return None
+
+
+def variants_for_photos(photos: Optional[List[Any]]) -> Optional[List[Optional[Dict[str, Any]]]]:
+    if not isinstance(photos, list) or not photos:
+        return None
+    variants = [load_variants(static_name(photo)) for photo in photos]
+    return variants if any(variants) else None
+
+
+def share_url(photo: Any, variants: Optional[Dict[str, Any]]) -> Any:
+    """URL to send over WhatsApp: the full-size JPEG (WhatsApp takes no WebP images), else the original."""
+    if isinstance(variants, dict):
+        full = variants.get("full") or {}
+        if full.get("jpeg"):
+            return full["jpeg"]
+    return photo
+
+
+@event.listens_for(Session, "before_flush")
+def _refresh_photo_variants(session: Session, flush_context, instances):
+    for instance in list(session.new) + list(session.dirty):
+        if not isinstance(instance, models.Vehicle):
+            continue
+        if instance in session.new or sa_inspect(instance).attrs.photos.history.has_changes():
+            variants = variants_for_photos(instance.photos)
+            if variants != instance.photo_variants:
+                instance.photo_variants = variants
@@ -0,0 +1,355 @@
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+import models
+import receipt_search
+import vehicle_catalogue
+from lead_bulk_ops import chunked
+
+# Inventory sheets ("INVENTARIO PAGINA WEB CRM.xlsx") are parsed with column
+# operations, matched against the company's vehicles with one query and turned
+# into a plan: rows to insert, vehicles to update, unchanged and invalid rows.
+# A dry run only returns the plan; applying it runs chunked bulk INSERT and
+# UPDATE statements on the caller's session, committing after every chunk.
+# A plate may repeat in the file with different mileage (new intakes, or
+# placeholder plates such as 0, 1, 2); only repeated plate and mileage pairs
+# are rejected.
+
+# Files with more rows than this are applied by a background job (progress via GET /jobs/{id}).
+INVENTORY_IMPORT_BACKGROUND_THRESHOLD = int(os.getenv("INVENTORY_IMPORT_BACKGROUND_THRESHOLD", "1000") or "1000")
+# Rows of each kind listed in the response; the counts always cover the whole file.
+INVENTORY_IMPORT_PREVIEW_ROWS = int(os.getenv("INVENTORY_IMPORT_PREVIEW_ROWS", "50") or "50")
+IMPORT_CHUNK_SIZE = 500
+# The sheet has a title row above the column names.
+HEADER_ROW = 1
+
+STATUS_COLUMN = "🚨🚨🚨🚨"
+STATUS_MAP = {
+    "VENDIDO": "sold",
+    "DISPONIBLE": "available",
+    "ALISTAMIENTO": "alistamiento",
+    "RESERVADO": "reserved",
+    "DESEMBOLSO": "desembolso",
+}
+# Sheet column -> (vehicle field, max length).
+TEXT_COLUMNS = {
+    "Marca & Modelo": ("make", 100),
+    "Placa:": ("plate", 20),
+    "Color:": ("color", 50),
+    "Combustible:": ("fuel_type", 50),
+    "Transmisión:": ("transmission", 50),
+    "Motor:": ("engine", 50),
+    "Cod:": ("internal_code", 50),
+    "Ubicacion:": ("location", 100),
+}
+NUMBER_COLUMNS = {
+    "Año:": "year",
+    "PRECIO DE VENTA": "price",
+    "PRECIO COMPRA :": "purchase_price",
+    "FASECO:": "faseco",
+    "Kilómetros:": "mileage",
+}
+DATE_COLUMNS = {
+    "Soat:": "soat",
+    "Tecno:": "tecno",
+}
+# Fields an import may change on an existing vehicle. Blank cells never clear a value.
+UPDATABLE_FIELDS = [
+    "make", "year", "price", "purchase_price", "faseco", "color", "fuel_type",
+    "transmission", "engine", "internal_code", "location", "soat", "tecno", "status",
+]
+VEHICLE_FIELDS = ["plate", "mileage"] + UPDATABLE_FIELDS
+_BLANK_TEXT = ["", "nan", "none", "nat", "----", "-----"]
+_MAX_INT = 2 ** 31 - 1
+
+
+# --- Parsing -------------------------------------------------------------
+
+def _column(frame: pd.DataFrame, name: str) -> pd.Series:
+    if name in frame.columns:
+        return frame[name]
+    return pd.Series([None] * len(frame), index=frame.index, dtype=object)
+
+
+def clean_text(series: pd.Series, max_length: int) -> pd.Series:
+    text = series.astype("string").str.strip()
+    text = text.mask(text.str.lower().isin(_BLANK_TEXT))
+    return text.str.slice(0, max_length)
+
+
+def clean_numbers(series: pd.Series) -> pd.Series:
+    """Whole numbers from numeric cells and from text such as "$ 45.900.000"."""
+    if pd.api.types.is_numeric_dtype(series):
+        values = pd.to_numeric(series, errors="coerce")
+    else:
+        text = series.astype("string")
+        # Only text cells go through the separator cleanup; numeric cells keep their decimals.
+        is_text = series.map(type).eq(str)
+        from_text = pd.to_numeric(
+            text.where(is_text).str.replace(r"[$.,\s]", "", regex=True).replace("", pd.NA),
+            errors="coerce",
+        )
+        from_number = pd.to_numeric(series.where(~is_text), errors="coerce")
+        values = from_text.astype("Float64").fillna(from_number.astype("Float64"))
+    values = np.trunc(values.astype("Float64"))
+    return values.where(values.abs() <= _MAX_INT).astype("Int64")
+
+
+def clean_dates(series: pd.Series) -> pd.Series:
+    """Dates from Excel serial numbers, date cells and date text; placeholders become NaT."""
+    is_number = series.map(lambda value: isinstance(value, (int, float)) and not isinstance(value, bool))
+    serials = pd.to_numeric(series.where(is_number), errors="coerce")
+    from_serials = pd.to_datetime(serials, unit="D", origin="1899-12-30", errors="coerce")
+    others = series.where(~is_number)
+    others = others.mask(others.astype("string").str.strip().str.lower().isin(_BLANK_TEXT))
+    from_values = pd.to_datetime(others, errors="coerce", format="mixed")
+    return from_serials.fillna(from_values).astype("datetime64[us]")
+
+
+def parse_inventory(source) -> pd.DataFrame:
+    """Reads the inventory sheet into one column per vehicle field plus `row` (sheet line) and `error`."""
+    raw = pd.read_excel(source, header=HEADER_ROW, dtype=object)
+    frame = pd.DataFrame(index=raw.index)
+    # Sheet line numbers as the user sees them: title row, header row, then data.
+    frame["row"] = raw.index + HEADER_ROW + 2
+    for column, (field, max_length) in TEXT_COLUMNS.items():
+        frame[field] = clean_text(_column(raw, column), max_length)
+    frame["plate"] = frame["plate"].str.upper()
+    for column, field in NUMBER_COLUMNS.items():
+        frame[field] = clean_numbers(_column(raw, column))
+    for column, field in DATE_COLUMNS.items():
+        frame[field] = clean_dates(_column(raw, column))
+
+    raw_status = clean_text(_column(raw, STATUS_COLUMN), 50).str.upper()
+    # Unknown labels are imported as available; blank cells leave the status untouched.
+    frame["status"] = raw_status.map(STATUS_MAP).fillna("available").where(raw_status.notna())
+
+    # Completely blank lines are dropped, as before.
+    frame = frame[frame["make"].notna() | frame["plate"].notna()].copy()
+    frame["error"] = pd.Series(pd.NA, index=frame.index, dtype="string")
+    frame.loc[frame["make"].isna(), "error"] = "Falta Marca & Modelo"
+    frame.loc[frame["plate"].isna(), "error"] = "Falta la placa"
+    # Same rule as against the database: a different mileage is another intake of the plate.
+    intake = pd.DataFrame({"plate": frame["plate"], "mileage": frame["mileage"].fillna(0)})
+    duplicated = frame["plate"].notna() & intake.duplicated(keep="first")
+    frame.loc[duplicated & frame["error"].isna(), "error"] = "Placa y kilometraje repetidos en el archivo"
+    return frame.reset_index(drop=True)
+
+
+# --- Planning ------------------------------------------------------------
+
+def _python_value(value):
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _records(frame: pd.DataFrame, columns: List[str]) -> List[Dict[str, Any]]:
+    return [
+        {column: _python_value(value) for column, value in zip(columns, values)}
+        for values in frame[columns].itertuples(index=False, name=None)
+    ]
+
+
+def _existing_vehicles(db: Session, company_id: int) -> pd.DataFrame:
+    rows = db.execute(
+        select(models.Vehicle.id, *[getattr(models.Vehicle, field) for field in VEHICLE_FIELDS])
+        .where(models.Vehicle.company_id == company_id)
+        .order_by(models.Vehicle.id.desc())
+    ).all()
+    existing = pd.DataFrame(rows, columns=["id"] + VEHICLE_FIELDS)
+    existing["plate"] = existing["plate"].astype("string").str.strip().str.upper()
+    existing["internal_code"] = existing["internal_code"].astype("string").str.strip()
+    for field in NUMBER_COLUMNS.values():
+        existing[field] = pd.to_numeric(existing[field], errors="coerce").astype("Int64")
+    return existing
+
+
+def plan_import(db: Session, frame: pd.DataFrame, company_id: int) -> Dict[str, Any]:
+    """Splits the parsed sheet into inserts, updates, unchanged and invalid rows.
+
+    A vehicle is identified by plate and mileage, as in parse_inventory: a row
+    matches the newest vehicle of the company with the same plate and mileage,
+    else the only vehicle with its plate, else the only vehicle with its
+    internal code (if no other row of the sheet has it). A match with a different mileage is a new intake of the
+    same car and is inserted as a new vehicle; otherwise the non-blank cells
+    that differ from the vehicle are updated.
+    """
+    invalid = frame[frame["error"].notna()]
+    valid = frame[frame["error"].isna()].copy()
+    existing = _existing_vehicles(db, company_id)
+
+    # Newest vehicle per key; `existing` is ordered by id desc.
+    with_plate = existing.dropna(subset=["plate"]).assign(mileage_key=existing["mileage"].fillna(0))
+    by_intake = with_plate.drop_duplicates(["plate", "mileage_key"]).set_index(["plate", "mileage_key"])["id"]
+    # Placeholder plates (0, 1, 2, ...) repeat across vehicles; plate alone only identifies a unique one.
+    by_unique_plate = with_plate.drop_duplicates("plate", keep=False).set_index("plate")["id"]
+    # Internal codes are often shared by a whole category ("003CA"); like plates they
+    # only identify a vehicle when unique, here in the company and in the sheet.
+    by_code = existing.dropna(subset=["internal_code"]).drop_duplicates("internal_code", keep=False).set_index("internal_code")["id"]
+    unique_code = valid["internal_code"].where(~valid["internal_code"].duplicated(keep=False))
+    intake_keys = pd.MultiIndex.from_arrays([valid["plate"], valid["mileage"].fillna(0)])
+    matched_id = pd.Series(by_intake.reindex(intake_keys).to_numpy(), index=valid.index)
+    matched_id = matched_id.fillna(valid["plate"].map(by_unique_plate))
+    matched_id = matched_id.fillna(unique_code.map(by_code))
+    valid["vehicle_id"] = matched_id.astype("Int64")
+
+    current = existing.set_index("id").add_prefix("current_")
+    merged = valid.join(current, on="vehicle_id")
+    is_match = merged["vehicle_id"].notna()
+    same_mileage = merged["mileage"].fillna(0).eq(merged["current_mileage"].fillna(0))
+    to_insert = merged[~is_match | ~same_mileage]
+    matches = merged[is_match & same_mileage]
+
+    changed_fields = pd.DataFrame(index=matches.index)
+    for field in UPDATABLE_FIELDS:
+        new, old = matches[field], matches[f"current_{field}"]
+        if field in DATE_COLUMNS.values():
+            old = pd.to_datetime(old, errors="coerce").astype("datetime64[us]")
+        changed_fields[field] = new.notna() & (old.isna() | new.ne(old)).fillna(True)
+    has_changes = changed_fields.any(axis=1)
+    to_update = matches[has_changes]
+
+    updates = []
+    for (index, row), changed in zip(to_update.iterrows(), changed_fields[has_changes].itertuples(index=False, name=None)):
+        fields = [field for field, is_changed in zip(UPDATABLE_FIELDS, changed) if is_changed]
+        updates.append({
+            "row": int(row["row"]),
+            "id": int(row["vehicle_id"]),
+            "plate": row["plate"],
+            "changes": {
+                field: {"from": _python_value(row[f"current_{field}"]), "to": _python_value(row[field])}
+                for field in fields
+            },
+        })
+
+    inserts = _records(to_insert, ["row"] + VEHICLE_FIELDS)
+    for record in inserts:
+        # Required columns keep the defaults the importer always used.
+        record["year"] = record["year"] or 0
+        record["price"] = record["price"] or 0
+        record["mileage"] = record["mileage"] or 0
+        record["status"] = record["status"] or models.VehicleStatus.AVAILABLE.value
+
+    return {
+        "company_id": company_id,
+        "inserts": inserts,
+        "updates": updates,
+        "unchanged": int((~has_changes).sum()),
+        "invalid": _records(invalid, ["row", "plate", "make", "error"]),
+    }
+
+
+def summarize(plan: Dict[str, Any], dry_run: bool) -> Dict[str, Any]:
+    preview = INVENTORY_IMPORT_PREVIEW_ROWS
+    invalid = plan["invalid"]
+    return {
+        "dry_run": dry_run,
+        "inserted": len(plan["inserts"]),
+        "updated": len(plan["updates"]),
+        "unchanged": plan["unchanged"],
+        "invalid": len(invalid),
+        # Kept for the import screen, which reads `errors`.
+        "errors": len(invalid),
+        "error_details": [
+            {"row": item["row"], "plate": item["plate"], "error": item["error"]}
+            for item in invalid[:preview]
+        ],
+        "inserts": [
+            {"row": item["row"], "plate": item["plate"], "make": item["make"], "mileage": item["mileage"]}
+            for item in plan["inserts"][:preview]
+        ],
+        "updates": plan["updates"][:preview],
+    }
+
+
+# --- Applying ------------------------------------------------------------
+
+class PartialImportError(Exception):
+    """A chunk failed after earlier chunks were committed.
+
+    Importing the same file again is safe: plan_import matches the committed
+    rows by plate and mileage, so only the rest is inserted or updated.
+    """
+
+    def __init__(self, inserted: int, updated: int, plan: Dict[str, Any], cause: Exception):
+        super().__init__(
+            f"Se importaron {inserted} de {len(plan['inserts'])} vehiculos nuevos y "
+            f"{updated} de {len(plan['updates'])} actualizaciones antes del error ({cause}); "
+            f"vuelve a importar el archivo para completar el resto."
+        )
+        self.partial_result = {
+            "inserted": inserted,
+            "updated": updated,
+            "pending_inserts": len(plan["inserts"]) - inserted,
+            "pending_updates": len(plan["updates"]) - updated,
+        }
+
+
+def apply_plan(db: Session, plan: Dict[str, Any], progress=None) -> Dict[str, Any]:
+    """Runs the plan with one bulk INSERT or UPDATE per chunk, committing after each one.
+
+    A failing chunk is rolled back and PartialImportError reports what was committed.
+    """
+    company_id = plan["company_id"]
+    inserted = updated = 0
+    try:
+        for chunk in chunked(plan["inserts"], IMPORT_CHUNK_SIZE):
+            rows = []
+            for item in chunk:
+                values = {field: item[field] for field in VEHICLE_FIELDS}
+                values.update(company_id=company_id, photos=[])
+                rows.append(values)
+            db.execute(insert(models.Vehicle), rows)
+            vehicle_catalogue.bump_versions(db.connection(), [company_id])
+            db.commit()
+            inserted += len(chunk)
+            if progress is not None:
+                progress.advance(len(chunk))
+
+        for chunk in chunked(plan["updates"], IMPORT_CHUNK_SIZE):
+            rows = [
+                {"id": item["id"], **{field: change["to"] for field, change in item["changes"].items()}}
+                for item in chunk
+            ]
+            # Bulk UPDATE by primary key; rows are grouped by the set of changed fields.
+            db.execute(update(models.Vehicle), rows)
+            # It also skips the flush listener that keeps receipt search documents current.
+            searched_ids = [
+                item["id"] for item in chunk
+                if any(field in receipt_search.VEHICLE_FIELDS for field in item["changes"])
+            ]
+            if searched_ids:
+                receipt_search.refresh_vehicle_documents(db.connection(), searched_ids)
+            vehicle_catalogue.bump_versions(db.connection(), [company_id])
+            db.commit()
+            updated += len(chunk)
+            if progress is not None:
+                progress.advance(len(chunk))
+    except Exception as exc:
+        db.rollback()
+        raise PartialImportError(inserted, updated, plan, exc) from exc
+    finally:
+        # Bulk statements skip the flush listeners that bump the version and drop catalogue snapshots.
+        vehicle_catalogue.invalidate([company_id])
+    return summarize(plan, dry_run=False)
+
+
+def import_file(db: Session, source, company_id: int, dry_run: bool = False) -> Dict[str, Any]:
+    plan = plan_import(db, parse_inventory(source), company_id)
+    if dry_run:
+        return summarize(plan, dry_run=True)
+    return apply_plan(db, plan)
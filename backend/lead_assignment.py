@@ -1,11 +1,30 @@
-import random
+import datetime
+import os
+import time
 import unicodedata
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from sqlalchemy.orm import Session
+from sqlalchemy import event, func, inspect as sa_inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
 
 import models
 
+# "least_open_leads" (default) or "round_robin" (weighted by counter.weight).
+LEAD_AUTO_ASSIGN_STRATEGY = (os.getenv("LEAD_AUTO_ASSIGN_STRATEGY", "least_open_leads") or "least_open_leads").strip().lower()
+# open_leads drifts when leads are closed or reassigned by hand; the pool is
+# rebuilt from the leads table when it is older than this.
+LEAD_ASSIGNMENT_RECONCILE_SECONDS = int(os.getenv("LEAD_ASSIGNMENT_RECONCILE_SECONDS", "900") or "900")
+# Minimum seconds between rebuilds of a pool that has no candidates.
+EMPTY_POOL_RETRY_SECONDS = 30
+ROUND_ROBIN_STEP = 1000
+
+CLOSED_LEAD_STATUSES = (models.LeadStatus.LOST.value, models.LeadStatus.SOLD.value)
+USER_POOL_ATTRIBUTES = ("is_active", "role_id", "company_id", "auto_assign_leads")
+ROLE_POOL_ATTRIBUTES = ("name", "base_role_name", "label", "auto_assign_leads")
+
+_empty_pool_checked_at: Dict[int, float] = {}
+
 
 def normalize_role_text(value: Optional[str]) -> str:
     if not value:
@@ -60,8 +79,195 @@ def get_auto_assign_candidate_users(db: Session, company_id: Optional[int]) -> L
     return [user for user in users if can_user_receive_auto_assigned_leads(user)]
 
 
+def invalidate_company_pool(db: Session, company_id: Optional[int] = None):
+    """Marks the candidate pool stale; the next assignment rebuilds it.
+
+    Stored in the counters table so every worker sees it. company_id=None
+    invalidates every company (e.g. a global role changed).
+    """
+    counters = models.LeadAssignmentCounter.__table__
+    statement = update(counters).values(refreshed_at=None)
+    if company_id:
+        statement = statement.where(counters.c.company_id == company_id)
+        _empty_pool_checked_at.pop(company_id, None)
+    else:
+        _empty_pool_checked_at.clear()
+    db.connection().execute(statement)
+
+
+def _counter_scope(company_id: int, user_ids: List[int]):
+    if not user_ids:
+        return models.LeadAssignmentCounter.company_id == company_id
+    return (models.LeadAssignmentCounter.company_id == company_id) | (models.LeadAssignmentCounter.user_id.in_(user_ids))
+
+
+def refresh_company_pool(db: Session, company_id: int):
+    """Rebuilds eligibility and open-lead load of every user of the company.
+
+    Runs in a SAVEPOINT of the caller's transaction: a second session would
+    wait on rows the caller already holds (MySQL) or on the file lock (SQLite).
+    """
+    try:
+        with db.begin_nested():
+            _rebuild_company_pool(db, company_id)
+    except IntegrityError:
+        # Another worker rebuilt the same pool concurrently.
+        pass
+
+
+def _rebuild_company_pool(db: Session, company_id: int):
+    users = db.query(models.User).options(joinedload(models.User.role)).filter(
+        models.User.company_id == company_id
+    ).all()
+    user_ids = [user.id for user in users]
+    open_counts: Dict[int, int] = {}
+    if user_ids:
+        open_counts = dict(db.execute(
+            select(models.Lead.assigned_to_id, func.count(models.Lead.id))
+            .where(
+                models.Lead.assigned_to_id.in_(user_ids),
+                models.Lead.deleted_at.is_(None),
+                func.coalesce(models.Lead.status, "").notin_(CLOSED_LEAD_STATUSES),
+            )
+            .group_by(models.Lead.assigned_to_id)
+        ).all())
+
+    counters = {
+        counter.user_id: counter
+        for counter in db.query(models.LeadAssignmentCounter).filter(
+            _counter_scope(company_id, user_ids)
+        ).all()
+    }
+    eligible_positions = [
+        counter.rr_position or 0
+        for counter in counters.values()
+        if counter.company_id == company_id and counter.eligible
+    ]
+    start_position = min(eligible_positions) if eligible_positions else 0
+    now = datetime.datetime.utcnow()
+    for user in users:
+        counter = counters.pop(user.id, None)
+        if counter is None:
+            # New members start at the current turn instead of catching up on past ones.
+            counter = models.LeadAssignmentCounter(user_id=user.id, rr_position=start_position, assigned_total=0, weight=1)
+            db.add(counter)
+        counter.company_id = company_id
+        counter.eligible = can_user_receive_auto_assigned_leads(user)
+        counter.open_leads = int(open_counts.get(user.id, 0) or 0)
+        counter.refreshed_at = now
+    for stale_counter in counters.values():
+        if stale_counter.company_id == company_id:
+            db.delete(stale_counter)
+
+
+def _select_candidate(db: Session, company_id: int):
+    query = select(
+        models.LeadAssignmentCounter.user_id,
+        models.LeadAssignmentCounter.refreshed_at,
+        models.LeadAssignmentCounter.weight,
+    ).where(
+        models.LeadAssignmentCounter.company_id == company_id,
+        models.LeadAssignmentCounter.eligible == True,  # noqa: E712
+    )
+    if LEAD_AUTO_ASSIGN_STRATEGY == "round_robin":
+        query = query.order_by(
+            models.LeadAssignmentCounter.rr_position,
+            models.LeadAssignmentCounter.user_id,
+        )
+    else:
+        query = query.order_by(
+            models.LeadAssignmentCounter.open_leads,
+            models.LeadAssignmentCounter.last_assigned_at,
+            models.LeadAssignmentCounter.user_id,
+        )
+    return db.execute(query.limit(1)).first()
+
+
+def _is_pool_stale(refreshed_at: Optional[datetime.datetime]) -> bool:
+    if refreshed_at is None:
+        return True
+    return (datetime.datetime.utcnow() - refreshed_at).total_seconds() > LEAD_ASSIGNMENT_RECONCILE_SECONDS
+
+
 def choose_auto_assign_user(db: Session, company_id: Optional[int]) -> Optional[models.User]:
-    candidates = get_auto_assign_candidate_users(db, company_id)
-    if not candidates:
+    """Picks the next advisor from the company's counters with one indexed read.
+
+    The counter row is bumped with an atomic UPDATE in the caller's transaction,
+    so it is rolled back together with the lead if the caller fails. Two
+    concurrent picks may land on the same advisor; the next pick compensates.
+    """
+    if not company_id:
+        return None
+
+    candidate = _select_candidate(db, company_id)
+    if candidate is None or _is_pool_stale(candidate.refreshed_at):
+        last_empty_check = _empty_pool_checked_at.get(company_id)
+        if candidate is not None or last_empty_check is None or time.monotonic() - last_empty_check > EMPTY_POOL_RETRY_SECONDS:
+            refresh_company_pool(db, company_id)
+            candidate = _select_candidate(db, company_id)
+            if candidate is None:
+                _empty_pool_checked_at[company_id] = time.monotonic()
+    if candidate is None:
         return None
-    return random.choice(candidates)
+
+    user_id = candidate.user_id
+    round_robin_step = max(1, ROUND_ROBIN_STEP // max(1, candidate.weight or 1))
+    db.execute(
+        update(models.LeadAssignmentCounter)
+        .where(models.LeadAssignmentCounter.user_id == user_id)
+        .values(
+            open_leads=models.LeadAssignmentCounter.open_leads + 1,
+            assigned_total=models.LeadAssignmentCounter.assigned_total + 1,
+            rr_position=models.LeadAssignmentCounter.rr_position + round_robin_step,
+            last_assigned_at=datetime.datetime.utcnow(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return db.get(models.User, user_id)
+
+
+def _attribute_changed(instance, attribute_names) -> bool:
+    state = sa_inspect(instance)
+    return any(state.attrs[name].history.has_changes() for name in attribute_names)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_pool_changes_after_flush(session: Session, flush_context):
+    pending = session.info.setdefault("lead_assignment_invalidations", set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, models.User):
+            if instance in session.dirty and not _attribute_changed(instance, USER_POOL_ATTRIBUTES):
+                continue
+            pending.add(instance.company_id)
+            pending.update(sa_inspect(instance).attrs.company_id.history.deleted or [])
+        elif isinstance(instance, models.Role):
+            if instance in session.dirty and not _attribute_changed(instance, ROLE_POOL_ATTRIBUTES):
+                continue
+            # Global roles (company_id NULL) affect every company.
+            pending.add(instance.company_id or "all")
+    pending.discard(None)
+    if not pending:
+        session.info.pop("lead_assignment_invalidations", None)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_pools_after_commit(session: Session):
+    pending = session.info.pop("lead_assignment_invalidations", None)
+    if not pending:
+        return
+    # Runs on its own connection once the user/role change is visible to other workers.
+    try:
+        with Session(bind=session.get_bind()) as invalidation_db:
+            if "all" in pending:
+                invalidate_company_pool(invalidation_db)
+            else:
+                for company_id in pending:
+                    invalidate_company_pool(invalidation_db, company_id)
+            invalidation_db.commit()
+    except Exception as exc:
+        print(f"Warning: could not invalidate lead assignment pool: {exc}", flush=True)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pool_changes_after_rollback(session: Session):
+    session.info.pop("lead_assignment_invalidations", None)
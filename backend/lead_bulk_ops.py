@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import datetime
+import os
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+import models
+
+# Leads handled per UPDATE/INSERT round trip. Keeps IN (...) lists and
+# executemany batches well under MySQL packet limits.
+BULK_CHUNK_SIZE = 500
+# Larger batches are applied by a background job (progress via GET /jobs/{id}).
+BULK_BACKGROUND_THRESHOLD = int(os.getenv("BULK_ASSIGN_BACKGROUND_THRESHOLD", "500") or "500")
+DIGEST_PREVIEW_NAMES = 3
+# (single title, digest title, single verb, digest verb)
+DIGEST_TEXTS = {
+    "assigned": ("Lead Asignado", "Leads Asignados", "Se te asigno el lead", "Se te asignaron"),
+    "reassigned": ("Lead Reasignado", "Leads Reasignados", "Se te reasigno el lead", "Se te reasignaron"),
+}
+
+
+class PartialAssignmentError(Exception):
+    """A chunk failed after earlier chunks were committed.
+
+    Re-running the same operation is safe: leads already on their target get no
+    new history row and supervisor links are only inserted when missing.
+    """
+
+    def __init__(self, applied: int, total: int, changed_by_target: Dict[int, List[Tuple[int, str]]], cause: Exception):
+        super().__init__(
+            f"Se aplicaron {applied} de {total} leads antes del error ({cause}); "
+            f"vuelve a ejecutar la operacion para completar el resto."
+        )
+        self.applied = applied
+        self.total = total
+        self.changed_by_target = changed_by_target
+        self.partial_result = {"applied": applied, "total": total}
+
+
+def chunked(values: Sequence, size: int = BULK_CHUNK_SIZE) -> Iterator[Sequence]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _apply_assignment_chunk(
+    db: Session,
+    chunk: Sequence[Tuple[int, int]],
+    actor_id: Optional[int],
+    history_comments: Dict[int, str],
+    supervisor_id: Optional[int],
+    company_id: Optional[int],
+    removed_supervisor_ids: Optional[Sequence[int]],
+) -> Tuple[int, Dict[int, List[Tuple[int, str]]]]:
+    changed_by_target: Dict[int, List[Tuple[int, str]]] = defaultdict(list)
+    target_by_lead = {lead_id: target_id for lead_id, target_id in chunk}
+    query = select(
+        models.Lead.id,
+        models.Lead.name,
+        models.Lead.status,
+        models.Lead.assigned_to_id,
+    ).where(models.Lead.id.in_(list(target_by_lead.keys())))
+    if company_id:
+        query = query.where(models.Lead.company_id == company_id)
+    rows = db.execute(query).all()
+    if not rows:
+        return 0, {}
+
+    lead_ids_by_target: Dict[int, List[int]] = defaultdict(list)
+    history_rows = []
+    now = datetime.datetime.utcnow()
+    for row in rows:
+        target_id = target_by_lead[row.id]
+        lead_ids_by_target[target_id].append(row.id)
+        if row.assigned_to_id != target_id:
+            changed_by_target[target_id].append((row.id, row.name or f"#{row.id}"))
+            history_rows.append({
+                "lead_id": row.id,
+                "user_id": actor_id,
+                "previous_status": row.status,
+                "new_status": row.status,
+                "comment": (history_comments.get(target_id) or "")[:500],
+                "created_at": now,
+            })
+
+    for target_id, lead_ids in lead_ids_by_target.items():
+        db.execute(
+            update(models.Lead)
+            .where(models.Lead.id.in_(lead_ids))
+            .values(assigned_to_id=target_id)
+            .execution_options(synchronize_session=False)
+        )
+
+    loaded_ids = [row.id for row in rows]
+    if removed_supervisor_ids:
+        db.execute(
+            delete(models.LeadSupervisor)
+            .where(
+                models.LeadSupervisor.lead_id.in_(loaded_ids),
+                models.LeadSupervisor.user_id.in_(list(removed_supervisor_ids)),
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    if supervisor_id:
+        already_linked = set(db.execute(
+            select(models.LeadSupervisor.lead_id).where(
+                models.LeadSupervisor.user_id == supervisor_id,
+                models.LeadSupervisor.lead_id.in_(loaded_ids),
+            )
+        ).scalars())
+        link_rows = [
+            {"lead_id": lead_id, "user_id": supervisor_id, "assigned_by_id": actor_id, "created_at": now}
+            for lead_id in loaded_ids
+            if lead_id not in already_linked
+        ]
+        if link_rows:
+            db.execute(insert(models.LeadSupervisor), link_rows)
+
+    if history_rows:
+        db.execute(insert(models.LeadHistory), history_rows)
+
+    db.commit()
+    return len(rows), changed_by_target
+
+
+def apply_assignment_plan(
+    db: Session,
+    plan: Sequence[Tuple[int, int]],
+    actor_id: Optional[int],
+    history_comments: Dict[int, str],
+    supervisor_id: Optional[int] = None,
+    company_id: Optional[int] = None,
+    progress=None,
+    removed_supervisor_ids: Optional[Sequence[int]] = None,
+) -> Tuple[int, Dict[int, List[Tuple[int, str]]]]:
+    """Applies (lead_id, target_user_id) pairs with set-based statements.
+
+    Per chunk: one UPDATE per target user, one DELETE of the links of
+    `removed_supervisor_ids`, one bulk INSERT of missing supervisor links and
+    one bulk INSERT of history rows. `history_comments` maps target user id ->
+    history comment. Commits after every chunk so a
+    large plan never holds row locks for the whole run; if a chunk fails it is
+    rolled back and PartialAssignmentError reports what was already committed.
+
+    Returns the number of leads found and target_user_id -> [(lead_id, lead_name)]
+    for the leads whose assignee actually changed (for notification digests).
+    """
+    assigned_count = 0
+    changed_by_target: Dict[int, List[Tuple[int, str]]] = defaultdict(list)
+    plan = list(plan)
+    for chunk in chunked(plan):
+        try:
+            chunk_count, chunk_changes = _apply_assignment_chunk(
+                db, chunk, actor_id, history_comments, supervisor_id, company_id, removed_supervisor_ids,
+            )
+        except Exception as exc:
+            db.rollback()
+            raise PartialAssignmentError(assigned_count, len(plan), dict(changed_by_target), exc) from exc
+        assigned_count += chunk_count
+        for target_id, changed_leads in chunk_changes.items():
+            changed_by_target[target_id].extend(changed_leads)
+        if progress is not None:
+            progress.advance(len(chunk))
+
+    return assigned_count, dict(changed_by_target)
+
+
+def build_assignment_digest(
+    user_id: int,
+    changed_leads: List[Tuple[int, str]],
+    board_path: str,
+    kind: str = "assigned",
+) -> Optional[dict]:
+    """One notification per advisor instead of one per assigned lead."""
+    if not changed_leads:
+        return None
+    single_title, digest_title, single_verb, digest_verb = DIGEST_TEXTS[kind]
+    if len(changed_leads) == 1:
+        lead_id, lead_name = changed_leads[0]
+        return {
+            "user_id": user_id,
+            "title": single_title,
+            "message": f"{single_verb}: {lead_name}. Continúa con la gestion.",
+            "type": "info",
+            "link": f"{board_path}?leadId={lead_id}",
+            "is_read": 0,
+        }
+
+    preview = ", ".join(name for _, name in changed_leads[:DIGEST_PREVIEW_NAMES])
+    remaining = len(changed_leads) - DIGEST_PREVIEW_NAMES
+    suffix = f" y {remaining} mas" if remaining > 0 else ""
+    return {
+        "user_id": user_id,
+        "title": digest_title,
+        "message": f"{digest_verb} {len(changed_leads)} leads: {preview}{suffix}. Continúa con la gestion."[:500],
+        "type": "info",
+        "link": board_path,
+        "is_read": 0,
+    }
+
+
+def insert_assignment_digests(
+    db: Session,
+    changed_by_target: Dict[int, List[Tuple[int, str]]],
+    board_paths: Dict[int, str],
+    kind: str = "assigned",
+) -> int:
+    notification_rows = []
+    now = datetime.datetime.utcnow()
+    for user_id, changed_leads in changed_by_target.items():
+        digest = build_assignment_digest(user_id, changed_leads, board_paths.get(user_id, "/admin/leads"), kind)
+        if digest:
+            digest["created_at"] = now
+            notification_rows.append(digest)
+    if notification_rows:
+        db.execute(insert(models.Notification), notification_rows)
+        db.commit()
+    return len(notification_rows)
+
+
+def apply_assignment_plan_with_digests(
+    db: Session,
+    plan: Sequence[Tuple[int, int]],
+    board_paths: Dict[int, str],
+    kind: str = "assigned",
+    **plan_options,
+) -> Tuple[int, Dict[int, List[Tuple[int, str]]]]:
+    """apply_assignment_plan plus the advisor digests.
+
+    On a partial failure the digests for the committed chunks are still sent
+    before PartialAssignmentError propagates.
+    """
+    try:
+        assigned_count, changed_by_target = apply_assignment_plan(db, plan, **plan_options)
+    except PartialAssignmentError as exc:
+        insert_assignment_digests(db, exc.changed_by_target, board_paths, kind=kind)
+        raise
+    insert_assignment_digests(db, changed_by_target, board_paths, kind=kind)
+    return assigned_count, changed_by_target
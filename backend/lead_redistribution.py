@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import heapq
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import models
+
+# Leads in these states no longer need follow-up and do not count as load.
+CLOSED_LEAD_STATUSES = (models.LeadStatus.LOST.value, models.LeadStatus.SOLD.value)
+
+
+def _open_lead_clause():
+    return func.coalesce(models.Lead.status, "").notin_(CLOSED_LEAD_STATUSES)
+
+
+def get_source_lead_ids(db: Session, source_user_id: int) -> List[int]:
+    return list(db.execute(
+        select(models.Lead.id)
+        .where(
+            models.Lead.assigned_to_id == source_user_id,
+            models.Lead.deleted_at.is_(None),
+        )
+        .order_by(models.Lead.id)
+    ).scalars())
+
+
+def get_open_lead_counts(db: Session, user_ids: Sequence[int]) -> Dict[int, int]:
+    """Current open-lead load per user in one GROUP BY."""
+    counts = {user_id: 0 for user_id in user_ids}
+    if not counts:
+        return counts
+    rows = db.execute(
+        select(models.Lead.assigned_to_id, func.count(models.Lead.id))
+        .where(
+            models.Lead.assigned_to_id.in_(list(counts.keys())),
+            models.Lead.deleted_at.is_(None),
+            _open_lead_clause(),
+        )
+        .group_by(models.Lead.assigned_to_id)
+    ).all()
+    for user_id, count in rows:
+        counts[user_id] = int(count or 0)
+    return counts
+
+
+def get_inactive_company_user_ids(db: Session, company_id: Optional[int]) -> List[int]:
+    if not company_id:
+        return []
+    return list(db.execute(
+        select(models.User.id).where(
+            models.User.company_id == company_id,
+            models.User.is_active == False,  # noqa: E712
+        )
+    ).scalars())
+
+
+def build_balanced_plan(
+    lead_ids: Sequence[int],
+    recipient_loads: Dict[int, int],
+) -> List[Tuple[int, int]]:
+    """Gives every lead to the recipient with the lowest projected load.
+
+    Ties go to the lowest user id, so the same input always yields the same plan.
+    """
+    if not recipient_loads:
+        return []
+    heap = [(load, user_id) for user_id, load in recipient_loads.items()]
+    heapq.heapify(heap)
+    plan = []
+    for lead_id in lead_ids:
+        load, user_id = heapq.heappop(heap)
+        plan.append((lead_id, user_id))
+        heapq.heappush(heap, (load + 1, user_id))
+    return plan
+
+
+def summarize_plan(
+    plan: Sequence[Tuple[int, int]],
+    recipient_loads: Dict[int, int],
+    recipient_labels: Dict[int, str],
+) -> List[dict]:
+    assigned: Dict[int, int] = {user_id: 0 for user_id in recipient_loads}
+    for _, user_id in plan:
+        assigned[user_id] = assigned.get(user_id, 0) + 1
+    return [
+        {
+            "user_id": user_id,
+            "user_label": recipient_labels.get(user_id),
+            "current_open_leads": recipient_loads.get(user_id, 0),
+            "assigned_leads": assigned[user_id],
+            "projected_open_leads": recipient_loads.get(user_id, 0) + assigned[user_id],
+        }
+        for user_id in sorted(assigned)
+    ]
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import case, event, func, inspect as sa_inspect, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+
+# Per-company usage kept next to the inserts/deletes that change it, so the
+# license checks on every lead/user creation read one row instead of running
+# COUNT(*) over leads and users. reconcile_usage_counters.py recounts nightly
+# and whenever the license period of a company changes.
+
+
+def _is_active_value(value) -> bool:
+    # Mirrors the SQL filter `users.is_active != 0` (NULL is not counted).
+    return value is not None and value != 0 and value is not False
+
+
+def _lead_created_date(lead: models.Lead) -> datetime.date:
+    created_at = getattr(lead, "created_at", None) or datetime.datetime.utcnow()
+    return created_at.date() if isinstance(created_at, datetime.datetime) else created_at
+
+
+def count_usage(db: Session, company: models.Company) -> Dict[str, int]:
+    leads_query = select(func.count(models.Lead.id)).where(models.Lead.company_id == company.id)
+    if getattr(company, "license_start_date", None):
+        leads_query = leads_query.where(func.date(models.Lead.created_at) >= company.license_start_date)
+    if getattr(company, "license_end_date", None):
+        leads_query = leads_query.where(func.date(models.Lead.created_at) <= company.license_end_date)
+    users_total, active_users = db.execute(
+        select(
+            func.count(models.User.id),
+            func.coalesce(func.sum(case((func.coalesce(models.User.is_active, 0) != 0, 1), else_=0)), 0),
+        ).where(models.User.company_id == company.id)
+    ).one()
+    return {
+        "leads_in_period": int(db.execute(leads_query).scalar() or 0),
+        "users_total": int(users_total or 0),
+        "active_users": int(active_users or 0),
+    }
+
+
+def reconcile_company_usage(db: Session, company: models.Company) -> Dict[str, int]:
+    """Recounts a company from scratch in a SAVEPOINT of the caller's transaction.
+
+    The counter row stays locked until the caller commits or rolls back.
+    """
+    usage: Dict[str, int] = {}
+    try:
+        with db.begin_nested():
+            # Lock first so deltas from concurrent writes wait for the recount.
+            counter = db.query(models.CompanyUsageCounter).filter(
+                models.CompanyUsageCounter.company_id == company.id
+            ).with_for_update().first()
+            usage = count_usage(db, company)
+            if counter is None:
+                counter = models.CompanyUsageCounter(company_id=company.id)
+                db.add(counter)
+            counter.period_start = getattr(company, "license_start_date", None)
+            counter.period_end = getattr(company, "license_end_date", None)
+            counter.leads_in_period = usage["leads_in_period"]
+            counter.users_total = usage["users_total"]
+            counter.active_users = usage["active_users"]
+            counter.reconciled_at = datetime.datetime.utcnow()
+    except IntegrityError:
+        # A concurrent request created the row first; its counts are equivalent.
+        pass
+    return usage
+
+
+def _is_current(counter: Optional[models.CompanyUsageCounter], company: models.Company) -> bool:
+    return counter is not None and (
+        counter.period_start == getattr(company, "license_start_date", None)
+        and counter.period_end == getattr(company, "license_end_date", None)
+    )
+
+
+def get_company_usage(db: Session, company: models.Company, *, lock: bool = False) -> models.CompanyUsageCounter:
+    """Single-row read of the usage counters, reconciling when missing or stale.
+
+    lock=True re-reads the row FOR UPDATE and keeps the lock for the rest of the
+    caller's transaction, so concurrent creations for the same company are
+    checked one after another against the incremented value.
+    """
+    query = db.query(models.CompanyUsageCounter).filter(models.CompanyUsageCounter.company_id == company.id)
+    counter = query.first()
+    reconciled = not _is_current(counter, company)
+    if reconciled:
+        reconcile_company_usage(db, company)
+    if lock or reconciled:
+        # After a reconcile the row is already locked by this transaction; the
+        # locking read also sees a row a concurrent request inserted first.
+        counter = query.with_for_update().populate_existing().first()
+    return counter
+
+
+def _apply_delta(connection, company_id: int, column_name: str, delta: int, created_on: Optional[datetime.date] = None):
+    if not company_id or not delta:
+        return
+    counters = models.CompanyUsageCounter.__table__
+    statement = update(counters).where(counters.c.company_id == company_id)
+    if created_on is not None:
+        # Only leads created inside the counted license period move the counter.
+        statement = statement.where(
+            or_(counters.c.period_start.is_(None), counters.c.period_start <= created_on),
+            or_(counters.c.period_end.is_(None), counters.c.period_end >= created_on),
+        )
+    column = counters.c[column_name]
+    connection.execute(statement.values({column_name: column + delta}))
+
+
+def record_user_changes(db: Session, company_id: Optional[int], *, users_total: int = 0, active_users: int = 0):
+    """Applies user deltas for bulk UPDATE/DELETE statements, which never reach the flush hook."""
+    connection = db.connection()
+    _apply_delta(connection, company_id, "users_total", users_total)
+    _apply_delta(connection, company_id, "active_users", active_users)
+
+
+def _keep_previous_value(target, value, oldvalue, initiator):
+    return value
+
+
+# The flush hook needs the values a user had before the change, also when the
+# attribute was expired (after a commit) and is assigned without being read first.
+for _field in ("company_id", "is_active"):
+    event.listen(getattr(models.User, _field), "set", _keep_previous_value, active_history=True, retval=True)
+
+
+def _user_state_before(user: models.User) -> Tuple[Optional[int], bool]:
+    state = sa_inspect(user)
+    company_history = state.attrs.company_id.history
+    active_history = state.attrs.is_active.history
+    previous_company = company_history.deleted[0] if company_history.deleted else user.company_id
+    previous_active = active_history.deleted[0] if active_history.deleted else user.is_active
+    return previous_company, _is_active_value(previous_active)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_usage_after_flush(session: Session, flush_context):
+    lead_deltas: Dict[Tuple[int, datetime.date], int] = {}
+    user_deltas: Dict[Tuple[int, str], int] = {}
+
+    def add_user(company_id, active, sign):
+        if not company_id:
+            return
+        user_deltas[(company_id, "users_total")] = user_deltas.get((company_id, "users_total"), 0) + sign
+        if active:
+            user_deltas[(company_id, "active_users")] = user_deltas.get((company_id, "active_users"), 0) + sign
+
+    for instance in session.new:
+        if isinstance(instance, models.Lead) and instance.company_id:
+            key = (instance.company_id, _lead_created_date(instance))
+            lead_deltas[key] = lead_deltas.get(key, 0) + 1
+        elif isinstance(instance, models.User):
+            add_user(instance.company_id, _is_active_value(instance.is_active), 1)
+
+    for instance in session.deleted:
+        if isinstance(instance, models.Lead) and instance.company_id:
+            key = (instance.company_id, _lead_created_date(instance))
+            lead_deltas[key] = lead_deltas.get(key, 0) - 1
+        elif isinstance(instance, models.User):
+            previous_company, previous_active = _user_state_before(instance)
+            add_user(previous_company, previous_active, -1)
+
+    for instance in session.dirty:
+        if not isinstance(instance, models.User) or instance in session.deleted:
+            continue
+        previous_company, previous_active = _user_state_before(instance)
+        current_active = _is_active_value(instance.is_active)
+        if previous_company == instance.company_id and previous_active == current_active:
+            continue
+        add_user(previous_company, previous_active, -1)
+        add_user(instance.company_id, current_active, 1)
+
+    if not lead_deltas and not user_deltas:
+        return
+    connection = session.connection()
+    for (company_id, created_on), delta in lead_deltas.items():
+        _apply_delta(connection, company_id, "leads_in_period", delta, created_on)
+    for (company_id, column_name), delta in user_deltas.items():
+        _apply_delta(connection, company_id, column_name, delta)
+
+
+def reconcile_usage_counters(db: Session, company_id: Optional[int] = None) -> int:
+    query = db.query(models.Company)
+    if company_id:
+        query = query.filter(models.Company.id == company_id)
+    companies = query.all()
+    for company in companies:
+        reconcile_company_usage(db, company)
+    return len(companies)
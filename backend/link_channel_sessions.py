@@ -0,0 +1,80 @@
+"""
+One-off pass that links channel chat sessions (WhatsApp, Facebook, Instagram)
+and their conversations to the lead with the same phone.
+
+Incoming messages link their session when they arrive; this covers sessions
+created before that, which used to be linked while reading a lead's messages.
+Only sessions or conversations without a lead are changed.
+
+Usage:
+    python link_channel_sessions.py
+    python link_channel_sessions.py --company-id 3 --dry-run
+"""
+import argparse
+import sys
+
+import models
+from bot_integration import phone_variants_for_lookup
+from database import SessionLocal
+
+CHUNK_SIZE = 500
+
+
+def _find_lead(db, channel_session):
+    lookup_phones = set(phone_variants_for_lookup(channel_session.external_user_id)) | {channel_session.external_user_id}
+    return db.query(models.Lead).filter(
+        models.Lead.company_id == channel_session.company_id,
+        models.Lead.phone.in_(lookup_phones),
+    ).order_by(
+        (models.Lead.source == channel_session.source).desc(),
+        (models.Lead.phone == channel_session.external_user_id).desc(),
+        models.Lead.id.asc(),
+    ).first()
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Link channel chat sessions to their leads")
+    parser.add_argument("--company-id", type=int, default=None)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    linked = 0
+    last_id = 0
+    with SessionLocal() as db:
+        while True:
+            query = db.query(models.ChannelChatSession).outerjoin(
+                models.Conversation, models.Conversation.id == models.ChannelChatSession.conversation_id
+            ).filter(
+                models.ChannelChatSession.id > last_id,
+                models.ChannelChatSession.conversation_id.isnot(None),
+                (models.ChannelChatSession.lead_id.is_(None)) | (models.Conversation.lead_id.is_(None)),
+            )
+            if args.company_id:
+                query = query.filter(models.ChannelChatSession.company_id == args.company_id)
+            chunk = query.order_by(models.ChannelChatSession.id).limit(CHUNK_SIZE).all()
+            if not chunk:
+                break
+            for channel_session in chunk:
+                lead_id = channel_session.lead_id
+                if not lead_id:
+                    lead = _find_lead(db, channel_session)
+                    lead_id = lead.id if lead else None
+                if not lead_id:
+                    continue
+                conversation = db.get(models.Conversation, channel_session.conversation_id)
+                channel_session.lead_id = lead_id
+                if conversation and not conversation.lead_id:
+                    conversation.lead_id = lead_id
+                linked += 1
+            last_id = chunk[-1].id
+            if args.dry_run:
+                db.rollback()
+            else:
+                db.commit()
+
+    print(f"{'Would link' if args.dry_run else 'Linked'} {linked} channel session(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
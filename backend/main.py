@@ -2,13 +2,13 @@ from fastapi import FastAPI, Depends, HTTPException, status, Query, Query, Body,
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from typing import Optional, List, Dict, Any
 from sqlalchemy.orm import Session, joinedload, selectinload, noload
-from sqlalchemy import or_, and_, func, text, false
+from sqlalchemy import or_, and_, func, text, false, select, union, union_all, literal, cast, extract, null, case, update, Integer, String
 from fastapi.middleware.cors import CORSMiddleware
 from database import engine, Base, get_db
 import models, schemas, auth_utils
 import lead_assignment
 from models import LeadNote, LeadFile # Explicitly for create_all to see them
-from routers import whatsapp, credits, purchases, notifications, rules, vehicles, meta, tiktok, gmail, appointments # Import the new routers
+from router_loader import RouterLoader
 from jose import JWTError, jwt
 import datetime
 import os
@@ -21,25 +21,40 @@ import json
 import random
 import base64
 import secrets
-import shutil
-import smtplib
-import ssl
 import uuid
 import unicodedata
 from html import escape
 from io import BytesIO
 from email.message import EmailMessage
 from zoneinfo import ZoneInfo
-from view_registry import SYSTEM_VIEWS, DEFAULT_ROLE_VIEW_ACCESS, DEFAULT_ROLE_MENU_ORDER, VALID_VIEW_IDS, COMPANY_VIEW_IDS
+from view_registry import SYSTEM_VIEWS, DEFAULT_ROLE_VIEW_ACCESS, DEFAULT_ROLE_MENU_ORDER, VALID_VIEW_IDS, COMPANY_VIEW_IDS, LAZY_ROUTER_MODULES, CORE_ROUTER_MODULES
 from fastapi import Request
 from fastapi.responses import JSONResponse
 from fastapi.responses import FileResponse
 from fastapi.responses import StreamingResponse
 from schema_ensure import ensure_mysql_schema
-
-# Create tables
-models.Base.metadata.create_all(bind=engine)
-ensure_mysql_schema(engine)
+import schema_migrations
+import perf_metrics
+import slow_query_log
+import background_jobs
+import lead_bulk_ops
+import lead_redistribution
+import license_usage
+import email_outbox
+import credit_pdf_cache
+import branding_assets
+import finance_documents
+import pdf_render_pool
+import document_exports
+import xlsx_export
+import receipt_search
+import receipt_display_names
+import finance_rollups
+import company_domains
+import vehicle_catalogue
+import image_derivatives
+import upload_store
+import file_serving
 
 BOGOTA_TZ = ZoneInfo("America/Bogota")
 
@@ -302,42 +317,50 @@ def ensure_company_license_allows_login(company: Optional[models.Company]):
     return license_state
 
 
-def count_company_users(db: Session, company_id: Optional[int]) -> int:
+def get_company_usage_counter(db: Session, company_id: Optional[int], *, lock: bool = False) -> Optional[models.CompanyUsageCounter]:
     if not company_id:
-        return 0
-    return db.query(func.count(models.User.id)).filter(models.User.company_id == company_id).scalar() or 0
+        return None
+    company = get_company_by_id(db, company_id)
+    if not company:
+        return None
+    return license_usage.get_company_usage(db, company, lock=lock)
+
+
+def count_company_users(db: Session, company_id: Optional[int]) -> int:
+    counter = get_company_usage_counter(db, company_id)
+    return counter.users_total if counter else 0
 
 
 def count_company_active_users(db: Session, company_id: Optional[int]) -> int:
-    if not company_id:
-        return 0
-    return db.query(func.count(models.User.id)).filter(
-        models.User.company_id == company_id,
-        models.User.is_active != 0
-    ).scalar() or 0
+    counter = get_company_usage_counter(db, company_id)
+    return counter.active_users if counter else 0
 
 
 def count_company_leads_in_license_period(db: Session, company: Optional[models.Company]) -> int:
     if not company:
         return 0
-    query = db.query(func.count(models.Lead.id)).filter(models.Lead.company_id == company.id)
-    if getattr(company, "license_start_date", None):
-        query = query.filter(func.date(models.Lead.created_at) >= company.license_start_date)
-    if getattr(company, "license_end_date", None):
-        query = query.filter(func.date(models.Lead.created_at) <= company.license_end_date)
-    return query.scalar() or 0
+    return license_usage.get_company_usage(db, company).leads_in_period
+
+
+def _counted_user_in_company(db: Session, user_id: Optional[int], company_id: int, *, active_only: bool = False) -> int:
+    if not user_id:
+        return 0
+    row = db.query(models.User.company_id, models.User.is_active).filter(models.User.id == user_id).first()
+    if not row or row.company_id != company_id:
+        return 0
+    if active_only and not license_usage._is_active_value(row.is_active):
+        return 0
+    return 1
 
 
 def ensure_company_user_limit(db: Session, company_id: Optional[int], *, excluding_user_id: Optional[int] = None):
     if not company_id:
         return
-    company = db.query(models.Company).filter(models.Company.id == company_id).first()
+    company = get_company_by_id(db, company_id)
     if not company or not company.max_users:
         return
-    query = db.query(func.count(models.User.id)).filter(models.User.company_id == company_id)
-    if excluding_user_id:
-        query = query.filter(models.User.id != excluding_user_id)
-    total_users = query.scalar() or 0
+    counter = license_usage.get_company_usage(db, company, lock=True)
+    total_users = counter.users_total - _counted_user_in_company(db, excluding_user_id, company_id)
     if total_users >= company.max_users:
         raise HTTPException(status_code=403, detail=f"La empresa alcanzó el límite de usuarios ({company.max_users}).")
 
@@ -345,16 +368,11 @@ def ensure_company_user_limit(db: Session, company_id: Optional[int], *, excludi
 def ensure_company_active_account_limit(db: Session, company_id: Optional[int], *, excluding_user_id: Optional[int] = None):
     if not company_id:
         return
-    company = db.query(models.Company).filter(models.Company.id == company_id).first()
+    company = get_company_by_id(db, company_id)
     if not company or not company.max_active_accounts:
         return
-    query = db.query(func.count(models.User.id)).filter(
-        models.User.company_id == company_id,
-        models.User.is_active != 0
-    )
-    if excluding_user_id:
-        query = query.filter(models.User.id != excluding_user_id)
-    total_active_users = query.scalar() or 0
+    counter = license_usage.get_company_usage(db, company, lock=True)
+    total_active_users = counter.active_users - _counted_user_in_company(db, excluding_user_id, company_id, active_only=True)
     if total_active_users >= company.max_active_accounts:
         raise HTTPException(status_code=403, detail=f"La empresa alcanzó el límite de cuentas activas ({company.max_active_accounts}).")
 
@@ -362,24 +380,18 @@ def ensure_company_active_account_limit(db: Session, company_id: Optional[int],
 def ensure_company_lead_creation_capacity(db: Session, company_id: Optional[int]):
     if not company_id:
         return
-    company = db.query(models.Company).filter(models.Company.id == company_id).first()
+    company = get_company_by_id(db, company_id)
     if not company:
         return
     if company.max_leads:
-        total_leads = count_company_leads_in_license_period(db, company)
+        # Row lock is held until the lead is committed, so concurrent webhooks
+        # cannot both take the last slot.
+        total_leads = license_usage.get_company_usage(db, company, lock=True).leads_in_period
         if total_leads >= company.max_leads:
             raise HTTPException(status_code=403, detail=f"La empresa alcanzó el límite de creación de leads ({company.max_leads}) para la licencia actual.")
 
 
-def normalize_public_host(raw_host: Optional[str]) -> str:
-    host = (raw_host or "").strip().lower()
-    if not host:
-        return ""
-    if ":" in host:
-        host = host.split(":", 1)[0]
-    if host.startswith("www."):
-        host = host[4:]
-    return host
+normalize_public_host = company_domains.normalize_public_host
 
 
 def normalize_public_domains(domains: Optional[List[str]], primary_domain: Optional[str] = None) -> List[str]:
@@ -395,52 +407,23 @@ def normalize_public_domains(domains: Optional[List[str]], primary_domain: Optio
     return normalized
 
 
-def company_matches_public_host(company: models.Company, host: str) -> bool:
-    if not company or not host:
-        return False
-    domains = normalize_public_domains(getattr(company, "public_domains", []), getattr(company, "public_domain", None))
-    return host in domains
-
-
 def validate_company_public_domains(db: Session, domains: List[str], exclude_company_id: Optional[int] = None):
     if not domains:
         return
 
-    existing_companies = db.query(models.Company).all()
-    for company in existing_companies:
-        if exclude_company_id and company.id == exclude_company_id:
-            continue
-        company_domains = normalize_public_domains(getattr(company, "public_domains", []), getattr(company, "public_domain", None))
-        collision = next((domain for domain in domains if domain in company_domains), None)
-        if collision:
-            raise HTTPException(
-                status_code=400,
-                detail=f'El dominio "{collision}" ya está configurado en la empresa "{company.name}"'
-            )
+    owner = company_domains.find_domain_owner(db, domains, exclude_company_id=exclude_company_id)
+    if owner:
+        collision, company = owner
+        raise HTTPException(
+            status_code=400,
+            detail=f'El dominio "{collision}" ya está configurado en la empresa "{company.name}"'
+        )
 
 
 def resolve_public_company(db: Session, request: Optional[Request]) -> Optional[models.Company]:
     if request is None:
         return None
-
-    host = normalize_public_host(request.headers.get("host"))
-    if not host:
-        return None
-
-    direct_match = db.query(models.Company).filter(
-        func.lower(models.Company.public_domain) == host
-    ).first()
-    if direct_match:
-        return direct_match
-
-    for company in db.query(models.Company).all():
-        if company_matches_public_host(company, host):
-            return company
-
-    if host in {"autosqp.com", "autosqp.co"}:
-        return db.query(models.Company).order_by(models.Company.id.asc()).first()
-
-    return None
+    return company_domains.resolve_company(db, request.headers.get("host"))
 
 
 def serialize_public_company(company: Optional[models.Company]) -> schemas.PublicCompanyContext:
@@ -490,38 +473,18 @@ AUTORIZO A AUTOS QP SAS Y A LAS ENTIDADES QUE PERTENEZCAN O LLEGAREN A PERTENECE
 """.strip()
 
 
-def _sanitize_public_credit_filename(file_name: Optional[str], fallback: str) -> str:
-    raw_name = str(file_name or fallback).strip() or fallback
-    safe_name = re.sub(r"[^A-Za-z0-9._-]+", "_", raw_name)
-    return safe_name or fallback
-
-
-def _save_public_credit_upload(upload, subdirectory: str, fallback_name: str) -> Optional[str]:
+def _save_public_credit_upload(db: Session, upload, fallback_name: str) -> Optional[str]:
     if not upload:
         return None
 
-    os.makedirs(os.path.join("static", "public-credit", subdirectory), exist_ok=True)
-    original_name = getattr(upload, "filename", None)
-    extension = os.path.splitext(original_name or fallback_name)[1] or ".bin"
-    unique_name = f"{uuid.uuid4().hex}{extension}"
-    safe_name = _sanitize_public_credit_filename(unique_name, fallback_name)
-    target_path = os.path.join("static", "public-credit", subdirectory, safe_name)
-
     if hasattr(upload, "file"):
-        with open(target_path, "wb") as buffer:
-            try:
-                upload.file.seek(0)
-            except Exception:
-                pass
-            shutil.copyfileobj(upload.file, buffer)
+        stored = upload_store.store_upload(db, upload)
     else:
-        with open(target_path, "wb") as buffer:
-            buffer.write(upload)
-
-    return f"/api/static/public-credit/{subdirectory}/{safe_name}".replace("\\", "/")
+        stored = upload_store.store_bytes(db, upload, fallback_name)
+    return stored.url
 
 
-def _save_public_credit_data_url(data_url: Optional[str], subdirectory: str, fallback_name: str) -> Optional[str]:
+def _save_public_credit_data_url(db: Session, data_url: Optional[str], fallback_name: str) -> Optional[str]:
     raw_value = str(data_url or "").strip()
     if not raw_value or "," not in raw_value:
         return None
@@ -536,7 +499,7 @@ def _save_public_credit_data_url(data_url: Optional[str], subdirectory: str, fal
         extension = ".webp"
 
     binary_content = base64.b64decode(encoded)
-    return _save_public_credit_upload(binary_content, subdirectory, f"{fallback_name}{extension}")
+    return _save_public_credit_upload(db, binary_content, f"{fallback_name}{extension}")
 
 
 def _get_public_credit_smtp_settings(db: Session, company: Optional[models.Company] = None) -> Dict[str, Any]:
@@ -585,6 +548,8 @@ def _get_public_credit_smtp_settings(db: Session, company: Optional[models.Compa
         "password": password,
         "sender": sender,
         "use_tls": use_tls,
+        # SMTP_SECURITY=none allows a plain local relay/sink in development.
+        "security": "" if use_company_smtp else (os.getenv("SMTP_SECURITY") or "").strip().lower(),
     }
 
 
@@ -667,24 +632,29 @@ def _send_public_credit_verification_email(target_email: str, db: Session, compa
         subtype="html",
     )
 
-    _deliver_smtp_message(message, smtp_settings)
+    email_outbox.enqueue_message(
+        db,
+        message,
+        kind="public_credit_verification",
+        company_id=getattr(company, "id", None),
+    )
 
 
 def _deliver_smtp_message(message: EmailMessage, smtp_settings: Dict[str, Any]):
-    """Send an already-built message using the company's SMTP connection."""
-
-    if smtp_settings["use_tls"]:
-        context = ssl.create_default_context()
-        with smtplib.SMTP(smtp_settings["host"], smtp_settings["port"]) as server:
-            server.starttls(context=context)
-            if smtp_settings["username"]:
-                server.login(smtp_settings["username"], smtp_settings["password"])
-            server.send_message(message)
-    else:
-        with smtplib.SMTP_SSL(smtp_settings["host"], smtp_settings["port"]) as server:
-            if smtp_settings["username"]:
-                server.login(smtp_settings["username"], smtp_settings["password"])
-            server.send_message(message)
+    """Send an already-built message right away (SMTP settings test only).
+
+    Transactional mail goes through email_outbox.enqueue_message instead.
+    """
+    email_outbox.deliver_now(message, smtp_settings)
+
+
+def _resolve_outbox_smtp_settings(db: Session, company_id: Optional[int]) -> Dict[str, Any]:
+    # Resolved at send time so SMTP passwords are never copied into the outbox.
+    company = db.query(models.Company).filter(models.Company.id == company_id).first() if company_id else None
+    return _get_public_credit_smtp_settings(db, company)
+
+
+email_outbox.set_settings_resolver(_resolve_outbox_smtp_settings)
 
 
 PUBLIC_CREDIT_SECTION_LABELS = {
@@ -1191,38 +1161,7 @@ def _build_public_credit_submission_pdf_reference_style(
         return f"{words[0][0]}{words[1][0]}".upper()
 
     def company_logo_reader() -> Optional[Any]:
-        logo_url = str(getattr(company, "logo_url", None) or "").strip()
-        if not logo_url:
-            return None
-
-        clean_value = logo_url.split("?", 1)[0].replace("\\", "/")
-        candidates = []
-        if os.path.isabs(clean_value):
-            candidates.append(clean_value)
-        for marker in ("/api/static/", "/static/", "api/static/", "static/"):
-            if clean_value.startswith(marker):
-                relative = clean_value[len(marker):]
-                candidates.append(os.path.join("static", *relative.split("/")))
-            elif marker in clean_value:
-                relative = clean_value.split(marker, 1)[1]
-                candidates.append(os.path.join("static", *relative.split("/")))
-        candidates.append(clean_value.lstrip("/"))
-
-        for candidate in candidates:
-            if candidate and os.path.isfile(candidate):
-                try:
-                    return ImageReader(candidate)
-                except Exception:
-                    pass
-
-        if clean_value.startswith(("http://", "https://")):
-            try:
-                response = requests.get(logo_url, timeout=8)
-                response.raise_for_status()
-                return ImageReader(BytesIO(response.content))
-            except Exception:
-                return None
-        return None
+        return branding_assets.get_logo_reader(company)
 
     def draw_logo_or_initials(x: float, y: float, box_width: float, box_height: float) -> None:
         logo_reader = company_logo_reader()
@@ -1522,6 +1461,40 @@ def _build_public_credit_submission_pdf(
     return _build_public_credit_submission_pdf_reference_style(company, submission)
 
 
+def _get_cached_public_credit_submission_pdf(
+    company: Optional[models.Company],
+    submission: models.PublicCreditSubmission,
+) -> bytes:
+    return credit_pdf_cache.get_or_render(company, submission, _build_public_credit_submission_pdf)[1]
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header_value = request.headers.get("if-none-match") or ""
+    candidates = [candidate.strip() for candidate in header_value.split(",") if candidate.strip()]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+def _public_credit_pdf_response(
+    request: Request,
+    company: Optional[models.Company],
+    submission: models.PublicCreditSubmission,
+    filename: str,
+) -> Response:
+    """Serves the cached PDF; the cache key doubles as ETag so repeat downloads get a 304."""
+    cache_key = credit_pdf_cache.credit_pdf_cache_key(company, submission)
+    headers = {"ETag": f'"{cache_key}"', "Cache-Control": "private, no-cache"}
+    if _etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    _, pdf_bytes = credit_pdf_cache.get_or_render(
+        company,
+        submission,
+        _build_public_credit_submission_pdf,
+        key=cache_key,
+    )
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
+
+
 def _parse_public_credit_recipients(raw_recipients: Optional[str], applicant_email: str) -> List[str]:
     candidates = [applicant_email]
     candidates.extend(re.split(r"[,;\n\r]+", str(raw_recipients or "")))
@@ -1535,13 +1508,13 @@ def _parse_public_credit_recipients(raw_recipients: Optional[str], applicant_ema
     return result
 
 
-def _send_public_credit_submission_email(
+def _build_public_credit_submission_email(
     db: Session,
     company: Optional[models.Company],
     submission: models.PublicCreditSubmission,
     pdf_bytes: bytes,
-):
-    smtp_settings = _get_public_credit_smtp_settings(db, company)
+    smtp_settings: Dict[str, Any],
+) -> EmailMessage:
     integration_settings = db.query(models.IntegrationSettings).filter(
         models.IntegrationSettings.company_id == submission.company_id
     ).first()
@@ -1610,7 +1583,41 @@ def _send_public_credit_submission_email(
         subtype="pdf",
         filename=f"formulario_credito_{safe_name or submission.id}.pdf",
     )
-    _deliver_smtp_message(message, smtp_settings)
+    return message
+
+
+def _build_public_credit_submission_outbox_message(db: Session, row: models.EmailOutbox):
+    """Outbox builder: the PDF is rendered by the mail worker, not the request."""
+    submission = db.query(models.PublicCreditSubmission).filter(
+        models.PublicCreditSubmission.id == row.entity_id
+    ).first()
+    if not submission:
+        raise ValueError(f"La solicitud de crédito {row.entity_id} ya no existe")
+    company = db.query(models.Company).filter(models.Company.id == submission.company_id).first()
+    smtp_settings = _get_public_credit_smtp_settings(db, company)
+    pdf_bytes = _get_cached_public_credit_submission_pdf(company, submission)
+    message = _build_public_credit_submission_email(db, company, submission, pdf_bytes, smtp_settings)
+    return message, smtp_settings
+
+
+def _queue_public_credit_submission_email(
+    db: Session,
+    company: Optional[models.Company],
+    submission: models.PublicCreditSubmission,
+):
+    # Fail fast on missing SMTP configuration so the response can tell the user.
+    _get_public_credit_smtp_settings(db, company)
+    email_outbox.enqueue_message(
+        db,
+        None,
+        kind="public_credit_submission",
+        company_id=submission.company_id,
+        entity_type="public_credit_submission",
+        entity_id=submission.id,
+    )
+
+
+email_outbox.register_builder("public_credit_submission", _build_public_credit_submission_outbox_message)
 
 
 def _build_public_credit_lead_message(payload: Dict[str, Any]) -> str:
@@ -2033,6 +2040,7 @@ def ensure_payment_receipts_columns():
 
         receipt_columns = {
             "display_name": "ALTER TABLE payment_receipts ADD COLUMN display_name VARCHAR(180) NULL",
+            "group_display_name": "ALTER TABLE payment_receipts ADD COLUMN group_display_name VARCHAR(180) NULL",
             "customer_name": "ALTER TABLE payment_receipts ADD COLUMN customer_name VARCHAR(180) NULL",
             "customer_document": "ALTER TABLE payment_receipts ADD COLUMN customer_document VARCHAR(80) NULL",
             "concept": "ALTER TABLE payment_receipts ADD COLUMN concept VARCHAR(200) NULL",
@@ -2070,8 +2078,6 @@ def ensure_payment_receipts_columns():
             "('super_admin', 'admin', 'asesor', 'gestion_creditos', 'aliado', 'inventario', 'compras', 'user')"
         ))
 
-ensure_role_configuration_columns()
-ensure_payment_receipts_columns()
 
 def ensure_company_public_domain_columns():
     with engine.begin() as conn:
@@ -2140,7 +2146,6 @@ def ensure_company_public_domain_columns():
             if not exists:
                 conn.execute(text(ddl))
 
-ensure_company_public_domain_columns()
 
 def ensure_user_status_columns():
     try:
@@ -2173,23 +2178,24 @@ def ensure_user_status_columns():
                       )
                 """))
     except Exception as exc:
-        print(f"Warning: could not ensure user status columns: {exc}", flush=True)
-
-ensure_user_status_columns()
+        schema_migrations.step_failed(f"could not ensure user status columns: {exc}")
+
+
+SYSTEM_ROLE_LABELS = {
+    "super_admin": "Super Admin Global",
+    "admin": "Administrador de Empresa",
+    "inventario": "Gestor de Inventario",
+    "asesor": "Asesor / Vendedor",
+    "gestion_creditos": "Gestion de Creditos",
+    "aliado": "Aliado Estrategico",
+    "compras": "Gestor de Compras",
+    "user": "Usuario Basico",
+}
 
 
 def ensure_system_roles_exist():
     try:
-        system_roles = {
-            "super_admin": "Super Admin Global",
-            "admin": "Administrador de Empresa",
-            "inventario": "Gestor de Inventario",
-            "asesor": "Asesor / Vendedor",
-            "gestion_creditos": "Gestion de Creditos",
-            "aliado": "Aliado Estrategico",
-            "compras": "Gestor de Compras",
-            "user": "Usuario Basico",
-        }
+        system_roles = SYSTEM_ROLE_LABELS
 
         with Session(engine) as db:
             existing_roles = {
@@ -2229,10 +2235,8 @@ def ensure_system_roles_exist():
             if changed:
                 db.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure system roles: {exc}", flush=True)
-
+        schema_migrations.step_failed(f"could not ensure system roles: {exc}")
 
-ensure_system_roles_exist()
 
 def ensure_sales_metadata_columns():
     try:
@@ -2273,9 +2277,7 @@ def ensure_sales_metadata_columns():
             if seller_is_nullable == "NO":
                 conn.execute(text("ALTER TABLE sales MODIFY COLUMN seller_id INTEGER NULL"))
     except Exception as exc:
-        print(f"Warning: could not ensure sales metadata columns: {exc}", flush=True)
-
-ensure_sales_metadata_columns()
+        schema_migrations.step_failed(f"could not ensure sales metadata columns: {exc}")
 
 
 def ensure_tax_report_entries_table():
@@ -2314,10 +2316,8 @@ def ensure_tax_report_entries_table():
                 )
             """))
     except Exception as exc:
-        print(f"Warning: could not ensure tax report entries table: {exc}", flush=True)
-
+        schema_migrations.step_failed(f"could not ensure tax report entries table: {exc}")
 
-ensure_tax_report_entries_table()
 
 def ensure_gmail_settings_columns():
     """
@@ -2376,9 +2376,8 @@ def ensure_gmail_settings_columns():
 
             conn.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure gmail settings columns: {exc}", flush=True)
+        schema_migrations.step_failed(f"could not ensure gmail settings columns: {exc}")
 
-ensure_gmail_settings_columns()
 
 def ensure_company_smtp_settings_columns():
     try:
@@ -2399,9 +2398,8 @@ def ensure_company_smtp_settings_columns():
                 except Exception:
                     pass
     except Exception as exc:
-        print(f"Warning: could not ensure smtp settings columns: {exc}", flush=True)
+        schema_migrations.step_failed(f"could not ensure smtp settings columns: {exc}")
 
-ensure_company_smtp_settings_columns()
 
 def ensure_whatsapp_settings_columns():
     try:
@@ -2425,9 +2423,8 @@ def ensure_whatsapp_settings_columns():
                 except Exception:
                     pass
     except Exception as exc:
-        print(f"Warning: could not ensure whatsapp settings columns: {exc}", flush=True)
+        schema_migrations.step_failed(f"could not ensure whatsapp settings columns: {exc}")
 
-ensure_whatsapp_settings_columns()
 
 def ensure_chatbot_settings_columns():
     """
@@ -2459,9 +2456,7 @@ def ensure_chatbot_settings_columns():
                 ))
             conn.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure chatbot settings columns: {exc}", flush=True)
-
-ensure_chatbot_settings_columns()
+        schema_migrations.step_failed(f"could not ensure chatbot settings columns: {exc}")
 
 
 def ensure_lead_reply_columns():
@@ -2488,10 +2483,7 @@ def ensure_lead_reply_columns():
                 ))
             conn.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure lead reply columns: {exc}", flush=True)
-
-
-ensure_lead_reply_columns()
+        schema_migrations.step_failed(f"could not ensure lead reply columns: {exc}")
 
 
 def ensure_lead_soft_delete_columns():
@@ -2523,10 +2515,7 @@ def ensure_lead_soft_delete_columns():
                 ))
             conn.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure lead soft delete columns: {exc}", flush=True)
-
-
-ensure_lead_soft_delete_columns()
+        schema_migrations.step_failed(f"could not ensure lead soft delete columns: {exc}")
 
 
 def ensure_credit_application_link_column():
@@ -2552,10 +2541,7 @@ def ensure_credit_application_link_column():
                 ))
             conn.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure credit application lead link column: {exc}", flush=True)
-
-
-ensure_credit_application_link_column()
+        schema_migrations.step_failed(f"could not ensure credit application lead link column: {exc}")
 
 
 def ensure_purchase_option_decision_columns():
@@ -2589,10 +2575,7 @@ def ensure_purchase_option_decision_columns():
                 ))
             conn.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure purchase option decision columns: {exc}", flush=True)
-
-
-ensure_purchase_option_decision_columns()
+        schema_migrations.step_failed(f"could not ensure purchase option decision columns: {exc}")
 
 
 def ensure_credit_notes_text_column():
@@ -2610,10 +2593,7 @@ def ensure_credit_notes_text_column():
                 ))
                 conn.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure credit notes text column: {exc}", flush=True)
-
-
-ensure_credit_notes_text_column()
+        schema_migrations.step_failed(f"could not ensure credit notes text column: {exc}")
 
 
 def ensure_credit_desired_vehicle_text_column():
@@ -2631,10 +2611,7 @@ def ensure_credit_desired_vehicle_text_column():
                 ))
                 conn.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure credit desired_vehicle text column: {exc}", flush=True)
-
-
-ensure_credit_desired_vehicle_text_column()
+        schema_migrations.step_failed(f"could not ensure credit desired_vehicle text column: {exc}")
 
 
 def ensure_credit_approval_columns():
@@ -2663,10 +2640,7 @@ def ensure_credit_approval_columns():
                 ))
             conn.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure credit approval columns: {exc}", flush=True)
-
-
-ensure_credit_approval_columns()
+        schema_migrations.step_failed(f"could not ensure credit approval columns: {exc}")
 
 
 def ensure_lead_process_detail_reservation_columns():
@@ -2695,10 +2669,8 @@ def ensure_lead_process_detail_reservation_columns():
                 ))
             conn.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure lead process detail reservation columns: {exc}", flush=True)
-
+        schema_migrations.step_failed(f"could not ensure lead process detail reservation columns: {exc}")
 
-ensure_lead_process_detail_reservation_columns()
 
 def ensure_automation_rule_reassignment_columns():
     try:
@@ -2726,11 +2698,9 @@ def ensure_automation_rule_reassignment_columns():
                 ))
             conn.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure automation rule reassignment columns: {exc}", flush=True)
+        schema_migrations.step_failed(f"could not ensure automation rule reassignment columns: {exc}")
 
 
-ensure_automation_rule_reassignment_columns()
-
 def ensure_sent_alert_logs_indexes():
     try:
         with engine.connect() as conn:
@@ -2747,10 +2717,8 @@ def ensure_sent_alert_logs_indexes():
                 ))
                 conn.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure sent_alert_logs indexes: {exc}", flush=True)
-
+        schema_migrations.step_failed(f"could not ensure sent_alert_logs indexes: {exc}")
 
-ensure_sent_alert_logs_indexes()
 
 def ensure_lead_query_indexes():
     try:
@@ -2809,10 +2777,187 @@ def ensure_lead_query_indexes():
 
             conn.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure lead query indexes: {exc}", flush=True)
+        schema_migrations.step_failed(f"could not ensure lead query indexes: {exc}")
+
+
+def ensure_message_timeline_indexes():
+    try:
+        with engine.connect() as conn:
+            desired_indexes = [
+                (
+                    "messages",
+                    "ix_messages_conversation_created",
+                    "CREATE INDEX ix_messages_conversation_created "
+                    "ON messages (conversation_id, created_at)"
+                ),
+                (
+                    "messages",
+                    "ix_messages_whatsapp_message_id",
+                    "CREATE INDEX ix_messages_whatsapp_message_id "
+                    "ON messages (whatsapp_message_id)"
+                ),
+                (
+                    "conversations",
+                    "ix_conversations_lead_id",
+                    "CREATE INDEX ix_conversations_lead_id "
+                    "ON conversations (lead_id)"
+                ),
+            ]
+
+            for table_name, index_name, ddl in desired_indexes:
+                index_exists = conn.execute(text(
+                    "SELECT COUNT(*) FROM INFORMATION_SCHEMA.STATISTICS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name "
+                    "AND INDEX_NAME = :index_name"
+                ), {
+                    "table_name": table_name,
+                    "index_name": index_name,
+                }).scalar()
+
+                if not index_exists:
+                    conn.execute(text(ddl))
+
+            conn.commit()
+    except Exception as exc:
+        schema_migrations.step_failed(f"could not ensure message timeline indexes: {exc}")
+
+
+def ensure_message_created_at_not_null():
+    # The message timeline orders and pages on (created_at, id); NULL dates would
+    # need IS NULL terms that keep ix_messages_conversation_created from serving it.
+    # Undated messages get their lead's creation date, so they stay at the old end.
+    try:
+        messages = models.Message.__table__
+        lead_created_at = (
+            select(models.Lead.created_at)
+            .join(models.Conversation, models.Conversation.lead_id == models.Lead.id)
+            .where(models.Conversation.id == messages.c.conversation_id)
+            .scalar_subquery()
+        )
+        with engine.begin() as conn:
+            backfilled = conn.execute(
+                update(messages)
+                .where(messages.c.created_at.is_(None))
+                .values(created_at=func.coalesce(lead_created_at, datetime.datetime.utcnow()))
+            ).rowcount
+            if conn.dialect.name == "mysql":
+                is_nullable = conn.execute(text(
+                    "SELECT IS_NULLABLE FROM INFORMATION_SCHEMA.COLUMNS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'messages' "
+                    "AND COLUMN_NAME = 'created_at'"
+                )).scalar()
+                if is_nullable == "YES":
+                    conn.execute(text("ALTER TABLE messages MODIFY COLUMN created_at DATETIME NOT NULL"))
+        if backfilled:
+            print(f"Messages: backfilled created_at on {backfilled} message(s)", flush=True)
+    except Exception as exc:
+        schema_migrations.step_failed(f"could not backfill message dates: {exc}")
+
+
+def ensure_finance_report_indexes():
+    try:
+        with engine.connect() as conn:
+            desired_indexes = [
+                (
+                    "sales",
+                    "ix_sales_company_status_date",
+                    "CREATE INDEX ix_sales_company_status_date "
+                    "ON sales (company_id, status, sale_date)"
+                ),
+                (
+                    "tax_report_entries",
+                    "ix_tax_report_entries_company_year",
+                    "CREATE INDEX ix_tax_report_entries_company_year "
+                    "ON tax_report_entries (company_id, year)"
+                ),
+                (
+                    "payment_receipts",
+                    "ix_payment_receipts_company_number",
+                    "CREATE INDEX ix_payment_receipts_company_number "
+                    "ON payment_receipts (company_id, receipt_number)"
+                ),
+                (
+                    "payment_receipts",
+                    "ix_payment_receipts_company_payment_date",
+                    "CREATE INDEX ix_payment_receipts_company_payment_date "
+                    "ON payment_receipts (company_id, payment_date)"
+                ),
+            ]
+
+            for table_name, index_name, ddl in desired_indexes:
+                index_exists = conn.execute(text(
+                    "SELECT COUNT(*) FROM INFORMATION_SCHEMA.STATISTICS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name "
+                    "AND INDEX_NAME = :index_name"
+                ), {
+                    "table_name": table_name,
+                    "index_name": index_name,
+                }).scalar()
+
+                if not index_exists:
+                    conn.execute(text(ddl))
+
+            conn.commit()
+    except Exception as exc:
+        schema_migrations.step_failed(f"could not ensure finance report indexes: {exc}")
+
+
+def ensure_receipt_search_documents():
+    try:
+        with engine.begin() as conn:
+            indexed = receipt_search.rebuild_documents(conn, missing_only=True)
+        if indexed:
+            print(f"Receipt search: indexed {indexed} receipt(s)", flush=True)
+    except Exception as exc:
+        schema_migrations.step_failed(f"could not build receipt search documents: {exc}")
+
+
+def ensure_receipt_group_display_names():
+    try:
+        with engine.begin() as conn:
+            updated = receipt_display_names.rebuild_group_display_names(conn)
+        if updated:
+            print(f"Receipt display names: updated {updated} receipt(s)", flush=True)
+    except Exception as exc:
+        schema_migrations.step_failed(f"could not backfill receipt display names: {exc}")
+
+
+def ensure_finance_monthly_rollups():
+    try:
+        with engine.begin() as conn:
+            rows = finance_rollups.rebuild_rollups(conn)
+        print(f"Finance rollups: rebuilt {rows} company month(s)", flush=True)
+    except Exception as exc:
+        schema_migrations.step_failed(f"could not rebuild finance rollups: {exc}")
+
+
+def ensure_company_domains():
+    try:
+        with engine.begin() as conn:
+            hosts = company_domains.rebuild_company_domains(conn)
+        print(f"Company domains: indexed {hosts} host(s)", flush=True)
+    except Exception as exc:
+        schema_migrations.step_failed(f"could not build company domains: {exc}")
+
+
+def ensure_vehicle_photo_variants_column():
+    try:
+        with engine.connect() as conn:
+            existing_cols_result = conn.execute(text(
+                "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'vehicles'"
+            ))
+            existing_cols = {row[0] for row in existing_cols_result.fetchall()}
 
+            if "photo_variants" not in existing_cols:
+                conn.execute(text(
+                    "ALTER TABLE vehicles "
+                    "ADD COLUMN photo_variants JSON NULL"
+                ))
+            conn.commit()
+    except Exception as exc:
+        schema_migrations.step_failed(f"could not ensure vehicle photo variants column: {exc}")
 
-ensure_lead_query_indexes()
 
 def ensure_user_activity_column():
     try:
@@ -2833,10 +2978,7 @@ def ensure_user_activity_column():
             ))
             conn.commit()
     except Exception as exc:
-        print(f"Warning: could not ensure user activity column: {exc}", flush=True)
-
-
-ensure_user_activity_column()
+        schema_migrations.step_failed(f"could not ensure user activity column: {exc}")
 
 
 def ensure_lead_statuses_synced():
@@ -2862,11 +3004,9 @@ def ensure_lead_statuses_synced():
                     {"old_status": old_status, "new_status": new_status}
                 )
     except Exception as exc:
-        print(f"Warning: could not sync lead statuses: {exc}", flush=True)
+        schema_migrations.step_failed(f"could not sync lead statuses: {exc}")
 
 
-ensure_lead_statuses_synced()
-
 app = FastAPI(title="AutosQP API", description="API para gestión de compra venta de carros")
 
 @app.exception_handler(Exception)
@@ -2878,16 +3018,37 @@ async def global_exception_handler(request: Request, exc: Exception):
         content={"detail": "Internal Server Error", "error": str(exc)}
     )
 
-app.include_router(whatsapp.router) # Register the router
-app.include_router(credits.router) # Register credits router
-app.include_router(purchases.router)
-app.include_router(notifications.router)
-app.include_router(rules.router)
-app.include_router(vehicles.router)
-app.include_router(meta.router)
-app.include_router(tiktok.router)
-app.include_router(gmail.router)
-app.include_router(appointments.router)
+# Core routers mount at boot; module routers (whatsapp, credits, gmail, ...) mount at
+# boot too unless ROUTER_LOAD_MODE=lazy, in which case the first request to their
+# prefix imports them. See view_registry.LAZY_ROUTER_MODULES.
+router_loader = RouterLoader(app, CORE_ROUTER_MODULES, LAZY_ROUTER_MODULES)
+router_loader.load_boot_modules()
+router_loader.install_middleware()
+
+# Per-route wall/DB time, query counts and N+1 suspects, exported at /metrics.
+perf_metrics.install(app, engine)
+
+
+@app.on_event("startup")
+def start_email_outbox_worker():
+    # Delivers mail queued in email_outbox (also started lazily on enqueue).
+    email_outbox.start_worker()
+
+
+@app.on_event("startup")
+def fail_stale_background_jobs():
+    # Jobs held by a worker that was restarted never finish; report them as failed.
+    try:
+        with Session(engine) as db:
+            failed = background_jobs.fail_stale_jobs(db)
+        if failed:
+            print(f"Background jobs: marked {failed} stale job(s) as failed", flush=True)
+    except Exception as exc:
+        print(f"Warning: could not check stale background jobs: {exc}", flush=True)
+
+
+# Statements over SLOW_QUERY_THRESHOLD_MS are stored with an EXPLAIN in slow_query_log.
+slow_query_log.install(engine)
 
 
 # Configure CORS
@@ -2916,6 +3077,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 @app.get("/ping")
@@ -3884,9 +4046,11 @@ def normalize_interested_process_detail(
     return process_detail_data
 
 
-def build_lead_board_link(target_user: Optional[models.User], lead_id: int) -> str:
+def build_lead_board_link(target_user: Optional[models.User], lead_id: Optional[int] = None) -> str:
     target_role_name = get_user_role_name(target_user)
     base_path = "/aliado/dashboard" if target_role_name == "aliado" else "/admin/leads"
+    if lead_id is None:
+        return base_path
     return f"{base_path}?leadId={lead_id}"
 
 
@@ -3958,7 +4122,7 @@ def ensure_role_view_defaults_synced():
             if updated:
                 db.commit()
     except Exception as exc:
-        print(f"Warning: could not sync role view defaults: {exc}", flush=True)
+        schema_migrations.step_failed(f"could not sync role view defaults: {exc}")
 
 
 def serialize_role(role: models.Role) -> schemas.Role:
@@ -4012,7 +4176,59 @@ def ensure_company_settings_scope(current_user: models.User, company_id: int):
         raise HTTPException(status_code=403, detail="Not authorized to manage this company")
 
 
-ensure_role_view_defaults_synced()
+def ensure_base_mysql_schema():
+    ensure_mysql_schema(engine)
+
+
+# Ordered schema steps. They run once per schema fingerprint (see schema_migrations),
+# not on every worker import. Append new ensure_* functions here.
+SCHEMA_MIGRATION_STEPS = [
+    ensure_base_mysql_schema,
+    ensure_role_configuration_columns,
+    ensure_payment_receipts_columns,
+    ensure_company_public_domain_columns,
+    ensure_user_status_columns,
+    ensure_system_roles_exist,
+    ensure_sales_metadata_columns,
+    ensure_tax_report_entries_table,
+    ensure_gmail_settings_columns,
+    ensure_company_smtp_settings_columns,
+    ensure_whatsapp_settings_columns,
+    ensure_chatbot_settings_columns,
+    ensure_lead_reply_columns,
+    ensure_lead_soft_delete_columns,
+    ensure_credit_application_link_column,
+    ensure_purchase_option_decision_columns,
+    ensure_credit_notes_text_column,
+    ensure_credit_desired_vehicle_text_column,
+    ensure_credit_approval_columns,
+    ensure_lead_process_detail_reservation_columns,
+    ensure_automation_rule_reassignment_columns,
+    ensure_sent_alert_logs_indexes,
+    ensure_lead_query_indexes,
+    ensure_message_timeline_indexes,
+    ensure_message_created_at_not_null,
+    ensure_finance_report_indexes,
+    ensure_receipt_search_documents,
+    ensure_receipt_group_display_names,
+    ensure_finance_monthly_rollups,
+    ensure_company_domains,
+    ensure_vehicle_photo_variants_column,
+    ensure_user_activity_column,
+    ensure_lead_statuses_synced,
+    ensure_role_view_defaults_synced,
+]
+
+# What the data-sync steps copy into the database; a change re-runs the migration.
+SCHEMA_SEED_DATA = {
+    "system_roles": SYSTEM_ROLE_LABELS,
+    "role_view_access": DEFAULT_ROLE_VIEW_ACCESS,
+    "role_menu_order": DEFAULT_ROLE_MENU_ORDER,
+    "lead_statuses": [status.value for status in models.LeadStatus],
+    "legacy_lead_statuses": LEGACY_LEAD_STATUS_MAP,
+}
+
+schema_migrations.ensure_schema_current(engine, models.Base.metadata, SCHEMA_MIGRATION_STEPS, SCHEMA_SEED_DATA)
 
 
 def get_company_role_override(db: Session, company_id: Optional[int], base_role_name: Optional[str]) -> Optional[models.Role]:
@@ -4811,7 +5027,7 @@ def clear_user_lead_supervisions(
 
 
 @app.post("/users/{user_id}/ecard-photo", response_model=schemas.User)
-async def upload_user_ecard_photo(
+def upload_user_ecard_photo(
     user_id: int,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
@@ -4829,13 +5045,9 @@ async def upload_user_ecard_photo(
     if extension not in allowed_extensions or not content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Solo se permiten imágenes JPG, PNG o WEBP")
 
-    os.makedirs("static/user-ecards", exist_ok=True)
-    safe_name = f"{uuid.uuid4().hex}{extension}"
-    target_path = os.path.join("static", "user-ecards", safe_name)
-    with open(target_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    db_user.ecard_photo_url = f"/api/static/user-ecards/{safe_name}"
+    stored = upload_store.store_upload(db, file)
+    upload_store.discard(db, db_user.ecard_photo_url)
+    db_user.ecard_photo_url = stored.url
     if not db_user.ecard_slug:
         db_user.ecard_slug = ensure_unique_ecard_slug(
             db,
@@ -4887,13 +5099,8 @@ def delete_user(
             raise HTTPException(status_code=403, detail="No puedes eliminar a un Súper Administrador")
             
     reassignment_target_id = disable_request.reassign_leads_to_user_id if disable_request else None
-    assigned_leads = db.query(models.Lead).options(
-        joinedload(models.Lead.supervisors)
-    ).filter(
-        models.Lead.assigned_to_id == user_id,
-        models.Lead.deleted_at.is_(None)
-    ).all()
-    assigned_leads_count = len(assigned_leads)
+    assigned_lead_ids = lead_redistribution.get_source_lead_ids(db, user_id)
+    assigned_leads_count = len(assigned_lead_ids)
 
     replacement_user = None
     if reassignment_target_id is not None:
@@ -4929,59 +5136,86 @@ def delete_user(
         )
 
     user_email_snapshot = db_user.email
-            
-    try:
-        if replacement_user is not None:
-            for lead in assigned_leads:
-                lead.assigned_to_id = replacement_user.id
-
-                supervisor_ids = [
-                    supervisor.id
-                    for supervisor in (getattr(lead, "supervisors", None) or [])
-                    if (
-                        supervisor
-                        and supervisor.id != db_user.id
-                        and is_active_user(supervisor)
-                    )
-                ]
-                sync_lead_supervisors(db, lead, supervisor_ids, current_user.id)
-
-                db.add(models.LeadHistory(
-                    lead_id=lead.id,
-                    user_id=current_user.id,
-                    previous_status=lead.status,
-                    new_status=lead.status,
-                    comment=(
-                        f"Lead reasignado por inhabilitacion de "
-                        f"{db_user.full_name or db_user.email} hacia "
-                        f"{replacement_user.full_name or replacement_user.email}. "
-                        f"Se conserva el estado actual."
-                    )
-                ))
-                db.add(models.Notification(
-                    user_id=replacement_user.id,
-                    title="Lead Reasignado",
-                    message=(
-                        f"Se te reasigno el lead: {lead.name}. "
-                        "Conserva su estado actual para que continues la gestion."
-                    ),
-                    type="info",
-                    link=build_lead_board_link(replacement_user, lead.id)
-                ))
+    actor_id = current_user.id
+    company_id = db_user.company_id
+    replacement_user_id = replacement_user.id if replacement_user is not None else None
+    replacement_label = (replacement_user.full_name or replacement_user.email) if replacement_user is not None else None
+    board_paths = {replacement_user_id: build_lead_board_link(replacement_user)} if replacement_user is not None else {}
+    history_comments = {
+        replacement_user_id: (
+            f"Lead reasignado por inhabilitacion de "
+            f"{db_user.full_name or db_user.email} hacia "
+            f"{replacement_label}. "
+            f"Se conserva el estado actual."
+        )
+    }
+
+    def run_user_disable(job_db: Session, progress=None):
+        reassigned = 0
+        if replacement_user_id is not None:
+            removed_supervisor_ids = [user_id] + lead_redistribution.get_inactive_company_user_ids(job_db, company_id)
+            pending_lead_ids = assigned_lead_ids
+            # Second pass picks up leads that landed on the user while the first one ran.
+            for _ in range(2):
+                if not pending_lead_ids:
+                    break
+                moved, _ = lead_bulk_ops.apply_assignment_plan_with_digests(
+                    job_db,
+                    [(lead_id, replacement_user_id) for lead_id in pending_lead_ids],
+                    board_paths,
+                    kind="reassigned",
+                    actor_id=actor_id,
+                    history_comments=history_comments,
+                    progress=progress,
+                    removed_supervisor_ids=removed_supervisor_ids,
+                )
+                reassigned += moved
+                pending_lead_ids = lead_redistribution.get_source_lead_ids(job_db, user_id)
+
+        was_active = job_db.query(models.User.id).filter(
+            models.User.id == user_id, models.User.is_active != 0
+        ).first() is not None
+        job_db.query(models.User).filter(models.User.id == user_id).update(
+            {"auto_assign_leads": False, "is_active": False},
+            synchronize_session=False,
+        )
+        if was_active:
+            license_usage.record_user_changes(job_db, company_id, active_users=-1)
+        lead_assignment.invalidate_company_pool(job_db, company_id)
+        job_db.commit()
 
-        db_user.auto_assign_leads = False
-        db_user.is_active = False
-        db.commit()
-        
         action_detail = f"Usuario inhabilitado: {user_email_snapshot}"
-        if replacement_user is not None and assigned_leads_count > 0:
-            action_detail += f". Leads reasignados a {replacement_user.full_name or replacement_user.email}"
-        log_action_to_db(db, current_user.id, "DISABLE", "User", user_id, action_detail)
-        
+        if replacement_user_id is not None and reassigned > 0:
+            action_detail += f". Leads reasignados a {replacement_label}"
+        log_action_to_db(job_db, actor_id, "DISABLE", "User", user_id, action_detail)
+        return {"reassigned_leads": reassigned}
+
+    try:
+        if assigned_leads_count > lead_bulk_ops.BULK_BACKGROUND_THRESHOLD:
+            # Stop auto-assignment right away; the job disables the user once the leads moved.
+            db_user.auto_assign_leads = False
+            db.commit()
+            job = background_jobs.submit_job(
+                db,
+                kind="user_disable_reassign",
+                total=assigned_leads_count,
+                handler=run_user_disable,
+                company_id=company_id,
+                created_by_id=actor_id,
+                payload={"user_id": user_id, "reassign_leads_to_user_id": replacement_user_id},
+            )
+            return {
+                "status": "queued",
+                "message": "Los leads se están reasignando; el usuario quedará inhabilitado al terminar",
+                "reassigned_leads": 0,
+                "job_id": job.id,
+            }
+
+        result = run_user_disable(db)
         return {
             "status": "success",
             "message": "Usuario inhabilitado correctamente",
-            "reassigned_leads": assigned_leads_count if replacement_user is not None else 0,
+            "reassigned_leads": result["reassigned_leads"],
         }
     except Exception as e:
         db.rollback()
@@ -4991,6 +5225,7 @@ def delete_user(
 @app.post("/users/{user_id}/redistribute-leads", response_model=schemas.UserLeadRedistributeResponse)
 def redistribute_user_leads(
     user_id: int,
+    dry_run: bool = Query(False),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
@@ -5022,72 +5257,96 @@ def redistribute_user_leads(
             detail="No hay asesores o vendedores activos con asignación automática habilitada para redistribuir estos leads"
         )
 
-    leads = db.query(models.Lead).options(
-        joinedload(models.Lead.supervisors)
-    ).filter(
-        models.Lead.assigned_to_id == source_user.id,
-        models.Lead.deleted_at.is_(None)
-    ).all()
-
-    if not leads:
+    lead_ids = lead_redistribution.get_source_lead_ids(db, source_user.id)
+    if not lead_ids:
         return {
             "status": "success",
             "message": "El usuario no tiene leads asignados para redistribuir",
             "redistributed_leads": 0,
             "recipient_users": len(recipient_users),
+            "dry_run": dry_run,
         }
 
-    redistributed = 0
-    for lead in leads:
-        target_user = random.choice(recipient_users)
-        previous_assigned_to_id = lead.assigned_to_id
-        lead.assigned_to_id = target_user.id
-
-        supervisor_ids = [
-            supervisor.id
-            for supervisor in (getattr(lead, "supervisors", None) or [])
-            if (
-                supervisor
-                and supervisor.id != source_user.id
-                and is_active_user(supervisor)
-            )
-        ]
-        sync_lead_supervisors(db, lead, supervisor_ids, current_user.id)
+    recipient_loads = lead_redistribution.get_open_lead_counts(db, [user.id for user in recipient_users])
+    plan = lead_redistribution.build_balanced_plan(lead_ids, recipient_loads)
+    plan_summary = lead_redistribution.summarize_plan(
+        plan,
+        recipient_loads,
+        {user.id: user.full_name or user.email for user in recipient_users},
+    )
+    if dry_run:
+        return {
+            "status": "success",
+            "message": f"Se redistribuirían {len(plan)} lead(s) entre {len(recipient_users)} usuario(s)",
+            "redistributed_leads": len(plan),
+            "recipient_users": len(recipient_users),
+            "dry_run": True,
+            "plan": plan_summary,
+        }
 
-        db.add(models.LeadHistory(
-            lead_id=lead.id,
-            user_id=current_user.id,
-            previous_status=lead.status,
-            new_status=lead.status,
-            comment=(
-                f"Lead redistribuido automaticamente desde "
-                f"{source_user.full_name or source_user.email} hacia {target_user.full_name or target_user.email}"
-            )
-        ))
-        db.add(models.Notification(
-            user_id=target_user.id,
-            title="Lead Reasignado",
-            message=f"Se te reasigno el lead: {lead.name}. Continúa con la gestión.",
-            type="info",
-            link=build_lead_board_link(target_user, lead.id)
-        ))
-        redistributed += 1
+    source_user_id = source_user.id
+    source_label = source_user.full_name or source_user.email
+    source_email = source_user.email
+    actor_id = current_user.id
+    company_id = source_user.company_id
+    history_comments = {
+        user.id: (
+            f"Lead redistribuido automaticamente desde "
+            f"{source_label} hacia {user.full_name or user.email}"
+        )
+        for user in recipient_users
+    }
+    board_paths = {user.id: build_lead_board_link(user) for user in recipient_users}
+    removed_supervisor_ids = [source_user_id] + lead_redistribution.get_inactive_company_user_ids(db, company_id)
+
+    def run_redistribution(job_db: Session, progress=None):
+        redistributed, _ = lead_bulk_ops.apply_assignment_plan_with_digests(
+            job_db,
+            plan,
+            board_paths,
+            kind="reassigned",
+            actor_id=actor_id,
+            history_comments=history_comments,
+            company_id=company_id,
+            progress=progress,
+            removed_supervisor_ids=removed_supervisor_ids,
+        )
+        log_action_to_db(
+            job_db,
+            actor_id,
+            "REDISTRIBUTE",
+            "User",
+            source_user_id,
+            f"Redistribuidos {redistributed} lead(s) asignados a {source_email}"
+        )
+        return {"redistributed_leads": redistributed}
 
-    db.commit()
-    log_action_to_db(
-        db,
-        current_user.id,
-        "REDISTRIBUTE",
-        "User",
-        source_user.id,
-        f"Redistribuidos {redistributed} lead(s) asignados a {source_user.email}"
-    )
+    if len(plan) > lead_bulk_ops.BULK_BACKGROUND_THRESHOLD:
+        job = background_jobs.submit_job(
+            db,
+            kind="lead_redistribution",
+            total=len(plan),
+            handler=run_redistribution,
+            company_id=company_id,
+            created_by_id=actor_id,
+            payload={"source_user_id": source_user_id, "lead_count": len(plan)},
+        )
+        return {
+            "status": "queued",
+            "message": "La redistribución de leads se está procesando en segundo plano",
+            "redistributed_leads": 0,
+            "recipient_users": len(recipient_users),
+            "plan": plan_summary,
+            "job_id": job.id,
+        }
 
+    result = run_redistribution(db)
     return {
         "status": "success",
         "message": "Leads redistribuidos correctamente",
-        "redistributed_leads": redistributed,
+        "redistributed_leads": result["redistributed_leads"],
         "recipient_users": len(recipient_users),
+        "plan": plan_summary,
     }
 
 # --- SYSTEM LOGS ENDPOINTS ---
@@ -5160,6 +5419,61 @@ def read_system_logs(
     
     return {"items": items, "total": total}
 
+def _load_json_or_none(value: Optional[str]):
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@app.get("/admin/slow-queries", response_model=schemas.SlowQueryList)
+def read_slow_queries(
+    limit: int = Query(20, ge=1, le=200),
+    order_by: str = Query("total", pattern="^(total|max|calls|recent)$"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    Top slow-query fingerprints (global, not tenant scoped).
+    Restricted to Super Admins.
+    """
+    if get_user_role_name(current_user) != "super_admin":
+        raise HTTPException(status_code=403, detail="Solo el super administrador puede ver las consultas lentas")
+
+    order_columns = {
+        "total": models.SlowQueryLog.total_ms.desc(),
+        "max": models.SlowQueryLog.max_ms.desc(),
+        "calls": models.SlowQueryLog.calls.desc(),
+        "recent": models.SlowQueryLog.last_seen_at.desc(),
+    }
+    total = db.query(func.count(models.SlowQueryLog.id)).scalar() or 0
+    entries = db.query(models.SlowQueryLog).order_by(order_columns[order_by], models.SlowQueryLog.id).limit(limit).all()
+
+    items = []
+    for entry in entries:
+        calls = entry.calls or 0
+        items.append(schemas.SlowQueryEntry(
+            id=entry.id,
+            fingerprint_hash=entry.fingerprint_hash,
+            fingerprint=entry.fingerprint,
+            sample_statement=entry.sample_statement,
+            parameter_shape=_load_json_or_none(entry.parameter_shape),
+            route=entry.route,
+            calls=calls,
+            total_ms=entry.total_ms or 0,
+            max_ms=entry.max_ms or 0,
+            last_ms=entry.last_ms or 0,
+            avg_ms=round((entry.total_ms or 0) / calls, 1) if calls else 0.0,
+            explain=_load_json_or_none(entry.explain_json),
+            explained_at=entry.explained_at,
+            first_seen_at=entry.first_seen_at,
+            last_seen_at=entry.last_seen_at,
+        ))
+    return {"items": items, "total": total, "threshold_ms": slow_query_log.SLOW_QUERY_THRESHOLD_MS}
+
+
 @app.get("/dashboard/stats", response_model=schemas.DashboardStats)
 def get_dashboard_stats(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     companies_count = db.query(models.Company).count()
@@ -5174,6 +5488,12 @@ def read_root():
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics", include_in_schema=False)
+def read_metrics(request: Request, db: Session = Depends(get_db)):
+    perf_metrics.ensure_metrics_access(request)
+    content = perf_metrics.render_prometheus() + email_outbox.render_prometheus(db)
+    return Response(content=content, media_type="text/plain; version=0.0.4")
+
 @app.post("/companies/", response_model=schemas.Company)
 def create_company(company: schemas.CompanyCreate, db: Session = Depends(get_db)):
     db_company = db.query(models.Company).filter(models.Company.name == company.name).first()
@@ -5208,6 +5528,8 @@ def create_company(company: schemas.CompanyCreate, db: Session = Depends(get_db)
     db.add(new_company)
     db.commit()
     db.refresh(new_company)
+    if new_company.logo_url:
+        branding_assets.schedule_logo_refresh(new_company.id, new_company.logo_url)
     return serialize_company(new_company)
 
 @app.get("/companies/", response_model=schemas.CompanyList)
@@ -5241,6 +5563,7 @@ def update_company(company_id: int, company_update: schemas.CompanyCreate, db: S
     db_company.public_domain = public_domains[0] if public_domains else None
     db_company.public_domains_json = json.dumps(public_domains)
     db_company.website_url = company_update.website_url
+    logo_changed = (db_company.logo_url or "") != (company_update.logo_url or "")
     db_company.logo_url = company_update.logo_url
     db_company.contact_address = company_update.contact_address
     db_company.contact_phone = company_update.contact_phone
@@ -5277,6 +5600,9 @@ def update_company(company_id: int, company_update: schemas.CompanyCreate, db: S
             f"Remediated {len(remediated_users)} users with disabled module roles for company {db_company.id}",
             flush=True,
         )
+    if logo_changed:
+        # Normalized once here instead of being fetched by every PDF render.
+        branding_assets.schedule_logo_refresh(db_company.id, db_company.logo_url)
 
     return serialize_company(db_company)
 
@@ -5678,7 +6004,7 @@ def read_public_credit_capture_session(
 
 
 @app.post("/public/credit-request/capture-session/{token}/upload", response_model=schemas.PublicCreditCaptureSessionResponse)
-async def upload_public_credit_capture_session_file(
+def upload_public_credit_capture_session_file(
     token: str,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
@@ -5689,8 +6015,8 @@ async def upload_public_credit_capture_session_file(
 
     is_signature = session.side == "signature"
     file_url = _save_public_credit_upload(
+        db,
         file,
-        "signatures" if is_signature else "documents",
         "signature_upload" if is_signature else f"document_{session.side}",
     )
     session.file_path = file_url
@@ -5703,7 +6029,7 @@ async def upload_public_credit_capture_session_file(
 
 
 @app.post("/public/credit-request/submit", response_model=schemas.PublicCreditSubmissionResponse)
-async def submit_public_credit_request(
+def submit_public_credit_request(
     request: Request,
     payload_json: str = Form(...),
     access_token: Optional[str] = Form(None),
@@ -5812,10 +6138,10 @@ async def submit_public_credit_request(
         if signature_capture.side != "signature":
             raise HTTPException(status_code=400, detail="La captura de firma no corresponde a una firma.")
 
-    document_front_url = _save_public_credit_upload(document_front, "documents", "document_front") if document_front else (front_capture.file_path if front_capture else None)
-    document_back_url = _save_public_credit_upload(document_back, "documents", "document_back") if document_back else (back_capture.file_path if back_capture else None)
-    signature_upload_url = _save_public_credit_upload(signature_file, "signatures", "signature_upload") if signature_file else (signature_capture.file_path if signature_capture else None)
-    signature_drawn_url = _save_public_credit_data_url(consent.get("signatureDrawnDataUrl"), "signatures", "signature_drawn")
+    document_front_url = _save_public_credit_upload(db, document_front, "document_front") if document_front else (front_capture.file_path if front_capture else None)
+    document_back_url = _save_public_credit_upload(db, document_back, "document_back") if document_back else (back_capture.file_path if back_capture else None)
+    signature_upload_url = _save_public_credit_upload(db, signature_file, "signature_upload") if signature_file else (signature_capture.file_path if signature_capture else None)
+    signature_drawn_url = _save_public_credit_data_url(db, consent.get("signatureDrawnDataUrl"), "signature_drawn")
 
     attachments = {
         "document_front": document_front_url,
@@ -5956,11 +6282,10 @@ async def submit_public_credit_request(
 
         response_message = "Formulario de crédito guardado y asociado al lead correctamente."
         try:
-            pdf_bytes = _build_public_credit_submission_pdf(company, submission)
-            _send_public_credit_submission_email(db, company, submission, pdf_bytes)
+            _queue_public_credit_submission_email(db, company, submission)
         except Exception as exc:
             print(
-                f"Warning: linked public credit submission {submission.id} was saved but email delivery failed: {exc}",
+                f"Warning: linked public credit submission {submission.id} was saved but the email could not be queued: {exc}",
                 flush=True,
             )
             response_message = (
@@ -6124,11 +6449,10 @@ async def submit_public_credit_request(
 
     response_message = "Solicitud de crédito enviada correctamente."
     try:
-        pdf_bytes = _build_public_credit_submission_pdf(company, submission)
-        _send_public_credit_submission_email(db, company, submission, pdf_bytes)
+        _queue_public_credit_submission_email(db, company, submission)
     except Exception as exc:
         print(
-            f"Warning: public credit submission {submission.id} was saved but email delivery failed: {exc}",
+            f"Warning: public credit submission {submission.id} was saved but the email could not be queued: {exc}",
             flush=True,
         )
         response_message = (
@@ -6216,6 +6540,7 @@ def read_public_credit_submission_detail(
 @app.get("/public-credit-submissions/{submission_id}/pdf")
 def download_public_credit_submission_pdf(
     submission_id: int,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
@@ -6230,16 +6555,12 @@ def download_public_credit_submission_pdf(
         raise HTTPException(status_code=404, detail="Solicitud pública no encontrada")
 
     company = db.query(models.Company).filter(models.Company.id == submission.company_id).first()
-    pdf_bytes = _build_public_credit_submission_pdf(company, submission)
     safe_name = re.sub(r"[^A-Za-z0-9_-]+", "_", submission.applicant_name or "solicitante").strip("_")
-    return StreamingResponse(
-        BytesIO(pdf_bytes),
-        media_type="application/pdf",
-        headers={
-            "Content-Disposition": (
-                f'attachment; filename="formulario_credito_{safe_name or submission.id}.pdf"'
-            )
-        },
+    return _public_credit_pdf_response(
+        request,
+        company,
+        submission,
+        f"formulario_credito_{safe_name or submission.id}.pdf",
     )
 
 
@@ -6272,6 +6593,7 @@ def update_public_credit_submission(
     submission.updated_at = datetime.datetime.now()
     db.commit()
     db.refresh(submission)
+    credit_pdf_cache.invalidate(submission.id)
 
     return schemas.PublicCreditSubmissionDetail(**serialize_public_credit_submission(submission))
 
@@ -6294,8 +6616,10 @@ def delete_public_credit_submission(
     if not submission:
         raise HTTPException(status_code=404, detail="Solicitud pública no encontrada")
 
+    submission_id = submission.id
     db.delete(submission)
     db.commit()
+    credit_pdf_cache.invalidate(submission_id)
     return Response(status_code=204)
 
 
@@ -6409,6 +6733,7 @@ def read_lead_credit_form(
 @app.get("/leads/{lead_id}/credit-form/pdf")
 def download_lead_credit_form_pdf(
     lead_id: int,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
@@ -6423,16 +6748,12 @@ def download_lead_credit_form_pdf(
         raise HTTPException(status_code=404, detail="Este lead aún no tiene un formulario de crédito guardado.")
 
     company = db.query(models.Company).filter(models.Company.id == submission.company_id).first()
-    pdf_bytes = _build_public_credit_submission_pdf(company, submission)
     safe_name = re.sub(r"[^A-Za-z0-9_-]+", "_", submission.applicant_name or lead.name or "solicitante").strip("_")
-    return StreamingResponse(
-        BytesIO(pdf_bytes),
-        media_type="application/pdf",
-        headers={
-            "Content-Disposition": (
-                f'attachment; filename="formulario_credito_{safe_name or submission.id}.pdf"'
-            )
-        },
+    return _public_credit_pdf_response(
+        request,
+        company,
+        submission,
+        f"formulario_credito_{safe_name or submission.id}.pdf",
     )
 
 
@@ -6590,6 +6911,7 @@ def _upsert_lead_credit_form_submission(
         current_attachments.update({key: value for key, value in attachments.items() if value})
         submission.attachments = current_attachments
     submission.updated_at = datetime.datetime.now()
+    credit_pdf_cache.invalidate(submission.id)
 
     db.add(models.LeadHistory(
         lead_id=lead.id,
@@ -6605,7 +6927,7 @@ def _upsert_lead_credit_form_submission(
 
 
 @app.put("/leads/{lead_id}/credit-form/files", response_model=schemas.PublicCreditSubmissionDetail)
-async def save_lead_credit_form_with_files(
+def save_lead_credit_form_with_files(
     lead_id: int,
     payload_json: str = Form(...),
     document_front: Optional[UploadFile] = File(None),
@@ -6665,10 +6987,10 @@ async def save_lead_credit_form_with_files(
             raise HTTPException(status_code=400, detail="La captura de firma no corresponde a una firma.")
 
     consent = form_payload.get("consent", {}) or {}
-    document_front_url = _save_public_credit_upload(document_front, "documents", "document_front") if document_front else (front_capture.file_path if front_capture else None)
-    document_back_url = _save_public_credit_upload(document_back, "documents", "document_back") if document_back else (back_capture.file_path if back_capture else None)
-    signature_upload_url = _save_public_credit_upload(signature_file, "signatures", "signature_upload") if signature_file else (signature_capture.file_path if signature_capture else None)
-    signature_drawn_url = _save_public_credit_data_url(consent.get("signatureDrawnDataUrl"), "signatures", "signature_drawn")
+    document_front_url = _save_public_credit_upload(db, document_front, "document_front") if document_front else (front_capture.file_path if front_capture else None)
+    document_back_url = _save_public_credit_upload(db, document_back, "document_back") if document_back else (back_capture.file_path if back_capture else None)
+    signature_upload_url = _save_public_credit_upload(db, signature_file, "signature_upload") if signature_file else (signature_capture.file_path if signature_capture else None)
+    signature_drawn_url = _save_public_credit_data_url(db, consent.get("signatureDrawnDataUrl"), "signature_drawn")
 
     attachments = {
         "document_front": document_front_url,
@@ -6860,7 +7182,15 @@ def send_lead_credit_form_access(
         """.strip(),
         subtype="html",
     )
-    _deliver_smtp_message(message, smtp_settings)
+    email_outbox.enqueue_message(
+        db,
+        message,
+        kind="lead_credit_form_access",
+        company_id=getattr(company, "id", None),
+        entity_type="lead",
+        entity_id=lead.id,
+        commit=False,
+    )
     db.add(models.LeadHistory(
         lead_id=lead.id,
         user_id=current_user.id,
@@ -7501,42 +7831,99 @@ def bulk_assign_leads(
     if not is_advisor_role(target_user.role):
         raise HTTPException(status_code=400, detail="Solo se pueden asignar leads a usuarios con rol asesor")
 
-    leads_to_update = db.query(models.Lead).options(joinedload(models.Lead.supervisors)).filter(
-        models.Lead.id.in_(payload.lead_ids)
-    )
-    
-    if current_user.company_id:
-        leads_to_update = leads_to_update.filter(models.Lead.company_id == current_user.company_id)
-    
-    leads = leads_to_update.all()
-    result = 0
-    for lead in leads:
-        previous_assigned_to_id = lead.assigned_to_id
-        lead.assigned_to_id = payload.assigned_to_id
-        supervisor_ids = normalize_supervisor_ids(getattr(lead, "supervisor_ids", []))
-        if should_keep_assigner_as_supervisor(current_user.id, payload.assigned_to_id):
-            supervisor_ids = ensure_user_in_supervisors(supervisor_ids, current_user.id)
-        sync_lead_supervisors(db, lead, supervisor_ids, current_user.id)
-
-        if previous_assigned_to_id != payload.assigned_to_id:
-            db.add(models.LeadHistory(
-                lead_id=lead.id,
-                user_id=current_user.id,
-                previous_status=lead.status,
-                new_status=lead.status,
-                comment=f"Lead asignado a {target_user.full_name or target_user.email}; quien asigna queda en supervision"
-            ))
-            db.add(models.Notification(
-                user_id=payload.assigned_to_id,
-                title="Lead Asignado",
-                message=f"Se te asigno el lead: {lead.name}. Continúa con la gestion.",
-                type="info",
-                link=build_lead_board_link(target_user, lead.id)
-            ))
-        result += 1
+    lead_ids = list(dict.fromkeys(payload.lead_ids))
+    target_user_id = target_user.id
+    target_label = target_user.full_name or target_user.email
+    target_email = target_user.email
+    company_id = current_user.company_id
+    actor_id = current_user.id
+    supervisor_id = actor_id if should_keep_assigner_as_supervisor(actor_id, target_user_id) else None
+    board_path = build_lead_board_link(target_user)
+    if supervisor_id:
+        # Same check as sync_lead_supervisors on the single-lead path, once per company of the leads.
+        lead_company_ids = set()
+        for chunk in lead_bulk_ops.chunked(lead_ids):
+            company_query = db.query(models.Lead.company_id).filter(models.Lead.id.in_(list(chunk)))
+            if company_id:
+                company_query = company_query.filter(models.Lead.company_id == company_id)
+            lead_company_ids.update(row[0] for row in company_query.distinct())
+        for lead_company_id in lead_company_ids:
+            validate_supervisors(db, lead_company_id, [supervisor_id])
+
+    def run_bulk_assignment(job_db: Session, progress=None):
+        assigned_count, changed_by_target = lead_bulk_ops.apply_assignment_plan_with_digests(
+            job_db,
+            [(lead_id, target_user_id) for lead_id in lead_ids],
+            {target_user_id: board_path},
+            actor_id=actor_id,
+            history_comments={target_user_id: f"Lead asignado a {target_label}; quien asigna queda en supervision"},
+            supervisor_id=supervisor_id,
+            company_id=company_id,
+            progress=progress,
+        )
+        return {
+            "assigned": assigned_count,
+            "changed": len(changed_by_target.get(target_user_id, [])),
+        }
 
-    db.commit()
-    return {"message": f"Successfully assigned {result} leads to user {target_user.email}"}
+    if len(lead_ids) > lead_bulk_ops.BULK_BACKGROUND_THRESHOLD:
+        job = background_jobs.submit_job(
+            db,
+            kind="lead_bulk_assign",
+            total=len(lead_ids),
+            handler=run_bulk_assignment,
+            company_id=company_id or target_user.company_id,
+            created_by_id=actor_id,
+            payload={"assigned_to_id": target_user_id, "lead_count": len(lead_ids)},
+        )
+        return {
+            "message": f"Assigning {len(lead_ids)} leads to user {target_email} in background",
+            "job_id": job.id,
+            "status": job.status,
+        }
+
+    result = run_bulk_assignment(db)
+    return {"message": f"Successfully assigned {result['assigned']} leads to user {target_email}"}
+
+
+def _get_accessible_background_job(db: Session, job_id: int, current_user: models.User) -> models.BackgroundJob:
+    job = db.query(models.BackgroundJob).filter(models.BackgroundJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Proceso no encontrado")
+    if get_user_role_name(current_user) != "super_admin" and (
+        job.company_id != current_user.company_id
+        or (job.created_by_id != current_user.id and not is_company_admin(current_user))
+    ):
+        raise HTTPException(status_code=403, detail="No tienes permisos para ver este proceso")
+    if background_jobs.is_stale(job) and background_jobs.fail_stale_jobs(db, job.id):
+        db.refresh(job)
+    return job
+
+
+@app.get("/jobs/{job_id}", response_model=schemas.BackgroundJobStatus)
+def read_background_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    return background_jobs.serialize_job(_get_accessible_background_job(db, job_id, current_user))
+
+
+@app.get("/jobs/{job_id}/download")
+def download_background_job_file(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_user_from_anywhere)
+):
+    job = _get_accessible_background_job(db, job_id, current_user)
+    result = background_jobs.serialize_job(job).get("result") or {}
+    file_name = result.get("file_name") if isinstance(result, dict) else None
+    if job.status != background_jobs.JOB_STATUS_COMPLETED or not file_name:
+        raise HTTPException(status_code=409, detail="El proceso aún no tiene un archivo para descargar")
+    path = document_exports.export_path(file_name)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=410, detail="El archivo del proceso ya expiró, genera la exportación de nuevo")
+    return FileResponse(path, media_type="application/zip", filename=os.path.basename(path))
 
 
 @app.post("/leads", response_model=schemas.Lead)
@@ -7795,48 +8182,66 @@ def get_reports_stats(db: Session = Depends(get_db), current_user: models.User =
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- STATIC FILES & UPLOAD ---
-from fastapi.staticfiles import StaticFiles
 from fastapi import UploadFile, File, Form
-import shutil
 import os
 import uuid
 
 # Ensure static directory exists
 os.makedirs("static", exist_ok=True)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Content ETags, immutable caching for blobs, Range and optional X-Accel-Redirect (see file_serving).
+app.mount("/static", file_serving.StoredFiles(directory="static"), name="static")
 
 @app.post("/upload/")
-async def upload_image(request: Request, file: UploadFile = File(...)):
-    # Generate unique filename
-    file_extension = file.filename.split(".")[-1]
-    unique_filename = f"{uuid.uuid4()}.{file_extension}"
-    file_path = f"static/{unique_filename}"
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    relative_url = f"/api/static/{unique_filename}"
+def upload_image(request: Request, file: UploadFile = File(...), db: Session = Depends(get_db)):
+    stored = upload_store.store_upload(db, file)
+    db.commit()
+    # static/ name of the blob, e.g. blobs/ab/<sha256>.jpg
+    static_name = stored.path[len("static/"):]
+
+    # Resized, metadata-free copies for pages and shares; the original is kept as uploaded.
+    # A re-uploaded photo reuses its blob and the derivatives already made for it.
+    variants = None
+    if image_derivatives.is_image_name(static_name):
+        variants = image_derivatives.load_variants(static_name)
+        if variants is None:
+            try:
+                variants = image_derivatives.submit(static_name).result(
+                    timeout=image_derivatives.IMAGE_DERIVATIVE_TIMEOUT_SECONDS
+                )
+            except Exception as exc:
+                print(f"Warning: could not create derivatives of {static_name}: {exc!r}", flush=True)
+
+    relative_url = stored.url
     base_url = str(request.base_url).rstrip("/")
     # Behind reverse proxies, base_url can already include /api.
     if base_url.endswith("/api"):
         base_url = base_url[:-4]
     return {
         "url": f"{base_url}{relative_url}",
-        "url_relative": relative_url
+        "url_relative": relative_url,
+        "variants": variants,
     }
 
 @app.get("/internal-files/{storage_name}")
-def get_internal_file(storage_name: str):
+def get_internal_file(storage_name: str, request: Request, db: Session = Depends(get_db)):
     safe_name = os.path.basename(storage_name)
     base_dir = os.path.abspath("static/internal_chat")
-    file_path = os.path.abspath(os.path.join(base_dir, safe_name))
+    blob_path = upload_store.blob_path(safe_name)
+    if blob_path:
+        # Blobs are shared with receipts, credits and purchases; only serve those sent in the chat.
+        is_chat_file = db.query(models.InternalMessage.id).filter(
+            models.InternalMessage.content.like(f'__FILE__%"storage_name": "{safe_name}"%')
+        ).first()
+        if not is_chat_file:
+            raise HTTPException(status_code=404, detail="File not found")
+    file_path = os.path.abspath(blob_path or os.path.join(base_dir, safe_name))
 
-    if not file_path.startswith(base_dir):
+    if not file_path.startswith((base_dir, os.path.abspath(upload_store.BLOB_DIR))):
         raise HTTPException(status_code=400, detail="Invalid file path")
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
 
-    return FileResponse(path=file_path, filename=safe_name)
+    return file_serving.build_file_response(request, file_path, filename=safe_name)
 
 # --- BRANDS & MODELS ENDPOINTS ---
 
@@ -9075,112 +9480,6 @@ def get_sale_display_name(sale: Optional[models.Sale]) -> Optional[str]:
     return None
 
 
-def _pick_best_receipt_display_name(candidates: List[str]) -> Optional[str]:
-    cleaned_candidates = []
-    for candidate in candidates or []:
-        normalized_candidate = (candidate or "").strip()
-        if normalized_candidate:
-            cleaned_candidates.append(normalized_candidate)
-
-    if not cleaned_candidates:
-        return None
-
-    def _display_name_score(value: str) -> tuple[int, int, int]:
-        has_digits = 1 if any(char.isdigit() for char in value) else 0
-        word_count = len(value.split())
-        return (has_digits, word_count, len(value))
-
-    return max(cleaned_candidates, key=_display_name_score)
-
-
-def enrich_receipt_display_names(
-    db: Session,
-    receipts: List[models.PaymentReceipt],
-    company_id: Optional[int] = None
-) -> List[models.PaymentReceipt]:
-    if not receipts:
-        return receipts
-
-    missing_receipt_numbers = {
-        (receipt.receipt_number or "").strip()
-        for receipt in receipts
-        if not (receipt.display_name or "").strip() and (receipt.receipt_number or "").strip()
-    }
-    missing_sale_ids = {
-        int(receipt.sale_id)
-        for receipt in receipts
-        if not (receipt.display_name or "").strip() and getattr(receipt, "sale_id", None)
-    }
-
-    if not missing_receipt_numbers and not missing_sale_ids:
-        return receipts
-
-    lookup_filters = []
-    if missing_receipt_numbers:
-        lookup_filters.append(models.PaymentReceipt.receipt_number.in_(missing_receipt_numbers))
-    if missing_sale_ids:
-        lookup_filters.append(models.PaymentReceipt.sale_id.in_(missing_sale_ids))
-
-    sibling_query = db.query(models.PaymentReceipt).filter(
-        models.PaymentReceipt.display_name.isnot(None),
-        models.PaymentReceipt.display_name != "",
-        or_(*lookup_filters)
-    )
-    if company_id:
-        sibling_query = sibling_query.filter(models.PaymentReceipt.company_id == company_id)
-
-    sibling_rows = sibling_query.order_by(
-        models.PaymentReceipt.payment_date.desc(),
-        models.PaymentReceipt.id.desc()
-    ).all()
-
-    display_name_candidates_by_receipt_number: Dict[str, List[str]] = {}
-    display_name_candidates_by_sale_id: Dict[int, List[str]] = {}
-
-    for sibling in sibling_rows:
-        sibling_name = (sibling.display_name or "").strip()
-        if not sibling_name:
-            continue
-        sibling_receipt_number = (sibling.receipt_number or "").strip()
-        if sibling_receipt_number:
-            display_name_candidates_by_receipt_number.setdefault(sibling_receipt_number, []).append(sibling_name)
-        sibling_sale_id = getattr(sibling, "sale_id", None)
-        if sibling_sale_id:
-            display_name_candidates_by_sale_id.setdefault(int(sibling_sale_id), []).append(sibling_name)
-
-    for receipt in receipts:
-        current_name = (receipt.display_name or "").strip()
-        if not current_name:
-            continue
-        current_receipt_number = (receipt.receipt_number or "").strip()
-        if current_receipt_number:
-            display_name_candidates_by_receipt_number.setdefault(current_receipt_number, []).append(current_name)
-        current_sale_id = getattr(receipt, "sale_id", None)
-        if current_sale_id:
-            display_name_candidates_by_sale_id.setdefault(int(current_sale_id), []).append(current_name)
-
-    display_name_by_receipt_number = {
-        receipt_number: _pick_best_receipt_display_name(candidate_names)
-        for receipt_number, candidate_names in display_name_candidates_by_receipt_number.items()
-    }
-    display_name_by_sale_id = {
-        sale_id: _pick_best_receipt_display_name(candidate_names)
-        for sale_id, candidate_names in display_name_candidates_by_sale_id.items()
-    }
-
-    for receipt in receipts:
-        receipt_number = (receipt.receipt_number or "").strip()
-        sale_id = int(receipt.sale_id) if getattr(receipt, "sale_id", None) else None
-        fallback_name = (
-            display_name_by_receipt_number.get(receipt_number)
-            or (display_name_by_sale_id.get(sale_id) if sale_id else None)
-        )
-        if fallback_name:
-            receipt.display_name = fallback_name
-
-    return receipts
-
-
 def apply_receipt_group_search_filter(
     query,
     db: Session,
@@ -9191,84 +9490,16 @@ def apply_receipt_group_search_filter(
     if not normalized_search:
         return query
 
-    search = f"%{normalized_search}%"
-    matched_rows_query = query.join(
-        models.Sale, models.PaymentReceipt.sale_id == models.Sale.id, isouter=True
-    ).join(
-        models.Vehicle, models.Sale.vehicle_id == models.Vehicle.id, isouter=True
-    ).join(
-        models.Lead, models.Sale.lead_id == models.Lead.id, isouter=True
-    ).join(
-        models.CreditApplication, models.CreditApplication.lead_id == models.Lead.id, isouter=True
-    ).join(
-        models.PublicCreditSubmission, models.PublicCreditSubmission.lead_id == models.Lead.id, isouter=True
-    ).filter(
-        or_(
-            models.PaymentReceipt.display_name.ilike(search),
-            models.PaymentReceipt.customer_name.ilike(search),
-            models.PaymentReceipt.customer_document.ilike(search),
-            models.PaymentReceipt.concept.ilike(search),
-            models.PaymentReceipt.receipt_number.ilike(search),
-            models.PaymentReceipt.notes.ilike(search),
-            models.PaymentReceipt.payment_method.ilike(search),
-            models.PaymentReceipt.bank.ilike(search),
-            models.Vehicle.make.ilike(search),
-            models.Vehicle.model.ilike(search),
-            models.Vehicle.plate.ilike(search),
-            models.Sale.external_seller_name.ilike(search),
-            models.Sale.tax_seller_name.ilike(search),
-            models.Sale.tax_seller_document.ilike(search),
-            models.Sale.tax_buyer_name.ilike(search),
-            models.Sale.tax_buyer_document.ilike(search),
-            models.Lead.name.ilike(search),
-            models.Lead.email.ilike(search),
-            models.Lead.phone.ilike(search),
-            models.CreditApplication.client_name.ilike(search),
-            models.CreditApplication.email.ilike(search),
-            models.CreditApplication.phone.ilike(search),
-            models.PublicCreditSubmission.applicant_name.ilike(search),
-            models.PublicCreditSubmission.document_number.ilike(search),
-            models.PublicCreditSubmission.email.ilike(search),
-            models.PublicCreditSubmission.phone.ilike(search)
-        )
-    )
-
-    matched_rows = matched_rows_query.with_entities(
-        models.PaymentReceipt.id,
-        models.PaymentReceipt.sale_id,
-        models.PaymentReceipt.receipt_number
-    ).all()
-
-    matched_receipt_ids = {int(row.id) for row in matched_rows if getattr(row, "id", None)}
-    matched_sale_ids = {int(row.sale_id) for row in matched_rows if getattr(row, "sale_id", None)}
-    matched_receipt_numbers = {
-        (row.receipt_number or "").strip()
-        for row in matched_rows
-        if (row.receipt_number or "").strip()
-    }
-
-    if not matched_receipt_ids and not matched_sale_ids and not matched_receipt_numbers:
-        return query.filter(false())
-
-    group_filters = []
-    if matched_receipt_ids:
-        group_filters.append(models.PaymentReceipt.id.in_(matched_receipt_ids))
-    if matched_sale_ids:
-        group_filters.append(models.PaymentReceipt.sale_id.in_(matched_sale_ids))
-    if matched_receipt_numbers:
-        group_filters.append(models.PaymentReceipt.receipt_number.in_(matched_receipt_numbers))
-
-    group_scope_query = db.query(models.PaymentReceipt.id)
+    # A match pulls in the whole group: receipts of the same sale or with the same receipt number.
+    matched = receipt_search.matching_documents(db, normalized_search, company_id).subquery()
+    query = query.filter(or_(
+        models.PaymentReceipt.id.in_(select(matched.c.receipt_id)),
+        models.PaymentReceipt.sale_id.in_(select(matched.c.sale_id).where(matched.c.sale_id.isnot(None))),
+        models.PaymentReceipt.receipt_number.in_(select(matched.c.receipt_number).where(matched.c.receipt_number.isnot(None))),
+    ))
     if company_id:
-        group_scope_query = group_scope_query.filter(models.PaymentReceipt.company_id == company_id)
-    group_scope_query = group_scope_query.filter(or_(*group_filters))
-
-    grouped_receipt_ids = [row.id for row in group_scope_query.all()]
-    if not grouped_receipt_ids:
-        return query.filter(false())
-
-    return query.filter(models.PaymentReceipt.id.in_(grouped_receipt_ids))
-
+        query = query.filter(models.PaymentReceipt.company_id == company_id)
+    return query
 
 def attach_sale_metadata_to_vehicle(vehicle: models.Vehicle, sale: Optional[models.Sale]) -> models.Vehicle:
     setattr(vehicle, "sold_price", getattr(sale, "sale_price", None))
@@ -9536,7 +9767,7 @@ def sync_public_chat_to_lead_conversation(db: Session, session: models.PublicCha
             message_type="text",
             status="delivered",
             whatsapp_message_id=marker,
-            created_at=pm.created_at
+            created_at=pm.created_at or datetime.datetime.utcnow()
         ))
         conversation.last_message_at = pm.created_at or datetime.datetime.utcnow()
 
@@ -10345,16 +10576,12 @@ def get_lead_notes(
     ).order_by(models.LeadNote.created_at.desc()).all()
 
 @app.post("/leads/{lead_id}/files", response_model=schemas.LeadFile)
-async def upload_lead_file(
+def upload_lead_file(
     lead_id: int, 
     file: UploadFile = File(...), 
     db: Session = Depends(get_db), 
     current_user: models.User = Depends(get_current_user)
 ):
-    import os
-    import uuid
-    import shutil
-    
     lead = db.query(models.Lead).filter(models.Lead.id == lead_id).first()
     if not lead:
         raise HTTPException(status_code=404, detail="Lead not found")
@@ -10363,19 +10590,13 @@ async def upload_lead_file(
         raise HTTPException(status_code=403, detail="Not authorized")
     ensure_can_modify_lead(current_user, lead)
         
-    os.makedirs("static/leads", exist_ok=True)
-    file_extension = file.filename.split(".")[-1]
-    unique_filename = f"{uuid.uuid4()}.{file_extension}"
-    file_path = f"static/leads/{unique_filename}"
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    stored = upload_store.store_upload(db, file)
         
     db_file = models.LeadFile(
         lead_id=lead_id,
         user_id=current_user.id,
         file_name=file.filename,
-        file_path=f"/{file_path}",
+        file_path=f"/{stored.path}",
         file_type=file.content_type
     )
     db.add(db_file)
@@ -10432,12 +10653,7 @@ def delete_lead_file(
     if not lead_file:
         raise HTTPException(status_code=404, detail="Lead file not found")
 
-    stored_path = (lead_file.file_path or "").lstrip("/")
-    if stored_path and os.path.exists(stored_path):
-        try:
-            os.remove(stored_path)
-        except OSError:
-            pass
+    upload_store.discard(db, lead_file.file_path)
 
     history_entry = models.LeadHistory(
         lead_id=lead.id,
@@ -10470,12 +10686,57 @@ def delete_lead_file(
 
     return {"message": "Lead file deleted successfully"}
 
+LEAD_MESSAGES_PAGE_SIZE = int(os.getenv("LEAD_MESSAGES_PAGE_SIZE", "100") or "100")
+LEAD_MESSAGES_MAX_PAGE_SIZE = 500
+
+
+def _lead_conversation_ids(db: Session, lead: models.Lead) -> List[int]:
+    # Channel sessions are linked to their lead when messages arrive
+    # (find_or_create_channel_session); the phone match only covers sessions
+    # of leads whose phone was entered or changed later.
+    conversation_ids = select(models.Conversation.id).where(models.Conversation.lead_id == lead.id)
+    session_filters = [models.ChannelChatSession.lead_id == lead.id]
+    if lead.phone:
+        lookup_phones = set(phone_variants_for_lookup(lead.phone)) | {lead.phone}
+        session_filters.append(models.ChannelChatSession.external_user_id.in_(lookup_phones))
+    session_conversation_ids = select(models.ChannelChatSession.conversation_id).where(
+        models.ChannelChatSession.company_id == lead.company_id,
+        models.ChannelChatSession.conversation_id.isnot(None),
+        or_(*session_filters),
+    )
+    return list(db.execute(union(conversation_ids, session_conversation_ids)).scalars())
+
+
+def _encode_message_cursor(message: models.Message) -> str:
+    return f"{message.created_at.isoformat()}_{message.id}"
+
+
+def _message_cursor_filter(cursor: str):
+    try:
+        created_at_value, message_id_value = cursor.rsplit("_", 1)
+        message_id = int(message_id_value)
+        created_at = datetime.datetime.fromisoformat(created_at_value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor de mensajes inválido")
+    # Newest first. created_at is never NULL (ensure_message_created_at_not_null),
+    # so the range stays on ix_messages_conversation_created.
+    return or_(
+        models.Message.created_at < created_at,
+        and_(models.Message.created_at == created_at, models.Message.id < message_id),
+    )
+
+
 @app.get("/leads/{lead_id}/messages")
 def get_lead_messages(
     lead_id: int, 
+    response: Response,
+    before: Optional[str] = None,
+    limit: int = Query(LEAD_MESSAGES_PAGE_SIZE, ge=1, le=LEAD_MESSAGES_MAX_PAGE_SIZE),
     db: Session = Depends(get_db), 
     current_user: models.User = Depends(get_current_user)
 ):
+    """Newest messages first. When older ones remain, X-Next-Cursor holds the
+    value to pass as `before` to load them."""
     # Retrieve the lead first to check company scope
     lead = db.query(models.Lead).filter(models.Lead.id == lead_id).first()
     if not lead:
@@ -10484,59 +10745,26 @@ def get_lead_messages(
     if current_user.company_id and lead.company_id != current_user.company_id:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    if lead.has_unread_reply:
+    # Opening the conversation acknowledges the reply; older pages do not.
+    if lead.has_unread_reply and not before:
         lead.has_unread_reply = 0
         db.commit()
-        
-    conversation_ids = {
-        row.id
-        for row in db.query(models.Conversation.id).filter(models.Conversation.lead_id == lead_id).all()
-    }
 
-    if lead.phone:
-        lookup_phones = phone_variants_for_lookup(lead.phone)
-        channel_query = db.query(models.ChannelChatSession).filter(
-            models.ChannelChatSession.company_id == lead.company_id,
-            models.ChannelChatSession.conversation_id.isnot(None),
-        )
-        channel_query = channel_query.filter(
-            or_(
-                models.ChannelChatSession.lead_id == lead.id,
-                models.ChannelChatSession.external_user_id.in_(lookup_phones or [lead.phone]),
-            )
-        )
-        for channel_session in channel_query.all():
-            if channel_session.conversation_id:
-                conversation_ids.add(channel_session.conversation_id)
-                if channel_session.lead_id != lead.id:
-                    channel_session.lead_id = lead.id
-                    db.commit()
-
-    # Backward-compatible linking for older channel conversations.
-    if not conversation_ids and lead.source in {"facebook", "instagram", "whatsapp"} and lead.phone:
-        channel_session = db.query(models.ChannelChatSession).filter(
-            models.ChannelChatSession.company_id == lead.company_id,
-            models.ChannelChatSession.source == lead.source,
-            models.ChannelChatSession.external_user_id == lead.phone,
-            models.ChannelChatSession.conversation_id.isnot(None),
-        ).first()
-        if channel_session and channel_session.conversation_id:
-            conversation = db.query(models.Conversation).filter(
-                models.Conversation.id == channel_session.conversation_id
-            ).first()
-            if conversation and conversation.lead_id != lead.id:
-                conversation.lead_id = lead.id
-                if channel_session.lead_id != lead.id:
-                    channel_session.lead_id = lead.id
-                db.commit()
-                conversation_ids.add(conversation.id)
+    conversation_ids = _lead_conversation_ids(db, lead)
     if not conversation_ids:
         return [] # No messages yet
-        
-    messages = db.query(models.Message).filter(
-        models.Message.conversation_id.in_(conversation_ids)
-    ).order_by(models.Message.created_at.desc()).all()
-    
+
+    query = db.query(models.Message).filter(models.Message.conversation_id.in_(conversation_ids))
+    if before:
+        query = query.filter(_message_cursor_filter(before))
+    messages = query.order_by(
+        models.Message.created_at.desc(),
+        models.Message.id.desc(),
+    ).limit(limit + 1).all()
+
+    if len(messages) > limit:
+        messages = messages[:limit]
+        response.headers["X-Next-Cursor"] = _encode_message_cursor(messages[-1])
     return messages
 
 @app.post("/webhooks/leads/{source}")
@@ -10581,11 +10809,10 @@ def receive_webhook_lead(
 def get_public_makes(request: Request, db: Session = Depends(get_db)):
     # Returns distinct makes from available vehicles
     company = resolve_public_company(db, request)
-    query = db.query(models.Vehicle.make).filter(models.Vehicle.status == 'available')
-    if company:
-        query = query.filter(models.Vehicle.company_id == company.id)
-    makes = query.distinct().all()
-    return [m[0] for m in makes if m[0]]
+    snapshot = vehicle_catalogue.get_snapshot(db, company.id if company else None)
+    return vehicle_catalogue.cached_response(
+        request, snapshot, "makes", lambda: [facet["value"] for facet in snapshot.facets["makes"]]
+    )
 
 @app.get("/vehicles/public")
 def get_public_vehicles(
@@ -10603,40 +10830,21 @@ def get_public_vehicles(
     limit: int = 50,
     db: Session = Depends(get_db)
 ):
-    query = db.query(models.Vehicle).filter(models.Vehicle.status == 'available')
     company = resolve_public_company(db, request)
-    if company:
-        query = query.filter(models.Vehicle.company_id == company.id)
-    
-    if q:
-        search = f"%{q}%"
-        query = query.filter(
-            (models.Vehicle.make.ilike(search)) |
-            (models.Vehicle.model.ilike(search)) |
-            (models.Vehicle.plate.ilike(search))
-        )
-    if make:
-        query = query.filter(models.Vehicle.make.ilike(f"%{make}%"))
-    if model:
-        query = query.filter(models.Vehicle.model.ilike(f"%{model}%"))
-    if color:
-        query = query.filter(models.Vehicle.color.ilike(f"%{color}%"))
-    if year_from is not None:
-        query = query.filter(models.Vehicle.year >= year_from)
-    if year_to is not None:
-        query = query.filter(models.Vehicle.year <= year_to)
-    if price_min is not None:
-        query = query.filter(models.Vehicle.price >= price_min)
-    if price_max is not None:
-        query = query.filter(models.Vehicle.price <= price_max)
-    if mileage_min is not None:
-        query = query.filter(models.Vehicle.mileage >= mileage_min)
-    if mileage_max is not None:
-        query = query.filter(models.Vehicle.mileage <= mileage_max)
-        
-    vehicles = query.order_by(models.Vehicle.id.desc()).limit(limit).all()
-    # Serialize to dict to match expected frontend structure if needed, or rely on FastAPI's response_model
-    return vehicles
+    snapshot = vehicle_catalogue.get_snapshot(db, company.id if company else None)
+    return vehicle_catalogue.cached_response(request, snapshot, "list", lambda: snapshot.search(
+        q=q,
+        make=make,
+        model=model,
+        color=color,
+        year_from=year_from,
+        year_to=year_to,
+        price_min=price_min,
+        price_max=price_max,
+        mileage_min=mileage_min,
+        mileage_max=mileage_max,
+        limit=min(max(limit, 1), vehicle_catalogue.MAX_PAGE_SIZE),
+    ))
 
 @app.get("/vehicles/", response_model=schemas.VehicleList)
 def read_vehicles(
@@ -11112,18 +11320,127 @@ def _manual_tax_query(db: Session, current_user: models.User):
     return query
 
 
-def _tax_row_matches(row: dict, q: Optional[str]) -> bool:
-    if not q:
-        return True
-    needle = q.strip().lower()
-    return any(needle in str(row.get(field) or "").lower() for field in [
-        "make", "reference", "plate", "seller_name", "buyer_name", "seller_document", "buyer_document"
-    ])
+TAX_TEXT_FIELDS = [
+    "transfer_to_cars", "seller_document", "seller_email", "seller_address", "seller_phone",
+    "seller_payment_method", "buyer_document", "buyer_address", "buyer_payment_method",
+    "buyer_financing_entity",
+]
+TAX_SEARCH_FIELDS = ["make", "reference", "plate", "seller_name", "buyer_name", "seller_document", "buyer_document"]
+
+
+def _tax_sql_clean(column):
+    return func.nullif(func.trim(column), "")
+
 
+def _tax_report_rows_query(db: Session, current_user: models.User, year: Optional[int] = None, q: Optional[str] = None):
+    """Approved sales and manual entries as one UNION ALL query, in report order.
+
+    Both branches project the same normalized columns as _sale_tax_row and
+    _manual_tax_row, so filtering, sorting and paging all run in the database.
+    """
+    sale_date = func.coalesce(models.Sale.sale_date, func.current_timestamp())
+    sale_rows = select(
+        literal("sale").label("source"),
+        models.Sale.id.label("row_id"),
+        cast(extract("month", sale_date), Integer).label("month_number"),
+        cast(null(), String).label("month_label"),
+        cast(extract("year", sale_date), Integer).label("year"),
+        models.Vehicle.make.label("make"),
+        models.Vehicle.model.label("reference"),
+        models.Vehicle.plate.label("plate"),
+        models.Vehicle.year.label("model_year"),
+        func.coalesce(models.Vehicle.purchase_price, 0).label("purchase_price"),
+        func.coalesce(models.Sale.sale_price, 0).label("sale_price"),
+        func.coalesce(_tax_sql_clean(models.Sale.tax_transaction_type), "INTERMEDIACION").label("transaction_type"),
+        func.coalesce(_tax_sql_clean(models.Sale.tax_seller_name), _tax_sql_clean(models.Sale.external_seller_name)).label("seller_name"),
+        func.coalesce(_tax_sql_clean(models.Sale.tax_buyer_name), _tax_sql_clean(models.Lead.name)).label("buyer_name"),
+        func.coalesce(_tax_sql_clean(models.Sale.tax_buyer_email), _tax_sql_clean(models.Lead.email)).label("buyer_email"),
+        func.coalesce(_tax_sql_clean(models.Sale.tax_buyer_phone), _tax_sql_clean(models.Lead.phone)).label("buyer_phone"),
+        *[_tax_sql_clean(getattr(models.Sale, f"tax_{field}")).label(field) for field in TAX_TEXT_FIELDS],
+    ).select_from(models.Sale).outerjoin(
+        models.Vehicle, models.Vehicle.id == models.Sale.vehicle_id
+    ).outerjoin(
+        models.Lead, models.Lead.id == models.Sale.lead_id
+    ).where(models.Sale.status == models.SaleStatus.APPROVED.value)
+    if current_user.company_id:
+        sale_rows = sale_rows.where(models.Sale.company_id == current_user.company_id)
+    if year:
+        sale_rows = sale_rows.where(
+            models.Sale.sale_date >= datetime.datetime(year, 1, 1),
+            models.Sale.sale_date < datetime.datetime(year + 1, 1, 1),
+        )
 
-def _tax_row_sort_key(row: dict):
-    month_index = {label: number for number, label in TAX_MONTH_LABELS.items()}.get((row.get("month") or "").upper(), 13)
-    return (row.get("year") or 9999, month_index, row.get("sale_id") or row.get("manual_entry_id") or 0)
+    month_numbers = {label: number for number, label in TAX_MONTH_LABELS.items()}
+    entry = models.TaxReportEntry
+    manual_rows = select(
+        literal("manual").label("source"),
+        entry.id.label("row_id"),
+        case(month_numbers, value=func.upper(func.trim(entry.month)), else_=13).label("month_number"),
+        _tax_sql_clean(entry.month).label("month_label"),
+        entry.year.label("year"),
+        _tax_sql_clean(entry.make).label("make"),
+        _tax_sql_clean(entry.reference).label("reference"),
+        _tax_sql_clean(entry.plate).label("plate"),
+        entry.model_year.label("model_year"),
+        func.coalesce(entry.purchase_price, 0).label("purchase_price"),
+        func.coalesce(entry.sale_price, 0).label("sale_price"),
+        func.coalesce(_tax_sql_clean(entry.transaction_type), "INTERMEDIACION").label("transaction_type"),
+        _tax_sql_clean(entry.seller_name).label("seller_name"),
+        _tax_sql_clean(entry.buyer_name).label("buyer_name"),
+        _tax_sql_clean(entry.buyer_email).label("buyer_email"),
+        _tax_sql_clean(entry.buyer_phone).label("buyer_phone"),
+        *[_tax_sql_clean(getattr(entry, field)).label(field) for field in TAX_TEXT_FIELDS],
+    )
+    if current_user.company_id:
+        manual_rows = manual_rows.where(entry.company_id == current_user.company_id)
+    if year:
+        manual_rows = manual_rows.where(entry.year == year)
+
+    rows = union_all(sale_rows, manual_rows).subquery("tax_rows")
+    query = db.query(rows)
+    needle = (q or "").strip().lower()
+    if needle:
+        query = query.filter(or_(*[
+            func.lower(rows.c[field]).contains(needle, autoescape=True)
+            for field in TAX_SEARCH_FIELDS
+        ]))
+    return query.order_by(
+        func.coalesce(rows.c.year, 9999),
+        rows.c.month_number,
+        rows.c.row_id,
+        rows.c.source.desc(),
+    )
+
+
+def _tax_union_row(row) -> dict:
+    purchase_price = int(row.purchase_price or 0)
+    commission_base = int(round(purchase_price * 0.03))
+    tax_iva = int(round(commission_base * 0.19))
+    is_sale = row.source == "sale"
+    item = {
+        "source": row.source,
+        "sale_id": row.row_id if is_sale else None,
+        "manual_entry_id": None if is_sale else row.row_id,
+        "month": TAX_MONTH_LABELS.get(row.month_number) if is_sale else row.month_label,
+        "year": row.year,
+        "make": row.make,
+        "reference": row.reference,
+        "plate": row.plate,
+        "model_year": row.model_year,
+        "purchase_price": purchase_price,
+        "commission_base": commission_base,
+        "tax_iva": tax_iva,
+        "sale_price": int(row.sale_price or 0),
+        "iva_base": commission_base,
+        "transaction_type": row.transaction_type,
+        "seller_name": row.seller_name,
+        "buyer_name": row.buyer_name,
+        "buyer_email": row.buyer_email,
+        "buyer_phone": row.buyer_phone,
+    }
+    for field in TAX_TEXT_FIELDS:
+        item[field] = getattr(row, field)
+    return item
 
 
 @app.get("/finance/tax-report", response_model=schemas.TaxReportList)
@@ -11138,20 +11455,10 @@ def read_tax_report(
     if get_user_role_name(current_user) not in ["admin", "super_admin"]:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    query = _get_sale_tax_query(db, current_user).filter(models.Sale.status == models.SaleStatus.APPROVED.value)
-    if year:
-        start = datetime.datetime(year, 1, 1)
-        end = datetime.datetime(year + 1, 1, 1)
-        query = query.filter(models.Sale.sale_date >= start, models.Sale.sale_date < end)
-    rows = [_sale_tax_row(sale) for sale in query.all()]
-
-    manual_query = _manual_tax_query(db, current_user)
-    if year:
-        manual_query = manual_query.filter(models.TaxReportEntry.year == year)
-    rows.extend(_manual_tax_row(entry) for entry in manual_query.all())
-    rows = [row for row in rows if _tax_row_matches(row, q)]
-    rows.sort(key=_tax_row_sort_key)
-    return {"items": rows[skip:skip + limit], "total": len(rows)}
+    query = _tax_report_rows_query(db, current_user, year=year, q=q)
+    total = query.order_by(None).count()
+    rows = query.offset(max(skip, 0)).limit(max(limit, 0)).all()
+    return {"items": [_tax_union_row(row) for row in rows], "total": total}
 
 
 @app.put("/sales/{sale_id}/tax-info", response_model=schemas.TaxReportRow)
@@ -11247,57 +11554,41 @@ def download_tax_report_xlsx(
     if get_user_role_name(current_user) not in ["admin", "super_admin"]:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    query = _get_sale_tax_query(db, current_user).filter(models.Sale.status == models.SaleStatus.APPROVED.value)
-    if year:
-        start = datetime.datetime(year, 1, 1)
-        end = datetime.datetime(year + 1, 1, 1)
-        query = query.filter(models.Sale.sale_date >= start, models.Sale.sale_date < end)
-    rows = [_sale_tax_row(sale) for sale in query.all()]
-    manual_query = _manual_tax_query(db, current_user)
-    if year:
-        manual_query = manual_query.filter(models.TaxReportEntry.year == year)
-    rows.extend(_manual_tax_row(entry) for entry in manual_query.all())
-    rows.sort(key=_tax_row_sort_key)
-
     try:
-        from openpyxl import Workbook
-        from openpyxl.styles import Alignment, Font, PatternFill
+        workbook = xlsx_export.StreamingWorkbook()
     except ImportError:
         raise HTTPException(status_code=500, detail="La libreria openpyxl no esta instalada en el servidor")
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"ANUAL {year or datetime.datetime.utcnow().year}"
-    ws.merge_cells("A1:N2")
-    ws.merge_cells("O1:T1")
-    ws.merge_cells("O2:T2")
-    ws.merge_cells("U1:AA1")
-    ws.merge_cells("U2:AA2")
-    ws["A1"] = "QUIEN ME VENDIO EL CARRO"
-    ws["O1"] = "A QUIEN LE COMPRE EL CARRO"
-    ws["O2"] = "DATOS CLIENTE"
-    ws["U1"] = "A QUIEN LE VENDI EL CARRO"
-    ws["U2"] = "DATOS CLIENTE"
-    headers = [
+    rows = _tax_report_rows_query(db, current_user, year=year).yield_per(xlsx_export.DB_CHUNK_ROWS)
+
+    filename_year = year or datetime.datetime.utcnow().year
+    ws = workbook.add_sheet(
+        f"ANUAL {filename_year}",
+        [10, 8, 16, 22, 12, 10, 18, 14, 14, 16, 14, 12, 24, 18, 26, 18, 28, 34, 16, 24, 26, 18, 28, 34, 16, 28, 28],
+    )
+    for merged_range in ("A1:N2", "O1:T1", "O2:T2", "U1:AA1", "U2:AA2"):
+        ws.merged_cells.add(merged_range)
+    group_row = [None] * 27
+    group_row[0] = "QUIEN ME VENDIO EL CARRO"
+    group_row[14] = "A QUIEN LE COMPRE EL CARRO"
+    group_row[20] = "A QUIEN LE VENDI EL CARRO"
+    client_row = [None] * 27
+    client_row[14] = "DATOS CLIENTE"
+    client_row[20] = "DATOS CLIENTE"
+    workbook.header(ws, group_row)
+    workbook.header(ws, client_row)
+    workbook.header(ws, [
         "MES", "AÑO", "MARCA", "REFERENCIA", "PLACA", "MODELO",
         "PRECIO COMPRA / CONSIGNACIÓN", "COMISION", "IVA", "PRECIO VENTA",
         "BASE DEL IVA", "IVA", "INTERMEDIACION O VENTA COMPLETA", "TRASPASO A CARS SI /NO",
         "NOMBRES O RAZON SOCIAL", "DOCUMENTO / NIT", "EMAIL", "DIRECCIÓN", "TELÉFONO",
         "FORMA DE PAGO A VENDEDOR", "NOMBRES", "DOCUMENTO", "EMAIL", "DIRECCIÓN",
         "TELÉFONO", "FORMA DE PAGO DEL COMPRADOR", "ENTIDAD / OBSERVACION",
-    ]
-    ws.append([])
-    ws.append(headers)
-
-    header_fill = PatternFill("solid", fgColor="1E293B")
-    for row in ws.iter_rows(min_row=1, max_row=3):
-        for cell in row:
-            cell.font = Font(bold=True, color="FFFFFF")
-            cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-            cell.fill = header_fill
-
-    for index, row in enumerate(rows, start=4):
-        ws.append([
+    ])
+
+    for index, union_row in enumerate(rows, start=4):
+        row = _tax_union_row(union_row)
+        workbook.row(ws, [
             row["month"], row["year"], row["make"], row["reference"], row["plate"], row["model_year"],
             row["purchase_price"], f"=G{index}*3%", f"=H{index}*0.19", row["sale_price"],
             f"=H{index}", None, row["transaction_type"], row["transfer_to_cars"],
@@ -11305,26 +11596,10 @@ def download_tax_report_xlsx(
             row["seller_phone"], row["seller_payment_method"], row["buyer_name"], row["buyer_document"],
             row["buyer_email"], row["buyer_address"], row["buyer_phone"], row["buyer_payment_method"],
             row["buyer_financing_entity"],
-        ])
+        ], currency_columns=(7, 8, 9, 10, 11, 12))
 
-    widths = [10, 8, 16, 22, 12, 10, 18, 14, 14, 16, 14, 12, 24, 18, 26, 18, 28, 34, 16, 24, 26, 18, 28, 34, 16, 28, 28]
-    for idx, width_value in enumerate(widths, start=1):
-        ws.column_dimensions[ws.cell(3, idx).column_letter].width = width_value
-    for row in ws.iter_rows(min_row=4):
-        for cell in row:
-            cell.alignment = Alignment(vertical="top", wrap_text=True)
-            if cell.column in {7, 8, 9, 10, 11, 12}:
-                cell.number_format = '"$"#,##0'
+    return workbook.response(f"cuadro_tributacion_{filename_year}.xlsx")
 
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    filename_year = year or datetime.datetime.utcnow().year
-    return StreamingResponse(
-        buffer,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f'attachment; filename="cuadro_tributacion_{filename_year}.xlsx"'}
-    )
 
 @app.put("/sales/{sale_id}/approve", response_model=schemas.Sale)
 def approve_sale(
@@ -11407,6 +11682,7 @@ def reject_sale(
     db.refresh(sale)
     return sale
 
+
 @app.get("/finance/stats")
 def get_finance_stats(
     start_date: Optional[str] = None,
@@ -11429,75 +11705,39 @@ def get_finance_stats(
         if range_end <= range_start:
             raise HTTPException(status_code=400, detail="La fecha final debe ser mayor o igual a la inicial")
          
-    # 1. Total Stats (All time)
-    query = db.query(models.Sale).filter(models.Sale.status == "approved")
-    if current_user.company_id:
-        query = query.filter(models.Sale.company_id == current_user.company_id)
-    if range_start and range_end:
-        query = query.filter(models.Sale.sale_date >= range_start, models.Sale.sale_date < range_end)
-    sales = query.all()
-    
-    total_revenue = sum(s.net_revenue for s in sales)
-    total_commissions = sum(s.commission_amount for s in sales)
-    total_sales_count = len(sales)
-    
-    # 2. Pending Count
-    pending_query = db.query(models.Sale).filter(models.Sale.status == "pending")
-    if current_user.company_id:
-        pending_query = pending_query.filter(models.Sale.company_id == current_user.company_id)
+    # Sale and receipt figures come from finance_monthly_rollups (see finance_rollups).
+    company_id = current_user.company_id
     if range_start and range_end:
-        pending_query = pending_query.filter(models.Sale.sale_date >= range_start, models.Sale.sale_date < range_end)
-    pending_count = pending_query.count()
-
-    # 3. Monthly Stats (Current Month)
-    now = datetime.datetime.utcnow()
-    current_month_sales = sales if (range_start and range_end) else [s for s in sales if s.sale_date and s.sale_date.month == now.month and s.sale_date.year == now.year]
-    
-    monthly_revenue = sum(s.net_revenue for s in current_month_sales)
-    monthly_commissions = sum(s.commission_amount for s in current_month_sales)
+        totals = finance_rollups.period_totals(db, company_id, range_start, range_end)
+        monthly = totals
+    else:
+        totals = finance_rollups.rollup_totals(db, company_id)
+        current_month = finance_rollups.month_start(datetime.datetime.utcnow())
+        monthly = finance_rollups.rollup_totals(db, company_id, current_month, finance_rollups.next_month(current_month))
 
-    # 4. Payroll Expenses (Sum of base_salary of all users)
-    # Filter by company if needed
-    user_query = db.query(models.User)
-    if current_user.company_id:
-        user_query = user_query.filter(models.User.company_id == current_user.company_id)
-    
-    users = user_query.all()
-    payroll_expenses = sum(u.base_salary or 0 for u in users)
+    # Payroll Expenses (Sum of base_salary of all users)
+    payroll_query = db.query(func.coalesce(func.sum(models.User.base_salary), 0))
+    if company_id:
+        payroll_query = payroll_query.filter(models.User.company_id == company_id)
+    payroll_expenses = int(payroll_query.scalar() or 0)
 
-    receipts_query = db.query(models.PaymentReceipt)
-    if current_user.company_id:
-        receipts_query = receipts_query.filter(models.PaymentReceipt.company_id == current_user.company_id)
-    if range_start and range_end:
-        receipt_date_field = func.coalesce(models.PaymentReceipt.payment_date, models.PaymentReceipt.created_at)
-        receipts_query = receipts_query.filter(receipt_date_field >= range_start, receipt_date_field < range_end)
-    receipts = receipts_query.all()
-    current_month_receipts = receipts if (range_start and range_end) else [
-        receipt for receipt in receipts
-        if receipt.payment_date and receipt.payment_date.month == now.month and receipt.payment_date.year == now.year
-    ]
-    total_income = sum((receipt.amount or 0) for receipt in receipts if (receipt.movement_type or "income") == "income")
-    total_expense = sum((receipt.amount or 0) for receipt in receipts if (receipt.movement_type or "income") == "expense")
-    monthly_income = sum((receipt.amount or 0) for receipt in current_month_receipts if (receipt.movement_type or "income") == "income")
-    monthly_expense = sum((receipt.amount or 0) for receipt in current_month_receipts if (receipt.movement_type or "income") == "expense")
-    
     return {
-        "total_revenue": total_revenue,
-        "total_commissions": total_commissions,
-        "total_sales_count": total_sales_count,
-        "pending_sales_count": pending_count,
-        "monthly_revenue": monthly_revenue, 
-        "monthly_commissions": monthly_commissions,
+        "total_revenue": totals["approved_net_revenue"],
+        "total_commissions": totals["approved_commissions"],
+        "total_sales_count": totals["approved_sales_count"],
+        "pending_sales_count": totals["pending_sales_count"],
+        "monthly_revenue": monthly["approved_net_revenue"],
+        "monthly_commissions": monthly["approved_commissions"],
         "payroll_expenses": payroll_expenses,
-        "receipts_total_count": len(receipts),
-        "receipts_total_amount": sum(receipt.amount or 0 for receipt in receipts),
-        "receipts_monthly_amount": sum(receipt.amount or 0 for receipt in current_month_receipts),
-        "accounting_income_total": total_income,
-        "accounting_expense_total": total_expense,
-        "accounting_balance_total": total_income - total_expense,
-        "accounting_income_monthly": monthly_income,
-        "accounting_expense_monthly": monthly_expense,
-        "accounting_balance_monthly": monthly_income - monthly_expense
+        "receipts_total_count": totals["receipts_count"],
+        "receipts_total_amount": totals["receipts_amount"],
+        "receipts_monthly_amount": monthly["receipts_amount"],
+        "accounting_income_total": totals["income_amount"],
+        "accounting_expense_total": totals["expense_amount"],
+        "accounting_balance_total": totals["income_amount"] - totals["expense_amount"],
+        "accounting_income_monthly": monthly["income_amount"],
+        "accounting_expense_monthly": monthly["expense_amount"],
+        "accounting_balance_monthly": monthly["income_amount"] - monthly["expense_amount"]
     }
 
 
@@ -11571,11 +11811,13 @@ def _accounting_movement_label(movement_type: Optional[str]) -> str:
 
 
 def _projection_sales_query(db: Session, current_user: models.User):
+    # selectinload keeps the collections compatible with yield_per chunking.
     query = db.query(models.Sale).options(
         joinedload(models.Sale.vehicle),
-        joinedload(models.Sale.lead),
+        joinedload(models.Sale.lead).joinedload(models.Lead.process_detail),
         joinedload(models.Sale.seller),
-        joinedload(models.Sale.payment_receipts),
+        joinedload(models.Sale.company),
+        selectinload(models.Sale.payment_receipts),
     )
     if current_user.company_id:
         query = query.filter(models.Sale.company_id == current_user.company_id)
@@ -11591,75 +11833,62 @@ def download_finance_projection_xlsx(
     if get_user_role_name(current_user) not in ["admin", "super_admin"]:
         raise HTTPException(status_code=403, detail="Not authorized")
 
+    try:
+        workbook = xlsx_export.StreamingWorkbook()
+    except ImportError:
+        raise HTTPException(status_code=500, detail="La libreria openpyxl no esta instalada en el servidor")
+
     report_year = year or datetime.datetime.utcnow().year
     start = datetime.datetime(report_year, 1, 1)
     end = datetime.datetime(report_year + 1, 1, 1)
-    sales = _projection_sales_query(db, current_user).filter(
-        models.Sale.sale_date >= start,
-        models.Sale.sale_date < end
-    ).order_by(models.Sale.sale_date.asc(), models.Sale.id.asc()).all()
 
-    receipts_query = db.query(models.PaymentReceipt).options(
-        joinedload(models.PaymentReceipt.sale).joinedload(models.Sale.vehicle),
-        joinedload(models.PaymentReceipt.sale).joinedload(models.Sale.lead),
-        joinedload(models.PaymentReceipt.sale).joinedload(models.Sale.seller),
-    )
-    if current_user.company_id:
-        receipts_query = receipts_query.filter(models.PaymentReceipt.company_id == current_user.company_id)
-    receipt_date = func.coalesce(models.PaymentReceipt.payment_date, models.PaymentReceipt.created_at)
-    receipts = receipts_query.filter(receipt_date >= start, receipt_date < end).all()
-
-    credits_query = db.query(models.CreditApplication).options(joinedload(models.CreditApplication.lead))
-    if current_user.company_id:
-        credits_query = credits_query.filter(models.CreditApplication.company_id == current_user.company_id)
-    credits = credits_query.filter(models.CreditApplication.created_at >= start, models.CreditApplication.created_at < end).all()
+    def append(ws, values):
+        workbook.row(ws, values, min_currency_column=10)
 
-    try:
-        from openpyxl import Workbook
-        from openpyxl.styles import Alignment, Font, PatternFill
-    except ImportError:
-        raise HTTPException(status_code=500, detail="La libreria openpyxl no esta instalada en el servidor")
-
-    wb = Workbook()
-    header_fill = PatternFill("solid", fgColor="1E293B")
-
-    def style_header(ws, row=1):
-        for cell in ws[row]:
-            cell.font = Font(bold=True, color="FFFFFF")
-            cell.fill = header_fill
-            cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-
-    def autosize(ws, max_width=34):
-        for column_cells in ws.columns:
-            length = 10
-            for cell in column_cells:
-                length = max(length, min(len(str(cell.value or "")) + 2, max_width))
-                cell.alignment = Alignment(vertical="top", wrap_text=True)
-            ws.column_dimensions[column_cells[0].column_letter].width = length
-
-    costs = wb.active
-    costs.title = "COSTOS X VH"
-    costs.append([
+    # Sheets are written in their final order; the sale-based sheets are
+    # filled in a single pass over the sales.
+    costs = workbook.add_sheet("COSTOS X VH", [10, 8, 24, 20, 12, 14, 28, 24, 12, 16, 10, 16, 16, 16, 16, 18, 16, 16, 16, 16])
+    workbook.header(costs, [
         "MES", "ITEM", "ASESOR VENTA", "EQUIPO", "ESTADO", "CONTINUA CON EL NEGOCIO",
         "NOMBRE DEL CLIENTE", "REFERENCIA", "PLACA", "TIPO DE TRANSACCION", "MODELO",
         "COSTO VEHICULO", "GASTOS VEHICULO", "COSTOS TOTALES", "VALOR DE VENTA",
         "SEPARACION / CUOTA INICIAL", "SALDO", "DESEMBOLSO", "COMISION CREDITO",
         "UTILIDAD NETA"
     ])
-    style_header(costs)
+    expenses = workbook.add_sheet("GASTOS", [20, 34, 24, 10, 16, 8, 8, 20, 10, 12, 34])
+    workbook.header(expenses, ["FECHA", "CONCEPTO", "CUENTA", "TIPO", "VALOR", "EFEC", "TRANS", "BANCO", "VENTA", "PLACA", "NOTA"])
+    process = workbook.add_sheet("VENTAS EN PROCESO", [8, 20, 14, 24, 28, 16, 20, 20, 34, 26, 12, 14, 16, 16, 18, 34])
+    workbook.header(process, [
+        "ITEM", "FECHA INGRESO", "ESTADO", "NOMBRE DEL EJECUTIVO", "NOMBRE DEL CLIENTE",
+        "TELEFONO", "FECHA DE RADICACION", "BANCO", "RTA BANCO", "CARRO", "PLACA",
+        "% DE FINANCIACION", "VALOR DEL VH", "CUANTO LE PRESTAN", "VALOR CUOTA INICIAL", "OBSERVACION"
+    ])
+    payments = workbook.add_sheet("RELACION DE PAGOS X CARRO", [10, 24, 12, 10, 26, 16, 28, 30, 16, 20, 16, 20, 16, 20, 34, 16, 16, 28, 16, 16, 16, 16, 16, 14])
+    workbook.header(payments, [
+        "FECHA", "VEHICULO", "PLACA", "MODELO", "VENDEDOR", "CEDULA", "CORREO", "DIRECCION",
+        "CELULAR", "OBSERVACIONES", "VALOR COMPRA", "SEPARACION", "VALOR", "BANCO",
+        "ABONOS / PAGOS", "GASTOS", "PRECIO FINAL", "CLIENTE", "VALOR VENTA", "TOTAL INGRESOS",
+        "TOTAL GASTOS", "DIFERENCIA", "BASE IMPUESTO", "IVA"
+    ])
+    status_ws = workbook.add_sheet("ESTADO VENTAS", [20, 24, 28, 34, 24, 20, 14])
+    workbook.header(status_ws, ["FECHA", "ASESOR", "CLIENTE", "ACTIVIDAD PENDIENTE", "RESPONSABLE", "FECHA DE COMPROMISO", "ESTADO"])
+
+    sales = _projection_sales_query(db, current_user).filter(
+        models.Sale.sale_date >= start,
+        models.Sale.sale_date < end
+    ).order_by(models.Sale.sale_date.asc(), models.Sale.id.asc()).yield_per(xlsx_export.DB_CHUNK_ROWS)
     for index, sale in enumerate(sales, start=1):
         vehicle = sale.vehicle
         lead = sale.lead
-        sale_receipts = sale.payment_receipts or []
+        sale_receipts = sorted(sale.payment_receipts or [], key=lambda item: item.payment_date or item.created_at or datetime.datetime.min)
         purchase_cost = _projection_money(getattr(vehicle, "purchase_price", None))
         vehicle_expenses = _receipt_sum(sale_receipts, "expense", ["vehicle_expense", "gasto_tramites", "gasto_operativo"])
         purchase_receipts = _receipt_sum(sale_receipts, "expense", ["vehicle_purchase", "costo_vehiculo"])
-        sale_income = _receipt_sum(sale_receipts, "income")
         down_payment = _projection_money(getattr(getattr(lead, "process_detail", None), "reservation_amount", None))
         credit_amount = _projection_money(getattr(getattr(lead, "process_detail", None), "credit_used_amount", None))
         sale_value = _projection_money(sale.sale_price)
         total_cost = purchase_cost + purchase_receipts + vehicle_expenses
-        costs.append([
+        append(costs, [
             _projection_month_label(sale.sale_date), index, get_sale_display_name(sale), getattr(sale.company, "name", None),
             sale.status, "CONTINUA" if sale.status != models.SaleStatus.REJECTED.value else "DESISTE",
             getattr(lead, "name", None), " ".join(filter(None, [getattr(vehicle, "make", None), getattr(vehicle, "model", None)])),
@@ -11668,15 +11897,54 @@ def download_finance_projection_xlsx(
             down_payment, max(sale_value - down_payment - credit_amount, 0), credit_amount,
             _projection_money(sale.commission_amount), sale_value - total_cost - _projection_money(sale.commission_amount)
         ])
-    autosize(costs)
 
-    expenses = wb.create_sheet("GASTOS")
-    expenses.append(["FECHA", "CONCEPTO", "CUENTA", "TIPO", "VALOR", "EFEC", "TRANS", "BANCO", "VENTA", "PLACA", "NOTA"])
-    style_header(expenses)
-    for receipt in receipts:
-        if (receipt.movement_type or "income") != "expense":
-            continue
-        expenses.append([
+        first_income = _first_receipt(sale_receipts, "income")
+        total_income = _receipt_sum(sale_receipts, "income")
+        total_expense = _receipt_sum(sale_receipts, "expense")
+        difference = total_income - total_expense
+        base_tax = int(difference / 1.19) if difference else 0
+        iva = int(base_tax * 0.19)
+        append(payments, [
+            _projection_month_label(sale.sale_date),
+            " ".join(filter(None, [getattr(vehicle, "make", None), getattr(vehicle, "model", None)])),
+            getattr(vehicle, "plate", None), getattr(vehicle, "year", None),
+            getattr(sale, "tax_seller_name", None) or get_sale_display_name(sale),
+            getattr(sale, "tax_seller_document", None), getattr(sale, "tax_seller_email", None),
+            getattr(sale, "tax_seller_address", None), getattr(sale, "tax_seller_phone", None),
+            getattr(sale, "tax_seller_payment_method", None), _projection_money(getattr(vehicle, "purchase_price", None)),
+            getattr(first_income, "payment_date", None), _projection_money(getattr(first_income, "amount", None)),
+            getattr(first_income, "bank", None) or getattr(first_income, "receipt_number", None),
+            " | ".join(f"{r.payment_date:%d/%m/%Y}: {r.concept or r.category} ${_projection_money(r.amount):,}" for r in sale_receipts if (r.movement_type or "income") == "income"),
+            total_expense, _projection_money(sale.sale_price), getattr(lead, "name", None),
+            _projection_money(sale.sale_price), total_income, total_expense, difference, base_tax, iva
+        ])
+
+    receipt_date = func.coalesce(models.PaymentReceipt.payment_date, models.PaymentReceipt.created_at)
+    expense_rows = db.query(
+        models.PaymentReceipt.payment_date,
+        models.PaymentReceipt.created_at,
+        models.PaymentReceipt.concept,
+        models.PaymentReceipt.category,
+        models.PaymentReceipt.movement_type,
+        models.PaymentReceipt.amount,
+        models.PaymentReceipt.payment_method,
+        models.PaymentReceipt.bank,
+        models.PaymentReceipt.sale_id,
+        models.Vehicle.plate,
+        models.PaymentReceipt.notes,
+    ).outerjoin(
+        models.Sale, models.Sale.id == models.PaymentReceipt.sale_id
+    ).outerjoin(
+        models.Vehicle, models.Vehicle.id == models.Sale.vehicle_id
+    ).filter(
+        models.PaymentReceipt.movement_type == "expense",
+        receipt_date >= start,
+        receipt_date < end,
+    )
+    if current_user.company_id:
+        expense_rows = expense_rows.filter(models.PaymentReceipt.company_id == current_user.company_id)
+    for receipt in expense_rows.order_by(receipt_date.asc(), models.PaymentReceipt.id.asc()).yield_per(xlsx_export.DB_CHUNK_ROWS):
+        append(expenses, [
             receipt.payment_date or receipt.created_at,
             receipt.concept,
             _accounting_category_label(receipt.category),
@@ -11685,25 +11953,28 @@ def download_finance_projection_xlsx(
             "X" if (receipt.payment_method or "").lower() == "efectivo" else "",
             "X" if (receipt.payment_method or "").lower() == "transferencia" else "",
             receipt.bank,
-            getattr(receipt.sale, "id", None),
-            getattr(getattr(receipt.sale, "vehicle", None), "plate", None), receipt.notes
+            receipt.sale_id,
+            receipt.plate, receipt.notes
         ])
-    autosize(expenses)
 
-    process = wb.create_sheet("VENTAS EN PROCESO")
-    process.append([
-        "ITEM", "FECHA INGRESO", "ESTADO", "NOMBRE DEL EJECUTIVO", "NOMBRE DEL CLIENTE",
-        "TELEFONO", "FECHA DE RADICACION", "BANCO", "RTA BANCO", "CARRO", "PLACA",
-        "% DE FINANCIACION", "VALOR DEL VH", "CUANTO LE PRESTAN", "VALOR CUOTA INICIAL", "OBSERVACION"
-    ])
-    style_header(process)
+    credits_query = db.query(models.CreditApplication).options(
+        joinedload(models.CreditApplication.lead).joinedload(models.Lead.assigned_to),
+        joinedload(models.CreditApplication.lead).joinedload(models.Lead.process_detail),
+        joinedload(models.CreditApplication.assigned_to),
+    )
+    if current_user.company_id:
+        credits_query = credits_query.filter(models.CreditApplication.company_id == current_user.company_id)
+    credits = credits_query.filter(
+        models.CreditApplication.created_at >= start,
+        models.CreditApplication.created_at < end
+    ).order_by(models.CreditApplication.created_at.asc(), models.CreditApplication.id.asc()).yield_per(xlsx_export.DB_CHUNK_ROWS)
     for index, credit in enumerate(credits, start=1):
         lead = credit.lead
         process_detail = getattr(lead, "process_detail", None)
         vehicle_value = _projection_money(credit.purchase_sale_price or credit.approved_amount)
         approved_amount = _projection_money(credit.approved_amount)
         financing_pct = round(approved_amount / vehicle_value, 2) if vehicle_value else None
-        process.append([
+        append(process, [
             index, credit.created_at, credit.status, getattr(getattr(lead, "assigned_to", None), "full_name", None),
             credit.client_name or getattr(lead, "name", None), credit.phone or getattr(lead, "phone", None),
             credit.updated_at, getattr(process_detail, "reservation_payment_method", None), credit.notes,
@@ -11712,72 +11983,19 @@ def download_finance_projection_xlsx(
             _projection_money(getattr(process_detail, "reservation_amount", None) or credit.down_payment or credit.approved_down_payment),
             credit.notes
         ])
-    autosize(process)
-
-    payments = wb.create_sheet("RELACION DE PAGOS X CARRO")
-    payments.append([
-        "FECHA", "VEHICULO", "PLACA", "MODELO", "VENDEDOR", "CEDULA", "CORREO", "DIRECCION",
-        "CELULAR", "OBSERVACIONES", "VALOR COMPRA", "SEPARACION", "VALOR", "BANCO",
-        "ABONOS / PAGOS", "GASTOS", "PRECIO FINAL", "CLIENTE", "VALOR VENTA", "TOTAL INGRESOS",
-        "TOTAL GASTOS", "DIFERENCIA", "BASE IMPUESTO", "IVA"
-    ])
-    style_header(payments)
-    for sale in sales:
-        vehicle = sale.vehicle
-        lead = sale.lead
-        sale_receipts = sorted(sale.payment_receipts or [], key=lambda item: item.payment_date or item.created_at or datetime.datetime.min)
-        first_income = _first_receipt(sale_receipts, "income")
-        total_income = _receipt_sum(sale_receipts, "income")
-        total_expense = _receipt_sum(sale_receipts, "expense")
-        difference = total_income - total_expense
-        base_tax = int(difference / 1.19) if difference else 0
-        iva = int(base_tax * 0.19)
-        payments.append([
-            _projection_month_label(sale.sale_date),
-            " ".join(filter(None, [getattr(vehicle, "make", None), getattr(vehicle, "model", None)])),
-            getattr(vehicle, "plate", None), getattr(vehicle, "year", None),
-            getattr(sale, "tax_seller_name", None) or get_sale_display_name(sale),
-            getattr(sale, "tax_seller_document", None), getattr(sale, "tax_seller_email", None),
-            getattr(sale, "tax_seller_address", None), getattr(sale, "tax_seller_phone", None),
-            getattr(sale, "tax_seller_payment_method", None), _projection_money(getattr(vehicle, "purchase_price", None)),
-            getattr(first_income, "payment_date", None), _projection_money(getattr(first_income, "amount", None)),
-            getattr(first_income, "bank", None) or getattr(first_income, "receipt_number", None),
-            " | ".join(f"{r.payment_date:%d/%m/%Y}: {r.concept or r.category} ${_projection_money(r.amount):,}" for r in sale_receipts if (r.movement_type or "income") == "income"),
-            total_expense, _projection_money(sale.sale_price), getattr(lead, "name", None),
-            _projection_money(sale.sale_price), total_income, total_expense, difference, base_tax, iva
-        ])
-    autosize(payments)
-
-    status_ws = wb.create_sheet("ESTADO VENTAS")
-    status_ws.append(["FECHA", "ASESOR", "CLIENTE", "ACTIVIDAD PENDIENTE", "RESPONSABLE", "FECHA DE COMPROMISO", "ESTADO"])
-    style_header(status_ws)
-    for credit in credits:
-        lead = credit.lead
-        status_ws.append([
+        append(status_ws, [
             credit.updated_at, getattr(getattr(lead, "assigned_to", None), "full_name", None),
             credit.client_name or getattr(lead, "name", None), credit.notes or credit.status,
             getattr(getattr(credit, "assigned_to", None), "full_name", None), credit.updated_at, credit.status
         ])
-    autosize(status_ws)
-
-    for ws in wb.worksheets:
-        for row in ws.iter_rows(min_row=2):
-            for cell in row:
-                if isinstance(cell.value, (int, float)) and cell.column >= 10:
-                    cell.number_format = '"$"#,##0'
 
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    return StreamingResponse(
-        buffer,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f'attachment; filename="proyeccion_contable_{report_year}.xlsx"'}
-    )
+    return workbook.response(f"proyeccion_contable_{report_year}.xlsx")
 
 
-@app.get("/finance/receipts", response_model=schemas.PaymentReceiptList)
-def read_payment_receipts(
+def _filter_payment_receipts_query(
+    query,
+    db: Session,
+    current_user: models.User,
     sale_id: Optional[int] = None,
     receipt_number: Optional[str] = None,
     category: Optional[str] = None,
@@ -11785,19 +12003,8 @@ def read_payment_receipts(
     q: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
 ):
-    if get_user_role_name(current_user) not in ["admin", "super_admin"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
-
-    query = db.query(models.PaymentReceipt).options(
-        joinedload(models.PaymentReceipt.sale).joinedload(models.Sale.vehicle),
-        joinedload(models.PaymentReceipt.sale).joinedload(models.Sale.seller),
-        joinedload(models.PaymentReceipt.user)
-    )
+    """Filters shared by the receipts list and the receipts ZIP export."""
     if current_user.company_id:
         query = query.filter(models.PaymentReceipt.company_id == current_user.company_id)
     if sale_id:
@@ -11820,10 +12027,46 @@ def read_payment_receipts(
         query = query.filter(receipt_date_field >= range_start, receipt_date_field < range_end)
     if q:
         query = apply_receipt_group_search_filter(query, db, q, current_user.company_id)
+    return query
+
+
+@app.get("/finance/receipts", response_model=schemas.PaymentReceiptList)
+def read_payment_receipts(
+    sale_id: Optional[int] = None,
+    receipt_number: Optional[str] = None,
+    category: Optional[str] = None,
+    movement_type: Optional[str] = None,
+    q: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    if get_user_role_name(current_user) not in ["admin", "super_admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    query = db.query(models.PaymentReceipt).options(
+        joinedload(models.PaymentReceipt.sale).joinedload(models.Sale.vehicle),
+        joinedload(models.PaymentReceipt.sale).joinedload(models.Sale.seller),
+        joinedload(models.PaymentReceipt.user)
+    )
+    query = _filter_payment_receipts_query(
+        query,
+        db,
+        current_user,
+        sale_id=sale_id,
+        receipt_number=receipt_number,
+        category=category,
+        movement_type=movement_type,
+        q=q,
+        start_date=start_date,
+        end_date=end_date,
+    )
 
     total = query.count()
     items = query.order_by(models.PaymentReceipt.payment_date.desc(), models.PaymentReceipt.id.desc()).offset(skip).limit(limit).all()
-    items = enrich_receipt_display_names(db, items, current_user.company_id)
     return {"items": items, "total": total}
 
 
@@ -11841,83 +12084,77 @@ def download_payment_receipts_xlsx(
         raise HTTPException(status_code=403, detail="Not authorized")
 
     try:
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill
+        workbook = xlsx_export.StreamingWorkbook(header_fill="1F2937")
     except ImportError:
         raise HTTPException(status_code=500, detail="La libreria openpyxl no esta instalada en el servidor")
 
-    query = db.query(models.PaymentReceipt).options(
-        joinedload(models.PaymentReceipt.sale).joinedload(models.Sale.vehicle),
-        joinedload(models.PaymentReceipt.sale).joinedload(models.Sale.seller),
-        joinedload(models.PaymentReceipt.user)
-    )
-    if current_user.company_id:
-        query = query.filter(models.PaymentReceipt.company_id == current_user.company_id)
-    if category:
-        query = query.filter(models.PaymentReceipt.category == category)
-    if movement_type:
-        query = query.filter(models.PaymentReceipt.movement_type == movement_type)
-    if start_date and end_date:
-        try:
-            range_start = datetime.datetime.combine(datetime.date.fromisoformat(start_date), datetime.time.min)
-            range_end = datetime.datetime.combine(datetime.date.fromisoformat(end_date) + datetime.timedelta(days=1), datetime.time.min)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Las fechas deben usar formato YYYY-MM-DD")
-        receipt_date_field = func.coalesce(models.PaymentReceipt.payment_date, models.PaymentReceipt.created_at)
-        query = query.filter(receipt_date_field >= range_start, receipt_date_field < range_end)
-    if q:
-        query = apply_receipt_group_search_filter(query, db, q, current_user.company_id)
+    receipt_ids = _filter_payment_receipts_query(
+        db.query(models.PaymentReceipt.id),
+        db,
+        current_user,
+        category=category,
+        movement_type=movement_type,
+        q=q,
+        start_date=start_date,
+        end_date=end_date,
+    ).subquery()
+    rows = db.query(
+        models.PaymentReceipt.payment_date,
+        models.PaymentReceipt.created_at,
+        models.PaymentReceipt.sale_id,
+        models.Vehicle.make,
+        models.Vehicle.model,
+        models.Vehicle.plate,
+        models.PaymentReceipt.concept,
+        models.PaymentReceipt.receipt_number,
+        models.PaymentReceipt.movement_type,
+        models.PaymentReceipt.category,
+        models.PaymentReceipt.amount,
+        models.PaymentReceipt.payment_method,
+        models.PaymentReceipt.bank,
+        models.PaymentReceipt.notes,
+        models.PaymentReceipt.file_name,
+        models.User.full_name,
+        models.User.email,
+    ).outerjoin(
+        models.Sale, models.Sale.id == models.PaymentReceipt.sale_id
+    ).outerjoin(
+        models.Vehicle, models.Vehicle.id == models.Sale.vehicle_id
+    ).outerjoin(
+        models.User, models.User.id == models.PaymentReceipt.user_id
+    ).filter(
+        models.PaymentReceipt.id.in_(select(receipt_ids.c.id))
+    ).order_by(
+        models.PaymentReceipt.payment_date.desc(), models.PaymentReceipt.id.desc()
+    ).yield_per(xlsx_export.DB_CHUNK_ROWS)
 
-    receipts = query.order_by(models.PaymentReceipt.payment_date.desc(), models.PaymentReceipt.id.desc()).all()
-    receipts = enrich_receipt_display_names(db, receipts, current_user.company_id)
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Contabilidad"
-    headers = [
+    ws = workbook.add_sheet("Contabilidad", [20, 10, 26, 12, 40, 14, 12, 24, 16, 12, 16, 20, 45, 30, 28])
+    workbook.header(ws, [
         "FECHA", "VENTA", "VEHICULO", "PLACA", "CONCEPTO", "RECIBO", "TIPO", "CUENTA",
         "VALOR", "EFECTIVO", "TRANSFERENCIA", "BANCO", "NOTA", "SOPORTE", "CREADO POR"
-    ]
-    ws.append(headers)
-    for cell in ws[1]:
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill("solid", fgColor="1F2937")
-
-    for receipt in receipts:
-        vehicle = getattr(receipt.sale, "vehicle", None)
-        vehicle_label = " ".join(filter(None, [getattr(vehicle, "make", None), getattr(vehicle, "model", None)])).strip()
-        payment_method = (receipt.payment_method or "").lower()
-        ws.append([
-            receipt.payment_date or receipt.created_at,
-            getattr(receipt.sale, "id", None),
+    ])
+    for row in rows:
+        vehicle_label = " ".join(filter(None, [row.make, row.model])).strip()
+        payment_method = (row.payment_method or "").lower()
+        workbook.row(ws, [
+            row.payment_date or row.created_at,
+            row.sale_id,
             vehicle_label,
-            getattr(vehicle, "plate", None),
-            receipt.concept,
-            receipt.receipt_number,
-            _accounting_movement_label(receipt.movement_type),
-            _accounting_category_label(receipt.category),
-            int(receipt.amount or 0),
+            row.plate,
+            row.concept,
+            row.receipt_number,
+            _accounting_movement_label(row.movement_type),
+            _accounting_category_label(row.category),
+            int(row.amount or 0),
             "X" if payment_method == "efectivo" else "",
             "X" if payment_method == "transferencia" else "",
-            receipt.bank,
-            receipt.notes,
-            receipt.file_name or "",
-            getattr(receipt.user, "full_name", None) or getattr(receipt.user, "email", None)
-        ])
+            row.bank,
+            row.notes,
+            row.file_name or "",
+            row.full_name or row.email
+        ], wrap=False)
 
-    for column_cells in ws.columns:
-        width = 12
-        for cell in column_cells:
-            width = max(width, min(len(str(cell.value or "")) + 2, 45))
-        ws.column_dimensions[column_cells[0].column_letter].width = width
-
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    return StreamingResponse(
-        buffer,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": 'attachment; filename="contabilidad_recibos.xlsx"'}
-    )
+    return workbook.response("contabilidad_recibos.xlsx")
 
 
 def _get_receipt_with_access(
@@ -12035,7 +12272,7 @@ def update_payment_receipt(
 
 
 @app.post("/finance/receipts/{receipt_id}/upload", response_model=schemas.PaymentReceipt)
-async def upload_payment_receipt_file(
+def upload_payment_receipt_file(
     receipt_id: int,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
@@ -12050,16 +12287,11 @@ async def upload_payment_receipt_file(
     stored_file_path = None
     stored_file_type = None
     if file and file.filename:
-        os.makedirs("static/accounting", exist_ok=True)
-        safe_name = os.path.basename(file.filename)
-        extension = safe_name.split(".")[-1] if "." in safe_name else "bin"
-        unique_filename = f"{uuid.uuid4()}.{extension}"
-        file_path = f"static/accounting/{unique_filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        stored_file_name = safe_name
-        stored_file_path = f"/{file_path.replace('\\', '/')}"
+        stored = upload_store.store_upload(db, file)
+        stored_file_name = stored.file_name
+        stored_file_path = f"/{stored.path}"
         stored_file_type = file.content_type
+        upload_store.discard(db, receipt.file_path)
 
         receipt.file_name = stored_file_name
         receipt.file_path = stored_file_path
@@ -12076,7 +12308,7 @@ async def upload_payment_receipt_file(
 
 
 @app.post("/finance/receipts", response_model=schemas.PaymentReceipt)
-async def create_payment_receipt(
+def create_payment_receipt(
     request: Request,
     sale_id: Optional[int] = Form(None),
     concept: Optional[str] = Form(None),
@@ -12137,15 +12369,9 @@ async def create_payment_receipt(
     stored_file_path = None
     stored_file_type = None
     if file and file.filename:
-        os.makedirs("static/accounting", exist_ok=True)
-        safe_name = os.path.basename(file.filename)
-        extension = safe_name.split(".")[-1] if "." in safe_name else "bin"
-        unique_filename = f"{uuid.uuid4()}.{extension}"
-        file_path = f"static/accounting/{unique_filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        stored_file_name = safe_name
-        stored_file_path = f"/{file_path.replace('\\', '/')}"
+        stored = upload_store.store_upload(db, file)
+        stored_file_name = stored.file_name
+        stored_file_path = f"/{stored.path}"
         stored_file_type = file.content_type
 
     receipt = models.PaymentReceipt(
@@ -12197,7 +12423,7 @@ def read_sale_attachments(
 
 
 @app.post("/finance/sales/{sale_id}/attachments", response_model=schemas.SaleAttachment)
-async def upload_sale_attachment(
+def upload_sale_attachment(
     sale_id: int,
     note: Optional[str] = Form(None),
     file: UploadFile = File(...),
@@ -12210,20 +12436,14 @@ async def upload_sale_attachment(
     if not file or not file.filename:
         raise HTTPException(status_code=400, detail="Debes adjuntar un archivo")
 
-    os.makedirs("static/sale-attachments", exist_ok=True)
-    safe_name = os.path.basename(file.filename)
-    extension = safe_name.split(".")[-1] if "." in safe_name else "bin"
-    unique_filename = f"{uuid.uuid4()}.{extension}"
-    file_path = f"static/sale-attachments/{unique_filename}"
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    stored = upload_store.store_upload(db, file)
 
     attachment = models.SaleAttachment(
         company_id=sale.company_id,
         sale_id=sale.id,
         user_id=current_user.id,
-        file_name=safe_name,
-        file_path=f"/{file_path.replace('\\', '/')}",
+        file_name=stored.file_name,
+        file_path=f"/{stored.path}",
         file_type=file.content_type,
         note=(note or "").strip() or None
     )
@@ -12254,17 +12474,93 @@ def delete_sale_attachment(
     if current_user.company_id and attachment.company_id != current_user.company_id:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    local_path = attachment.file_path.lstrip("/").replace("/", os.sep)
+    upload_store.discard(db, attachment.file_path)
     db.delete(attachment)
     db.commit()
-    if local_path and os.path.exists(local_path):
-        try:
-            os.remove(local_path)
-        except OSError:
-            pass
     return {"message": "Comprobante eliminado"}
 
 
+def _finance_company_name(company: Optional[models.Company]) -> str:
+    return re.sub(r"\s+admin$", "", str(getattr(company, "name", None) or "Empresa").strip(), flags=re.IGNORECASE) or "Empresa"
+
+
+def _sale_invoice_document(sale: models.Sale) -> Dict[str, Any]:
+    """Plain-data snapshot of a sale for finance_documents.render_sale_invoice_pdf."""
+    receipts = sorted(
+        sale.payment_receipts or [],
+        key=lambda item: (item.payment_date or item.created_at or datetime.datetime.min, item.id or 0)
+    )
+    return {
+        "sale_id": sale.id,
+        "company_name": _finance_company_name(sale.company),
+        "logo_path": branding_assets.get_logo_path(sale.company),
+        "vehicle_label": " ".join(filter(None, [
+            getattr(sale.vehicle, "make", None),
+            getattr(sale.vehicle, "model", None),
+            getattr(sale.vehicle, "plate", None)
+        ])).strip() or "Sin datos de vehiculo",
+        "lead_label": getattr(sale.lead, "name", None) or "Sin cliente asociado",
+        "seller_label": (
+            getattr(sale.seller, "full_name", None)
+            or getattr(sale.seller, "email", None)
+            or sale.external_seller_name
+            or "Sin vendedor"
+        ),
+        "sale_price": sale.sale_price,
+        "status": sale.status,
+        "receipts": [
+            {
+                "payment_date": receipt.payment_date,
+                "concept": receipt.concept or receipt.notes or "Movimiento contable",
+                "category_label": _accounting_category_label(receipt.category),
+                "movement_label": _accounting_movement_label(receipt.movement_type),
+                "is_expense": (receipt.movement_type or "income") == "expense",
+                "amount": receipt.amount,
+            }
+            for receipt in receipts
+        ],
+    }
+
+
+def _payment_receipt_document(receipt: models.PaymentReceipt) -> Dict[str, Any]:
+    """Plain-data snapshot of a receipt for finance_documents.render_payment_receipt_pdf."""
+    display_lines = [
+        ("Concepto", (receipt.concept or "Sin concepto").upper()),
+        ("Tipo de Movimiento", _accounting_movement_label(receipt.movement_type).upper()),
+        ("Cuenta Contable", _accounting_category_label(receipt.category).upper()),
+        ("Forma de Pago", (receipt.payment_method or "Sin definir").capitalize()),
+        ("Banco / Cuenta", (receipt.bank or "Sin definir").upper()),
+        ("Valor Total", f"COP ${int(receipt.amount or 0):,}".replace(",", ".")),
+    ]
+    if receipt.sale:
+        vehicle_label = " ".join(filter(None, [
+            getattr(receipt.sale.vehicle, "make", None),
+            getattr(receipt.sale.vehicle, "model", None),
+            getattr(receipt.sale.vehicle, "plate", None)
+        ])).strip()
+        display_lines.extend([
+            ("Referencia Venta", f"#{receipt.sale.id}"),
+            ("Vehiculo Asociado", (vehicle_label or "Sin datos de vehiculo").upper()),
+            ("Vendedor", (getattr(receipt.sale.seller, "full_name", None) or getattr(receipt.sale.seller, "email", "") or "N/A").upper())
+        ])
+    return {
+        "receipt_id": receipt.id,
+        "receipt_number": receipt.receipt_number,
+        "payment_date": receipt.payment_date,
+        "company_name": _finance_company_name(receipt.company),
+        "logo_path": branding_assets.get_logo_path(receipt.company),
+        "display_lines": display_lines,
+        "notes": receipt.notes,
+    }
+
+
+def _render_finance_pdf(renderer, document: Dict[str, Any]) -> bytes:
+    try:
+        return pdf_render_pool.render(renderer, document)
+    except ImportError:
+        raise HTTPException(status_code=500, detail="La libreria reportlab no esta instalada en el servidor")
+
+
 @app.get("/finance/sales/{sale_id}/invoice.pdf")
 def download_sale_invoice_pdf(
     sale_id: int,
@@ -12286,171 +12582,116 @@ def download_sale_invoice_pdf(
     if current_user.company_id and sale.company_id != current_user.company_id:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    receipts = sorted(
-        sale.payment_receipts or [],
-        key=lambda item: (item.payment_date or item.created_at or datetime.datetime.min, item.id or 0)
+    pdf_bytes = _render_finance_pdf(finance_documents.render_sale_invoice_pdf, _sale_invoice_document(sale))
+    return Response(
+        content=pdf_bytes,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="factura_venta_{sale.id}.pdf"'}
     )
 
-    try:
-        from reportlab.lib.colors import HexColor
-        from reportlab.lib.pagesizes import letter
-        from reportlab.pdfgen import canvas
-    except ImportError:
-        raise HTTPException(status_code=500, detail="La libreria reportlab no esta instalada en el servidor")
 
-    def money(value: int) -> str:
-        return f"COP ${int(value or 0):,}".replace(",", ".")
+def _iter_finance_export_items(db: Session, receipt_ids: List[int], sale_ids: List[int]):
+    """Yields (zip entry name, renderer, document) loading rows in chunks."""
+    for chunk in lead_bulk_ops.chunked(receipt_ids, 200):
+        receipts = db.query(models.PaymentReceipt).options(
+            joinedload(models.PaymentReceipt.sale).joinedload(models.Sale.vehicle),
+            joinedload(models.PaymentReceipt.sale).joinedload(models.Sale.seller),
+            joinedload(models.PaymentReceipt.company),
+        ).filter(models.PaymentReceipt.id.in_(list(chunk))).all()
+        receipts_by_id = {receipt.id: receipt for receipt in receipts}
+        for receipt_id in chunk:
+            receipt = receipts_by_id.get(receipt_id)
+            if receipt:
+                yield (
+                    f"recibos/recibo_{receipt.id}.pdf",
+                    finance_documents.render_payment_receipt_pdf,
+                    _payment_receipt_document(receipt),
+                )
+    for chunk in lead_bulk_ops.chunked(sale_ids, 100):
+        sales = db.query(models.Sale).options(
+            joinedload(models.Sale.vehicle),
+            joinedload(models.Sale.seller),
+            joinedload(models.Sale.lead),
+            joinedload(models.Sale.company),
+            joinedload(models.Sale.payment_receipts),
+        ).filter(models.Sale.id.in_(list(chunk))).all()
+        sales_by_id = {sale.id: sale for sale in sales}
+        for sale_id in chunk:
+            sale = sales_by_id.get(sale_id)
+            if sale:
+                yield (
+                    f"facturas/factura_venta_{sale.id}.pdf",
+                    finance_documents.render_sale_invoice_pdf,
+                    _sale_invoice_document(sale),
+                )
 
-    def write_row(pdf_doc, y_pos, values, fills=None):
-        x_positions = [50, 115, 290, 390, 470]
-        widths = [58, 165, 90, 70, 85]
-        for index, value in enumerate(values):
-            pdf_doc.setFillColor(fills[index] if fills and fills[index] else HexColor("#1e293b"))
-            pdf_doc.drawString(x_positions[index], y_pos, str(value)[: int(widths[index] / 4.8)])
 
-    buffer = BytesIO()
-    pdf = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    pdf.setTitle(f"factura_venta_{sale.id}.pdf")
-    company_name = re.sub(r"\s+admin$", "", str(getattr(sale.company, "name", None) or "Empresa").strip(), flags=re.IGNORECASE) or "Empresa"
-
-    def draw_header():
-        pdf.setFillColor(HexColor("#1e293b"))
-        pdf.rect(0, height - 100, width, 100, fill=1, stroke=0)
-        pdf.setFillColor(HexColor("#ffffff"))
-        pdf.setFont("Helvetica-Bold", 22)
-        pdf.drawString(50, height - 58, f"{company_name.upper()} - FACTURA CONSOLIDADA"[:58])
-        pdf.setFont("Helvetica", 10)
-        pdf.drawString(50, height - 78, "Resumen contable de venta y movimientos relacionados")
-        pdf.setFont("Helvetica-Bold", 14)
-        pdf.drawRightString(width - 50, height - 58, f"Venta #{sale.id}")
-        pdf.setFont("Helvetica", 10)
-        pdf.drawRightString(width - 50, height - 78, f"Fecha: {datetime.datetime.utcnow().strftime('%d/%m/%Y')}")
-
-    draw_header()
-    y = height - 135
-
-    vehicle_label = " ".join(filter(None, [
-        getattr(sale.vehicle, "make", None),
-        getattr(sale.vehicle, "model", None),
-        getattr(sale.vehicle, "plate", None)
-    ])).strip() or "Sin datos de vehiculo"
-    seller_label = (
-        getattr(sale.seller, "full_name", None)
-        or getattr(sale.seller, "email", None)
-        or sale.external_seller_name
-        or "Sin vendedor"
-    )
-    lead_label = getattr(sale.lead, "name", None) or "Sin cliente asociado"
-
-    pdf.setFont("Helvetica-Bold", 14)
-    pdf.setFillColor(HexColor("#0f172a"))
-    pdf.drawString(50, y, "Datos de la venta")
-    y -= 22
-    for label, value in [
-        ("Vehiculo", vehicle_label),
-        ("Cliente", lead_label),
-        ("Vendedor", seller_label),
-        ("Valor de venta", money(sale.sale_price)),
-        ("Estado", (sale.status or "pending").upper())
-    ]:
-        pdf.setFont("Helvetica-Bold", 10)
-        pdf.setFillColor(HexColor("#64748b"))
-        pdf.drawString(50, y, f"{label}:")
-        pdf.setFont("Helvetica", 10)
-        pdf.setFillColor(HexColor("#1e293b"))
-        pdf.drawString(150, y, str(value)[:80])
-        y -= 18
-
-    y -= 10
-    pdf.setFont("Helvetica-Bold", 14)
-    pdf.setFillColor(HexColor("#0f172a"))
-    pdf.drawString(50, y, "Movimientos relacionados")
-    y -= 24
-
-    pdf.setFillColor(HexColor("#f1f5f9"))
-    pdf.rect(45, y - 6, width - 90, 22, fill=1, stroke=0)
-    pdf.setFont("Helvetica-Bold", 9)
-    write_row(pdf, y, ["Fecha", "Concepto", "Cuenta", "Tipo", "Valor"])
-    y -= 22
-
-    income_total = 0
-    expense_total = 0
-    pdf.setFont("Helvetica", 9)
-    for receipt in receipts:
-        if y < 95:
-            pdf.showPage()
-            draw_header()
-            y = height - 135
-            pdf.setFillColor(HexColor("#f1f5f9"))
-            pdf.rect(45, y - 6, width - 90, 22, fill=1, stroke=0)
-            pdf.setFont("Helvetica-Bold", 9)
-            write_row(pdf, y, ["Fecha", "Concepto", "Cuenta", "Tipo", "Valor"])
-            y -= 22
-            pdf.setFont("Helvetica", 9)
-
-        is_expense = (receipt.movement_type or "income") == "expense"
-        if is_expense:
-            expense_total += int(receipt.amount or 0)
-        else:
-            income_total += int(receipt.amount or 0)
-
-        pdf.setStrokeColor(HexColor("#e2e8f0"))
-        pdf.line(45, y - 6, width - 45, y - 6)
-        write_row(
-            pdf,
-            y,
-            [
-                receipt.payment_date.strftime("%d/%m/%Y") if receipt.payment_date else "-",
-                receipt.concept or receipt.notes or "Movimiento contable",
-                _accounting_category_label(receipt.category),
-                _accounting_movement_label(receipt.movement_type),
-                money(receipt.amount)
-            ],
-            [None, None, None, HexColor("#dc2626") if is_expense else HexColor("#059669"), HexColor("#dc2626") if is_expense else HexColor("#059669")]
-        )
-        y -= 20
-
-    if not receipts:
-        pdf.setFont("Helvetica-Oblique", 10)
-        pdf.setFillColor(HexColor("#64748b"))
-        pdf.drawString(50, y, "Esta venta no tiene movimientos contables asociados.")
-        y -= 24
+@app.get("/finance/receipts.zip")
+def export_finance_documents_zip(
+    sale_id: Optional[int] = None,
+    receipt_number: Optional[str] = None,
+    category: Optional[str] = None,
+    movement_type: Optional[str] = None,
+    q: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    include_invoices: bool = True,
+    background: bool = False,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_user_from_anywhere)
+):
+    if get_user_role_name(current_user) not in ["admin", "super_admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
 
-    y -= 16
-    if y < 150:
-        pdf.showPage()
-        draw_header()
-        y = height - 150
-
-    balance_total = income_total - expense_total
-    pdf.setFillColor(HexColor("#f8fafc"))
-    pdf.rect(330, y - 70, width - 380, 88, fill=1, stroke=1)
-    pdf.setFont("Helvetica-Bold", 10)
-    pdf.setFillColor(HexColor("#059669"))
-    pdf.drawString(350, y, f"Ingresos: {money(income_total)}")
-    y -= 20
-    pdf.setFillColor(HexColor("#dc2626"))
-    pdf.drawString(350, y, f"Egresos: {money(expense_total)}")
-    y -= 20
-    pdf.setFillColor(HexColor("#1d4ed8") if balance_total >= 0 else HexColor("#dc2626"))
-    pdf.drawString(350, y, f"Neto: {money(balance_total)}")
-
-    pdf.setStrokeColor(HexColor("#cbd5e1"))
-    pdf.line(50, 80, width - 50, 80)
-    pdf.setFont("Helvetica-Oblique", 8)
-    pdf.setFillColor(HexColor("#94a3b8"))
-    pdf.drawCentredString(width / 2, 63, "Este documento consolida los movimientos contables relacionados con la venta.")
-    pdf.drawCentredString(width / 2, 51, f"Generado digitalmente el {datetime.datetime.utcnow().strftime('%d/%m/%Y %H:%M')}")
+    query = _filter_payment_receipts_query(
+        db.query(models.PaymentReceipt.id, models.PaymentReceipt.sale_id),
+        db,
+        current_user,
+        sale_id=sale_id,
+        receipt_number=receipt_number,
+        category=category,
+        movement_type=movement_type,
+        q=q,
+        start_date=start_date,
+        end_date=end_date,
+    )
+    rows = query.order_by(models.PaymentReceipt.payment_date.desc(), models.PaymentReceipt.id.desc()).all()
+    receipt_ids = [row.id for row in rows]
+    sale_ids = sorted({row.sale_id for row in rows if row.sale_id}) if include_invoices else []
+    total_documents = len(receipt_ids) + len(sale_ids)
+    if not total_documents:
+        raise HTTPException(status_code=404, detail="No hay comprobantes para exportar con estos filtros")
+
+    export_date = datetime.datetime.utcnow().strftime("%Y%m%d")
+    if background or total_documents > document_exports.EXPORT_BACKGROUND_THRESHOLD:
+        def run_export(job_db: Session, progress: background_jobs.JobProgress):
+            file_name = document_exports.write_zip_file(
+                f"documentos_contables_{export_date}",
+                _iter_finance_export_items(job_db, receipt_ids, sale_ids),
+                progress,
+            )
+            return {"file_name": file_name, "documents": total_documents}
 
-    pdf.showPage()
-    pdf.save()
-    buffer.seek(0)
+        job = background_jobs.submit_job(
+            db,
+            "finance_documents_zip",
+            total_documents,
+            run_export,
+            company_id=current_user.company_id,
+            created_by_id=current_user.id,
+            payload={"receipts": len(receipt_ids), "invoices": len(sale_ids)},
+        )
+        return JSONResponse(
+            status_code=202,
+            content={"job_id": job.id, "status": job.status, "total": total_documents},
+        )
 
+    # Snapshots are taken now: the request session is gone once streaming starts.
+    items = list(_iter_finance_export_items(db, receipt_ids, sale_ids))
     return StreamingResponse(
-        buffer,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f'attachment; filename="factura_venta_{sale.id}.pdf"'}
+        document_exports.iter_zip_stream(items),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="documentos_contables_{export_date}.zip"'},
     )
 
 
@@ -12464,119 +12705,9 @@ def download_payment_receipt_pdf(
         raise HTTPException(status_code=403, detail="Not authorized")
 
     receipt = _get_receipt_with_access(db, receipt_id, current_user)
-
-    try:
-        from reportlab.lib.colors import HexColor
-        from reportlab.lib.pagesizes import letter
-        from reportlab.pdfgen import canvas
-    except ImportError:
-        raise HTTPException(status_code=500, detail="La libreria reportlab no esta instalada en el servidor")
-
-    buffer = BytesIO()
-    pdf = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    company_name = re.sub(r"\s+admin$", "", str(getattr(receipt.company, "name", None) or "Empresa").strip(), flags=re.IGNORECASE) or "Empresa"
-
-    y = height - 60
-    pdf.setTitle(f"recibo_{receipt.id}.pdf")
-    
-    # Header with background
-    pdf.setFillColor(HexColor("#1e293b"))
-    pdf.rect(0, height - 100, width, 100, fill=1, stroke=0)
-    
-    pdf.setFillColor(HexColor("#ffffff"))
-    pdf.setFont("Helvetica-Bold", 24)
-    pdf.drawString(50, height - 60, f"{company_name.upper()} - COMPRA Y VENTA"[:58])
-    
-    pdf.setFont("Helvetica", 10)
-    pdf.drawString(50, height - 80, "Soporte de Contabilidad | Gestion Financiera")
-    
-    pdf.setFillColor(HexColor("#ffffff"))
-    pdf.setFont("Helvetica-Bold", 14)
-    pdf.drawRightString(width - 50, height - 60, f"No. {receipt.receipt_number or 'PROV'}")
-    pdf.setFont("Helvetica", 10)
-    pdf.drawRightString(width - 50, height - 80, f"Fecha: {receipt.payment_date.strftime('%d/%m/%Y') if receipt.payment_date else 'N/A'}")
-
-    y = height - 140
-    
-    # Main Content
-    pdf.setFillColor(HexColor("#0f172a"))
-    pdf.setFont("Helvetica-Bold", 16)
-    pdf.drawString(50, y, "Detalle del Movimiento")
-    y -= 10
-    
-    pdf.setStrokeColor(HexColor("#e2e8f0"))
-    pdf.line(50, y, width - 50, y)
-    y -= 30
-
-    display_lines = [
-        ("Concepto", (receipt.concept or "Sin concepto").upper()),
-        ("Tipo de Movimiento", _accounting_movement_label(receipt.movement_type).upper()),
-        ("Cuenta Contable", _accounting_category_label(receipt.category).upper()),
-        ("Forma de Pago", (receipt.payment_method or "Sin definir").capitalize()),
-        ("Banco / Cuenta", (receipt.bank or "Sin definir").upper()),
-        ("Valor Total", f"COP ${int(receipt.amount or 0):,}".replace(",", ".")),
-    ]
-
-    if receipt.sale:
-        vehicle_label = " ".join(filter(None, [
-            getattr(receipt.sale.vehicle, "make", None),
-            getattr(receipt.sale.vehicle, "model", None),
-            getattr(receipt.sale.vehicle, "plate", None)
-        ])).strip()
-        display_lines.extend([
-            ("Referencia Venta", f"#{receipt.sale.id}"),
-            ("Vehiculo Asociado", (vehicle_label or "Sin datos de vehiculo").upper()),
-            ("Vendedor", (getattr(receipt.sale.seller, "full_name", None) or getattr(receipt.sale.seller, "email", "") or "N/A").upper())
-        ])
-
-    for label, value in display_lines:
-        pdf.setFont("Helvetica-Bold", 11)
-        pdf.setFillColor(HexColor("#64748b"))
-        pdf.drawString(50, y, f"{label}:")
-        
-        pdf.setFont("Helvetica", 11)
-        pdf.setFillColor(HexColor("#1e293b"))
-        pdf.drawString(180, y, str(value))
-        
-        y -= 6
-        pdf.setStrokeColor(HexColor("#f1f5f9"))
-        pdf.line(50, y, width - 50, y)
-        y -= 20
-
-    if receipt.notes:
-        y -= 20
-        pdf.setFillColor(HexColor("#f8fafc"))
-        pdf.rect(50, y - 60, width - 100, 70, fill=1, stroke=1)
-        
-        pdf.setFillColor(HexColor("#475569"))
-        pdf.setFont("Helvetica-Bold", 10)
-        pdf.drawString(60, y, "NOTAS Y OBSERVACIONES:")
-        y -= 15
-        pdf.setFont("Helvetica", 9)
-        pdf.setFillColor(HexColor("#1e293b"))
-        text_object = pdf.beginText(60, y)
-        text_object.setLeading(12)
-        for paragraph in str(receipt.notes).splitlines() or [""]:
-            text_object.textLine(paragraph[:100])
-        pdf.drawText(text_object)
-        y -= 60
-
-    # Footer
-    pdf.setStrokeColor(HexColor("#cbd5e1"))
-    pdf.line(50, 100, width - 50, 100)
-    
-    pdf.setFont("Helvetica-Oblique", 8)
-    pdf.setFillColor(HexColor("#94a3b8"))
-    pdf.drawCentredString(width/2, 85, f"Este documento es un soporte interno de contabilidad de {company_name}.")
-    pdf.drawCentredString(width/2, 75, f"Generado digitalmente el {datetime.datetime.utcnow().strftime('%d/%m/%Y %H:%M')}")
-
-    pdf.showPage()
-    pdf.save()
-    buffer.seek(0)
-
-    return StreamingResponse(
-        buffer,
+    pdf_bytes = _render_finance_pdf(finance_documents.render_payment_receipt_pdf, _payment_receipt_document(receipt))
+    return Response(
+        content=pdf_bytes,
         media_type="application/pdf",
         headers={"Content-Disposition": f'attachment; filename="recibo_{receipt.id}.pdf"'}
     )
@@ -12592,14 +12723,7 @@ def delete_payment_receipt(
         raise HTTPException(status_code=403, detail="Solo un administrador puede eliminar recibos")
 
     receipt = _get_receipt_with_access(db, receipt_id, current_user)
-    if receipt.file_path:
-        try:
-            relative_path = receipt.file_path.lstrip("/").replace("/", os.sep)
-            absolute_path = os.path.abspath(relative_path)
-            if os.path.exists(absolute_path):
-                os.remove(absolute_path)
-        except Exception:
-            pass
+    upload_store.discard(db, receipt.file_path)
 
     db.delete(receipt)
     db.commit()
@@ -12679,7 +12803,7 @@ def create_internal_message(
     ).filter(models.InternalMessage.id == db_message.id).first()
 
 @app.post("/internal-messages/upload", response_model=schemas.InternalMessage)
-async def upload_internal_message_file(
+def upload_internal_message_file(
     request: Request,
     file: UploadFile = File(...),
     recipient_id: Optional[int] = Form(None),
@@ -12694,28 +12818,17 @@ async def upload_internal_message_file(
         if recipient.company_id != current_user.company_id:
             raise HTTPException(status_code=403, detail="Cannot message users from other companies")
 
-    os.makedirs("static/internal_chat", exist_ok=True)
-
-    safe_name = os.path.basename(file.filename or "archivo")
-    ext = safe_name.split(".")[-1] if "." in safe_name else "bin"
-    unique_name = f"{uuid.uuid4()}.{ext}"
-    rel_path = f"static/internal_chat/{unique_name}"
-
-    with open(rel_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    rel_path_web = rel_path.replace("\\", "/")
-    relative_url = f"/api/{rel_path_web}"
-    file_url = f"{str(request.base_url).rstrip('/')}{relative_url}"
+    stored = upload_store.store_upload(db, file)
+    file_url = f"{str(request.base_url).rstrip('/')}{stored.url}"
     payload = {
         "type": "file",
-        "file_name": safe_name,
-        "storage_name": unique_name,
+        "file_name": stored.file_name,
+        "storage_name": stored.storage_name,
         "file_url": file_url,
-        "file_url_relative": relative_url,
-        "file_path": rel_path_web,
+        "file_url_relative": stored.url,
+        "file_path": stored.path,
         "file_type": file.content_type or "application/octet-stream",
-        "file_size": os.path.getsize(rel_path),
+        "file_size": stored.size,
         "text": content.strip() if content else ""
     }
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Enum as SqEnum, JSON, DateTime, Text, Date
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Enum as SqEnum, JSON, DateTime, Text, Date, Index, LargeBinary, BigInteger
 from sqlalchemy.orm import relationship
 from database import Base
 import enum
@@ -106,6 +106,33 @@ class Company(Base):
         return normalized
 
 
+class CompanyDomain(Base):
+    """Normalized public host of a company, kept in sync with public_domain(s) by company_domains."""
+    __tablename__ = "company_domains"
+
+    host = Column(String(255), primary_key=True)
+    company_id = Column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=False, index=True)
+    is_primary = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class UploadBlob(Base):
+    """Content-addressed uploaded file, shared by every record that stored the same bytes (see upload_store)."""
+    __tablename__ = "upload_blobs"
+    __table_args__ = (
+        Index("ix_upload_blobs_ref_count_updated", "ref_count", "updated_at"),
+    )
+
+    sha256 = Column(String(64), primary_key=True)
+    storage_path = Column(String(255), nullable=False)
+    size = Column(BigInteger, nullable=False, default=0)
+    content_type = Column(String(150), nullable=True)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Last reference change; unreferenced blobs are collected after a grace period.
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
 class PublicCreditEmailVerification(Base):
     __tablename__ = "public_credit_email_verifications"
 
@@ -449,6 +476,9 @@ class SaleStatus(str, enum.Enum):
 
 class Sale(Base):
     __tablename__ = "sales"
+    __table_args__ = (
+        Index("ix_sales_company_status_date", "company_id", "status", "sale_date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     vehicle_id = Column(Integer, ForeignKey("vehicles.id"), unique=True)
@@ -493,12 +523,18 @@ class Sale(Base):
 
 class PaymentReceipt(Base):
     __tablename__ = "payment_receipts"
+    __table_args__ = (
+        Index("ix_payment_receipts_company_number", "company_id", "receipt_number"),
+        Index("ix_payment_receipts_company_payment_date", "company_id", "payment_date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"), index=True, nullable=False)
     sale_id = Column(Integer, ForeignKey("sales.id"), index=True, nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     display_name = Column(String(180), nullable=True)
+    # Best display name among receipts with the same number or sale (receipt_display_names).
+    group_display_name = Column(String(180), nullable=True)
     customer_name = Column(String(180), nullable=True)
     customer_document = Column(String(80), nullable=True)
     concept = Column(String(200), nullable=True)
@@ -519,6 +555,49 @@ class PaymentReceipt(Base):
     company = relationship("Company")
     user = relationship("User")
 
+    @property
+    def resolved_display_name(self):
+        return (self.display_name or "").strip() or self.group_display_name
+
+
+class FinanceMonthlyRollup(Base):
+    """Approved/pending sales and receipt totals per company and month, maintained by finance_rollups."""
+    __tablename__ = "finance_monthly_rollups"
+    __table_args__ = (
+        Index("ux_finance_monthly_rollups_company_month", "company_id", "month", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
+    # First day of the month; finance_rollups.UNDATED_MONTH holds sales without a date.
+    month = Column(Date, nullable=False)
+    approved_sales_count = Column(Integer, nullable=False, default=0)
+    approved_net_revenue = Column(BigInteger, nullable=False, default=0)
+    approved_commissions = Column(BigInteger, nullable=False, default=0)
+    pending_sales_count = Column(Integer, nullable=False, default=0)
+    receipts_count = Column(Integer, nullable=False, default=0)
+    receipts_amount = Column(BigInteger, nullable=False, default=0)
+    income_amount = Column(BigInteger, nullable=False, default=0)
+    expense_amount = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
+class ReceiptSearchDocument(Base):
+    """One normalized search text per receipt (receipt, sale, vehicle, lead and
+    credit fields), maintained by receipt_search."""
+    __tablename__ = "receipt_search_documents"
+    __table_args__ = (
+        Index("ix_receipt_search_documents_company_sale", "company_id", "sale_id"),
+        Index("ix_receipt_search_documents_text", "search_text", mysql_prefix="FULLTEXT", mysql_with_parser="ngram"),
+    )
+
+    receipt_id = Column(Integer, ForeignKey("payment_receipts.id", ondelete="CASCADE"), primary_key=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
+    sale_id = Column(Integer, nullable=True)
+    receipt_number = Column(String(120), nullable=True)
+    search_text = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
 
 class SaleAttachment(Base):
     __tablename__ = "sale_attachments"
@@ -540,6 +619,9 @@ class SaleAttachment(Base):
 
 class TaxReportEntry(Base):
     __tablename__ = "tax_report_entries"
+    __table_args__ = (
+        Index("ix_tax_report_entries_company_year", "company_id", "year"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"), index=True, nullable=False)
@@ -767,6 +849,8 @@ class Vehicle(Base):
     description = Column(Text, nullable=True)
     status = Column(String(50), default="available") # available, reserved, sold
     photos = Column(JSON, nullable=True) # List of image URLs
+    # Derivative URLs per photo, same order as photos (see image_derivatives)
+    photo_variants = Column(JSON, nullable=True)
     
     company_id = Column(Integer, ForeignKey("companies.id"))
     company = relationship("Company", back_populates="vehicles")
@@ -776,7 +860,7 @@ class Conversation(Base):
     __tablename__ = "conversations"
 
     id = Column(Integer, primary_key=True, index=True)
-    lead_id = Column(Integer, ForeignKey("leads.id"), nullable=True)
+    lead_id = Column(Integer, ForeignKey("leads.id"), nullable=True, index=True)
     company_id = Column(Integer, ForeignKey("companies.id"))
     last_message_at = Column(DateTime, default=datetime.datetime.utcnow)
     
@@ -794,6 +878,9 @@ class MessageType(str, enum.Enum):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_conversation_created", "conversation_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"))
@@ -801,9 +888,9 @@ class Message(Base):
     content = Column(String(2000), nullable=True) # Text content or Caption
     media_url = Column(String(1000), nullable=True)
     message_type = Column(String(20), default=MessageType.TEXT) # text, image, etc
-    whatsapp_message_id = Column(String(100), nullable=True)
+    whatsapp_message_id = Column(String(100), nullable=True, index=True)
     status = Column(String(20), default="sent") # sent, delivered, read
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    created_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     
     conversation = relationship("Conversation", back_populates="messages")
 
@@ -932,3 +1019,100 @@ class SystemLog(Base):
 
     user = relationship("User")
     company = relationship("Company")
+
+class SlowQueryLog(Base):
+    __tablename__ = "slow_query_log"
+
+    id = Column(Integer, primary_key=True, index=True)
+    fingerprint_hash = Column(String(40), unique=True, index=True, nullable=False)
+    fingerprint = Column(Text, nullable=False) # SQL normalizado (literales -> ?)
+    sample_statement = Column(Text, nullable=True)
+    parameter_shape = Column(Text, nullable=True) # JSON con los tipos de los parametros
+    route = Column(String(255), nullable=True) # Ultima ruta HTTP que lo ejecuto
+    calls = Column(Integer, nullable=False, default=0)
+    total_ms = Column(Integer, nullable=False, default=0)
+    max_ms = Column(Integer, nullable=False, default=0)
+    last_ms = Column(Integer, nullable=False, default=0)
+    explain_json = Column(Text, nullable=True)
+    explained_at = Column(DateTime, nullable=True)
+    first_seen_at = Column(DateTime, default=datetime.datetime.utcnow)
+    last_seen_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class BackgroundJob(Base):
+    __tablename__ = "background_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=True, index=True)
+    created_by_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    kind = Column(String(50), nullable=False, index=True) # e.g. "lead_bulk_assign"
+    status = Column(String(20), nullable=False, default="queued") # queued, running, completed, failed
+    total = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    payload_json = Column(Text, nullable=True)
+    result_json = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class LeadAssignmentCounter(Base):
+    __tablename__ = "lead_assignment_counters"
+    __table_args__ = (
+        Index("ix_lead_assignment_counters_pool_load", "company_id", "eligible", "open_leads"),
+        Index("ix_lead_assignment_counters_pool_turn", "company_id", "eligible", "rr_position"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, unique=True)
+    eligible = Column(Boolean, nullable=False, default=False) # Puede recibir leads automaticos
+    weight = Column(Integer, nullable=False, default=1) # Peso para round robin ponderado
+    open_leads = Column(Integer, nullable=False, default=0)
+    assigned_total = Column(Integer, nullable=False, default=0)
+    rr_position = Column(Integer, nullable=False, default=0) # Avanza 1000/weight por cada lead recibido
+    last_assigned_at = Column(DateTime, nullable=True)
+    refreshed_at = Column(DateTime, nullable=True) # NULL = pool invalidado, se recalcula en la siguiente asignacion
+
+class CompanyUsageCounter(Base):
+    __tablename__ = "company_usage_counters"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False, unique=True)
+    period_start = Column(Date, nullable=True) # Periodo de licencia al que corresponde leads_in_period
+    period_end = Column(Date, nullable=True)
+    leads_in_period = Column(Integer, nullable=False, default=0)
+    users_total = Column(Integer, nullable=False, default=0)
+    active_users = Column(Integer, nullable=False, default=0)
+    reconciled_at = Column(DateTime, nullable=True)
+
+class CatalogueVersion(Base):
+    """Bumped in the transaction of every vehicle write, so each worker can tell its catalogue snapshot is stale (see vehicle_catalogue)."""
+    __tablename__ = "catalogue_versions"
+
+    company_id = Column(Integer, primary_key=True, autoincrement=False) # 0 = vehiculos sin empresa
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        Index("ix_email_outbox_due", "status", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=True, index=True)
+    kind = Column(String(50), nullable=False) # e.g. "public_credit_verification"
+    recipient = Column(String(255), nullable=True)
+    subject = Column(String(255), nullable=True)
+    message_bytes = Column(LargeBinary(length=16 * 1024 * 1024), nullable=True) # NULL = se construye al enviar
+    entity_type = Column(String(50), nullable=True)
+    entity_id = Column(Integer, nullable=True)
+    status = Column(String(20), nullable=False, default="pending") # pending, sending, sent, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.datetime.utcnow)
+    locked_by = Column(String(100), nullable=True)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+# Reportlab rendering is CPU-bound and holds the GIL, so documents are drawn in
+# separate processes instead of the API worker's request threads. Renderers
+# must be module-level functions of a module that is cheap to import (e.g.
+# finance_documents) taking picklable arguments. PDF_RENDER_WORKERS=0 renders
+# in-process.
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2") or "2")
+PDF_RENDER_TIMEOUT_SECONDS = int(os.getenv("PDF_RENDER_TIMEOUT_SECONDS", "60") or "60")
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if PDF_RENDER_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            # spawn: never fork the API process with its open DB connections and threads.
+            _executor = ProcessPoolExecutor(
+                max_workers=PDF_RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def _reset_executor(broken: ProcessPoolExecutor):
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def submit(renderer: Callable[..., bytes], *args: Any) -> Future:
+    executor = _get_executor()
+    if executor is not None:
+        try:
+            return executor.submit(renderer, *args)
+        except (BrokenProcessPool, RuntimeError) as exc:
+            print(f"Warning: PDF render pool unavailable, rendering in-process: {exc}", flush=True)
+            _reset_executor(executor)
+    future: Future = Future()
+    try:
+        future.set_result(renderer(*args))
+    except Exception as exc:
+        future.set_exception(exc)
+    return future
+
+
+def render(renderer: Callable[..., bytes], *args: Any) -> bytes:
+    """Renders on the pool and waits; the calling thread only blocks, it does not hold the GIL."""
+    future = submit(renderer, *args)
+    try:
+        return future.result(timeout=PDF_RENDER_TIMEOUT_SECONDS)
+    except BrokenProcessPool as exc:
+        # A worker died (e.g. OOM); rebuild the pool for later calls and render here.
+        print(f"Warning: PDF render pool broke, rendering in-process: {exc}", flush=True)
+        executor = _executor
+        if executor is not None:
+            _reset_executor(executor)
+        return renderer(*args)
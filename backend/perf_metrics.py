@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+import contextvars
+import hashlib
+import hmac
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Server-Timing is opt-in: it leaks internal timings to any client.
+SERVER_TIMING_ENABLED = (os.getenv("SERVER_TIMING_ENABLED", "0") or "0").strip().lower() in {"1", "true", "yes"}
+# Same statement fingerprint executed this many times in one request = N+1 suspect.
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10") or "10")
+# Shared secret for /metrics (sent as ?token= or Authorization: Bearer); unset = /metrics answers 404.
+METRICS_TOKEN = (os.getenv("METRICS_TOKEN", "") or "").strip()
+MAX_TRACKED_N_PLUS_ONE = 200
+
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'")
+_IN_LIST_RE = re.compile(r"\bIN\s*\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+|__\[POSTCOMPILE_\w+\])\s*,?)+\)", re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class RequestStats:
+    __slots__ = ("path", "db_seconds", "query_count", "rows", "statements")
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.db_seconds = 0.0
+        self.query_count = 0
+        self.rows = 0
+        self.statements: Counter = Counter()
+
+
+_current_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "autosqp_request_stats",
+    default=None,
+)
+
+
+def get_current_request_stats() -> Optional[RequestStats]:
+    return _current_request_stats.get()
+
+
+def fingerprint_statement(statement: str) -> str:
+    normalized = _STRING_RE.sub("?", statement or "")
+    normalized = _IN_LIST_RE.sub("IN (...)", normalized)
+    normalized = _NUMBER_RE.sub("?", normalized)
+    return _WHITESPACE_RE.sub(" ", normalized).strip()
+
+
+def fingerprint_hash(fingerprint: str) -> str:
+    return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:12]
+
+
+class _RouteMetrics:
+    __slots__ = ("requests", "errors", "wall_seconds", "db_seconds", "queries", "rows", "n_plus_one", "buckets")
+
+    def __init__(self):
+        self.requests: Counter = Counter()
+        self.errors = 0
+        self.wall_seconds = 0.0
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.n_plus_one = 0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[tuple, _RouteMetrics] = defaultdict(_RouteMetrics)
+        # (method, route, fingerprint hash) -> {"statement", "max_repeats", "occurrences"}
+        self._n_plus_one: Dict[tuple, Dict[str, Any]] = {}
+
+    def record(self, method: str, route: str, status_code: int, wall_seconds: float, stats: RequestStats):
+        suspects = [
+            (fingerprint, count)
+            for fingerprint, count in stats.statements.items()
+            if count >= N_PLUS_ONE_THRESHOLD
+        ]
+        with self._lock:
+            metrics = self._routes[(method, route)]
+            metrics.requests[status_code] += 1
+            if status_code >= 500:
+                metrics.errors += 1
+            metrics.wall_seconds += wall_seconds
+            metrics.db_seconds += stats.db_seconds
+            metrics.queries += stats.query_count
+            metrics.rows += stats.rows
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if wall_seconds <= bound:
+                    metrics.buckets[index] += 1
+            if suspects:
+                metrics.n_plus_one += 1
+            for fingerprint, count in suspects:
+                key = (method, route, fingerprint_hash(fingerprint))
+                entry = self._n_plus_one.get(key)
+                if entry is None:
+                    if len(self._n_plus_one) >= MAX_TRACKED_N_PLUS_ONE:
+                        continue
+                    entry = {"statement": fingerprint[:160], "max_repeats": 0, "occurrences": 0}
+                    self._n_plus_one[key] = entry
+                entry["occurrences"] += 1
+                entry["max_repeats"] = max(entry["max_repeats"], count)
+        return suspects
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            routes = {key: value for key, value in self._routes.items()}
+            n_plus_one = {key: dict(value) for key, value in self._n_plus_one.items()}
+
+        lines = [
+            "# HELP autosqp_http_requests_total HTTP requests by route and status.",
+            "# TYPE autosqp_http_requests_total counter",
+        ]
+        for (method, route), metrics in sorted(routes.items()):
+            for status_code, count in sorted(metrics.requests.items()):
+                lines.append(
+                    f'autosqp_http_requests_total{{{_labels(method, route)},status="{status_code}"}} {count}'
+                )
+
+        lines += [
+            "# HELP autosqp_http_request_duration_seconds Wall time per request.",
+            "# TYPE autosqp_http_request_duration_seconds histogram",
+        ]
+        for (method, route), metrics in sorted(routes.items()):
+            labels = _labels(method, route)
+            total = sum(metrics.requests.values())
+            for bound, count in zip(DURATION_BUCKETS, metrics.buckets):
+                lines.append(f'autosqp_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'autosqp_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {total}')
+            lines.append(f"autosqp_http_request_duration_seconds_sum{{{labels}}} {metrics.wall_seconds:.6f}")
+            lines.append(f"autosqp_http_request_duration_seconds_count{{{labels}}} {total}")
+
+        counters = [
+            ("autosqp_http_request_db_seconds_total", "Time spent in SQL per route.", "db_seconds"),
+            ("autosqp_http_request_queries_total", "SQL statements executed per route.", "queries"),
+            ("autosqp_http_request_rows_total", "Rows returned by SQL per route.", "rows"),
+            ("autosqp_http_request_errors_total", "Requests that ended in a 5xx.", "errors"),
+            ("autosqp_http_request_n_plus_one_total", "Requests with a repeated-statement (N+1) pattern.", "n_plus_one"),
+        ]
+        for name, help_text, attribute in counters:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (method, route), metrics in sorted(routes.items()):
+                value = getattr(metrics, attribute)
+                rendered = f"{value:.6f}" if isinstance(value, float) else str(value)
+                lines.append(f"{name}{{{_labels(method, route)}}} {rendered}")
+
+        lines += [
+            "# HELP autosqp_n_plus_one_statement_max_repeats Highest repeat count of a suspected N+1 statement.",
+            "# TYPE autosqp_n_plus_one_statement_max_repeats gauge",
+        ]
+        for (method, route, digest), entry in sorted(n_plus_one.items()):
+            lines.append(
+                "autosqp_n_plus_one_statement_max_repeats{"
+                f'{_labels(method, route)},fingerprint="{digest}",statement="{_escape(entry["statement"])}"'
+                f'}} {entry["max_repeats"]}'
+            )
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self._n_plus_one.clear()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", " ").replace('"', '\\"')
+
+
+def _labels(method: str, route: str) -> str:
+    return f'method="{_escape(method)}",route="{_escape(route)}"'
+
+
+registry = MetricsRegistry()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_request_stats.get() is None:
+        return
+    conn.info.setdefault("autosqp_query_started_at", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_request_stats.get()
+    if stats is None:
+        return
+    started = conn.info.get("autosqp_query_started_at")
+    if started:
+        stats.db_seconds += time.perf_counter() - started.pop()
+    stats.query_count += 1
+    rowcount = getattr(cursor, "rowcount", -1) or 0
+    if rowcount > 0 and statement.lstrip()[:6].upper() == "SELECT":
+        stats.rows += rowcount
+    stats.statements[fingerprint_statement(statement)] += 1
+
+
+def install_sql_hooks(engine: Engine):
+    if getattr(engine, "_autosqp_perf_hooks", False):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    engine._autosqp_perf_hooks = True
+
+
+def _route_label(request: Request) -> str:
+    route = request.scope.get("route")
+    path = getattr(route, "path", None)
+    if path:
+        return path
+    if request.url.path.startswith("/static/"):
+        return "/static"
+    return "unmatched"
+
+
+def install(app: FastAPI, engine: Engine):
+    install_sql_hooks(engine)
+
+    @app.middleware("http")
+    async def request_metrics_middleware(request: Request, call_next):
+        stats = RequestStats(request.url.path)
+        token = _current_request_stats.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+        finally:
+            wall_seconds = time.perf_counter() - started
+            _current_request_stats.reset(token)
+            route = _route_label(request)
+            suspects = registry.record(request.method, route, status_code, wall_seconds, stats)
+            for fingerprint, count in suspects:
+                print(
+                    f"PERF: possible N+1 on {request.method} {route}: {count}x {fingerprint[:160]}",
+                    flush=True,
+                )
+
+        if SERVER_TIMING_ENABLED:
+            response.headers["Server-Timing"] = (
+                f"app;dur={wall_seconds * 1000:.1f}, "
+                f"db;dur={stats.db_seconds * 1000:.1f};desc=\"{stats.query_count} queries\""
+            )
+        return response
+
+
+def ensure_metrics_access(request: Request):
+    # Without a configured token the endpoint does not exist.
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    provided = request.query_params.get("token") or ""
+    authorization = request.headers.get("authorization") or ""
+    if authorization.lower().startswith("bearer "):
+        provided = authorization[7:].strip()
+    if not hmac.compare_digest(provided.encode("utf-8"), METRICS_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Not authorized", headers={"WWW-Authenticate": "Bearer"})
+
+
+def render_prometheus() -> str:
+    return registry.render_prometheus()
@@ -0,0 +1,33 @@
+"""
+Rebuild the receipt search documents (receipt_search_documents) from the
+receipts and their sales, vehicles, leads and credit applications.
+
+The API keeps the documents current; run this after bulk changes made
+outside the ORM (SQL scripts, imports).
+
+Usage:
+    python rebuild_receipt_search.py
+    python rebuild_receipt_search.py --company-id 3
+    python rebuild_receipt_search.py --missing-only
+"""
+import argparse
+import sys
+
+import receipt_search
+from database import engine
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Rebuild receipt search documents")
+    parser.add_argument("--company-id", type=int, default=None)
+    parser.add_argument("--missing-only", action="store_true")
+    args = parser.parse_args()
+
+    with engine.begin() as conn:
+        total = receipt_search.rebuild_documents(conn, company_id=args.company_id, missing_only=args.missing_only)
+    print(f"Indexed {total} receipt(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
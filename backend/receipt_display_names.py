@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, event, inspect as sa_inspect, or_, select, update
+from sqlalchemy.orm import Session
+
+import models
+
+# Receipts of one movement are often registered separately (same receipt
+# number or same sale) and only some of them carry a display name. The best
+# name of each group is stored on every receipt as group_display_name, kept
+# current after each flush that touches a receipt's name, number or sale, so
+# listings read it straight from the row (PaymentReceipt.resolved_display_name).
+
+GROUP_CHUNK_SIZE = 500
+
+GroupKey = Tuple[int, str, object]  # (company_id, "number" | "sale", value)
+
+
+def pick_best_display_name(candidates: Iterable[Optional[str]]) -> Optional[str]:
+    cleaned_candidates = [candidate.strip() for candidate in candidates if (candidate or "").strip()]
+    if not cleaned_candidates:
+        return None
+
+    def _display_name_score(value: str) -> Tuple[int, int, int]:
+        has_digits = 1 if any(char.isdigit() for char in value) else 0
+        word_count = len(value.split())
+        return (has_digits, word_count, len(value))
+
+    return max(cleaned_candidates, key=_display_name_score)
+
+
+def _group_filter(numbers: Set[str], sale_ids: Set[int]):
+    filters = []
+    if numbers:
+        filters.append(models.PaymentReceipt.receipt_number.in_(numbers))
+    if sale_ids:
+        filters.append(models.PaymentReceipt.sale_id.in_(sale_ids))
+    return or_(*filters)
+
+
+def _refresh_company_groups(connection, company_id: int, numbers: Set[str], sale_ids: Set[int]) -> int:
+    receipts = models.PaymentReceipt
+    members = connection.execute(
+        select(receipts.id, receipts.receipt_number, receipts.sale_id, receipts.group_display_name)
+        .where(receipts.company_id == company_id, _group_filter(numbers, sale_ids))
+    ).all()
+    if not members:
+        return 0
+
+    # A member's name comes from its own number group first, then its sale group.
+    member_numbers = {(row.receipt_number or "").strip() for row in members} - {""}
+    member_sale_ids = {row.sale_id for row in members if row.sale_id}
+    candidates_by_number: Dict[str, List[str]] = {}
+    candidates_by_sale: Dict[int, List[str]] = {}
+    named_rows = connection.execute(
+        select(receipts.receipt_number, receipts.sale_id, receipts.display_name)
+        .where(
+            receipts.company_id == company_id,
+            receipts.display_name.isnot(None),
+            receipts.display_name != "",
+            _group_filter(member_numbers, member_sale_ids),
+        )
+        .order_by(receipts.payment_date.desc(), receipts.id.desc())
+    ).all()
+    for row in named_rows:
+        receipt_number = (row.receipt_number or "").strip()
+        if receipt_number:
+            candidates_by_number.setdefault(receipt_number, []).append(row.display_name)
+        if row.sale_id:
+            candidates_by_sale.setdefault(row.sale_id, []).append(row.display_name)
+
+    best_by_number = {key: pick_best_display_name(names) for key, names in candidates_by_number.items()}
+    best_by_sale = {key: pick_best_display_name(names) for key, names in candidates_by_sale.items()}
+    changes = []
+    for row in members:
+        group_name = best_by_number.get((row.receipt_number or "").strip()) or best_by_sale.get(row.sale_id)
+        if group_name != row.group_display_name:
+            changes.append({"receipt_id": row.id, "group_name": group_name})
+    if changes:
+        connection.execute(
+            update(receipts.__table__)
+            .where(receipts.__table__.c.id == bindparam("receipt_id"))
+            .values(group_display_name=bindparam("group_name")),
+            changes,
+        )
+    return len(changes)
+
+
+def refresh_groups(connection, groups: Iterable[GroupKey]) -> int:
+    by_company: Dict[int, Tuple[Set[str], Set[int]]] = {}
+    for company_id, kind, value in groups:
+        if not company_id or not value:
+            continue
+        numbers, sale_ids = by_company.setdefault(company_id, (set(), set()))
+        if kind == "number":
+            numbers.add(value)
+        else:
+            sale_ids.add(value)
+    updated = 0
+    for company_id, (numbers, sale_ids) in by_company.items():
+        updated += _refresh_company_groups(connection, company_id, numbers, sale_ids)
+    return updated
+
+
+def rebuild_group_display_names(connection, company_id: Optional[int] = None) -> int:
+    """Recomputes every group, a chunk of receipt numbers and sales at a time."""
+    receipts = models.PaymentReceipt
+    company_query = select(receipts.company_id).distinct()
+    if company_id:
+        company_query = company_query.where(receipts.company_id == company_id)
+    updated = 0
+    for current_company_id in connection.execute(company_query).scalars().all():
+        scope = receipts.company_id == current_company_id
+        numbers = sorted({
+            (value or "").strip()
+            for value in connection.execute(select(receipts.receipt_number).where(scope).distinct()).scalars()
+        } - {""})
+        sale_ids = sorted(
+            connection.execute(select(receipts.sale_id).where(scope, receipts.sale_id.isnot(None)).distinct()).scalars()
+        )
+        for start in range(0, len(numbers), GROUP_CHUNK_SIZE):
+            updated += _refresh_company_groups(connection, current_company_id, set(numbers[start:start + GROUP_CHUNK_SIZE]), set())
+        for start in range(0, len(sale_ids), GROUP_CHUNK_SIZE):
+            updated += _refresh_company_groups(connection, current_company_id, set(), set(sale_ids[start:start + GROUP_CHUNK_SIZE]))
+    return updated
+
+
+def _receipt_groups(receipt: models.PaymentReceipt, include_previous: bool) -> Set[GroupKey]:
+    state = sa_inspect(receipt)
+    values = {
+        field: {getattr(receipt, field)} | (set(state.attrs[field].history.deleted or ()) if include_previous else set())
+        for field in ("company_id", "receipt_number", "sale_id")
+    }
+    groups: Set[GroupKey] = set()
+    for company_id in values["company_id"]:
+        for receipt_number in values["receipt_number"]:
+            if (receipt_number or "").strip():
+                groups.add((company_id, "number", receipt_number.strip()))
+        for sale_id in values["sale_id"]:
+            if sale_id:
+                groups.add((company_id, "sale", sale_id))
+    return groups
+
+
+@event.listens_for(Session, "after_flush")
+def _refresh_group_names_after_flush(session: Session, flush_context):
+    groups: Set[GroupKey] = set()
+    for instance in session.new:
+        if isinstance(instance, models.PaymentReceipt):
+            groups |= _receipt_groups(instance, include_previous=False)
+    for instance in session.deleted:
+        if isinstance(instance, models.PaymentReceipt):
+            groups |= _receipt_groups(instance, include_previous=True)
+    for instance in session.dirty:
+        if not isinstance(instance, models.PaymentReceipt) or instance in session.deleted:
+            continue
+        state = sa_inspect(instance)
+        if any(state.attrs[field].history.has_changes() for field in ("display_name", "receipt_number", "sale_id", "company_id")):
+            groups |= _receipt_groups(instance, include_previous=True)
+    if groups:
+        refresh_groups(session.connection(), groups)
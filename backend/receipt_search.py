@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import delete, event, insert, inspect as sa_inspect, or_, select
+from sqlalchemy.orm import Session
+
+import models
+
+# Receipt search reads one row per receipt from receipt_search_documents: the
+# normalized (lowercase, no accents) text of the receipt and of its sale,
+# vehicle, lead, credit applications and public credit submissions. The
+# documents are rebuilt after every flush that changes one of those fields, so
+# a search is a single indexed lookup (FULLTEXT ngram on MySQL) instead of a
+# join over all of those tables.
+
+DOCUMENT_CHUNK_SIZE = 500
+# MySQL's default ngram_token_size; shorter terms only use the LIKE filter.
+NGRAM_TOKEN_SIZE = 2
+_SEPARATOR = " | "
+
+RECEIPT_FIELDS = (
+    "display_name", "customer_name", "customer_document", "concept",
+    "receipt_number", "notes", "payment_method", "bank",
+)
+SALE_FIELDS = (
+    "external_seller_name", "tax_seller_name", "tax_seller_document",
+    "tax_buyer_name", "tax_buyer_document",
+)
+VEHICLE_FIELDS = ("make", "model", "plate")
+LEAD_FIELDS = ("name", "email", "phone")
+CREDIT_FIELDS = ("client_name", "email", "phone")
+SUBMISSION_FIELDS = ("applicant_name", "document_number", "email", "phone")
+
+
+def normalize_search_text(value) -> str:
+    normalized = unicodedata.normalize("NFKD", str(value or ""))
+    normalized = "".join(char for char in normalized if not unicodedata.combining(char))
+    return re.sub(r"\s+", " ", normalized).strip().lower()
+
+
+def _labeled(model, prefix: str, fields: Iterable[str]):
+    return [getattr(model, field).label(f"{prefix}_{field}") for field in fields]
+
+
+def _lead_texts(connection, lead_ids: Set[int]) -> Dict[int, List[str]]:
+    texts: Dict[int, List[str]] = {}
+    if not lead_ids:
+        return texts
+    for model, fields in (
+        (models.CreditApplication, CREDIT_FIELDS),
+        (models.PublicCreditSubmission, SUBMISSION_FIELDS),
+    ):
+        rows = connection.execute(
+            select(model.lead_id, *[getattr(model, field) for field in fields])
+            .where(model.lead_id.in_(lead_ids))
+            .order_by(model.id)
+        ).all()
+        for row in rows:
+            texts.setdefault(row[0], []).extend(row[1:])
+    return texts
+
+
+def _build_documents(connection, receipt_ids: List[int]) -> List[dict]:
+    rows = connection.execute(
+        select(
+            models.PaymentReceipt.id,
+            models.PaymentReceipt.company_id,
+            models.PaymentReceipt.sale_id,
+            models.Sale.lead_id,
+            *_labeled(models.PaymentReceipt, "receipt", RECEIPT_FIELDS),
+            *_labeled(models.Vehicle, "vehicle", VEHICLE_FIELDS),
+            *_labeled(models.Sale, "sale", SALE_FIELDS),
+            *_labeled(models.Lead, "lead", LEAD_FIELDS),
+        )
+        .select_from(models.PaymentReceipt)
+        .outerjoin(models.Sale, models.Sale.id == models.PaymentReceipt.sale_id)
+        .outerjoin(models.Vehicle, models.Vehicle.id == models.Sale.vehicle_id)
+        .outerjoin(models.Lead, models.Lead.id == models.Sale.lead_id)
+        .where(models.PaymentReceipt.id.in_(receipt_ids))
+    ).mappings().all()
+
+    lead_texts = _lead_texts(connection, {row["lead_id"] for row in rows if row["lead_id"]})
+    documents = []
+    for row in rows:
+        values = [row[f"receipt_{field}"] for field in RECEIPT_FIELDS]
+        values += [row[f"vehicle_{field}"] for field in VEHICLE_FIELDS]
+        values += [row[f"sale_{field}"] for field in SALE_FIELDS]
+        values += [row[f"lead_{field}"] for field in LEAD_FIELDS]
+        values += lead_texts.get(row["lead_id"], [])
+        parts: List[str] = []
+        for value in values:
+            part = normalize_search_text(value)
+            if part and part not in parts:
+                parts.append(part)
+        documents.append({
+            "receipt_id": row["id"],
+            "company_id": row["company_id"],
+            "sale_id": row["sale_id"],
+            "receipt_number": (row["receipt_receipt_number"] or "").strip() or None,
+            "search_text": _SEPARATOR.join(parts),
+        })
+    return documents
+
+
+def refresh_documents(connection, receipt_ids: Iterable[int]) -> int:
+    """Rebuilds the documents of the given receipts; receipts that no longer exist lose theirs."""
+    ids = sorted({int(receipt_id) for receipt_id in receipt_ids if receipt_id})
+    table = models.ReceiptSearchDocument.__table__
+    written = 0
+    for start in range(0, len(ids), DOCUMENT_CHUNK_SIZE):
+        chunk = ids[start:start + DOCUMENT_CHUNK_SIZE]
+        documents = _build_documents(connection, chunk)
+        connection.execute(delete(table).where(table.c.receipt_id.in_(chunk)))
+        if documents:
+            connection.execute(insert(table), documents)
+        written += len(documents)
+    return written
+
+
+def refresh_vehicle_documents(connection, vehicle_ids: Iterable[int]) -> int:
+    """Rebuilds the documents of receipts whose sale is for one of the vehicles (bulk vehicle UPDATEs)."""
+    ids = sorted({int(vehicle_id) for vehicle_id in vehicle_ids if vehicle_id})
+    receipt_ids: Set[int] = set()
+    for start in range(0, len(ids), DOCUMENT_CHUNK_SIZE):
+        receipt_ids |= set(connection.execute(
+            select(models.PaymentReceipt.id)
+            .join(models.Sale, models.Sale.id == models.PaymentReceipt.sale_id)
+            .where(models.Sale.vehicle_id.in_(ids[start:start + DOCUMENT_CHUNK_SIZE]))
+        ).scalars())
+    return refresh_documents(connection, receipt_ids)
+
+
+def rebuild_documents(connection, company_id: Optional[int] = None, missing_only: bool = False) -> int:
+    """Indexes every receipt (or only those without a document) in id order."""
+    documents = models.ReceiptSearchDocument
+    written = 0
+    last_id = 0
+    while True:
+        query = select(models.PaymentReceipt.id).where(models.PaymentReceipt.id > last_id)
+        if company_id:
+            query = query.where(models.PaymentReceipt.company_id == company_id)
+        if missing_only:
+            query = query.where(~select(documents.receipt_id).where(
+                documents.receipt_id == models.PaymentReceipt.id
+            ).exists())
+        chunk = list(connection.execute(
+            query.order_by(models.PaymentReceipt.id).limit(DOCUMENT_CHUNK_SIZE)
+        ).scalars())
+        if not chunk:
+            return written
+        written += refresh_documents(connection, chunk)
+        last_id = chunk[-1]
+
+
+def matching_documents(db: Session, search_term: str, company_id: Optional[int] = None):
+    """SELECT of (receipt_id, sale_id, receipt_number) whose document contains the term."""
+    documents = models.ReceiptSearchDocument
+    needle = normalize_search_text(search_term)
+    query = select(documents.receipt_id, documents.sale_id, documents.receipt_number)
+    if company_id:
+        query = query.where(documents.company_id == company_id)
+    phrase = needle.replace('"', " ").strip()
+    if db.get_bind().dialect.name == "mysql" and len(phrase) >= NGRAM_TOKEN_SIZE:
+        # The FULLTEXT phrase narrows the candidates; LIKE keeps exact substring semantics.
+        query = query.where(documents.search_text.match(f'"{phrase}"'))
+    return query.where(documents.search_text.contains(needle, autoescape=True))
+
+
+def _changed(instance, fields: Iterable[str]) -> bool:
+    state = sa_inspect(instance)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+def _previous_and_current(instance, field: str) -> Set[int]:
+    history = sa_inspect(instance).attrs[field].history
+    values = set(history.deleted or ()) | {getattr(instance, field)}
+    return {value for value in values if value}
+
+
+@event.listens_for(Session, "after_flush")
+def _refresh_documents_after_flush(session: Session, flush_context):
+    receipt_ids: Set[int] = set()
+    removed_receipt_ids: Set[int] = set()
+    sale_ids: Set[int] = set()
+    vehicle_ids: Set[int] = set()
+    lead_ids: Set[int] = set()
+
+    for instance in session.new:
+        if isinstance(instance, models.PaymentReceipt):
+            receipt_ids.add(instance.id)
+        elif isinstance(instance, (models.CreditApplication, models.PublicCreditSubmission)) and instance.lead_id:
+            lead_ids.add(instance.lead_id)
+
+    for instance in session.deleted:
+        if isinstance(instance, models.PaymentReceipt):
+            removed_receipt_ids.add(instance.id)
+        elif isinstance(instance, (models.CreditApplication, models.PublicCreditSubmission)):
+            lead_ids |= _previous_and_current(instance, "lead_id")
+
+    for instance in session.dirty:
+        if instance in session.deleted:
+            continue
+        if isinstance(instance, models.PaymentReceipt):
+            if _changed(instance, RECEIPT_FIELDS + ("sale_id", "company_id")):
+                receipt_ids.add(instance.id)
+        elif isinstance(instance, models.Sale):
+            if _changed(instance, SALE_FIELDS + ("vehicle_id", "lead_id")):
+                sale_ids.add(instance.id)
+        elif isinstance(instance, models.Vehicle):
+            if _changed(instance, VEHICLE_FIELDS):
+                vehicle_ids.add(instance.id)
+        elif isinstance(instance, models.Lead):
+            if _changed(instance, LEAD_FIELDS):
+                lead_ids.add(instance.id)
+        elif isinstance(instance, models.CreditApplication):
+            if _changed(instance, CREDIT_FIELDS + ("lead_id",)):
+                lead_ids |= _previous_and_current(instance, "lead_id")
+        elif isinstance(instance, models.PublicCreditSubmission):
+            if _changed(instance, SUBMISSION_FIELDS + ("lead_id",)):
+                lead_ids |= _previous_and_current(instance, "lead_id")
+
+    if not (receipt_ids or removed_receipt_ids or sale_ids or vehicle_ids or lead_ids):
+        return
+    connection = session.connection()
+    related_sales = []
+    if sale_ids:
+        related_sales.append(models.PaymentReceipt.sale_id.in_(sale_ids))
+    if vehicle_ids:
+        related_sales.append(models.PaymentReceipt.sale_id.in_(
+            select(models.Sale.id).where(models.Sale.vehicle_id.in_(vehicle_ids))
+        ))
+    if lead_ids:
+        related_sales.append(models.PaymentReceipt.sale_id.in_(
+            select(models.Sale.id).where(models.Sale.lead_id.in_(lead_ids))
+        ))
+    if related_sales:
+        receipt_ids |= set(connection.execute(
+            select(models.PaymentReceipt.id).where(or_(*related_sales))
+        ).scalars())
+    # Receipts deleted in this flush are gone from payment_receipts, so
+    # refreshing them only removes their documents.
+    refresh_documents(connection, receipt_ids | removed_receipt_ids)
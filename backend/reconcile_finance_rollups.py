@@ -0,0 +1,31 @@
+"""
+Rebuild the finance monthly rollups (finance_monthly_rollups) from the sales
+and payment receipts with one GROUP BY per table.
+
+Run nightly from cron; the API adjusts the rollups on every sale and receipt
+change between runs, and after bulk changes made outside the ORM.
+
+Usage:
+    python reconcile_finance_rollups.py
+    python reconcile_finance_rollups.py --company-id 3
+"""
+import argparse
+import sys
+
+import finance_rollups
+from database import engine
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Rebuild finance monthly rollups")
+    parser.add_argument("--company-id", type=int, default=None)
+    args = parser.parse_args()
+
+    with engine.begin() as conn:
+        total = finance_rollups.rebuild_rollups(conn, company_id=args.company_id)
+    print(f"Rebuilt {total} company month(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
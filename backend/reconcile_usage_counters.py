@@ -0,0 +1,31 @@
+"""
+Recount the per-company license usage counters (leads in the license period,
+users and active users) from the source tables.
+
+Run nightly from cron; the API keeps the counters up to date between runs.
+
+Usage:
+    python reconcile_usage_counters.py
+    python reconcile_usage_counters.py --company-id 3
+"""
+import argparse
+import sys
+
+import license_usage
+from database import SessionLocal
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Reconcile company license usage counters")
+    parser.add_argument("--company-id", type=int, default=None)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        total = license_usage.reconcile_usage_counters(db, args.company_id)
+        db.commit()
+    print(f"Reconciled usage counters for {total} company(ies)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
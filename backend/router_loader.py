@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import importlib
+import os
+import threading
+from typing import Dict, Iterable, List
+
+from fastapi import FastAPI
+
+# eager: import and mount every router at boot (previous behaviour).
+# lazy: mount core routers at boot, the rest on the first request to their prefix.
+ROUTER_LOAD_MODE = (os.getenv("ROUTER_LOAD_MODE", "eager") or "eager").strip().lower()
+
+
+class RouterLoader:
+    def __init__(self, app: FastAPI, core_modules: Iterable[str], optional_modules: Iterable[str]):
+        self.app = app
+        self.core_modules = list(core_modules)
+        self.optional_modules = list(optional_modules)
+        self.loaded: Dict[str, bool] = {}
+        self.prefixes: Dict[str, str] = {
+            f"/{module_name}": module_name for module_name in self.optional_modules
+        }
+        self._lock = threading.Lock()
+
+    def load(self, module_name: str) -> bool:
+        if self.loaded.get(module_name):
+            return False
+        with self._lock:
+            if self.loaded.get(module_name):
+                return False
+            module = importlib.import_module(f"routers.{module_name}")
+            self.app.include_router(module.router)
+            self.loaded[module_name] = True
+            # Regenerate /docs with the new routes on the next request.
+            self.app.openapi_schema = None
+            return True
+
+    def load_boot_modules(self, mode: str = ROUTER_LOAD_MODE) -> List[str]:
+        boot_modules = self.core_modules if mode == "lazy" else self.core_modules + self.optional_modules
+        for module_name in boot_modules:
+            self.load(module_name)
+        return boot_modules
+
+    def load_for_path(self, path: str) -> bool:
+        segment = "/" + path.lstrip("/").split("/", 1)[0]
+        module_name = self.prefixes.get(segment)
+        if not module_name:
+            return False
+        return self.load(module_name)
+
+    def install_middleware(self):
+        loader = self
+
+        @self.app.middleware("http")
+        async def lazy_router_middleware(request, call_next):
+            loader.load_for_path(request.url.path)
+            return await call_next(request)
+
+    def status(self) -> Dict[str, bool]:
+        return {
+            module_name: bool(self.loaded.get(module_name))
+            for module_name in self.core_modules + self.optional_modules
+        }
@@ -6,9 +6,7 @@ import datetime
 from database import get_db
 import models, schemas
 from dependencies import get_current_user
-import os
-import shutil
-import uuid
+import upload_store
 import json
 
 router = APIRouter(
@@ -917,7 +915,7 @@ def add_credit_note(
     return {"credit": credit, "lead_note": lead_note}
 
 @router.post("/{credit_id}/files", response_model=schemas.LeadFile)
-async def upload_credit_file(
+def upload_credit_file(
     credit_id: int,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
@@ -939,19 +937,13 @@ async def upload_credit_file(
     if not credit.lead_id:
         raise HTTPException(status_code=400, detail="Credit application has no related lead")
 
-    os.makedirs("static/leads", exist_ok=True)
-    file_extension = file.filename.split(".")[-1]
-    unique_filename = f"{uuid.uuid4()}.{file_extension}"
-    file_path = f"static/leads/{unique_filename}"
-
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    stored = upload_store.store_upload(db, file)
 
     db_file = models.LeadFile(
         lead_id=credit.lead_id,
         user_id=current_user.id,
         file_name=file.filename,
-        file_path=f"/{file_path}",
+        file_path=f"/{stored.path}",
         file_type=file.content_type
     )
     db.add(db_file)
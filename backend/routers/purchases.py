@@ -4,9 +4,7 @@ from typing import Optional
 from database import get_db
 import models, schemas
 from dependencies import get_current_user
-import os
-import shutil
-import uuid
+import upload_store
 import json
 import random
 import datetime
@@ -311,17 +309,8 @@ def _resolve_lead_status_for_history(lead: Optional[models.Lead], fallback: str
     return status_value or fallback
 
 
-def _store_purchase_option_photos(files):
-    os.makedirs("static/purchase-options", exist_ok=True)
-    stored_paths = []
-    for file in files:
-        extension = file.filename.split(".")[-1]
-        unique_filename = f"{uuid.uuid4()}.{extension}"
-        file_path = f"static/purchase-options/{unique_filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        stored_paths.append(f"/{file_path}")
-    return stored_paths
+def _store_purchase_option_photos(db: Session, files):
+    return [f"/{upload_store.store_upload(db, file).path}" for file in files]
 
 
 def _refresh_purchase_status_from_options(db: Session, purchase: Optional[models.CreditApplication]):
@@ -1052,7 +1041,7 @@ def add_purchase_note(
 
 
 @router.post("/{purchase_id}/files", response_model=schemas.LeadFile)
-async def upload_purchase_file(
+def upload_purchase_file(
     purchase_id: int,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
@@ -1068,19 +1057,13 @@ async def upload_purchase_file(
     if not purchase.lead_id:
         raise HTTPException(status_code=400, detail="Purchase request has no related lead")
 
-    os.makedirs("static/leads", exist_ok=True)
-    file_extension = file.filename.split(".")[-1]
-    unique_filename = f"{uuid.uuid4()}.{file_extension}"
-    file_path = f"static/leads/{unique_filename}"
-
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    stored = upload_store.store_upload(db, file)
 
     db_file = models.LeadFile(
         lead_id=purchase.lead_id,
         user_id=current_user.id,
         file_name=file.filename,
-        file_path=f"/{file_path}",
+        file_path=f"/{stored.path}",
         file_type=file.content_type
     )
     db.add(db_file)
@@ -1123,7 +1106,7 @@ def get_purchase_options(
 
 
 @router.post("/{purchase_id}/options", response_model=schemas.PurchaseOption)
-async def create_purchase_option(
+def create_purchase_option(
     purchase_id: int,
     title: str = Form(...),
     description: str = Form(""),
@@ -1146,7 +1129,7 @@ async def create_purchase_option(
         joinedload(models.Lead.supervisors).joinedload(models.User.role)
     ).filter(models.Lead.id == purchase.lead_id).first()
 
-    photo_paths = _store_purchase_option_photos(photos)
+    photo_paths = _store_purchase_option_photos(db, photos)
     option = models.PurchaseOption(
         lead_id=purchase.lead_id,
         user_id=current_user.id,
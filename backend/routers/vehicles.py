@@ -3,11 +3,10 @@ from sqlalchemy.orm import Session
 from sqlalchemy import or_
 from typing import List, Optional
 import models, schemas
+import background_jobs
+import company_domains
+import vehicle_catalogue
 from database import get_db
-import os
-import shutil
-import json
-from import_vehicles_from_excel import import_inventory
 
 # Attempting to import log_action_to_db (will require circular import bypassing if done wrong, but from main is fine if deferred)
 # Instead of direct import which might cause circular loops since main imports routers, we'll rewrite log_action_to_db directly or use it inline:
@@ -40,59 +39,10 @@ router = APIRouter(
 )
 
 
-def normalize_public_host(raw_host: Optional[str]) -> str:
-    host = (raw_host or "").strip().lower()
-    if not host:
-        return ""
-    if ":" in host:
-        host = host.split(":", 1)[0]
-    if host.startswith("www."):
-        host = host[4:]
-    return host
-
-
-def normalize_public_domains(company) -> List[str]:
-    raw_json = getattr(company, "public_domains_json", None)
-    values = []
-    if raw_json:
-        try:
-            decoded = json.loads(raw_json)
-            if isinstance(decoded, list):
-                values.extend(decoded)
-        except Exception:
-            pass
-    if getattr(company, "public_domain", None):
-        values.insert(0, company.public_domain)
-
-    normalized = []
-    for value in values:
-        normalized_value = normalize_public_host(value)
-        if normalized_value and normalized_value not in normalized:
-            normalized.append(normalized_value)
-    return normalized
-
-
 def resolve_public_company_id(db: Session, request: Optional[Request]) -> Optional[int]:
     if request is None:
         return None
-
-    host = normalize_public_host(request.headers.get("host"))
-    if not host:
-        return None
-
-    direct_company = db.query(models.Company.id).filter(models.Company.public_domain.ilike(host)).first()
-    if direct_company:
-        return direct_company[0]
-
-    for company in db.query(models.Company.id, models.Company.public_domain, models.Company.public_domains_json).all():
-        if host in normalize_public_domains(company):
-            return company.id
-
-    if host in {"autosqp.com", "autosqp.co"}:
-        company = db.query(models.Company.id).order_by(models.Company.id.asc()).first()
-        return company[0] if company else None
-
-    return None
+    return company_domains.resolve_company_id(db, request.headers.get("host"))
 
 def get_effective_role_name(role) -> str:
     if not role:
@@ -148,64 +98,34 @@ def get_public_vehicles(
 ):
     """
     Public endpoint to fetch available vehicles.
-    No authentication required.
+    No authentication required. Served from the catalogue snapshot.
     """
     resolved_company_id = company_id or resolve_public_company_id(db, request)
-    query = db.query(models.Vehicle).filter(models.Vehicle.status == "available")
-
-    if resolved_company_id:
-        query = query.filter(models.Vehicle.company_id == resolved_company_id)
-
-    if q:
-        search = f"%{q}%"
-        query = query.filter(
-            or_(
-                models.Vehicle.make.ilike(search),
-                models.Vehicle.model.ilike(search),
-                models.Vehicle.description.ilike(search)
-            )
-        )
-
-    if make:
-        query = query.filter(models.Vehicle.make.ilike(f"%{make}%"))
-    
-    if model:
-        query = query.filter(models.Vehicle.model.ilike(f"%{model}%"))
-
-    if year_from:
-        query = query.filter(models.Vehicle.year >= year_from)
-    
-    if year_to:
-        query = query.filter(models.Vehicle.year <= year_to)
-
-    if price_min:
-        query = query.filter(models.Vehicle.price >= price_min)
-    
-    if price_max:
-        query = query.filter(models.Vehicle.price <= price_max)
-
-    if mileage_min:
-        query = query.filter(models.Vehicle.mileage >= mileage_min)
-
-    if mileage_max:
-        query = query.filter(models.Vehicle.mileage <= mileage_max)
-    
-    if color:
-        query = query.filter(models.Vehicle.color.ilike(f"%{color}%"))
-
-    if sort_by == "price_desc":
-        query = query.order_by(models.Vehicle.price.desc(), models.Vehicle.id.desc())
-    elif sort_by == "price_asc":
-        query = query.order_by(models.Vehicle.price.asc(), models.Vehicle.id.desc())
-    elif sort_by == "mileage_desc":
-        query = query.order_by(models.Vehicle.mileage.desc(), models.Vehicle.id.desc())
-    elif sort_by == "mileage_asc":
-        query = query.order_by(models.Vehicle.mileage.asc(), models.Vehicle.id.desc())
-    else:
-        query = query.order_by(models.Vehicle.status.asc())
-        query = query.order_by(models.Vehicle.created_at.desc() if hasattr(models.Vehicle, 'created_at') else models.Vehicle.id.desc())
-
-    return query.offset(skip).limit(limit).all()
+    snapshot = vehicle_catalogue.get_snapshot(db, resolved_company_id)
+    return vehicle_catalogue.cached_response(request, snapshot, "list", lambda: snapshot.search(
+        q=q,
+        make=make,
+        model=model,
+        color=color,
+        year_from=year_from,
+        year_to=year_to,
+        price_min=price_min,
+        price_max=price_max,
+        mileage_min=mileage_min,
+        mileage_max=mileage_max,
+        sort_by=sort_by,
+        skip=max(skip, 0),
+        limit=min(max(limit, 1), vehicle_catalogue.MAX_PAGE_SIZE),
+    ))
+
+@router.get("/public/facets", response_model=schemas.VehicleCatalogueFacets)
+def get_public_vehicle_facets(request: Request, company_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Makes, models, colors, years and price/mileage histograms of the available vehicles.
+    """
+    resolved_company_id = company_id or resolve_public_company_id(db, request)
+    snapshot = vehicle_catalogue.get_snapshot(db, resolved_company_id)
+    return vehicle_catalogue.cached_response(request, snapshot, "facets", lambda: snapshot.facets)
 
 @router.get("/public/{vehicle_id}", response_model=schemas.Vehicle)
 def get_public_vehicle(vehicle_id: int, request: Request, db: Session = Depends(get_db)):
@@ -214,16 +134,11 @@ def get_public_vehicle(vehicle_id: int, request: Request, db: Session = Depends(
     No authentication required.
     """
     resolved_company_id = resolve_public_company_id(db, request)
-    query = db.query(models.Vehicle).filter(
-        models.Vehicle.id == vehicle_id,
-        models.Vehicle.status == "available"
-    )
-    if resolved_company_id:
-        query = query.filter(models.Vehicle.company_id == resolved_company_id)
-    vehicle = query.first()
+    snapshot = vehicle_catalogue.get_snapshot(db, resolved_company_id)
+    vehicle = snapshot.by_id.get(vehicle_id)
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found or not available")
-    return vehicle
+    return vehicle_catalogue.cached_response(request, snapshot, f"vehicle-{vehicle_id}", lambda: vehicle)
 
 @router.get("/makes", response_model=List[str])
 def get_available_makes(request: Request, db: Session = Depends(get_db)):
@@ -231,11 +146,10 @@ def get_available_makes(request: Request, db: Session = Depends(get_db)):
     Get list of unique makes from available vehicles
     """
     resolved_company_id = resolve_public_company_id(db, request)
-    query = db.query(models.Vehicle.make).filter(models.Vehicle.status == "available")
-    if resolved_company_id:
-        query = query.filter(models.Vehicle.company_id == resolved_company_id)
-    makes = query.distinct().all()
-    return [m[0] for m in makes if m[0]]
+    snapshot = vehicle_catalogue.get_snapshot(db, resolved_company_id)
+    return vehicle_catalogue.cached_response(
+        request, snapshot, "makes", lambda: [facet["value"] for facet in snapshot.facets["makes"]]
+    )
 
 # --- CRUD Endpoints (Protected) ---
 from dependencies import get_current_user
@@ -298,14 +212,16 @@ def read_vehicles(
     
     return {"items": items, "total": total}
 
-@router.post("/upload")
+@router.post("/upload", response_model=schemas.InventoryImportResult)
 def upload_vehicles_excel(
     file: UploadFile = File(...),
+    dry_run: bool = False,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """
-    Sube un archivo Excel y lanza el script de importaciÃ³n masiva.
+    Sube un archivo Excel de inventario. Con dry_run=true solo devuelve los cambios
+    que se harían; los archivos grandes se aplican en segundo plano (GET /jobs/{id}).
     """
     ensure_inventory_editor(current_user)
     if not current_user.company_id:
@@ -314,30 +230,44 @@ def upload_vehicles_excel(
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="El archivo debe ser un Excel (.xlsx o .xls)")
 
-    # Save temp file
-    temp_file_path = f"temp_upload_{file.filename}"
+    # Import diferido: pandas no debe cargarse al arrancar los workers.
+    import inventory_import
+    company_id = current_user.company_id
+    actor_id = current_user.id
     try:
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Ejecutar el importador pasando la ruta temporal y el id de firma
-        results = import_inventory(file_path=temp_file_path, default_company_id=current_user.company_id)
-        
-        if "error" in results:
-            raise HTTPException(status_code=500, detail=results["error"])
-            
-        log_action_to_db(db, current_user.id, "IMPORT_EXCEL", "Vehicle", None, f"Importados correctamente mediante Excel")
-            
+        frame = inventory_import.parse_inventory(file.file)
+        plan = inventory_import.plan_import(db, frame, company_id)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"No se pudo leer el archivo de inventario: {str(e)}")
+
+    if dry_run:
+        return inventory_import.summarize(plan, dry_run=True)
+
+    def run_import(job_db: Session, progress=None):
+        results = inventory_import.apply_plan(job_db, plan, progress=progress)
+        log_action_to_db(
+            job_db, actor_id, "IMPORT_EXCEL", "Vehicle", None,
+            f"Importados mediante Excel: {results['inserted']} nuevos, {results['updated']} actualizados",
+        )
         return results
+
+    pending = len(plan["inserts"]) + len(plan["updates"])
+    try:
+        if pending > inventory_import.INVENTORY_IMPORT_BACKGROUND_THRESHOLD:
+            job = background_jobs.submit_job(
+                db,
+                kind="inventory_import",
+                total=pending,
+                handler=run_import,
+                company_id=company_id,
+                created_by_id=actor_id,
+                payload={"file_name": file.filename, "rows": len(frame)},
+            )
+            return {**inventory_import.summarize(plan, dry_run=False), "job_id": job.id, "status": job.status}
+        return run_import(db)
     except Exception as e:
+        db.rollback()
         raise HTTPException(status_code=500, detail=f"Error interno durante la importaciÃ³n: {str(e)}")
-    finally:
-        # Clean up temp file
-        if os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-            except:
-                pass
 
 @router.get("/{vehicle_id}", response_model=schemas.Vehicle)
 def read_vehicle(vehicle_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
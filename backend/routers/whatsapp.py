@@ -4,12 +4,12 @@ from fastapi.responses import PlainTextResponse
 from sqlalchemy.orm import Session, joinedload
 from database import get_db
 import models, schemas_whatsapp, auth_utils
+import image_derivatives
+import upload_store
 from typing import List, Optional
 import os
 import json
 import datetime
-import shutil
-import uuid
 import requests
 from bot_integration import (
     process_channel_bot_message,
@@ -651,7 +651,7 @@ def send_lead_message(
 
 
 @router.post("/leads/{lead_id}/documents", response_model=schemas_whatsapp.Message)
-async def send_lead_document(
+def send_lead_document(
     lead_id: int,
     request: Request,
     file: UploadFile = File(...),
@@ -683,15 +683,9 @@ async def send_lead_document(
     if chat_session and chat_session.lead_id != lead.id:
         chat_session.lead_id = lead.id
 
-    os.makedirs("static/whatsapp-documents", exist_ok=True)
-    safe_name = os.path.basename(file.filename)
-    extension = safe_name.rsplit(".", 1)[-1] if "." in safe_name else "bin"
-    stored_name = f"{uuid.uuid4()}.{extension}"
-    stored_path = f"static/whatsapp-documents/{stored_name}"
-    with open(stored_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    relative_path = f"/static/whatsapp-documents/{stored_name}"
+    stored = upload_store.store_upload(db, file)
+    safe_name = stored.file_name
+    relative_path = f"/{stored.path}"
     public_url = build_api_public_url(request, relative_path)
     normalized_number = normalize_phone(lead.phone)
     outbound_number = (normalized_number or lead.phone).replace("+", "")
@@ -879,8 +873,10 @@ def send_vehicle_to_whatsapp(
 
     image_message_ids: List[str] = []
     photo_list = vehicle.photos if isinstance(vehicle.photos, list) else []
-    for photo in photo_list:
-        media_url = normalize_media_url(photo, request)
+    photo_variants = vehicle.photo_variants if isinstance(vehicle.photo_variants, list) else []
+    for index, photo in enumerate(photo_list):
+        variants = photo_variants[index] if index < len(photo_variants) else None
+        media_url = normalize_media_url(image_derivatives.share_url(photo, variants), request)
         if not media_url:
             continue
 
@@ -0,0 +1,55 @@
+"""
+Apply startup schema migrations once per deploy.
+
+Usage (before restarting gunicorn):
+    SCHEMA_MIGRATIONS_MODE=skip gunicorn ...   # workers only read the fingerprint
+    python run_migrations.py                   # applies pending steps
+    python run_migrations.py --force           # re-run every step
+    python run_migrations.py --check           # exit 1 when migrations are pending
+"""
+import argparse
+import os
+import sys
+
+# Importing main must not trigger the migration itself; we drive it explicitly below.
+os.environ["SCHEMA_MIGRATIONS_MODE"] = "skip"
+
+import main  # noqa: E402
+import models  # noqa: E402
+import schema_migrations  # noqa: E402
+from database import engine  # noqa: E402
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Apply AutosQP schema migrations")
+    parser.add_argument("--force", action="store_true", help="Run every step even if the fingerprint is current")
+    parser.add_argument("--check", action="store_true", help="Only report whether migrations are pending")
+    args = parser.parse_args()
+
+    steps = main.SCHEMA_MIGRATION_STEPS
+    seed_data = main.SCHEMA_SEED_DATA
+    fingerprint = schema_migrations.compute_schema_fingerprint(models.Base.metadata, steps, seed_data)
+    applied = schema_migrations.read_applied_fingerprint(engine)
+
+    if args.check:
+        if applied == fingerprint:
+            print(f"Schema is current ({fingerprint[:12]})")
+            return 0
+        print(f"Schema migrations pending: applied={str(applied)[:12]} expected={fingerprint[:12]}")
+        return 1
+
+    executed = schema_migrations.run_migrations(
+        engine, models.Base.metadata, steps, force=args.force, seed_data=seed_data
+    )
+    if not executed:
+        print(f"Schema already current ({fingerprint[:12]}), nothing to do")
+        return 0
+    failures = schema_migrations.failed_steps()
+    if failures:
+        print(f"{len(failures)} migration step(s) failed; fix them and run again")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
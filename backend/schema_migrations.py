@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import json
+import os
+from typing import Any, Callable, Iterable, Optional, Sequence
+
+from sqlalchemy import MetaData, text
+from sqlalchemy.engine import Connection, Engine
+
+# Bump whenever the body of an existing migration step changes in a way that
+# must be re-applied on databases that already recorded the previous fingerprint.
+# Constants that data-sync steps copy into the database (default role views,
+# lead statuses) are passed as seed_data and fingerprinted, so changing them
+# re-runs the steps without a bump.
+SCHEMA_REVISION = 1
+
+SCHEMA_STATE_TABLE = "schema_migration_state"
+SCHEMA_STATE_KEY = "startup"
+SCHEMA_LOCK_NAME = "autosqp_schema_migrations"
+SCHEMA_LOCK_TIMEOUT_SECONDS = int(os.getenv("SCHEMA_MIGRATIONS_LOCK_TIMEOUT", "600") or "600")
+
+# auto: worker imports check the fingerprint and only migrate when it is stale.
+# skip: worker imports never migrate; run `python run_migrations.py` on deploy.
+SCHEMA_MIGRATIONS_MODE = (os.getenv("SCHEMA_MIGRATIONS_MODE", "auto") or "auto").strip().lower()
+
+MigrationStep = Callable[[], None]
+
+# Steps catch their own errors so one failure does not stop the others; they
+# report it here, and the fingerprint is only recorded when no step failed.
+_failed_steps: list = []
+
+
+def step_failed(message: str) -> None:
+    """Called by a migration step that could not complete; the run is retried on the next start."""
+    print(f"Warning: {message}", flush=True)
+    _failed_steps.append(message)
+
+
+def failed_steps() -> list:
+    """Failures reported during the last run_migrations() call."""
+    return list(_failed_steps)
+
+
+def _metadata_signature(metadata: MetaData) -> list:
+    signature = []
+    for table_name in sorted(metadata.tables):
+        table = metadata.tables[table_name]
+        columns = sorted(f"{column.name}:{column.type!r}" for column in table.columns)
+        indexes = sorted(index.name or "" for index in table.indexes)
+        signature.append([table_name, columns, indexes])
+    return signature
+
+
+def compute_schema_fingerprint(
+    metadata: MetaData,
+    steps: Sequence[MigrationStep],
+    seed_data: Optional[Any] = None,
+) -> str:
+    payload = {
+        "revision": SCHEMA_REVISION,
+        "steps": [getattr(step, "__name__", repr(step)) for step in steps],
+        "metadata": _metadata_signature(metadata),
+        "seed_data": seed_data,
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _ensure_state_table(conn: Connection) -> None:
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {SCHEMA_STATE_TABLE} ("
+        "state_key VARCHAR(50) NOT NULL PRIMARY KEY, "
+        "fingerprint VARCHAR(64) NOT NULL, "
+        "applied_at DATETIME NOT NULL"
+        ")"
+    ))
+
+
+def read_applied_fingerprint(engine: Engine) -> str | None:
+    try:
+        with engine.connect() as conn:
+            return conn.execute(
+                text(f"SELECT fingerprint FROM {SCHEMA_STATE_TABLE} WHERE state_key = :key"),
+                {"key": SCHEMA_STATE_KEY},
+            ).scalar()
+    except Exception:
+        # Missing state table means nothing was recorded yet.
+        return None
+
+
+def _record_applied_fingerprint(engine: Engine, fingerprint: str) -> None:
+    with engine.begin() as conn:
+        _ensure_state_table(conn)
+        conn.execute(
+            text(f"DELETE FROM {SCHEMA_STATE_TABLE} WHERE state_key = :key"),
+            {"key": SCHEMA_STATE_KEY},
+        )
+        conn.execute(
+            text(
+                f"INSERT INTO {SCHEMA_STATE_TABLE} (state_key, fingerprint, applied_at) "
+                "VALUES (:key, :fingerprint, :applied_at)"
+            ),
+            {
+                "key": SCHEMA_STATE_KEY,
+                "fingerprint": fingerprint,
+                "applied_at": datetime.datetime.utcnow(),
+            },
+        )
+
+
+def _acquire_lock(conn: Connection) -> bool:
+    if conn.engine.url.get_backend_name() != "mysql":
+        return True
+    acquired = conn.execute(
+        text("SELECT GET_LOCK(:name, :timeout)"),
+        {"name": SCHEMA_LOCK_NAME, "timeout": SCHEMA_LOCK_TIMEOUT_SECONDS},
+    ).scalar()
+    return bool(acquired)
+
+
+def _release_lock(conn: Connection) -> None:
+    if conn.engine.url.get_backend_name() != "mysql":
+        return
+    conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": SCHEMA_LOCK_NAME})
+
+
+def run_migrations(
+    engine: Engine,
+    metadata: MetaData,
+    steps: Iterable[MigrationStep],
+    *,
+    force: bool = False,
+    seed_data: Optional[Any] = None,
+) -> bool:
+    """
+    Apply create_all plus every registered step once per schema fingerprint.
+
+    Returns True when the steps were executed, False when the database already
+    recorded the current fingerprint. The fingerprint is only recorded when no
+    step reported a failure through step_failed(), so failed steps are retried.
+    Concurrent callers on MySQL serialize on a named lock, so only the first
+    worker of a deploy pays for the migration.
+    """
+    steps = list(steps)
+    fingerprint = compute_schema_fingerprint(metadata, steps, seed_data)
+    if not force and read_applied_fingerprint(engine) == fingerprint:
+        return False
+
+    with engine.connect() as lock_conn:
+        if not _acquire_lock(lock_conn):
+            raise RuntimeError("Timed out waiting for the schema migration lock")
+        try:
+            # Another worker may have finished while we waited for the lock.
+            if not force and read_applied_fingerprint(engine) == fingerprint:
+                return False
+
+            started_at = datetime.datetime.utcnow()
+            print(f"Schema migrations: applying fingerprint {fingerprint[:12]}", flush=True)
+            metadata.create_all(bind=engine)
+            _failed_steps.clear()
+            for step in steps:
+                step()
+            elapsed = (datetime.datetime.utcnow() - started_at).total_seconds()
+            if _failed_steps:
+                print(
+                    f"Warning: schema migrations finished with {len(_failed_steps)} failed step(s) in "
+                    f"{elapsed:.2f}s; the fingerprint was not recorded and they will run again",
+                    flush=True,
+                )
+                return True
+            _record_applied_fingerprint(engine, fingerprint)
+            print(f"Schema migrations: done in {elapsed:.2f}s", flush=True)
+            return True
+        finally:
+            _release_lock(lock_conn)
+
+
+def ensure_schema_current(
+    engine: Engine,
+    metadata: MetaData,
+    steps: Sequence[MigrationStep],
+    seed_data: Optional[Any] = None,
+) -> bool:
+    """
+    Startup hook used by main.py: one indexed read when the schema is current.
+    """
+    if SCHEMA_MIGRATIONS_MODE == "skip":
+        fingerprint = compute_schema_fingerprint(metadata, steps, seed_data)
+        if read_applied_fingerprint(engine) != fingerprint:
+            print(
+                "Warning: database schema fingerprint is stale; run `python run_migrations.py`",
+                flush=True,
+            )
+        return False
+    return run_migrations(engine, metadata, steps, seed_data=seed_data)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr, ConfigDict, Field
-from typing import List, Optional, Any, Dict
+from pydantic import AliasChoices, BaseModel, EmailStr, ConfigDict, Field
+from typing import List, Optional, Any, Dict, Union
 from datetime import datetime, date
 import enum
 
@@ -156,11 +156,22 @@ class UserDisableRequest(BaseModel):
     reassign_leads_to_user_id: Optional[int] = None
 
 
+class LeadRedistributionPlanEntry(BaseModel):
+    user_id: int
+    user_label: Optional[str] = None
+    current_open_leads: int
+    assigned_leads: int
+    projected_open_leads: int
+
+
 class UserLeadRedistributeResponse(BaseModel):
     status: str
     message: str
     redistributed_leads: int
     recipient_users: int
+    dry_run: bool = False
+    plan: List[LeadRedistributionPlanEntry] = []
+    job_id: Optional[int] = None
 
 
 class UserLeadSupervisionClearResponse(BaseModel):
@@ -881,6 +892,8 @@ class Vehicle(VehicleBase):
     sold_by_type: Optional[str] = None
     sold_by_name: Optional[str] = None
     sold_by_user: Optional[User] = None
+    # Same order as photos; None for photos without derivatives.
+    photo_variants: Optional[List[Optional[Dict[str, Any]]]] = None
     
     model_config = ConfigDict(from_attributes=True)
 
@@ -888,6 +901,59 @@ class VehicleList(BaseModel):
     items: List[Vehicle]
     total: int
 
+class CatalogueFacetCount(BaseModel):
+    value: Union[str, int]
+    count: int
+
+class CatalogueModelCount(BaseModel):
+    make: str
+    model: Optional[str] = None
+    count: int
+
+class CatalogueHistogramBucket(BaseModel):
+    min: int
+    max: int
+    count: int
+
+class VehicleCatalogueFacets(BaseModel):
+    total: int
+    makes: List[CatalogueFacetCount]
+    models: List[CatalogueModelCount]
+    colors: List[CatalogueFacetCount]
+    years: List[CatalogueFacetCount]
+    price_histogram: List[CatalogueHistogramBucket]
+    mileage_histogram: List[CatalogueHistogramBucket]
+
+class InventoryImportIssue(BaseModel):
+    row: int
+    plate: Optional[str] = None
+    error: str
+
+class InventoryImportInsert(BaseModel):
+    row: int
+    plate: str
+    make: str
+    mileage: Optional[int] = None
+
+class InventoryImportUpdate(BaseModel):
+    row: int
+    id: int
+    plate: str
+    changes: Dict[str, Dict[str, Any]]
+
+class InventoryImportResult(BaseModel):
+    dry_run: bool = False
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    invalid: int = 0
+    errors: int = 0
+    error_details: List[InventoryImportIssue] = []
+    inserts: List[InventoryImportInsert] = []
+    updates: List[InventoryImportUpdate] = []
+    job_id: Optional[int] = None
+    status: Optional[str] = None
+
 class CarBrandBase(BaseModel):
     name: str
     logo_url: Optional[str] = None
@@ -1071,6 +1137,8 @@ class PaymentReceiptBase(BaseModel):
     bank: Optional[str] = None
 
 class PaymentReceiptMinimal(PaymentReceiptBase):
+    # Own name, or the one resolved for its receipt group when it has none.
+    display_name: Optional[str] = Field(default=None, validation_alias=AliasChoices("resolved_display_name", "display_name"))
     id: int
     company_id: int
     user_id: int
@@ -1362,3 +1430,38 @@ class SystemLog(SystemLogBase):
 class SystemLogList(BaseModel):
     items: List[SystemLog]
     total: int
+
+class SlowQueryEntry(BaseModel):
+    id: int
+    fingerprint_hash: str
+    fingerprint: str
+    sample_statement: Optional[str] = None
+    parameter_shape: Optional[Any] = None
+    route: Optional[str] = None
+    calls: int
+    total_ms: int
+    max_ms: int
+    last_ms: int
+    avg_ms: float
+    explain: Optional[Any] = None
+    explained_at: Optional[datetime] = None
+    first_seen_at: Optional[datetime] = None
+    last_seen_at: Optional[datetime] = None
+
+class SlowQueryList(BaseModel):
+    items: List[SlowQueryEntry]
+    total: int
+    threshold_ms: int
+
+class BackgroundJobStatus(BaseModel):
+    id: int
+    kind: str
+    status: str
+    total: int
+    processed: int
+    progress: float
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
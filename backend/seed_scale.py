@@ -0,0 +1,457 @@
+"""
+Deterministic scale data generator for benchmarks.
+
+Builds one tenant per requested size with realistic volumes: advisors and
+supervisors, leads with history and supervisor links, credits, purchase
+requests, vehicles, sales, receipts, manual tax entries, notifications and
+conversations with messages. The same --seed always produces the same rows.
+
+Usage:
+    python seed_scale.py --sizes 1000 10000 100000
+    python seed_scale.py --sizes 1000 --seed 7 --prefix "Bench"
+"""
+import argparse
+import datetime
+import json
+import random
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import auth_utils
+import finance_rollups
+import models
+from database import Base, SessionLocal, engine
+
+BENCH_PASSWORD = "bench1234"
+BASE_DATE = datetime.datetime(2024, 1, 1, 8, 0, 0)
+INSERT_CHUNK_SIZE = 2000
+
+FIRST_NAMES = ["Juan", "Maria", "Carlos", "Ana", "Luis", "Sofia", "Diego", "Valentina", "Andres", "Camila", "Jorge", "Laura"]
+LAST_NAMES = ["Perez", "Garcia", "Lopez", "Martinez", "Rodriguez", "Hernandez", "Gonzalez", "Ramirez", "Torres", "Castro"]
+MAKES = {
+    "Mazda": ["2", "3", "CX-30", "CX-5"],
+    "Chevrolet": ["Onix", "Tracker", "Spark", "Captiva"],
+    "Renault": ["Logan", "Sandero", "Duster", "Koleos"],
+    "Kia": ["Picanto", "Rio", "Sportage", "Seltos"],
+    "Toyota": ["Corolla", "Hilux", "Fortuner", "Yaris"],
+}
+COLORS = ["Blanco", "Negro", "Gris", "Rojo", "Azul", "Plata"]
+SOURCES = ["facebook", "whatsapp", "instagram", "tiktok", "web", "other"]
+# Weighted to look like a real board: most leads are early in the funnel.
+LEAD_STATUS_WEIGHTS = [
+    ("new", 30), ("contacted", 20), ("in_process", 15), ("credit_study", 8), ("approvals", 5),
+    ("reserved", 3), ("preparation", 2), ("sold", 7), ("lost", 10),
+]
+SYSTEM_ROLE_LABELS = {
+    "admin": "Administrador de Empresa",
+    "asesor": "Asesor / Vendedor",
+    "gestion_creditos": "Gestion de Creditos",
+    "compras": "Gestor de Compras",
+    "aliado": "Aliado Estrategico",
+}
+
+
+class IdAllocator:
+    """Hands out explicit primary keys so related rows can be bulk inserted together."""
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.next_ids: Dict[str, int] = {}
+
+    def take(self, model) -> int:
+        table_name = model.__tablename__
+        if table_name not in self.next_ids:
+            current_max = self.db.query(func.max(model.id)).scalar() or 0
+            self.next_ids[table_name] = current_max + 1
+        value = self.next_ids[table_name]
+        self.next_ids[table_name] += 1
+        return value
+
+
+def bulk_insert(db: Session, model, rows: List[dict]):
+    # executemany needs every row to bind the same columns.
+    columns = set()
+    for row in rows:
+        columns.update(row)
+    for row in rows:
+        for column in columns - row.keys():
+            row[column] = None
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db.execute(model.__table__.insert(), rows[start:start + INSERT_CHUNK_SIZE])
+
+
+def _person_name(rng: random.Random) -> str:
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def _moment(rng: random.Random, max_days: int = 720) -> datetime.datetime:
+    return BASE_DATE + datetime.timedelta(minutes=rng.randint(0, max_days * 24 * 60))
+
+
+def ensure_roles(db: Session) -> Dict[str, int]:
+    role_ids = {}
+    for role_name, label in SYSTEM_ROLE_LABELS.items():
+        role = db.query(models.Role).filter(models.Role.name == role_name).first()
+        if not role:
+            role = models.Role(name=role_name, label=label, is_system=True, auto_assign_leads=(role_name == "asesor"))
+            db.add(role)
+            db.flush()
+        role_ids[role_name] = role.id
+    return role_ids
+
+
+def build_tenant(
+    db: Session,
+    rng: random.Random,
+    lead_count: int,
+    *,
+    company_name: str,
+    role_ids: Dict[str, int],
+    password_hash: str,
+) -> Optional[dict]:
+    if db.query(models.Company.id).filter(models.Company.name == company_name).first():
+        print(f"Tenant '{company_name}' already exists, skipping")
+        return None
+
+    ids = IdAllocator(db)
+    slug = company_name.lower().replace(" ", "-")
+    company_id = ids.take(models.Company)
+    db.execute(models.Company.__table__.insert(), [{
+        "id": company_id,
+        "name": company_name,
+        "primary_color": "#2563eb",
+        "secondary_color": "#0f172a",
+        "public_credit_requires_email_validation": False,
+    }])
+
+    # --- Users ---
+    advisor_count = min(200, max(5, lead_count // 500))
+    supervisor_count = max(1, advisor_count // 10)
+    users = []
+
+    def add_user(role_name: str, label: str, **extra) -> int:
+        user_id = ids.take(models.User)
+        users.append({
+            "id": user_id,
+            "email": f"{label}@{slug}.bench",
+            "full_name": _person_name(rng),
+            "hashed_password": password_hash,
+            "is_active": 1,
+            "role_id": role_ids[role_name],
+            "company_id": company_id,
+            "auto_assign_leads": role_name == "asesor",
+            "commission_percentage": extra.get("commission_percentage", 0),
+            "created_at": BASE_DATE,
+            "last_active": BASE_DATE,
+            "ecard_enabled": False,
+            "ecard_show_instagram": False,
+            "ecard_show_facebook": False,
+            "ecard_show_tiktok": False,
+            "ecard_show_whatsapp": True,
+        })
+        return user_id
+
+    admin_id = add_user("admin", "admin")
+    advisor_ids = [add_user("asesor", f"asesor{index}", commission_percentage=rng.choice([3, 4, 5])) for index in range(advisor_count)]
+    supervisor_ids = [add_user("gestion_creditos", f"creditos{index}") for index in range(supervisor_count)]
+    purchase_manager_id = add_user("compras", "compras")
+    ally_id = add_user("aliado", "aliado")
+    bulk_insert(db, models.User, users)
+
+    # --- Vehicles ---
+    vehicles = []
+    vehicle_count = max(20, lead_count // 20)
+    for index in range(vehicle_count):
+        make = rng.choice(list(MAKES))
+        vehicles.append({
+            "id": ids.take(models.Vehicle),
+            "make": make,
+            "model": rng.choice(MAKES[make]),
+            "year": rng.randint(2012, 2025),
+            "price": rng.randrange(35_000_000, 180_000_000, 500_000),
+            "purchase_price": rng.randrange(25_000_000, 150_000_000, 500_000),
+            "plate": f"{chr(65 + index % 26)}{chr(65 + (index // 26) % 26)}{chr(65 + (index // 676) % 26)}{index % 1000:03d}",
+            "mileage": rng.randint(5_000, 160_000),
+            "color": rng.choice(COLORS),
+            "fuel_type": rng.choice(["Gasolina", "Diesel", "Hibrido"]),
+            "transmission": rng.choice(["Manual", "Automatica"]),
+            "internal_code": f"INV-{company_id}-{index:05d}",
+            "status": "available",
+            "photos": [],
+            "company_id": company_id,
+        })
+
+    # --- Leads + history + supervisors ---
+    statuses = [status for status, _ in LEAD_STATUS_WEIGHTS]
+    weights = [weight for _, weight in LEAD_STATUS_WEIGHTS]
+    leads, history, supervisor_links = [], [], []
+    credits, notifications, conversations, messages = [], [], [], []
+    sold_leads = []
+    for index in range(lead_count):
+        lead_id = ids.take(models.Lead)
+        status = rng.choices(statuses, weights)[0]
+        created_at = _moment(rng)
+        assigned_to_id = rng.choice(advisor_ids)
+        name = _person_name(rng)
+        phone = f"57300{index:07d}"
+        leads.append({
+            "id": lead_id,
+            "name": name,
+            "email": f"lead{index}@{slug}.bench" if rng.random() < 0.6 else None,
+            "phone": phone,
+            "source": rng.choice(SOURCES),
+            "status": status,
+            "status_updated_at": created_at + datetime.timedelta(days=rng.randint(0, 30)),
+            "message": "Interesado en financiacion" if rng.random() < 0.5 else None,
+            "created_at": created_at,
+            "has_unread_reply": 1 if rng.random() < 0.1 else 0,
+            "deleted_at": created_at + datetime.timedelta(days=40) if rng.random() < 0.02 else None,
+            "company_id": company_id,
+            "assigned_to_id": assigned_to_id,
+            "created_by_id": admin_id,
+        })
+
+        previous_status = "new"
+        for step in range(rng.randint(1, 3)):
+            history.append({
+                "id": ids.take(models.LeadHistory),
+                "lead_id": lead_id,
+                "user_id": assigned_to_id,
+                "previous_status": previous_status,
+                "new_status": status,
+                "comment": "Actualizacion de estado",
+                "created_at": created_at + datetime.timedelta(hours=step * 6),
+            })
+            previous_status = status
+
+        if rng.random() < 0.3:
+            supervisor_links.append({
+                "lead_id": lead_id,
+                "user_id": rng.choice(supervisor_ids),
+                "assigned_by_id": admin_id,
+                "created_at": created_at,
+            })
+
+        if status in {"credit_study", "approvals", "reserved", "preparation", "sold"} and rng.random() < 0.8:
+            credits.append({
+                "id": ids.take(models.CreditApplication),
+                "lead_id": lead_id,
+                "client_name": name,
+                "phone": phone,
+                "desired_vehicle": f"{rng.choice(list(MAKES))} {rng.randint(2015, 2025)}",
+                "monthly_income": rng.randrange(2_000_000, 15_000_000, 100_000),
+                "other_income": 0,
+                "occupation": rng.choice(["Empleado", "Independiente", "Pensionado"]),
+                "application_mode": "individual",
+                "down_payment": rng.randrange(0, 30_000_000, 500_000),
+                "status": rng.choice(["pending", "in_review", "approved", "rejected", "completed"]),
+                "notes": "[credit_request] Solicitud generada por benchmark",
+                "created_at": created_at,
+                "updated_at": created_at,
+                "company_id": company_id,
+                "assigned_to_id": rng.choice(supervisor_ids),
+            })
+        elif status == "in_process" and rng.random() < 0.2:
+            credits.append({
+                "id": ids.take(models.CreditApplication),
+                "lead_id": lead_id,
+                "client_name": name,
+                "phone": phone,
+                "desired_vehicle": f"{rng.choice(list(MAKES))} {rng.randint(2015, 2025)}",
+                "occupation": "Empleado",
+                "application_mode": "individual",
+                "other_income": 0,
+                "down_payment": 0,
+                "status": rng.choice(["pending", "purchase_process", "car_purchased"]),
+                "notes": "[purchase_request] Busqueda de vehiculo",
+                "purchase_price": rng.randrange(25_000_000, 120_000_000, 500_000),
+                "created_at": created_at,
+                "updated_at": created_at,
+                "company_id": company_id,
+                "assigned_to_id": purchase_manager_id,
+            })
+
+        if status == "sold":
+            sold_leads.append((lead_id, assigned_to_id, name, created_at))
+
+        if rng.random() < 0.5:
+            notifications.append({
+                "id": ids.take(models.Notification),
+                "user_id": assigned_to_id,
+                "title": "Nuevo lead asignado",
+                "message": f"Se te asigno el lead {name}",
+                "type": "info",
+                "is_read": 1 if rng.random() < 0.7 else 0,
+                "link": f"/admin/leads?lead_id={lead_id}",
+                "created_at": created_at,
+            })
+
+        if rng.random() < 0.3:
+            conversation_id = ids.take(models.Conversation)
+            message_count = rng.randint(3, 20)
+            conversations.append({
+                "id": conversation_id,
+                "lead_id": lead_id,
+                "company_id": company_id,
+                "last_message_at": created_at + datetime.timedelta(minutes=message_count * 5),
+            })
+            for message_index in range(message_count):
+                messages.append({
+                    "id": ids.take(models.Message),
+                    "conversation_id": conversation_id,
+                    "sender_type": "lead" if message_index % 2 == 0 else "user",
+                    "content": f"Mensaje {message_index + 1} sobre el vehiculo",
+                    "message_type": "text",
+                    "whatsapp_message_id": f"wamid.bench.{conversation_id}.{message_index}",
+                    "status": "delivered",
+                    "created_at": created_at + datetime.timedelta(minutes=message_index * 5),
+                })
+
+    # --- Sales + receipts ---
+    sales, receipts = [], []
+    available_vehicle_indexes = list(range(len(vehicles)))
+    rng.shuffle(available_vehicle_indexes)
+    for lead_id, seller_id, buyer_name, created_at in sold_leads[: len(vehicles) // 2]:
+        vehicle = vehicles[available_vehicle_indexes.pop()]
+        vehicle["status"] = "sold"
+        sale_id = ids.take(models.Sale)
+        sale_price = vehicle["price"]
+        commission_amount = sale_price * 4 // 100
+        sale_date = created_at + datetime.timedelta(days=rng.randint(5, 45))
+        sales.append({
+            "id": sale_id,
+            "vehicle_id": vehicle["id"],
+            "lead_id": lead_id,
+            "seller_id": seller_id,
+            "company_id": company_id,
+            "seller_type": "internal",
+            "tax_transaction_type": rng.choice(["intermediacion", "compra_venta"]),
+            "tax_buyer_name": buyer_name,
+            "tax_buyer_document": str(rng.randint(10_000_000, 1_199_999_999)),
+            "sale_price": sale_price,
+            "commission_percentage": 4,
+            "commission_amount": commission_amount,
+            "net_revenue": sale_price - commission_amount,
+            "status": rng.choices(["approved", "pending", "rejected"], [85, 10, 5])[0],
+            "approved_by_id": admin_id,
+            "sale_date": sale_date,
+        })
+        remaining = sale_price
+        for receipt_index in range(rng.randint(1, 3)):
+            amount = remaining // 2 if receipt_index < 2 else remaining
+            remaining -= amount
+            receipts.append({
+                "id": ids.take(models.PaymentReceipt),
+                "company_id": company_id,
+                "sale_id": sale_id,
+                "user_id": admin_id,
+                "customer_name": buyer_name,
+                "customer_document": str(rng.randint(10_000_000, 1_199_999_999)),
+                "concept": "Abono venta vehiculo",
+                "movement_type": "income",
+                "receipt_number": f"RC-{company_id}-{sale_id}-{receipt_index + 1}",
+                "payment_date": sale_date + datetime.timedelta(days=receipt_index),
+                "amount": amount,
+                "category": "sale_payment",
+                "payment_method": rng.choice(["transferencia", "efectivo", "credito"]),
+                "created_at": sale_date,
+            })
+
+    tax_entries = []
+    for index in range(max(5, lead_count // 200)):
+        moment = _moment(rng)
+        make = rng.choice(list(MAKES))
+        tax_entries.append({
+            "id": ids.take(models.TaxReportEntry),
+            "company_id": company_id,
+            "month": ["enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"][moment.month - 1],
+            "year": moment.year,
+            "make": make,
+            "reference": rng.choice(MAKES[make]),
+            "plate": f"MAN{index:03d}",
+            "model_year": rng.randint(2012, 2025),
+            "purchase_price": rng.randrange(25_000_000, 120_000_000, 500_000),
+            "sale_price": rng.randrange(35_000_000, 150_000_000, 500_000),
+            "transaction_type": "intermediacion",
+            "buyer_name": _person_name(rng),
+            "created_at": moment,
+            "updated_at": moment,
+        })
+
+    bulk_insert(db, models.Vehicle, vehicles)
+    bulk_insert(db, models.Lead, leads)
+    bulk_insert(db, models.LeadHistory, history)
+    bulk_insert(db, models.LeadSupervisor, supervisor_links)
+    bulk_insert(db, models.CreditApplication, credits)
+    bulk_insert(db, models.Sale, sales)
+    bulk_insert(db, models.PaymentReceipt, receipts)
+    bulk_insert(db, models.TaxReportEntry, tax_entries)
+    bulk_insert(db, models.Notification, notifications)
+    bulk_insert(db, models.Conversation, conversations)
+    bulk_insert(db, models.Message, messages)
+    # Bulk inserts skip the ORM listeners that keep the finance rollups current.
+    finance_rollups.rebuild_rollups(db.connection(), company_id)
+    db.commit()
+
+    summary = {
+        "company_id": company_id,
+        "company_name": company_name,
+        "admin_email": f"admin@{slug}.bench",
+        "advisor_email": f"asesor0@{slug}.bench",
+        "password": BENCH_PASSWORD,
+        "ally_user_id": ally_id,
+        "counts": {
+            "users": len(users),
+            "vehicles": len(vehicles),
+            "leads": len(leads),
+            "lead_history": len(history),
+            "lead_supervisors": len(supervisor_links),
+            "credit_applications": len(credits),
+            "sales": len(sales),
+            "payment_receipts": len(receipts),
+            "tax_report_entries": len(tax_entries),
+            "notifications": len(notifications),
+            "conversations": len(conversations),
+            "messages": len(messages),
+        },
+    }
+    return summary
+
+
+def tenant_name(prefix: str, size: int) -> str:
+    return f"{prefix} {size}"
+
+
+def seed_scale(sizes: List[int], seed: int = 42, prefix: str = "Bench") -> List[dict]:
+    Base.metadata.create_all(bind=engine)
+    password_hash = auth_utils.get_password_hash(BENCH_PASSWORD)
+    results = []
+    with SessionLocal() as db:
+        role_ids = ensure_roles(db)
+        db.commit()
+        for size in sizes:
+            # One RNG per size keeps each tenant identical regardless of which sizes are requested.
+            rng = random.Random(f"{seed}:{size}")
+            summary = build_tenant(
+                db,
+                rng,
+                size,
+                company_name=tenant_name(prefix, size),
+                role_ids=role_ids,
+                password_hash=password_hash,
+            )
+            if summary:
+                print(json.dumps(summary["counts"]))
+                results.append(summary)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate deterministic benchmark tenants")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--prefix", default="Bench")
+    args = parser.parse_args()
+    seed_scale(args.sizes, seed=args.seed, prefix=args.prefix)
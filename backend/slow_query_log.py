@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import models
+import perf_metrics
+
+# Statements slower than this are recorded. 0 disables the recorder.
+SLOW_QUERY_THRESHOLD_MS = int(os.getenv("SLOW_QUERY_THRESHOLD_MS", "500") or "0")
+# A fingerprint is re-EXPLAINed at most this often.
+SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS = int(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS", "3600") or "3600")
+SLOW_QUERY_QUEUE_SIZE = 1000
+
+_local = threading.local()
+
+
+def _parameter_type_name(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, (list, tuple, set)):
+        return f"list[{len(value)}]"
+    return type(value).__name__
+
+
+def describe_parameter_shape(parameters: Any) -> Any:
+    """Types only: bound values may contain personal data and are never stored."""
+    if isinstance(parameters, dict):
+        return {str(key): _parameter_type_name(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return {"executemany": len(parameters), "first": describe_parameter_shape(parameters[0])}
+        return [_parameter_type_name(value) for value in parameters]
+    return _parameter_type_name(parameters)
+
+
+class SlowQueryRecorder:
+    def __init__(self, engine: Engine, threshold_ms: int = SLOW_QUERY_THRESHOLD_MS):
+        self.engine = engine
+        self.threshold_ms = threshold_ms
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=SLOW_QUERY_QUEUE_SIZE)
+        self._last_explained: Dict[str, float] = {}
+        self._worker: Optional[threading.Thread] = None
+        self.dropped = 0
+
+    def install(self):
+        if self.threshold_ms <= 0 or getattr(self.engine, "_autosqp_slow_query_hooks", False):
+            return
+        event.listen(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(self.engine, "after_cursor_execute", self._after_cursor_execute)
+        self.engine._autosqp_slow_query_hooks = True
+        self._worker = threading.Thread(target=self._run, name="slow-query-recorder", daemon=True)
+        self._worker.start()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("autosqp_slow_query_started_at", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("autosqp_slow_query_started_at")
+        if not started:
+            return
+        elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+        if elapsed_ms < self.threshold_ms or getattr(_local, "recording", False):
+            return
+
+        request_stats = perf_metrics.get_current_request_stats()
+        event_payload = {
+            "statement": statement,
+            "parameters": parameters,
+            "executemany": executemany,
+            "elapsed_ms": elapsed_ms,
+            "route": getattr(request_stats, "path", None),
+            "seen_at": datetime.datetime.utcnow(),
+        }
+        try:
+            self._queue.put_nowait(event_payload)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            event_payload = self._queue.get()
+            _local.recording = True
+            try:
+                self.record(event_payload)
+            except Exception as exc:
+                print(f"Warning: could not record slow query: {exc}", flush=True)
+            finally:
+                _local.recording = False
+
+    def _explain(self, statement: str, parameters: Any) -> Optional[List[Dict[str, Any]]]:
+        first_keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+        if first_keyword not in {"SELECT", "WITH"}:
+            return None
+        with self.engine.connect() as conn:
+            result = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters or ())
+            keys = list(result.keys())
+            return [
+                {key: (value if isinstance(value, (int, float, str)) or value is None else str(value)) for key, value in zip(keys, row)}
+                for row in result.fetchall()
+            ]
+
+    def record(self, event_payload: Dict[str, Any]):
+        statement = event_payload["statement"]
+        fingerprint = perf_metrics.fingerprint_statement(statement)
+        digest = perf_metrics.fingerprint_hash(fingerprint)
+        elapsed_ms = int(round(event_payload["elapsed_ms"]))
+
+        explain_rows = None
+        now = time.monotonic()
+        last_explained = self._last_explained.get(digest)
+        if not event_payload["executemany"] and (
+            last_explained is None or now - last_explained >= SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS
+        ):
+            try:
+                explain_rows = self._explain(statement, event_payload["parameters"])
+            except Exception as exc:
+                explain_rows = [{"error": str(exc)[:500]}]
+            self._last_explained[digest] = now
+
+        with Session(self.engine) as db:
+            entry = db.query(models.SlowQueryLog).filter(models.SlowQueryLog.fingerprint_hash == digest).first()
+            if not entry:
+                entry = models.SlowQueryLog(
+                    fingerprint_hash=digest,
+                    fingerprint=fingerprint,
+                    calls=0,
+                    total_ms=0,
+                    max_ms=0,
+                    first_seen_at=event_payload["seen_at"],
+                )
+                db.add(entry)
+            entry.sample_statement = statement[:20000]
+            entry.parameter_shape = json.dumps(describe_parameter_shape(event_payload["parameters"]))
+            entry.route = (event_payload["route"] or "")[:255] or entry.route
+            entry.calls = (entry.calls or 0) + 1
+            entry.total_ms = (entry.total_ms or 0) + elapsed_ms
+            entry.max_ms = max(entry.max_ms or 0, elapsed_ms)
+            entry.last_ms = elapsed_ms
+            entry.last_seen_at = event_payload["seen_at"]
+            if explain_rows is not None:
+                entry.explain_json = json.dumps(explain_rows, default=str)
+                entry.explained_at = event_payload["seen_at"]
+            db.commit()
+
+
+recorder: Optional[SlowQueryRecorder] = None
+
+
+def install(engine: Engine) -> Optional[SlowQueryRecorder]:
+    global recorder
+    if recorder is None:
+        recorder = SlowQueryRecorder(engine)
+        recorder.install()
+    return recorder
@@ -0,0 +1,99 @@
+"""
+Minimal local SMTP sink for development: accepts every message and writes it
+as an .eml file, so the e-mail outbox can be exercised without a real server.
+
+Point the backend at it with:
+    SMTP_HOST=127.0.0.1 SMTP_PORT=1025 SMTP_FROM=no-reply@local.test SMTP_SECURITY=none
+
+Usage:
+    python smtp_sink.py
+    python smtp_sink.py --port 1025 --out-dir /tmp/autosqp-mail
+"""
+import argparse
+import datetime
+import os
+import socketserver
+import sys
+
+
+class SmtpSinkHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line: str):
+        self.wfile.write((line + "\r\n").encode("ascii"))
+        self.wfile.flush()
+
+    def handle(self):
+        self._reply("220 autosqp-smtp-sink ready")
+        recipients = []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            command = raw.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in {"EHLO", "HELO"}:
+                self._reply("250-autosqp-smtp-sink")
+                self._reply("250 AUTH PLAIN LOGIN")
+            elif verb == "AUTH":
+                self._reply("235 Authentication succeeded")
+            elif verb == "MAIL":
+                recipients = []
+                self._reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[-1].strip().strip("<>"))
+                self._reply("250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in {b".\r\n", b".\n"}:
+                        break
+                    lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                self.server.store(b"".join(lines), recipients)
+                self._reply("250 OK: queued")
+            elif verb in {"RSET", "NOOP"}:
+                self._reply("250 OK")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class SmtpSinkServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, out_dir: str):
+        super().__init__(address, SmtpSinkHandler)
+        self.out_dir = out_dir
+        self.count = 0
+        os.makedirs(out_dir, exist_ok=True)
+
+    def store(self, message_bytes: bytes, recipients):
+        self.count += 1
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        path = os.path.join(self.out_dir, f"{stamp}-{self.count}.eml")
+        with open(path, "wb") as handle:
+            handle.write(message_bytes)
+        print(f"Stored message for {', '.join(recipients)} -> {path}", flush=True)
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Local SMTP sink that stores messages as .eml files")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--out-dir", default=os.path.join(os.getcwd(), "mail_sink"))
+    args = parser.parse_args()
+
+    with SmtpSinkServer((args.host, args.port), args.out_dir) as server:
+        print(f"SMTP sink listening on {args.host}:{args.port}, writing to {args.out_dir}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,50 @@
+"""
+Shared fixtures for the backend tests.
+
+database.py reads DATABASE_URL at import time, so a throw-away SQLite file is
+configured here before any backend module is imported.
+
+Usage (from backend/):
+    python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+TEST_DB_DIR = tempfile.mkdtemp(prefix="autosqp-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DB_DIR, 'test.db')}"
+os.environ["SCHEMA_MIGRATIONS_MODE"] = "skip"
+os.environ["EMAIL_OUTBOX_WORKER"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import models
+from database import SessionLocal, engine
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    models.Base.metadata.create_all(bind=engine)
+    yield
+    engine.dispose()
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+
+
+@pytest.fixture
+def company(db):
+    """A fresh company per test, so tests never see each other's rows."""
+    company = models.Company(name=f"Test {uuid.uuid4().hex[:12]}")
+    db.add(company)
+    db.commit()
+    return company
@@ -0,0 +1,85 @@
+import datetime
+
+import finance_rollups
+import models
+from database import engine
+
+
+def _rollup_rows(db, company_id):
+    rows = db.query(models.FinanceMonthlyRollup).filter(
+        models.FinanceMonthlyRollup.company_id == company_id
+    ).all()
+    return {
+        row.month: {column: int(getattr(row, column) or 0) for column in finance_rollups.ROLLUP_COLUMNS}
+        for row in rows
+        if any(getattr(row, column) for column in finance_rollups.ROLLUP_COLUMNS)
+    }
+
+
+def _sale(company_id, status, sale_date, net_revenue, commission_amount=0):
+    return models.Sale(
+        company_id=company_id,
+        status=status,
+        sale_date=sale_date,
+        net_revenue=net_revenue,
+        commission_amount=commission_amount,
+    )
+
+
+def _receipt(company_id, payment_date, amount, movement_type="income"):
+    return models.PaymentReceipt(
+        company_id=company_id,
+        user_id=1,
+        payment_date=payment_date,
+        amount=amount,
+        movement_type=movement_type,
+    )
+
+
+def test_flush_deltas_match_a_rebuild(db, company):
+    january = datetime.datetime(2026, 1, 15)
+    february = datetime.datetime(2026, 2, 3)
+    approved = _sale(company.id, models.SaleStatus.APPROVED.value, january, 1_000_000, 50_000)
+    pending = _sale(company.id, models.SaleStatus.PENDING.value, january, 400_000, 20_000)
+    rejected_later = _sale(company.id, models.SaleStatus.APPROVED.value, february, 700_000, 35_000)
+    income = _receipt(company.id, january, 250_000)
+    expense = _receipt(company.id, february, 80_000, movement_type="expense")
+    removed = _receipt(company.id, february, 10_000)
+    db.add_all([approved, pending, rejected_later, income, expense, removed])
+    db.commit()
+
+    # Status, amount and date changes, across commits so the old values are expired.
+    pending.status = models.SaleStatus.APPROVED.value
+    pending.net_revenue = 450_000
+    rejected_later.status = models.SaleStatus.REJECTED.value
+    income.payment_date = february
+    expense.amount = 90_000
+    db.delete(removed)
+    db.commit()
+
+    from_deltas = _rollup_rows(db, company.id)
+    with engine.begin() as connection:
+        finance_rollups.rebuild_rollups(connection, company.id)
+    db.expire_all()
+    rebuilt = _rollup_rows(db, company.id)
+
+    assert from_deltas == rebuilt
+    assert rebuilt[datetime.date(2026, 1, 1)]["approved_net_revenue"] == 1_450_000
+    assert rebuilt[datetime.date(2026, 2, 1)]["income_amount"] == 250_000
+    assert rebuilt[datetime.date(2026, 2, 1)]["approved_sales_count"] == 0
+
+
+def test_rollup_totals_match_live_totals(db, company):
+    march = datetime.datetime(2026, 3, 10)
+    db.add_all([
+        _sale(company.id, models.SaleStatus.APPROVED.value, march, 900_000, 45_000),
+        _sale(company.id, models.SaleStatus.PENDING.value, march, 100_000),
+        _receipt(company.id, march, 300_000),
+        _receipt(company.id, march, 40_000, movement_type="expense"),
+    ])
+    db.commit()
+
+    start, end = datetime.datetime(2026, 3, 1), datetime.datetime(2026, 4, 1)
+    assert finance_rollups.rollup_totals(db, company.id, start.date(), end.date()) == finance_rollups.live_totals(
+        db, company.id, start, end
+    )
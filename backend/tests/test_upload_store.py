@@ -0,0 +1,82 @@
+import datetime
+import os
+
+import pytest
+
+import models
+import upload_store
+
+
+@pytest.fixture(autouse=True)
+def upload_dir(tmp_path, monkeypatch):
+    # Blobs are stored under static/ relative to the working directory.
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def _ref_count(db, stored):
+    db.expire_all()
+    return db.get(models.UploadBlob, stored.sha256).ref_count
+
+
+def _age(db, stored, hours=48):
+    # GC only touches blobs older than the grace period, by row and by file time.
+    old = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+    db.query(models.UploadBlob).filter(models.UploadBlob.sha256 == stored.sha256).update({"updated_at": old})
+    db.commit()
+    old_timestamp = (datetime.datetime.now() - datetime.timedelta(hours=hours)).timestamp()
+    os.utime(stored.path, (old_timestamp, old_timestamp))
+
+
+def test_same_content_is_stored_once_and_counted(db):
+    first = upload_store.store_bytes(db, b"same bytes", "cedula.pdf", "application/pdf")
+    second = upload_store.store_bytes(db, b"same bytes", "copia.pdf", "application/pdf")
+    db.commit()
+
+    assert second.path == first.path
+    assert second.deduplicated and not first.deduplicated
+    assert _ref_count(db, first) == 2
+
+    upload_store.release(db, first.url)
+    db.commit()
+    assert _ref_count(db, first) == 1
+
+
+def test_gc_removes_unreferenced_blob(db):
+    stored = upload_store.store_bytes(db, b"only once", "recibo.pdf")
+    db.commit()
+    upload_store.release(db, stored.url)
+    db.commit()
+    _age(db, stored)
+
+    counts = upload_store.collect_garbage(db, grace_hours=24)
+
+    assert counts["blobs"] == 1
+    assert not os.path.exists(stored.path)
+    assert db.get(models.UploadBlob, stored.sha256) is None
+
+
+def test_gc_keeps_blob_still_referenced_by_a_copied_url(db, company):
+    # Public credit uploads are counted once but saved on the submission and on a lead file.
+    stored = upload_store.store_bytes(db, b"shared attachment", "extracto.pdf")
+    submission = models.PublicCreditSubmission(
+        company_id=company.id,
+        email="cliente@example.com",
+        applicant_name="Cliente",
+        attachments=[{"file_name": "extracto.pdf", "url": stored.url}],
+    )
+    lead_file = models.LeadFile(lead_id=None, file_name="extracto.pdf", file_path=stored.url)
+    db.add_all([submission, lead_file])
+    db.commit()
+
+    upload_store.discard(db, lead_file.file_path)
+    db.delete(lead_file)
+    db.commit()
+    _age(db, stored)
+
+    counts = upload_store.collect_garbage(db, grace_hours=24)
+
+    assert counts["blobs"] == 0
+    assert counts["relinked"] == 1
+    assert os.path.exists(stored.path)
+    assert _ref_count(db, stored) == 1
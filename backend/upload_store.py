@@ -0,0 +1,371 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import os
+import re
+import shutil
+import time
+import uuid
+from dataclasses import dataclass
+from io import BytesIO
+from typing import BinaryIO, Dict, Iterable, Optional, Set
+
+from fastapi import HTTPException
+from sqlalchemy import JSON, String, cast, delete, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+import models
+
+# Uploaded files are stored once per content: the upload is copied in chunks
+# to a temp file while its SHA-256 is computed, then moved to
+# static/blobs/<aa>/<sha256>.<ext>, or dropped when that content is already
+# stored. upload_blobs counts the records that point to each blob; the count
+# changes in the caller's transaction, so a failed request leaves at most an
+# orphan file. Deleting a record releases its reference instead of removing
+# the file, and gc_upload_blobs.py removes blobs nobody references anymore.
+# Some flows copy a stored URL into further records (public credit attachments
+# and their LeadFile rows, capture sessions) without counting it again, so GC
+# also looks for the blob in the columns that hold file URLs before deleting.
+
+UPLOAD_MAX_MB = int(os.getenv("UPLOAD_MAX_MB", "25") or "25")
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+STATIC_DIR = "static"
+BLOB_DIR = os.path.join(STATIC_DIR, "blobs")
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR", os.path.join("cache", "uploads"))
+# Unreferenced blobs and orphan files younger than this are kept, so a request
+# that is still between storing the blob and committing is never affected.
+UPLOAD_GC_GRACE_HOURS = int(os.getenv("UPLOAD_GC_GRACE_HOURS", "24") or "24")
+# Blobs looked up per query when GC checks the columns that hold file URLs.
+GC_REFERENCE_CHUNK_SIZE = 100
+
+_BLOB_NAME_RE = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]{1,10}$")
+_BLOB_PATH_RE = re.compile(r"(?:^|/)static/blobs/[0-9a-f]{2}/([0-9a-f]{64})\.[a-z0-9]{1,10}$")
+
+
+@dataclass
+class StoredFile:
+    sha256: str
+    # Relative to the backend directory, e.g. static/blobs/ab/ab12....pdf
+    path: str
+    size: int
+    file_name: str
+    content_type: Optional[str]
+    deduplicated: bool
+
+    @property
+    def storage_name(self) -> str:
+        return os.path.basename(self.path)
+
+    @property
+    def url(self) -> str:
+        return f"/api/{self.path}"
+
+
+def _extension(file_name: Optional[str]) -> str:
+    extension = os.path.splitext(str(file_name or ""))[1].lstrip(".").lower()
+    return extension if re.fullmatch(r"[a-z0-9]{1,10}", extension) else "bin"
+
+
+def safe_file_name(file_name: Optional[str], fallback: str = "archivo") -> str:
+    """Client file name without directories, for display and downloads."""
+    name = os.path.basename(str(file_name or "").replace("\\", "/")).strip()
+    return name or fallback
+
+
+def blob_path(storage_name: str) -> Optional[str]:
+    """Local path of a blob by its file name (<sha256>.<ext>), or None for other names."""
+    if not _BLOB_NAME_RE.match(storage_name or ""):
+        return None
+    return os.path.join(BLOB_DIR, storage_name[:2], storage_name)
+
+
+def blob_sha(path_or_url: Optional[str]) -> Optional[str]:
+    """SHA-256 of the blob a stored path or URL points to, or None for legacy files."""
+    clean_value = str(path_or_url or "").split("?", 1)[0].replace("\\", "/").strip()
+    match = _BLOB_PATH_RE.search(clean_value)
+    return match.group(1) if match else None
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"El archivo supera el tamaño máximo permitido ({UPLOAD_MAX_MB} MB)")
+
+
+def _add_reference(db: Session, sha256: str, row: Dict) -> None:
+    table = models.UploadBlob.__table__
+    now = datetime.datetime.utcnow()
+    row = {**row, "sha256": sha256, "ref_count": 1, "created_at": now, "updated_at": now}
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+        statement = mysql_insert(table).values(row)
+        statement = statement.on_duplicate_key_update(ref_count=table.c.ref_count + 1, updated_at=now)
+        db.execute(statement)
+        return
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+
+        statement = dialect_insert(table).values(row)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.sha256],
+            set_={"ref_count": table.c.ref_count + 1, "updated_at": now},
+        )
+        db.execute(statement)
+        return
+    result = db.execute(
+        update(table).where(table.c.sha256 == sha256).values(ref_count=table.c.ref_count + 1, updated_at=now)
+    )
+    if not result.rowcount:
+        db.execute(insert(table), [row])
+
+
+def _move_into_place(temp_path: str, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # shutil.move falls back to copy + delete when the temp dir is on another device.
+    shutil.move(temp_path, path)
+
+
+def store_file(
+    db: Session,
+    source: BinaryIO,
+    file_name: Optional[str],
+    content_type: Optional[str] = None,
+    max_bytes: Optional[int] = None,
+) -> StoredFile:
+    """Stores the stream (or reuses the blob with the same content) and adds one reference to it.
+
+    Raises HTTPException 413 once more than max_bytes (UPLOAD_MAX_MB by default) were read.
+    """
+    max_bytes = max_bytes if max_bytes is not None else UPLOAD_MAX_MB * 1024 * 1024
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    temp_path = os.path.join(UPLOAD_TMP_DIR, f"{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        try:
+            source.seek(0)
+        except Exception:
+            pass
+        with open(temp_path, "wb") as buffer:
+            while True:
+                chunk = source.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large()
+                digest.update(chunk)
+                buffer.write(chunk)
+
+        sha256 = digest.hexdigest()
+        existing_path = db.execute(
+            select(models.UploadBlob.storage_path).where(models.UploadBlob.sha256 == sha256)
+        ).scalar()
+        deduplicated = bool(existing_path) and os.path.isfile(existing_path)
+        path = existing_path if deduplicated else os.path.join(BLOB_DIR, sha256[:2], f"{sha256}.{_extension(file_name)}")
+        if not deduplicated:
+            _move_into_place(temp_path, path)
+        _add_reference(db, sha256, {
+            "storage_path": path.replace("\\", "/"),
+            "size": size,
+            "content_type": (content_type or "")[:150] or None,
+        })
+        if deduplicated and not os.path.isfile(path):
+            # collect_garbage removed the blob between the lookup and the reference; the
+            # reference waited on its row lock, so the file is gone for good: store it again.
+            _move_into_place(temp_path, path)
+            deduplicated = False
+        if not deduplicated and existing_path:
+            # The row outlived its file (deleted by hand); point it at the new copy.
+            db.execute(
+                update(models.UploadBlob)
+                .where(models.UploadBlob.sha256 == sha256)
+                .values(storage_path=path.replace("\\", "/"))
+            )
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return StoredFile(
+        sha256=sha256,
+        path=path.replace("\\", "/"),
+        size=size,
+        file_name=safe_file_name(file_name),
+        content_type=content_type,
+        deduplicated=deduplicated,
+    )
+
+
+def store_upload(db: Session, upload, max_bytes: Optional[int] = None) -> StoredFile:
+    """store_file() for a FastAPI UploadFile; rejects a declared oversize body before reading it."""
+    limit = max_bytes if max_bytes is not None else UPLOAD_MAX_MB * 1024 * 1024
+    declared_size = getattr(upload, "size", None)
+    if declared_size is not None and declared_size > limit:
+        raise _too_large()
+    return store_file(db, upload.file, getattr(upload, "filename", None), getattr(upload, "content_type", None), limit)
+
+
+def store_bytes(db: Session, data: bytes, file_name: Optional[str], content_type: Optional[str] = None) -> StoredFile:
+    """store_file() for content already in memory (decoded data URLs, generated files)."""
+    return store_file(db, BytesIO(data), file_name, content_type)
+
+
+def release(db: Session, path_or_url: Optional[str]) -> bool:
+    """Drops one reference to the blob behind a stored path; False when it is not a blob."""
+    sha256 = blob_sha(path_or_url)
+    if not sha256:
+        return False
+    db.execute(
+        update(models.UploadBlob)
+        .where(models.UploadBlob.sha256 == sha256, models.UploadBlob.ref_count > 0)
+        .values(ref_count=models.UploadBlob.ref_count - 1, updated_at=datetime.datetime.utcnow())
+    )
+    return True
+
+
+def discard(db: Session, path_or_url: Optional[str]):
+    """Releases a blob reference, or removes a legacy (pre-blob) file under static/ right away."""
+    if not path_or_url or release(db, path_or_url):
+        return
+    relative_path = str(path_or_url).split("?", 1)[0].lstrip("/")
+    if relative_path.startswith("api/"):
+        relative_path = relative_path[len("api/"):]
+    absolute_path = os.path.abspath(relative_path.replace("/", os.sep))
+    if not absolute_path.startswith(os.path.abspath(STATIC_DIR) + os.sep):
+        return
+    if os.path.isfile(absolute_path):
+        try:
+            os.remove(absolute_path)
+        except OSError:
+            pass
+
+
+# --- Garbage collection --------------------------------------------------
+
+def _remove_blob_files(path: str):
+    if os.path.isfile(path):
+        os.remove(path)
+    # Resized copies of images (image_derivatives) live in a folder named after the blob.
+    derivative_dir = os.path.join(STATIC_DIR, "derivatives", os.path.splitext(os.path.relpath(path, STATIC_DIR))[0])
+    if os.path.isdir(derivative_dir):
+        shutil.rmtree(derivative_dir, ignore_errors=True)
+
+
+def _reference_columns():
+    """Columns that store uploaded file paths or URLs, including JSON lists and maps of them."""
+    return [
+        models.LeadFile.file_path,
+        models.PublicCreditSubmission.attachments,
+        models.PublicCreditCaptureSession.file_path,
+        models.PaymentReceipt.file_path,
+        models.SaleAttachment.file_path,
+        models.InternalMessage.content,
+        models.Message.media_url,
+        models.User.ecard_photo_url,
+        models.Vehicle.photos,
+        models.PurchaseOption.photos,
+        models.Company.logo_url,
+        models.CarBrand.logo_url,
+        models.LeadProcessDetail.business_sheet_url,
+    ]
+
+
+def referenced_blobs(db: Session, sha256s: Iterable[str]) -> Set[str]:
+    """The blobs among sha256s that some record still points to, whatever their reference count says."""
+    pending = sorted(set(sha256s))
+    found: Set[str] = set()
+    for start in range(0, len(pending), GC_REFERENCE_CHUNK_SIZE):
+        chunk = pending[start:start + GC_REFERENCE_CHUNK_SIZE]
+        for column in _reference_columns():
+            text_value = cast(column, String) if isinstance(column.type, JSON) else column
+            for value in db.execute(
+                select(text_value).where(or_(*[text_value.like(f"%{sha256}%") for sha256 in chunk]))
+            ).scalars():
+                found.update(sha256 for sha256 in chunk if sha256 in str(value or ""))
+    return found
+
+
+def collect_garbage(db: Session, grace_hours: Optional[int] = None, dry_run: bool = False) -> Dict[str, int]:
+    """Removes blobs without references and blob files without a row, once older than the grace period."""
+    grace_hours = UPLOAD_GC_GRACE_HOURS if grace_hours is None else grace_hours
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=grace_hours)
+    counts = {"blobs": 0, "relinked": 0, "orphans": 0, "temp_files": 0, "bytes": 0}
+
+    cutoff_timestamp = time.time() - grace_hours * 3600
+    unreferenced = db.execute(
+        select(models.UploadBlob.sha256, models.UploadBlob.storage_path, models.UploadBlob.size)
+        .where(models.UploadBlob.ref_count <= 0, models.UploadBlob.updated_at < cutoff)
+    ).all()
+    unreferenced = [
+        (sha256, storage_path, size) for sha256, storage_path, size in unreferenced
+        if not (os.path.isfile(storage_path) and os.path.getmtime(storage_path) >= cutoff_timestamp)
+    ]
+    still_used = referenced_blobs(db, [sha256 for sha256, _storage_path, _size in unreferenced])
+    if still_used:
+        # Copied URLs were never counted: keep the blob with one reference for them.
+        counts["relinked"] = len(still_used)
+        if not dry_run:
+            db.execute(
+                update(models.UploadBlob)
+                .where(models.UploadBlob.sha256.in_(still_used), models.UploadBlob.ref_count <= 0)
+                .values(ref_count=1, updated_at=datetime.datetime.utcnow())
+            )
+            db.commit()
+    for sha256, storage_path, size in unreferenced:
+        if sha256 in still_used:
+            continue
+        if not dry_run:
+            # The row stays locked until the files are gone: an upload reusing the blob
+            # meanwhile waits for it, then finds the file missing and stores it again.
+            locked = db.execute(
+                select(models.UploadBlob.sha256)
+                .where(models.UploadBlob.sha256 == sha256, models.UploadBlob.ref_count <= 0)
+                .with_for_update()
+            ).scalar()
+            if not locked:
+                db.rollback()
+                continue
+            db.execute(delete(models.UploadBlob).where(models.UploadBlob.sha256 == sha256))
+            try:
+                _remove_blob_files(storage_path)
+            except OSError as exc:
+                db.rollback()
+                print(f"Warning: could not remove blob {storage_path}: {exc}", flush=True)
+                continue
+            db.commit()
+        counts["blobs"] += 1
+        counts["bytes"] += size or 0
+
+    # Files written by requests that failed before committing their blob row.
+    known = set(db.execute(select(models.UploadBlob.sha256)).scalars())
+    orphans = {}
+    if os.path.isdir(BLOB_DIR):
+        for directory, _subdirectories, file_names in os.walk(BLOB_DIR):
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                sha256 = file_name.split(".", 1)[0]
+                if sha256 in known or os.path.getmtime(path) >= cutoff_timestamp:
+                    continue
+                orphans[path] = sha256
+    if orphans:
+        # A row deleted by hand leaves files that records may still point to.
+        still_used = referenced_blobs(db, orphans.values())
+        for path, sha256 in orphans.items():
+            if sha256 in still_used:
+                continue
+            counts["orphans"] += 1
+            counts["bytes"] += os.path.getsize(path)
+            if not dry_run:
+                _remove_blob_files(path)
+    if os.path.isdir(UPLOAD_TMP_DIR):
+        for file_name in os.listdir(UPLOAD_TMP_DIR):
+            path = os.path.join(UPLOAD_TMP_DIR, file_name)
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff_timestamp:
+                counts["temp_files"] += 1
+                if not dry_run:
+                    os.remove(path)
+    return counts
@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from fastapi import Request, Response
+from pydantic import ValidationError
+from sqlalchemy import event, func, insert, inspect as sa_inspect, select, update
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+
+# The public catalogue (website inventory, vehicle detail, makes) is answered
+# from an in-memory snapshot of each company's available vehicles: the
+# serialized rows plus precomputed facets. Every vehicle write bumps the
+# company's row in catalogue_versions in the same transaction (bump_versions()
+# for bulk statements that skip the flush hook). Each request reads that
+# version with one primary-key lookup and rebuilds the snapshot when it moved,
+# so every worker sees a commit right away. CATALOGUE_SNAPSHOT_SECONDS still
+# bounds the age of a snapshot, for writes made outside the ORM.
+# Responses carry an ETag derived from the snapshot, so browsers and proxies
+# revalidate with 304s for CATALOGUE_CACHE_SECONDS.
+
+CATALOGUE_SNAPSHOT_SECONDS = int(os.getenv("CATALOGUE_SNAPSHOT_SECONDS", "60") or "60")
+CATALOGUE_CACHE_SECONDS = int(os.getenv("CATALOGUE_CACHE_SECONDS", "30") or "30")
+PRICE_BUCKET_SIZE = 10_000_000
+MILEAGE_BUCKET_SIZE = 20_000
+MAX_PAGE_SIZE = 500
+SORT_FIELDS = {
+    "price_asc": ("price", False),
+    "price_desc": ("price", True),
+    "mileage_asc": ("mileage", False),
+    "mileage_desc": ("mileage", True),
+}
+
+_lock = threading.Lock()
+_build_locks: Dict[Optional[int], threading.Lock] = {}
+_snapshots: Dict[Optional[int], "CatalogueSnapshot"] = {}
+# Bumped by invalidate(); a build that started before is returned but not kept.
+_generation = 0
+
+
+def _fold(value) -> str:
+    # Case- and accent-insensitive, like the ilike filters on MySQL collations.
+    normalized = unicodedata.normalize("NFKD", str(value or ""))
+    return "".join(char for char in normalized if not unicodedata.combining(char)).lower()
+
+
+def _counts(values: Iterable[Any]) -> List[dict]:
+    counts: Dict[Any, int] = {}
+    for value in values:
+        if value not in (None, ""):
+            counts[value] = counts.get(value, 0) + 1
+    return [{"value": value, "count": count} for value, count in sorted(counts.items(), key=lambda item: str(item[0]))]
+
+
+def _histogram(values: Iterable[Optional[int]], bucket_size: int) -> List[dict]:
+    buckets: Dict[int, int] = {}
+    for value in values:
+        if value is not None:
+            start = (int(value) // bucket_size) * bucket_size
+            buckets[start] = buckets.get(start, 0) + 1
+    return [
+        {"min": start, "max": start + bucket_size, "count": count}
+        for start, count in sorted(buckets.items())
+    ]
+
+
+class CatalogueSnapshot:
+    def __init__(self, company_id: Optional[int], vehicles: List[models.Vehicle], db_version: int = 0):
+        self.company_id = company_id
+        self.db_version = db_version
+        self.expires_at = time.monotonic() + CATALOGUE_SNAPSHOT_SECONDS
+        # Newest first, the default catalogue order.
+        self.items = []
+        for vehicle in sorted(vehicles, key=lambda vehicle: vehicle.id, reverse=True):
+            try:
+                self.items.append(schemas.Vehicle.model_validate(vehicle).model_dump(mode="json"))
+            except ValidationError as exc:
+                print(f"Warning: vehicle {vehicle.id} left out of the public catalogue: {exc.errors()[:1]}", flush=True)
+        self.by_id = {item["id"]: item for item in self.items}
+        # One line per field so a term never matches across two of them.
+        self.search_text = {
+            item["id"]: "\n".join(_fold(item.get(field)) for field in ("make", "model", "description"))
+            for item in self.items
+        }
+        self.folded = {
+            item["id"]: {field: _fold(item.get(field)) for field in ("make", "model", "color")}
+            for item in self.items
+        }
+        self.version = hashlib.sha1(
+            json.dumps(self.items, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()[:16]
+        self.facets = {
+            "total": len(self.items),
+            "makes": _counts(item["make"] for item in self.items),
+            "models": [
+                {"make": make, "model": model, "count": count}
+                for (make, model), count in sorted(
+                    _pair_counts((item["make"], item["model"]) for item in self.items).items(),
+                    key=lambda entry: (str(entry[0][0]), str(entry[0][1])),
+                )
+            ],
+            "colors": _counts(item["color"] for item in self.items),
+            "years": _counts(item["year"] for item in self.items),
+            "price_histogram": _histogram((item["price"] for item in self.items), PRICE_BUCKET_SIZE),
+            "mileage_histogram": _histogram((item["mileage"] for item in self.items), MILEAGE_BUCKET_SIZE),
+        }
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def search(
+        self,
+        q: Optional[str] = None,
+        make: Optional[str] = None,
+        model: Optional[str] = None,
+        color: Optional[str] = None,
+        year_from: Optional[int] = None,
+        year_to: Optional[int] = None,
+        price_min: Optional[int] = None,
+        price_max: Optional[int] = None,
+        mileage_min: Optional[int] = None,
+        mileage_max: Optional[int] = None,
+        sort_by: Optional[str] = None,
+        skip: int = 0,
+        limit: int = 100,
+    ) -> List[dict]:
+        needle = _fold(q) if q else ""
+        text_filters = {
+            field: _fold(value)
+            for field, value in (("make", make), ("model", model), ("color", color))
+            if value
+        }
+        ranges = [
+            ("year", year_from, year_to),
+            ("price", price_min, price_max),
+            ("mileage", mileage_min, mileage_max),
+        ]
+
+        results = []
+        for item in self.items:
+            if needle and needle not in self.search_text[item["id"]]:
+                continue
+            folded = self.folded[item["id"]]
+            if any(value not in folded[field] for field, value in text_filters.items()):
+                continue
+            if not _in_ranges(item, ranges):
+                continue
+            results.append(item)
+
+        if sort_by in SORT_FIELDS:
+            field, descending = SORT_FIELDS[sort_by]
+            # Items are already newest first, which breaks ties; NULLs sort
+            # first ascending and last descending, as in SQL.
+            results.sort(
+                key=lambda item: (item[field] is not None, item[field] or 0),
+                reverse=descending,
+            )
+        return results[skip:skip + limit]
+
+
+def _pair_counts(pairs: Iterable[tuple]) -> Dict[tuple, int]:
+    counts: Dict[tuple, int] = {}
+    for make, model in pairs:
+        if make:
+            counts[(make, model)] = counts.get((make, model), 0) + 1
+    return counts
+
+
+def _in_ranges(item: dict, ranges) -> bool:
+    # Falsy bounds are ignored, matching the previous `if year_from:` filters.
+    for field, lower, upper in ranges:
+        value = item.get(field)
+        if lower and (value is None or value < lower):
+            return False
+        if upper and (value is None or value > upper):
+            return False
+    return True
+
+
+# --- Snapshots -----------------------------------------------------------
+
+def _version_key(company_id: Optional[int]) -> int:
+    return int(company_id or 0)
+
+
+def current_version(db: Session, company_id: Optional[int]) -> int:
+    """Version of a company's vehicles; the cross-company catalogue uses the sum of all of them."""
+    versions = models.CatalogueVersion
+    if company_id:
+        query = select(versions.version).where(versions.company_id == _version_key(company_id))
+    else:
+        query = select(func.coalesce(func.sum(versions.version), 0))
+    return int(db.execute(query).scalar() or 0)
+
+
+def bump_versions(connection, company_ids: Iterable[Optional[int]]):
+    """Marks the catalogue of the companies as changed, in the caller's transaction."""
+    table = models.CatalogueVersion.__table__
+    now = datetime.datetime.utcnow()
+    dialect = connection.dialect.name
+    for company_key in sorted({_version_key(company_id) for company_id in company_ids}):
+        row = {"company_id": company_key, "version": 1, "updated_at": now}
+        if dialect == "mysql":
+            from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+            statement = mysql_insert(table).values(row)
+            connection.execute(statement.on_duplicate_key_update(version=table.c.version + 1, updated_at=now))
+            continue
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+
+            statement = dialect_insert(table).values(row)
+            connection.execute(statement.on_conflict_do_update(
+                index_elements=[table.c.company_id],
+                set_={"version": table.c.version + 1, "updated_at": now},
+            ))
+            continue
+        result = connection.execute(
+            update(table).where(table.c.company_id == company_key).values(version=table.c.version + 1, updated_at=now)
+        )
+        if not result.rowcount:
+            connection.execute(insert(table), [row])
+
+
+def get_snapshot(db: Session, company_id: Optional[int]) -> CatalogueSnapshot:
+    db_version = current_version(db, company_id)
+    snapshot = _snapshots.get(company_id)
+    if snapshot is not None and not snapshot.expired and snapshot.db_version == db_version:
+        return snapshot
+    with _lock:
+        build_lock = _build_locks.setdefault(company_id, threading.Lock())
+    # One rebuild per company at a time; concurrent requests wait for it.
+    with build_lock:
+        snapshot = _snapshots.get(company_id)
+        if snapshot is not None and not snapshot.expired and snapshot.db_version == db_version:
+            return snapshot
+        generation = _generation
+        query = db.query(models.Vehicle).filter(models.Vehicle.status == models.VehicleStatus.AVAILABLE.value)
+        if company_id:
+            query = query.filter(models.Vehicle.company_id == company_id)
+        snapshot = CatalogueSnapshot(company_id, query.all(), db_version)
+        with _lock:
+            if generation == _generation:
+                _snapshots[company_id] = snapshot
+        return snapshot
+
+
+def invalidate(company_ids: Optional[Iterable[Optional[int]]] = None):
+    """Drops the snapshots of the given companies (all when omitted) and the cross-company one."""
+    global _generation
+    with _lock:
+        _generation += 1
+        if company_ids is None:
+            _snapshots.clear()
+            return
+        for company_id in set(company_ids) | {None}:
+            _snapshots.pop(company_id, None)
+
+
+# --- HTTP ----------------------------------------------------------------
+
+def _etag(snapshot: CatalogueSnapshot, request: Request, kind: str) -> str:
+    query = "&".join(sorted(f"{key}={value}" for key, value in request.query_params.multi_items()))
+    digest = hashlib.sha1(f"{kind}?{query}".encode("utf-8")).hexdigest()[:12]
+    return f'W/"{snapshot.version}-{digest}"'
+
+
+def cached_response(request: Request, snapshot: CatalogueSnapshot, kind: str, build_payload) -> Response:
+    etag = _etag(snapshot, request, kind)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={CATALOGUE_CACHE_SECONDS}",
+        # The tenant comes from the Host header.
+        "Vary": "Host",
+    }
+    if_none_match = request.headers.get("if-none-match") or ""
+    if etag in {tag.strip() for tag in if_none_match.split(",")}:
+        return Response(status_code=304, headers=headers)
+    body = json.dumps(build_payload(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# --- Invalidation --------------------------------------------------------
+
+_VEHICLE_KEY = "vehicle_catalogue_companies"
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_vehicle_changes(session: Session, flush_context):
+    flushed: Set[Optional[int]] = set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, models.Vehicle):
+            history = sa_inspect(instance).attrs.company_id.history
+            flushed.add(instance.company_id)
+            flushed.update(history.deleted or ())
+    if flushed:
+        # Other workers notice the change through the version committed with it.
+        bump_versions(session.connection(), flushed)
+        session.info.setdefault(_VEHICLE_KEY, set()).update(flushed)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session):
+    company_ids = session.info.pop(_VEHICLE_KEY, None)
+    if company_ids:
+        invalidate(company_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session: Session):
+    session.info.pop(_VEHICLE_KEY, None)
@@ -60,3 +60,21 @@ DEFAULT_ROLE_MENU_ORDER = {
 
 VALID_VIEW_IDS = {view["id"] for view in SYSTEM_VIEWS}
 COMPANY_VIEW_IDS = {view["id"] for view in SYSTEM_VIEWS if view.get("scope") != "global"} | EXTRA_COMPANY_MODULE_IDS
+
+# Routers that back optional company modules. With ROUTER_LOAD_MODE=lazy they are
+# only imported and mounted on the first request to their prefix. They are not
+# gated per company: other views (the leads board, notifications) call these
+# prefixes whether or not the company enabled the matching module.
+LAZY_ROUTER_MODULES = [
+    "whatsapp",
+    "credits",
+    "purchases",
+    "meta",
+    "tiktok",
+    "gmail",
+    "appointments",
+    "rules",
+]
+
+# Always mounted at boot: main.py declares overlapping paths after them.
+CORE_ROUTER_MODULES = ["notifications", "vehicles"]
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import tempfile
+from typing import Any, Iterable, Iterator, List, Optional, Sequence
+
+from fastapi.responses import StreamingResponse
+
+# Spreadsheet exports built with openpyxl write-only workbooks: rows are
+# written to disk as they are appended, so memory stays flat no matter how
+# many rows a report has. Callers feed rows from queries iterated with
+# yield_per(DB_CHUNK_ROWS) and the finished file is streamed from a spooled
+# temporary file.
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+DB_CHUNK_ROWS = 500
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+STREAM_CHUNK_BYTES = 64 * 1024
+CURRENCY_FORMAT = '"$"#,##0'
+
+
+class StreamingWorkbook:
+    def __init__(self, header_fill: str = "1E293B"):
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Alignment, Font, PatternFill
+
+        self._cell = WriteOnlyCell
+        self.workbook = Workbook(write_only=True)
+        self.header_font = Font(bold=True, color="FFFFFF")
+        self.header_fill = PatternFill("solid", fgColor=header_fill)
+        self.header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+        self.data_alignment = Alignment(vertical="top", wrap_text=True)
+
+    def add_sheet(self, title: str, widths: Sequence[int] = ()):
+        from openpyxl.utils import get_column_letter
+
+        # Write-only sheets cannot be autosized afterwards; widths are set up front.
+        sheet = self.workbook.create_sheet(title)
+        for index, width in enumerate(widths, start=1):
+            sheet.column_dimensions[get_column_letter(index)].width = width
+        return sheet
+
+    def header(self, sheet, values: Iterable[Any]):
+        cells = []
+        for value in values:
+            cell = self._cell(sheet, value=value)
+            cell.font = self.header_font
+            cell.fill = self.header_fill
+            cell.alignment = self.header_alignment
+            cells.append(cell)
+        sheet.append(cells)
+
+    def row(
+        self,
+        sheet,
+        values: Iterable[Any],
+        currency_columns: Optional[Iterable[int]] = None,
+        min_currency_column: Optional[int] = None,
+        wrap: bool = True,
+    ):
+        """Appends a data row. Columns are 1-based: `currency_columns` are always
+        money-formatted (they may hold formulas), columns from `min_currency_column`
+        on only when the value is a number."""
+        currency_columns = set(currency_columns or ())
+        cells: List[Any] = []
+        for column, value in enumerate(values, start=1):
+            is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+            is_currency = column in currency_columns or (
+                is_number and min_currency_column is not None and column >= min_currency_column
+            )
+            if not wrap and not is_currency:
+                cells.append(value)
+                continue
+            cell = self._cell(sheet, value=value)
+            if wrap:
+                cell.alignment = self.data_alignment
+            if is_currency:
+                cell.number_format = CURRENCY_FORMAT
+            cells.append(cell)
+        sheet.append(cells)
+
+    def response(self, filename: str) -> StreamingResponse:
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        try:
+            self.workbook.save(spool)
+            size = spool.tell()
+            spool.seek(0)
+        except Exception:
+            spool.close()
+            raise
+        return StreamingResponse(
+            _iter_spool(spool),
+            media_type=XLSX_MEDIA_TYPE,
+            headers={
+                "Content-Disposition": f'attachment; filename="{filename}"',
+                "Content-Length": str(size),
+            },
+        )
+
+
+def _iter_spool(spool) -> Iterator[bytes]:
+    try:
+        while True:
+            chunk = spool.read(STREAM_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        spool.close()
@@ -109,7 +109,7 @@ const LeadsTable = ({ source, title }) => {
         if (!selectedAdvisor) return;
         try {
             const token = localStorage.getItem('token');
-            await axios.put('/api/leads/bulk-assign', {
+            const response = await axios.put('/api/leads/bulk-assign', {
                 lead_ids: selectedLeads,
                 assigned_to_id: parseInt(selectedAdvisor)
             }, {
@@ -119,6 +119,10 @@ const LeadsTable = ({ source, title }) => {
             // Success
             setIsAssignModalOpen(false);
             setSelectedLeads([]);
+            if (response.data?.job_id) {
+                Swal.fire('Asignación en Proceso', 'Los leads se están asignando en segundo plano. Recarga en unos segundos para ver el resultado.', 'info');
+                return;
+            }
             fetchLeads(); // Refresh data
             Swal.fire('Asignación Completada', 'Los leads han sido asignados correctamente.', 'success');
         } catch (error) {
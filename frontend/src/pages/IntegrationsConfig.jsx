@@ -119,7 +119,7 @@ const IntegrationsConfig = () => {
         }
     };
 
-    const handleUploadExcel = async () => {
+    const handleUploadExcel = async (dryRun = false) => {
         if (!uploadFile) return;
         setUploading(true);
         setStatus({ type: 'loading', message: 'Leyendo datos, esto puede tardar unos segundos...' });
@@ -133,6 +133,7 @@ const IntegrationsConfig = () => {
                 `/api/vehicles/upload`,
                 formData,
                 {
+                    params: { dry_run: dryRun },
                     headers: {
                         'Content-Type': 'multipart/form-data',
                         Authorization: `Bearer ${token}`
@@ -140,19 +141,36 @@ const IntegrationsConfig = () => {
                 }
             );
 
-            const { inserted, updated, errors } = response.data;
+            let result = response.data;
+            if (result.job_id) {
+                for (;;) {
+                    await new Promise((resolve) => setTimeout(resolve, 2000));
+                    const jobRes = await axios.get(`/api/jobs/${result.job_id}`, { headers: { Authorization: `Bearer ${token}` } });
+                    const job = jobRes.data;
+                    if (job?.status === 'completed') {
+                        result = job.result || result;
+                        break;
+                    }
+                    if (job?.status === 'failed') throw new Error(job.error || 'La importación falló');
+                    setStatus({ type: 'loading', message: `Importando inventario... ${Math.round((job?.progress || 0) * 100)}%` });
+                }
+            }
+
+            const { inserted, updated, unchanged, invalid } = result;
             setStatus({
                 type: 'success',
-                message: `✅ Importado: ${inserted} nuevos, ${updated} actualizados. ❌ Errores: ${errors}`
+                message: dryRun
+                    ? `Simulación: ${inserted} nuevos, ${updated} por actualizar, ${unchanged} sin cambios. ❌ Filas inválidas: ${invalid}`
+                    : `✅ Importado: ${inserted} nuevos, ${updated} actualizados, ${unchanged} sin cambios. ❌ Filas inválidas: ${invalid}`
             });
             setTimeout(() => setStatus({ type: '', message: '' }), 10000);
         } catch (error) {
             console.error(error);
-            setStatus({ type: 'error', message: error.response?.data?.detail || 'Error al importar archivo. Verifica el formato.' });
+            setStatus({ type: 'error', message: error.response?.data?.detail || error.message || 'Error al importar archivo. Verifica el formato.' });
             setTimeout(() => setStatus({ type: '', message: '' }), 5000);
         } finally {
             setUploading(false);
-            setUploadFile(null);
+            if (!dryRun) setUploadFile(null);
         }
     };
 
@@ -676,7 +694,8 @@ const IntegrationsConfig = () => {
                                 <ul className="list-disc pl-5 space-y-1">
                                     <li>Sube el archivo Excel con el formato "INVENTARIO PAGINA WEB CRM.xlsx".</li>
                                     <li>Las columnas deben coincidir con la plantilla oficial (Marca & Modelo, Año, Precio, etc).</li>
-                                    <li>Los vehículos nuevos se agregarán, los existentes (por Placa) se actualizarán.</li>
+                                    <li>Los vehículos nuevos se agregarán, los existentes (por Placa o Código) se actualizarán.</li>
+                                    <li>Usa "Simular importación" para ver cuántos vehículos cambiarían antes de aplicar.</li>
                                 </ul>
                             </div>
 
@@ -690,10 +709,18 @@ const IntegrationsConfig = () => {
                                 />
                             </div>
 
-                            <div className="pt-4 flex justify-end">
+                            <div className="pt-4 flex justify-end gap-3">
+                                <button
+                                    type="button"
+                                    onClick={() => handleUploadExcel(true)}
+                                    disabled={uploading || !uploadFile}
+                                    className="bg-white border border-slate-300 hover:bg-slate-50 text-slate-700 font-bold py-3 px-6 rounded-xl transition-all disabled:opacity-50"
+                                >
+                                    Simular importación
+                                </button>
                                 <button
                                     type="button"
-                                    onClick={handleUploadExcel}
+                                    onClick={() => handleUploadExcel(false)}
                                     disabled={uploading || !uploadFile}
                                     className="bg-green-600 hover:bg-green-700 text-white font-bold py-3 px-8 rounded-xl shadow-md transition-all disabled:opacity-50"
                                 >
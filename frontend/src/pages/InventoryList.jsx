@@ -3,7 +3,7 @@ import axios from 'axios';
 import { Link } from 'react-router-dom';
 import Swal from 'sweetalert2';
 import { useAuth } from '../context/AuthContext';
-import { normalizeMediaUrl } from '../utils/media';
+import { normalizeMediaUrl, vehiclePhotoUrl } from '../utils/media';
 
 const InventoryList = () => {
     const { user } = useAuth();
@@ -498,7 +498,7 @@ const InventoryList = () => {
                                         <td className="px-6 py-4 whitespace-nowrap">
                                             <div className="h-12 w-16 bg-gray-200 rounded-lg overflow-hidden flex items-center justify-center">
                                                 {vehicle.photos && vehicle.photos.length > 0 ? (
-                                                    <img src={normalizeMediaUrl(vehicle.photos[0])} alt={vehicle.model} className="h-full w-full object-cover" />
+                                                    <img src={vehiclePhotoUrl(vehicle, 0, 'thumb')} alt={vehicle.model} className="h-full w-full object-cover" />
                                                 ) : (
                                                     <svg className="h-6 w-6 text-gray-400" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth="2" d="M4 16l4.586-4.586a2 2 0 012.828 0L16 16m-2-2l1.586-1.586a2 2 0 012.828 0L20 14m-6-6h.01M6 20h12a2 2 0 002-2V6a2 2 0 00-2-2H6a2 2 0 00-2 2v12a2 2 0 002 2z" /></svg>
                                                 )}
@@ -1823,6 +1823,8 @@ const HistoryModal = ({ lead, onClose, onUpdate, onUpdateContact, onSaveSupervis
     // Load Lead Messages
     const [messages, setMessages] = useState([]);
     const [loadingMessages, setLoadingMessages] = useState(false);
+    const [olderMessagesCursor, setOlderMessagesCursor] = useState(null);
+    const [loadingOlderMessages, setLoadingOlderMessages] = useState(false);
 
     // Reply State
     const [replyMessage, setReplyMessage] = useState('');
@@ -1951,6 +1953,7 @@ const HistoryModal = ({ lead, onClose, onUpdate, onUpdateContact, onSaveSupervis
             });
             // Reverse so oldest is top, newest is bottom
             setMessages(Array.isArray(response.data) ? response.data.reverse() : []);
+            setOlderMessagesCursor(response.headers['x-next-cursor'] || null);
         } catch (error) {
             console.error("Error fetching lead messages", error);
         } finally {
@@ -1958,6 +1961,25 @@ const HistoryModal = ({ lead, onClose, onUpdate, onUpdateContact, onSaveSupervis
         }
     };
 
+    const fetchOlderMessages = async () => {
+        if (!olderMessagesCursor) return;
+        setLoadingOlderMessages(true);
+        try {
+            const token = localStorage.getItem('token');
+            const response = await axios.get(`${API_BASE_URL}/leads/${lead.id}/messages`, {
+                headers: { Authorization: `Bearer ${token}` },
+                params: { before: olderMessagesCursor }
+            });
+            const olderMessages = Array.isArray(response.data) ? response.data.reverse() : [];
+            setMessages((current) => [...olderMessages, ...current]);
+            setOlderMessagesCursor(response.headers['x-next-cursor'] || null);
+        } catch (error) {
+            console.error("Error fetching older lead messages", error);
+        } finally {
+            setLoadingOlderMessages(false);
+        }
+    };
+
     const fetchWhatsappSettings = async () => {
         if (!lead?.company_id) {
             setWhatsappSettings({
@@ -4408,6 +4430,18 @@ const HistoryModal = ({ lead, onClose, onUpdate, onUpdateContact, onSaveSupervis
                                         />
                                     </div>
                                 )}
+                                {!loadingMessages && olderMessagesCursor && (
+                                    <div className="text-center">
+                                        <button
+                                            type="button"
+                                            onClick={fetchOlderMessages}
+                                            disabled={loadingOlderMessages}
+                                            className="rounded-lg border border-gray-200 bg-white px-3 py-1.5 text-xs font-bold text-gray-600 transition hover:bg-gray-100 disabled:opacity-60"
+                                        >
+                                            {loadingOlderMessages ? 'Cargando...' : 'Cargar mensajes anteriores'}
+                                        </button>
+                                    </div>
+                                )}
                                 {loadingMessages ? (
                                     <div className="text-center text-sm text-gray-400 py-4">Cargando mensajes...</div>
                                 ) : messages.length > 0 ? (
@@ -3,7 +3,7 @@ import axios from 'axios';
 import { Link } from 'react-router-dom';
 import PublicSalesChatbot from '../components/PublicSalesChatbot';
 import PublicBrandLogo from '../components/PublicBrandLogo';
-import { normalizeMediaUrl } from '../utils/media';
+import { vehiclePhotoUrl } from '../utils/media';
 import { getPublicCompanyHomeUrl, usePublicCompany } from '../utils/publicCompany';
 
 const APP_BASE_PATH = import.meta.env.BASE_URL === '/' ? '' : import.meta.env.BASE_URL.replace(/\/$/, '');
@@ -605,7 +605,8 @@ const PublicInventory = () => {
                                         <Link to={`/autos/${vehicle.id}`} className="block relative aspect-[4/3] overflow-hidden">
                                             {vehicle.photos && vehicle.photos.length > 0 ? (
                                                 <img
-                                                    src={normalizeMediaUrl(vehicle.photos[0])}
+                                                    src={vehiclePhotoUrl(vehicle, 0, 'card')}
+                                                    loading="lazy"
                                                     alt={`${vehicle.make} ${vehicle.model}`}
                                                     className={`w-full h-full object-cover transition-transform duration-700 group-hover:scale-110 ${vehicle.status === 'sold' ? 'grayscale opacity-80 group-hover:grayscale-0 group-hover:opacity-100' : ''}`}
                                                 />
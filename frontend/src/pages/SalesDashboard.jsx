@@ -624,6 +624,59 @@ const SalesDashboard = ({ receiptEntryOnly = false, receiptSearchOnly = false, i
         window.open(`/api/finance/receipts.xlsx?${params.toString()}`, '_blank');
     };
 
+    const handleDownloadReceiptsZip = async () => {
+        const token = localStorage.getItem('token');
+        const params = {
+            q: receiptSearch || undefined,
+            category: receiptCategory || undefined,
+            movement_type: receiptMovementType || undefined,
+            start_date: startDate || undefined,
+            end_date: endDate || undefined
+        };
+        try {
+            const response = await axios.get('/api/finance/receipts.zip', {
+                headers: { Authorization: `Bearer ${token}` },
+                params,
+                responseType: 'blob'
+            });
+            if (response.status === 202) {
+                const job = JSON.parse(await response.data.text());
+                Swal.fire({
+                    title: 'Generando PDFs',
+                    text: `Preparando ${job.total} documentos. La descarga iniciará al terminar.`,
+                    icon: 'info',
+                    showConfirmButton: false,
+                    allowOutsideClick: false
+                });
+                for (;;) {
+                    await new Promise((resolve) => setTimeout(resolve, 2000));
+                    const jobRes = await axios.get(`/api/jobs/${job.job_id}`, { headers: { Authorization: `Bearer ${token}` } });
+                    if (jobRes.data?.status === 'completed') break;
+                    if (jobRes.data?.status === 'failed') throw new Error(jobRes.data?.error || 'La exportación falló');
+                }
+                Swal.close();
+                window.open(`/api/jobs/${job.job_id}/download?token=${token}`, '_blank');
+                return;
+            }
+            const url = URL.createObjectURL(response.data);
+            const link = document.createElement('a');
+            link.href = url;
+            link.download = 'documentos_contables.zip';
+            link.click();
+            URL.revokeObjectURL(url);
+        } catch (error) {
+            let detail = error.message;
+            if (error.response?.data instanceof Blob) {
+                try {
+                    detail = JSON.parse(await error.response.data.text()).detail || detail;
+                } catch (parseError) {
+                    detail = error.message;
+                }
+            }
+            Swal.fire('Error', detail || 'No se pudieron descargar los PDFs.', 'error');
+        }
+    };
+
     const handleEditTaxInfo = async (row = null) => {
         const isManual = row?.source === 'manual' || !row;
         const fieldLabels = [
@@ -2466,13 +2519,22 @@ const SalesDashboard = ({ receiptEntryOnly = false, receiptSearchOnly = false, i
                                         <h3 className="text-lg font-bold text-gray-800">Libro de recibos</h3>
                                         <p className="text-sm text-gray-500">Soportes cargados desde contabilidad.</p>
                                     </div>
-                                    <button
-                                        type="button"
-                                        onClick={handleDownloadReceiptsReport}
-                                        className="rounded-xl bg-emerald-600 px-4 py-2.5 text-sm font-semibold text-white shadow-sm transition hover:bg-emerald-700"
-                                    >
-                                        Descargar Excel
-                                    </button>
+                                    <div className="flex flex-wrap gap-2">
+                                        <button
+                                            type="button"
+                                            onClick={handleDownloadReceiptsReport}
+                                            className="rounded-xl bg-emerald-600 px-4 py-2.5 text-sm font-semibold text-white shadow-sm transition hover:bg-emerald-700"
+                                        >
+                                            Descargar Excel
+                                        </button>
+                                        <button
+                                            type="button"
+                                            onClick={handleDownloadReceiptsZip}
+                                            className="rounded-xl bg-slate-800 px-4 py-2.5 text-sm font-semibold text-white shadow-sm transition hover:bg-slate-900"
+                                        >
+                                            Descargar PDFs (ZIP)
+                                        </button>
+                                    </div>
                                 </div>
                                 <div className="mt-4 grid grid-cols-1 gap-3 lg:grid-cols-[minmax(0,1fr)_200px_200px_auto]">
                                     <input
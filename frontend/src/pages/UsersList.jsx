@@ -98,7 +98,7 @@ const UsersList = () => {
     const handleRedistributeLeads = async (targetUser) => {
         const result = await Swal.fire({
             title: 'Redistribuir leads',
-            text: `Se redistribuirán aleatoriamente todos los leads asignados a ${targetUser.full_name || targetUser.email} entre asesores/vendedores con asignación automática habilitada.`,
+            text: `Se redistribuirán todos los leads asignados a ${targetUser.full_name || targetUser.email} entre asesores/vendedores con asignación automática habilitada, equilibrando la carga actual de cada uno.`,
             icon: 'warning',
             showCancelButton: true,
             confirmButtonText: 'Redistribuir',
@@ -116,11 +116,15 @@ const UsersList = () => {
                 { headers: { Authorization: `Bearer ${token}` } }
             );
 
-            Swal.fire(
-                'Éxito',
-                `${response.data.redistributed_leads} lead(s) redistribuido(s) entre ${response.data.recipient_users} usuario(s).`,
-                'success'
-            );
+            if (response.data.job_id) {
+                Swal.fire('En proceso', response.data.message, 'info');
+            } else {
+                Swal.fire(
+                    'Éxito',
+                    `${response.data.redistributed_leads} lead(s) redistribuido(s) entre ${response.data.recipient_users} usuario(s).`,
+                    'success'
+                );
+            }
             fetchUsers();
         } catch (error) {
             console.error('Error redistributing leads', error);
@@ -3,7 +3,7 @@ import { useParams, Link } from 'react-router-dom';
 import axios from 'axios';
 import PublicSalesChatbot from '../components/PublicSalesChatbot';
 import PublicBrandLogo from '../components/PublicBrandLogo';
-import { normalizeMediaUrl } from '../utils/media';
+import { normalizeMediaUrl, vehiclePhotoUrl } from '../utils/media';
 import { getPublicCompanyHomeUrl, usePublicCompany } from '../utils/publicCompany';
 
 const withAlpha = (hex, alpha = '14') => {
@@ -187,7 +187,7 @@ const VehicleDetail = () => {
                                 {selectedImage ? (
                                     <>
                                         <img
-                                            src={selectedImage}
+                                            src={vehiclePhotoUrl(vehicle, vehicle.photos.indexOf(selectedImage), 'full')}
                                             alt={`${vehicle.make} ${vehicle.model}`}
                                             className="w-full h-full object-contain"
                                         />
@@ -243,7 +243,7 @@ const VehicleDetail = () => {
                                             `}
                                             style={selectedImage === photo ? { borderColor: primaryColor, boxShadow: `0 0 0 2px ${primarySoft}` } : undefined}
                                         >
-                                            <img src={photo} alt={`Thumbnail ${index + 1}`} className="w-full h-full object-cover" />
+                                            <img src={vehiclePhotoUrl(vehicle, index, 'thumb')} alt={`Thumbnail ${index + 1}`} className="w-full h-full object-cover" />
                                         </button>
                                     ))}
                                 </div>
@@ -378,7 +378,7 @@ const VehicleDetail = () => {
                                     onClick={() => setSelectedImage(photo)}
                                     className={`w-12 h-12 rounded-lg overflow-hidden border-2 transition ${selectedImage === photo ? 'border-white opacity-100' : 'border-transparent opacity-50 hover:opacity-80'}`}
                                 >
-                                    <img src={photo} className="w-full h-full object-cover" />
+                                    <img src={vehiclePhotoUrl(vehicle, index, 'thumb')} className="w-full h-full object-cover" />
                                 </button>
                             ))}
                         </div>
@@ -54,3 +54,10 @@ export const normalizeMediaUrl = (url) => {
 
     return raw;
 };
+
+// Resized copy of a vehicle photo ('thumb', 'card' or 'full') when the API has
+// one in vehicle.photo_variants; otherwise the original upload.
+export const vehiclePhotoUrl = (vehicle, index, size = 'card', format = 'webp') => {
+    const variant = vehicle?.photo_variants?.[index]?.[size]?.[format];
+    return normalizeMediaUrl(variant || vehicle?.photos?.[index]);
+};